@@ -0,0 +1,175 @@
+"""
+异步 Embedding 服务
+
+FastAPI 的 async def 接口中调用同步 EmbeddingService 会阻塞整个事件循环，
+一次慢请求拖住所有其他请求。本模块基于 AsyncOpenAI（httpx.AsyncClient）提供等价的异步接口：
+
+- 连接池：每个事件循环一个 httpx.AsyncClient，复用 keep-alive 连接
+- 并发上限：asyncio.Semaphore 限制同时进行的 API 请求数
+- 超时：请求超时 / 连接超时，超时后由 openai 客户端按 max_retries 重试
+- 与同步服务共用持久化缓存（缓存读写放到线程池执行，不阻塞事件循环）
+
+provider 为 local 时返回本地模型的异步包装（AsyncLocalEmbeddingService），与同步服务共用同一个模型。
+"""
+
+import asyncio
+import hashlib
+import logging
+import weakref
+from typing import Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认参数：同时进行的请求数 / 连接池大小 / 请求超时（秒）/ 重试次数
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_RETRIES = 2
+
+
+class AsyncEmbeddingService:
+    """
+    异步 Embedding 服务
+    支持 OpenAI 兼容 API（包括 Ollama），只能在创建它的事件循环中使用
+    """
+    
+    def __init__(self, config: Dict, cache=None):
+        """
+        初始化异步 Embedding 服务
+        
+        Args:
+            config: 配置字典，包含 model_name / api_key / base_url，以及可选的：
+                - async_max_concurrency: 同时进行的 API 请求数
+                - async_max_connections: 连接池大小
+                - timeout: 请求超时（秒）
+                - max_retries: 失败重试次数
+            cache: EmbeddingCache 实例（None 表示不缓存）
+        """
+        self.model_name = config.get('model_name', 'text-embedding-v3')
+        self.api_key = config.get('api_key', '')
+        self.base_url = config.get('base_url', '')
+        self.cache = cache
+        self.max_concurrency = max(1, int(config.get('async_max_concurrency', DEFAULT_MAX_CONCURRENCY)))
+        self.timeout = float(config.get('timeout', DEFAULT_TIMEOUT))
+        max_connections = max(1, int(config.get('async_max_connections', DEFAULT_MAX_CONNECTIONS)))
+        
+        import httpx
+        from openai import AsyncOpenAI
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 10.0))
+        )
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=self._http_client,
+            timeout=self.timeout,
+            max_retries=int(config.get('max_retries', DEFAULT_MAX_RETRIES))
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        logger.info(f"异步 Embedding 服务初始化：model={self.model_name}, base_url={self.base_url}, "
+                    f"max_concurrency={self.max_concurrency}, timeout={self.timeout}s")
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """
+        将文本转换为向量
+        
+        Args:
+            text: 输入文本
+        
+        Returns:
+            numpy 数组表示的向量
+        """
+        return (await self.embed_batch([text]))[0]
+    
+    async def embed_batch(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        """
+        批量计算 Embedding（只请求未命中缓存的文本，各批次在并发上限内同时请求）
+        
+        Args:
+            texts: 文本列表
+            batch_size: 批次大小
+        
+        Returns:
+            与文本一一对应的向量列表
+        """
+        model_version = self.get_model_version()
+        embeddings = await self._cache_call('get_many', model_version, texts) or [None] * len(texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if not missing:
+            return embeddings
+        
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        results = await asyncio.gather(*(self._request(batch) for batch in batches))
+        computed = dict(zip(missing, (embedding for result in results for embedding in result)))
+        await self._cache_call('put_many', model_version, missing, [computed[text] for text in missing])
+        return [computed[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+    
+    async def _request(self, batch: List[str]) -> List[np.ndarray]:
+        """在并发上限内调用一次 API"""
+        async with self._semaphore:
+            try:
+                response = await self.client.embeddings.create(model=self.model_name, input=batch)
+            except Exception as e:
+                logger.error(f"异步 Embedding 失败：{e}")
+                raise
+        return [np.array(data.embedding) for data in response.data]
+    
+    async def _cache_call(self, method: str, *args):
+        """在线程池中调用缓存方法；缓存读写失败只记录日志"""
+        if self.cache is None:
+            return None
+        try:
+            return await asyncio.to_thread(getattr(self.cache, method), *args)
+        except Exception as e:
+            logger.warning(f"Embedding 缓存{method}失败：{e}")
+            return None
+    
+    def get_model_version(self) -> str:
+        """获取模型版本标识（与同步服务一致，使用模型名）"""
+        return self.model_name
+    
+    async def aclose(self):
+        """关闭连接池"""
+        await self._http_client.aclose()
+
+
+# 每个事件循环一个实例（httpx 连接和信号量都绑定在事件循环上）
+_services: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+
+def get_async_embedding_service(config: Dict) -> AsyncEmbeddingService:
+    """
+    获取当前事件循环的异步 Embedding 服务（配置变化时重新创建）
+    
+    Args:
+        config: 配置字典（缓存配置与同步服务相同）
+    
+    Returns:
+        AsyncEmbeddingService 实例（provider 为 local 时为 AsyncLocalEmbeddingService）
+    
+    Raises:
+        RuntimeError: 不在事件循环中调用
+    """
+    loop = asyncio.get_running_loop()
+    config_hash = hashlib.md5(str(sorted(config.items())).encode()).hexdigest()
+    
+    cached = _services.get(loop)
+    if cached is not None and cached[0] == config_hash:
+        return cached[1]
+    
+    if config.get('provider') == 'local':
+        from agent.services.embedding_service import get_embedding_service
+        from agent.services.local_embedding_service import AsyncLocalEmbeddingService
+        service = AsyncLocalEmbeddingService(get_embedding_service(config))
+    else:
+        from agent.services.embedding_service import _build_cache
+        service = AsyncEmbeddingService(config, cache=_build_cache(config))
+    if cached is not None:
+        loop.create_task(cached[1].aclose())
+    _services[loop] = (config_hash, service)
+    logger.info("创建新的异步 Embedding 服务实例")
+    return service
@@ -0,0 +1,271 @@
+"""
+Embedding 持久化缓存
+
+同一段文本在查重、审核入库、更新和重建时会被多次向量化，每次都调用远程 API。
+缓存按 (模型, 规范化文本哈希) 保存向量，命中时不再调用 API：
+
+- 存储：独立的 SQLite 文件（默认 data/embedding_cache.db，与题库数据库分开，可随时删除）
+- 规范化：NFKC（统一全半角）、合并连续空白、去掉首尾空白（不改变语义，不去标点）
+- 淘汰：条目数超过上限时按最近使用时间（LRU）删除最旧的条目，删到上限的 90%；
+  条目数在进程内计数，只有计数超过上限时才重新 COUNT 一次（其他进程也可能写入同一文件）
+- 统计：进程内命中 / 未命中 / 淘汰计数
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from core.database.connection import chunked
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存文件与条目上限
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent.parent / "data" / "embedding_cache.db"
+DEFAULT_MAX_ENTRIES = 50000
+
+# 淘汰时删到上限的比例（避免每次写入都触发淘汰）
+EVICT_TO_RATIO = 0.9
+
+_WHITESPACE = re.compile(r"\s+")
+
+CACHE_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        dimension INTEGER NOT NULL,
+        embedding BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used_at)",
+    "CREATE INDEX IF NOT EXISTS idx_embedding_cache_model ON embedding_cache(model)",
+]
+
+
+def normalize_text(text: str) -> str:
+    """缓存键使用的文本规范化"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    """(模型, 规范化文本) 的缓存键"""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Embedding 持久化缓存（线程安全）"""
+    
+    def __init__(self, path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        初始化缓存
+        
+        Args:
+            path: SQLite 文件路径（默认 data/embedding_cache.db）
+            max_entries: 最多保存的条目数
+        """
+        self.path = str(path or DEFAULT_CACHE_PATH)
+        self.max_entries = max(1, int(max_entries))
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        for sql in CACHE_SQL:
+            self._conn.execute(sql)
+        self._entries = self._count()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        """读取单条缓存，未命中返回 None"""
+        return self.get_many(model, [text])[0]
+    
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        批量读取缓存（命中的条目刷新最近使用时间）
+        
+        Args:
+            model: 模型版本标识
+            texts: 文本列表
+        
+        Returns:
+            与文本一一对应的向量，未命中为 None
+        """
+        keys = [cache_key(model, text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for batch in chunked(unique_keys):
+                placeholders = ", ".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT cache_key, embedding FROM embedding_cache WHERE cache_key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                with self._transaction():
+                    self._conn.executemany(
+                        "UPDATE embedding_cache SET last_used_at = ? WHERE cache_key = ?",
+                        [(now, key) for key in found]
+                    )
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+    
+    def put(self, model: str, text: str, embedding):
+        """写入单条缓存"""
+        self.put_many(model, [text], [embedding])
+    
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence):
+        """
+        批量写入缓存（向量按 float32 保存），超过上限时按 LRU 淘汰
+        
+        写入和淘汰在同一个事务中完成。
+        
+        Args:
+            model: 模型版本标识
+            texts: 文本列表
+            embeddings: 与文本一一对应的向量
+        """
+        now = time.time()
+        rows = {}
+        for text, embedding in zip(texts, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32)
+            key = cache_key(model, text)
+            rows[key] = (key, model, vector.shape[0], vector.tobytes(), now, now)
+        if not rows:
+            return
+        with self._lock, self._transaction():
+            existing = set()
+            for batch in chunked(list(rows)):
+                placeholders = ", ".join("?" for _ in batch)
+                existing.update(key for (key,) in self._conn.execute(
+                    f"SELECT cache_key FROM embedding_cache WHERE cache_key IN ({placeholders})", batch
+                ))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache "
+                "(cache_key, model, dimension, embedding, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                list(rows.values())
+            )
+            self._entries += len(rows) - len(existing)
+            self._evict()
+    
+    def _count(self) -> int:
+        """缓存表的实际条目数"""
+        return self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+    
+    @contextmanager
+    def _transaction(self):
+        """在一个事务中执行（连接为自动提交模式，需要显式 BEGIN / COMMIT）"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+    
+    def _evict(self):
+        """条目数超过上限时删除最久未使用的条目（调用方持有锁）"""
+        if self._entries <= self.max_entries:
+            return
+        # 计数可能因其他进程写入而不准，淘汰前以实际条目数为准
+        self._entries = self._count()
+        if self._entries <= self.max_entries:
+            return
+        remove = self._entries - int(self.max_entries * EVICT_TO_RATIO)
+        self._conn.execute(
+            "DELETE FROM embedding_cache WHERE cache_key IN "
+            "(SELECT cache_key FROM embedding_cache ORDER BY last_used_at, created_at LIMIT ?)",
+            (remove,)
+        )
+        self._entries -= remove
+        self.evictions += remove
+        logger.info(f"Embedding 缓存淘汰：removed={remove}, max_entries={self.max_entries}")
+    
+    def clear(self, model: Optional[str] = None) -> int:
+        """
+        清空缓存
+        
+        Args:
+            model: 只清空该模型的条目（默认全部）
+        
+        Returns:
+            删除的条目数
+        """
+        with self._lock:
+            if model is None:
+                cursor = self._conn.execute("DELETE FROM embedding_cache")
+            else:
+                cursor = self._conn.execute("DELETE FROM embedding_cache WHERE model = ?", (model,))
+            self._entries = max(0, self._entries - cursor.rowcount)
+        return cursor.rowcount
+    
+    def get_stats(self) -> Dict:
+        """缓存条目数、按模型分布和进程内命中统计"""
+        with self._lock:
+            models = dict(self._conn.execute(
+                "SELECT model, COUNT(*) FROM embedding_cache GROUP BY model"
+            ).fetchall())
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': sum(models.values()),
+                'max_entries': self.max_entries,
+                'models': models,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions
+            }
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+# 按文件路径共享的缓存实例（配置变化重建 Embedding 服务时复用，命中统计不清零）
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path: Optional[str] = None,
+                        max_entries: int = DEFAULT_MAX_ENTRIES) -> EmbeddingCache:
+    """
+    获取缓存实例（同一路径只打开一次）
+    
+    Args:
+        path: SQLite 文件路径（默认 data/embedding_cache.db）
+        max_entries: 最多保存的条目数
+    
+    Returns:
+        EmbeddingCache 实例
+    """
+    path = str(path or DEFAULT_CACHE_PATH)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = EmbeddingCache(path, max_entries)
+        else:
+            cache.max_entries = max(1, int(max_entries))
+        return cache
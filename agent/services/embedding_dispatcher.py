@@ -0,0 +1,191 @@
+"""
+Embedding 微批调度器
+
+并发的请求各自调用 embed() 时，每道题一次 HTTP 往返；而 API 一次可以接受多条文本。
+调度器把单条向量化请求放入队列，凑满 max_batch_size 条或等待 max_wait_ms 毫秒后
+合并为一次 embed_batch 调用，再把向量分别交还给各个调用方：
+
+- 调用方拿到 Future，可同步等待（embed）或在异步代码中 await（asyncio.wrap_future）
+- 同时执行的批次数不超过 max_in_flight，达到上限时收集线程等待（对调用方形成背压）
+- 某一批失败时逐条重试，只有出错的文本把异常交给对应的调用方
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认参数：单批最多条数 / 最长等待毫秒 / 同时执行的批次数
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 10
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class EmbeddingDispatcher:
+    """把单条向量化请求合并为批量调用的调度器（线程安全）"""
+    
+    def __init__(self,
+                 embed_batch: Callable[[List[str]], List[np.ndarray]],
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        """
+        初始化调度器
+        
+        Args:
+            embed_batch: 批量向量化函数（文本列表 -> 等长的向量列表）
+            max_batch_size: 单批最多条数
+            max_wait_ms: 第一条请求到达后最多等待的毫秒数
+            max_in_flight: 同时执行的批次数上限
+        """
+        self.embed_batch = embed_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_in_flight = max(1, int(max_in_flight))
+        
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._collector: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+    
+    def submit(self, text: str) -> Future:
+        """
+        提交一条向量化请求
+        
+        Args:
+            text: 输入文本
+        
+        Returns:
+            结果为向量的 Future
+        
+        Raises:
+            RuntimeError: 调度器已关闭
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding 调度器已关闭")
+            self._ensure_started()
+            self._queue.put((text, future))
+        return future
+    
+    def embed(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """提交请求并等待向量（timeout 秒内未完成抛出 TimeoutError）"""
+        return self.submit(text).result(timeout=timeout)
+    
+    def close(self, wait: bool = True):
+        """
+        关闭调度器：已排队的请求仍会执行完
+        
+        Args:
+            wait: 是否等待执行中的批次完成
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            collector, executor = self._collector, self._executor
+            if collector is not None:
+                self._queue.put(None)
+        if collector is not None and wait:
+            collector.join()
+        if executor is not None:
+            executor.shutdown(wait=wait)
+    
+    def get_stats(self) -> Dict:
+        """批次数、请求数、平均和最大批大小、排队中的请求数"""
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+                'max_batch_size': self.max_batch_seen,
+                'pending': self._queue.qsize(),
+                'max_in_flight': self.max_in_flight
+            }
+    
+    def _ensure_started(self):
+        """首次提交时启动收集线程和执行线程池（调用方持有锁）"""
+        if self._collector is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embedding-batch")
+        self._collector = threading.Thread(target=self._collect_loop, name="embedding-dispatcher", daemon=True)
+        self._collector.start()
+    
+    def _collect_loop(self):
+        """收集线程：阻塞等待第一条请求，再在时间窗口内凑批"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            # 执行中的批次达到上限时在这里等待，后续请求留在队列中继续凑批
+            self._slots.acquire()
+            try:
+                self._executor.submit(self._run_batch, batch)
+            except RuntimeError:
+                self._slots.release()
+                self._run_batch(batch, release=False)
+            if stop:
+                return
+    
+    def _run_batch(self, batch: List[Tuple[str, Future]], release: bool = True):
+        """执行一批请求并把结果分别交给调用方"""
+        try:
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                return
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.embed_batch(texts)
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"返回向量数 {len(embeddings)} 与请求数 {len(texts)} 不一致")
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    return
+                # 整批失败时逐条重试，避免一条异常文本拖累同批的其他请求
+                logger.warning(f"批量向量化失败，逐条重试：size={len(batch)}, error={e}")
+                for text, future in batch:
+                    try:
+                        future.set_result(self.embed_batch([text])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                return
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+        finally:
+            if release:
+                self._slots.release()
@@ -1,6 +1,9 @@
 """
 Embedding 服务
 支持在线 API 和 Ollama 本地模型（OpenAI 兼容格式）
+向量按 (模型, 规范化文本) 持久化缓存，相同文本不重复调用 API
+并发的单条 embed() 调用可由微批调度器合并为一次批量请求
+provider 为 local 时改用本地模型（LocalEmbeddingService），不访问网络
 """
 import numpy as np
 from typing import Optional, Dict
@@ -15,7 +18,7 @@ class EmbeddingService:
     支持 OpenAI 兼容 API（包括 Ollama）
     """
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, cache=None, batching: bool = False):
         """
         初始化 Embedding 服务
         
@@ -24,10 +27,14 @@ class EmbeddingService:
                 - model_name: 模型名称
                 - api_key: API Key
                 - base_url: API 基础 URL
+                - batch_max_size / batch_max_wait_ms / batch_max_in_flight: 微批调度参数
+            cache: EmbeddingCache 实例（None 表示不缓存）
+            batching: 是否把并发的 embed() 调用合并为批量请求
         """
         self.model_name = config.get('model_name', 'text-embedding-v3')
         self.api_key = config.get('api_key', '')
         self.base_url = config.get('base_url', '')
+        self.cache = cache
         
         # 初始化 OpenAI 客户端（兼容 Ollama）
         from openai import OpenAI
@@ -36,7 +43,20 @@ class EmbeddingService:
             base_url=self.base_url
         )
         
-        logger.info(f"Embedding 服务初始化：model={self.model_name}, base_url={self.base_url}")
+        self.dispatcher = None
+        if batching:
+            from agent.services.embedding_dispatcher import (
+                DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_IN_FLIGHT, DEFAULT_MAX_WAIT_MS, EmbeddingDispatcher
+            )
+            self.dispatcher = EmbeddingDispatcher(
+                self._embed_uncached,
+                max_batch_size=config.get('batch_max_size', DEFAULT_MAX_BATCH_SIZE),
+                max_wait_ms=config.get('batch_max_wait_ms', DEFAULT_MAX_WAIT_MS),
+                max_in_flight=config.get('batch_max_in_flight', DEFAULT_MAX_IN_FLIGHT)
+            )
+        
+        logger.info(f"Embedding 服务初始化：model={self.model_name}, base_url={self.base_url}, "
+                    f"batching={batching}")
     
     def embed(self, text: str) -> np.ndarray:
         """
@@ -48,6 +68,15 @@ class EmbeddingService:
         Returns:
             numpy 数组表示的向量
         """
+        if self.cache is not None:
+            cached = self._cache_call('get', self.get_model_version(), text)
+            if cached is not None:
+                return cached
+        
+        if self.dispatcher is not None:
+            # 与其他线程同时发起的请求合并为一次批量调用（结果由 _embed_uncached 写入缓存）
+            return self.dispatcher.embed(text)
+        
         try:
             response = self.client.embeddings.create(
                 model=self.model_name,
@@ -55,10 +84,13 @@ class EmbeddingService:
             )
             embedding = np.array(response.data[0].embedding)
             logger.debug(f"Embedding 计算成功：dimension={len(embedding)}")
-            return embedding
         except Exception as e:
             logger.error(f"Embedding 计算失败：{e}")
             raise
+        
+        if self.cache is not None:
+            self._cache_call('put', self.get_model_version(), text, embedding)
+        return embedding
     
     def embed_batch(self, texts: list[str], batch_size: int = 32) -> list[np.ndarray]:
         """
@@ -71,6 +103,27 @@ class EmbeddingService:
         Returns:
             向量列表
         """
+        if self.cache is None:
+            return self._request_batch(texts, batch_size)
+        
+        # 只请求未命中缓存的文本
+        embeddings = self._cache_call('get_many', self.get_model_version(), texts) or [None] * len(texts)
+        missing = [text for text, embedding in zip(texts, embeddings) if embedding is None]
+        if missing:
+            computed = iter(self._embed_uncached(missing, batch_size))
+            embeddings = [next(computed) if embedding is None else embedding for embedding in embeddings]
+        return embeddings
+    
+    def _embed_uncached(self, texts: list[str], batch_size: int = 32) -> list[np.ndarray]:
+        """调用 API 计算向量并写入缓存（重复的文本只请求一次）"""
+        unique = list(dict.fromkeys(texts))
+        computed = dict(zip(unique, self._request_batch(unique, batch_size)))
+        if self.cache is not None:
+            self._cache_call('put_many', self.get_model_version(), unique, [computed[text] for text in unique])
+        return [computed[text] for text in texts]
+    
+    def _request_batch(self, texts: list[str], batch_size: int) -> list[np.ndarray]:
+        """按批次调用 API"""
         embeddings = []
         
         for i in range(0, len(texts), batch_size):
@@ -88,6 +141,37 @@ class EmbeddingService:
         
         return embeddings
     
+    def _cache_call(self, method: str, *args):
+        """调用缓存方法；缓存读写失败只记录日志，不影响向量化"""
+        try:
+            return getattr(self.cache, method)(*args)
+        except Exception as e:
+            logger.warning(f"Embedding 缓存{method}失败：{e}")
+            return None
+    
+    def get_cache_stats(self) -> Optional[Dict]:
+        """
+        获取缓存统计
+        
+        Returns:
+            缓存条目数与命中统计，未启用缓存时返回 None
+        """
+        return self.cache.get_stats() if self.cache is not None else None
+    
+    def get_batching_stats(self) -> Optional[Dict]:
+        """
+        获取微批调度统计
+        
+        Returns:
+            批次数、请求数、平均批大小等，未启用微批时返回 None
+        """
+        return self.dispatcher.get_stats() if self.dispatcher is not None else None
+    
+    def close(self):
+        """关闭微批调度器（已排队的请求仍会执行完）"""
+        if self.dispatcher is not None:
+            self.dispatcher.close(wait=False)
+    
     def get_model_version(self) -> str:
         """
         获取模型版本标识
@@ -106,15 +190,32 @@ _embedding_service: Optional[EmbeddingService] = None
 _last_config_hash: str = ""
 
 
+def _build_cache(config: Dict):
+    """按配置创建缓存（cache_enabled=false 时不缓存；缓存不可用时只记录日志）"""
+    if not config.get('cache_enabled', True):
+        return None
+    try:
+        from agent.services.embedding_cache import DEFAULT_MAX_ENTRIES, get_embedding_cache
+        return get_embedding_cache(
+            config.get('cache_path') or None,
+            config.get('cache_max_entries', DEFAULT_MAX_ENTRIES)
+        )
+    except Exception as e:
+        logger.warning(f"Embedding 缓存不可用，将直接调用 API：{e}")
+        return None
+
+
 def get_embedding_service(config: Dict) -> EmbeddingService:
     """
     获取 Embedding 服务单例
     
     Args:
-        config: 配置字典
+        config: 配置字典（可选 cache_enabled / cache_path / cache_max_entries 控制持久化缓存，
+                batch_enabled / batch_max_size / batch_max_wait_ms / batch_max_in_flight 控制微批调度，
+                provider 为 local 时使用本地模型，参数见 LocalEmbeddingService）
         
     Returns:
-        EmbeddingService 实例
+        EmbeddingService 实例（provider 为 local 时为 LocalEmbeddingService）
     """
     global _embedding_service, _last_config_hash
     
@@ -123,7 +224,18 @@ def get_embedding_service(config: Dict) -> EmbeddingService:
     config_hash = hashlib.md5(str(sorted(config.items())).encode()).hexdigest()
     
     if _embedding_service is None or config_hash != _last_config_hash:
-        _embedding_service = EmbeddingService(config)
+        if _embedding_service is not None:
+            _embedding_service.close()
+        if config.get('provider') == 'local':
+            # 本地计算比读写缓存更快，也无需合并请求
+            from agent.services.local_embedding_service import LocalEmbeddingService
+            _embedding_service = LocalEmbeddingService(config)
+        else:
+            _embedding_service = EmbeddingService(
+                config,
+                cache=_build_cache(config),
+                batching=config.get('batch_enabled', True)
+            )
         _last_config_hash = config_hash
         logger.info("创建新的 Embedding 服务实例")
     
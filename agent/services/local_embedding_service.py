@@ -0,0 +1,363 @@
+"""
+本地 Embedding 服务（离线部署）
+
+无法访问任何 OpenAI 兼容接口的环境（内网 / 隔离网络）中，用 scikit-learn 在本机计算题目向量，
+查重和相似题检索照常可用。在 agent.json 的 embedding 中设置 "provider": "local" 启用：
+
+- hashing（默认）：字符 n-gram 哈希向量，无需训练，进程重启后结果不变
+- tfidf：在题库上训练字符 n-gram TF-IDF 权重，可选 TruncatedSVD 降维；
+  训练结果保存到 local_model_path，重新训练后模型版本随之变化
+
+两种方法共用 char_ngram_counts：整批题目拼接为一个码点数组，用 numpy 一次算出所有 n-gram 的哈希，
+不逐个字符串切分 n-gram，单核每秒可处理数万道题。向量为 L2 归一化的 float32。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LOCAL_METHODS = ("hashing", "tfidf")
+
+# 默认参数：向量维度 / 字符 n-gram 范围 / TF-IDF 降维前的哈希特征数 / 单次变换的文本数
+DEFAULT_DIMENSION = 512
+DEFAULT_NGRAM_RANGE = (1, 3)
+DEFAULT_MAX_FEATURES = 2 ** 15
+DEFAULT_CHUNK_SIZE = 4096
+
+# n-gram 哈希常数（64 位 FNV-1a 与 splitmix64 终混）
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME = np.uint64(0x100000001B3)
+_MIX = np.uint64(0xBF58476D1CE4E5B9)
+
+_WHITESPACE = re.compile(r"\s+")
+
+# TF-IDF 模型文件默认路径（项目根目录下）
+DEFAULT_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "data", "local_embedding.pkl"
+)
+
+
+def preprocess(text: str) -> str:
+    """统一全半角和大小写，去掉空白（题干中的空格多为排版差异，不应影响 n-gram）"""
+    return _WHITESPACE.sub("", unicodedata.normalize("NFKC", text or "")).lower()
+
+
+def char_ngram_counts(texts: Sequence[str], n_features: int, ngram_range=DEFAULT_NGRAM_RANGE):
+    """
+    字符 n-gram 哈希计数矩阵
+    
+    Args:
+        texts: 文本列表
+        n_features: 哈希桶数（矩阵列数）
+        ngram_range: n-gram 长度范围（含两端）
+    
+    Returns:
+        (len(texts), n_features) 的 scipy.sparse.csr_matrix（float32），不跨题目取 n-gram
+    """
+    from scipy import sparse
+    
+    docs = [np.frombuffer(preprocess(text).encode("utf-32-le"), dtype=np.uint32) for text in texts]
+    lengths = np.fromiter((len(doc) for doc in docs), dtype=np.int64, count=len(docs))
+    codes = np.concatenate(docs).astype(np.uint64) if docs else np.zeros(0, dtype=np.uint64)
+    doc_ids = np.repeat(np.arange(len(docs), dtype=np.int64), lengths)
+    
+    rows, cols = [], []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        size = len(codes) - n + 1
+        if size <= 0:
+            continue
+        # 首尾字符属于同一道题的 n-gram 才有效
+        valid = doc_ids[:size] == doc_ids[n - 1:]
+        hashes = np.full(size, _FNV_OFFSET ^ np.uint64(n), dtype=np.uint64)
+        for offset in range(n):
+            hashes = (hashes ^ codes[offset:offset + size]) * _FNV_PRIME
+        hashes ^= hashes >> np.uint64(31)
+        hashes *= _MIX
+        hashes ^= hashes >> np.uint64(29)
+        rows.append(doc_ids[:size][valid])
+        cols.append((hashes[valid] % np.uint64(n_features)).astype(np.int64))
+    
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(docs), n_features)
+    )
+    matrix.sum_duplicates()
+    return matrix
+
+
+class LocalEmbeddingService:
+    """
+    本地 Embedding 服务
+    与 EmbeddingService 接口一致（embed / embed_batch / get_model_version），不访问网络
+    """
+    
+    def __init__(self, config: Dict):
+        """
+        初始化本地 Embedding 服务
+        
+        Args:
+            config: 配置字典，可选：
+                - local_method: hashing / tfidf
+                - local_dimension: 向量维度（hashing 为哈希桶数，tfidf 为 SVD 维度）
+                - local_ngram_range: 字符 n-gram 范围，如 [1, 3]
+                - local_svd: tfidf 是否做 SVD 降维（false 时哈希特征数即为向量维度）
+                - local_max_features: tfidf 降维前的哈希特征数
+                - local_model_path: tfidf 模型文件路径
+        
+        Raises:
+            ValueError: local_method 不支持
+        """
+        self.method = config.get('local_method', 'hashing')
+        if self.method not in LOCAL_METHODS:
+            raise ValueError(f"不支持的本地向量化方法：{self.method}，可选：{', '.join(LOCAL_METHODS)}")
+        self.dimension = max(2, int(config.get('local_dimension', DEFAULT_DIMENSION)))
+        ngram_min, ngram_max = config.get('local_ngram_range', DEFAULT_NGRAM_RANGE)
+        self.ngram_range = (int(ngram_min), int(ngram_max))
+        self.use_svd = bool(config.get('local_svd', True))
+        self.max_features = int(config.get('local_max_features', DEFAULT_MAX_FEATURES))
+        self.model_path = config.get('local_model_path') or DEFAULT_MODEL_PATH
+        
+        self._lock = threading.Lock()
+        self._tfidf = None
+        self._projection = None
+        self._fit_id: Optional[str] = None
+        # 已加载的模型文件标识：变化时（其他进程重新训练）重新加载
+        self._loaded_stamp: Optional[Tuple[int, int]] = None
+        
+        if self.method == 'tfidf':
+            self._load()
+        
+        logger.info(f"本地 Embedding 服务初始化：{self.get_model_version()}")
+    
+    @property
+    def fitted(self) -> bool:
+        """是否可以计算向量（hashing 始终可以，tfidf 需要先训练）"""
+        return self.method == 'hashing' or self._tfidf is not None
+    
+    def fit(self, texts: Sequence[str]) -> str:
+        """
+        在题库上训练 TF-IDF（和 SVD）模型并保存（hashing 无需训练，直接返回）
+        
+        Args:
+            texts: 题目文本
+        
+        Returns:
+            训练后的模型版本
+        
+        Raises:
+            ValueError: 文本为空
+        """
+        if self.method == 'hashing':
+            return self.get_model_version()
+        texts = [text for text in texts if text and text.strip()]
+        if not texts:
+            raise ValueError("没有可用于训练的题目文本")
+        
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfTransformer
+        
+        counts = char_ngram_counts(texts, self._n_features(), self.ngram_range)
+        tfidf = TfidfTransformer(sublinear_tf=True).fit(counts)
+        projection = None
+        if self.use_svd:
+            n_components = min(self.dimension, counts.shape[0] - 1)
+            if n_components < 2:
+                raise ValueError(f"题目过少（{counts.shape[0]} 道），无法做 SVD 降维")
+            # 只保留投影矩阵（特征数 × 维度，行优先 float32），稀疏矩阵直接相乘
+            svd = TruncatedSVD(n_components=n_components, random_state=0).fit(tfidf.transform(counts))
+            projection = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        
+        # 相同题库和参数训练得到相同的版本，题库变化后版本随之变化（触发重新向量化）
+        digest = hashlib.sha1(repr(self._params()).encode())
+        for text in sorted(set(texts)):
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\0")
+        
+        with self._lock:
+            self._tfidf, self._projection, self._fit_id = tfidf, projection, digest.hexdigest()[:12]
+            self._save()
+        logger.info(f"本地 TF-IDF 模型训练完成：documents={len(texts)}, features={counts.shape[1]}, "
+                    f"version={self.get_model_version()}")
+        return self.get_model_version()
+    
+    def embed(self, text: str) -> np.ndarray:
+        """
+        将文本转换为向量
+        
+        Args:
+            text: 输入文本
+        
+        Returns:
+            numpy 数组表示的向量
+        """
+        return self.embed_matrix([text])[0]
+    
+    def embed_batch(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        """
+        批量计算 Embedding（本地计算不按 batch_size 分批，参数仅为与在线服务保持一致）
+        
+        Args:
+            texts: 文本列表
+            batch_size: 批次大小（忽略）
+        
+        Returns:
+            向量列表
+        """
+        return list(self.embed_matrix(texts))
+    
+    def embed_matrix(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        批量计算 Embedding，返回 (len(texts), dimension) 的矩阵
+        
+        Args:
+            texts: 文本列表
+        
+        Returns:
+            L2 归一化的 float32 矩阵
+        
+        Raises:
+            RuntimeError: tfidf 模型尚未训练
+        """
+        from sklearn.preprocessing import normalize
+        
+        self.refresh()
+        with self._lock:
+            tfidf, projection = self._tfidf, self._projection
+        if self.method == 'tfidf' and tfidf is None:
+            raise RuntimeError("本地 TF-IDF 模型尚未训练，请运行 python scripts/rebuild_embeddings.py --fit-local")
+        
+        result = np.zeros((len(texts), self.get_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), DEFAULT_CHUNK_SIZE):
+            matrix = char_ngram_counts(texts[start:start + DEFAULT_CHUNK_SIZE], self._n_features(), self.ngram_range)
+            if tfidf is None:
+                np.log1p(matrix.data, out=matrix.data)
+            else:
+                matrix = tfidf.transform(matrix)
+            vectors = matrix @ projection if projection is not None else matrix.toarray()
+            result[start:start + len(vectors)] = normalize(vectors)
+        return result
+    
+    def get_dimension(self) -> int:
+        """向量维度"""
+        return self._projection.shape[1] if self._projection is not None else self.dimension
+    
+    def _n_features(self) -> int:
+        """哈希特征数：hashing 和不降维的 tfidf 即为向量维度"""
+        return self.max_features if self.method == 'tfidf' and self.use_svd else self.dimension
+    
+    def get_model_version(self) -> str:
+        """
+        获取模型版本标识
+        
+        Returns:
+            方法、维度和 n-gram 范围（tfidf 另含训练标识），参数或题库变化时版本随之变化
+        """
+        self.refresh()
+        ngram = f"{self.ngram_range[0]}-{self.ngram_range[1]}"
+        if self.method == 'hashing':
+            return f"local-hashing-d{self.dimension}-ng{ngram}"
+        suffix = "svd" if self.use_svd else "raw"
+        return f"local-tfidf-{suffix}-d{self.dimension}-ng{ngram}-{self._fit_id or 'unfitted'}"
+    
+    def get_cache_stats(self) -> Optional[Dict]:
+        """本地计算不使用缓存"""
+        return None
+    
+    def get_batching_stats(self) -> Optional[Dict]:
+        """本地计算不使用微批调度"""
+        return None
+    
+    def close(self):
+        """无需释放资源"""
+    
+    def _params(self) -> tuple:
+        """决定 tfidf 模型的参数（与模型文件中的不一致时需要重新训练）"""
+        return (self.ngram_range, self.dimension, self.use_svd, self.max_features)
+    
+    def refresh(self) -> bool:
+        """
+        模型文件被替换时重新加载（rebuild_embeddings.py --fit-local 在其他进程训练后，
+        运行中的服务不必重启即可使用新模型和新版本）
+        
+        Returns:
+            是否重新加载了模型文件
+        """
+        if self.method != 'tfidf' or self._model_stamp() == self._loaded_stamp:
+            return False
+        self._load()
+        return True
+    
+    def _model_stamp(self) -> Optional[Tuple[int, int]]:
+        """模型文件的 (inode, 修改时间)：保存时整体替换文件，两者随之变化；文件不存在时为 None"""
+        try:
+            stat = os.stat(self.model_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+    
+    def _load(self):
+        """加载训练好的 tfidf 模型（文件不存在或参数不一致时保持当前状态）"""
+        stamp = self._model_stamp()
+        self._loaded_stamp = stamp
+        if stamp is None:
+            logger.warning(f"本地 TF-IDF 模型不存在：{self.model_path}，请先训练")
+            return
+        try:
+            with open(self.model_path, "rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"加载本地 TF-IDF 模型失败：{e}")
+            return
+        params = self._params()
+        if state.get('params') != params:
+            logger.warning(f"本地 TF-IDF 模型参数与配置不一致，需要重新训练：{state.get('params')} != {params}")
+            return
+        with self._lock:
+            self._tfidf, self._projection, self._fit_id = state['tfidf'], state['projection'], state['fit_id']
+        logger.info(f"加载本地 TF-IDF 模型：fit_id={state['fit_id']}")
+    
+    def _save(self):
+        """保存 tfidf 模型（先写临时文件再替换，避免读到半个文件；调用方持有锁）"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.model_path)), exist_ok=True)
+        state = {
+            'params': self._params(),
+            'tfidf': self._tfidf,
+            'projection': self._projection,
+            'fit_id': self._fit_id
+        }
+        tmp_path = f"{self.model_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, self.model_path)
+        self._loaded_stamp = self._model_stamp()
+
+
+class AsyncLocalEmbeddingService:
+    """本地 Embedding 服务的异步包装：计算放到线程池执行，不阻塞事件循环"""
+    
+    def __init__(self, service: LocalEmbeddingService):
+        self.service = service
+    
+    async def embed(self, text: str) -> np.ndarray:
+        return (await self.embed_batch([text]))[0]
+    
+    async def embed_batch(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        return await asyncio.to_thread(self.service.embed_batch, texts, batch_size)
+    
+    def get_model_version(self) -> str:
+        return self.service.get_model_version()
+    
+    async def aclose(self):
+        """无需释放资源"""
@@ -0,0 +1,112 @@
+"""
+AsyncEmbeddingService 测试
+测试异步客户端的批次并发上限、缓存和按事件循环复用实例
+"""
+import pytest
+import sys
+import os
+import asyncio
+from unittest.mock import Mock, patch
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from agent.services.async_embedding_service import AsyncEmbeddingService, get_async_embedding_service
+from agent.services.embedding_cache import EmbeddingCache
+
+
+class FakeEmbeddings:
+    """模拟 AsyncOpenAI().embeddings：向量为 [len(text)]，记录同时进行的请求数"""
+    
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+    
+    async def create(self, model, input):
+        self.calls.append(list(input))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(self.delay)
+        self.running -= 1
+        return Mock(data=[Mock(embedding=[float(len(text))]) for text in input])
+
+
+def build_service(config, cache=None):
+    """创建使用模拟客户端的异步服务"""
+    fake = FakeEmbeddings()
+    with patch('openai.AsyncOpenAI') as mock_openai:
+        mock_openai.return_value.embeddings = fake
+        service = AsyncEmbeddingService(config, cache=cache)
+    return service, fake
+
+
+class TestAsyncEmbeddingService:
+    """异步 Embedding 服务测试"""
+    
+    def test_embed_batch_bounded_concurrency(self):
+        """测试各批次并发请求但不超过并发上限，结果顺序与输入一致"""
+        async def run():
+            service, fake = build_service({'model_name': 'm', 'async_max_concurrency': 2})
+            texts = ["a" * (i + 1) for i in range(10)]
+            result = await service.embed_batch(texts, batch_size=2)
+            await service.aclose()
+            return fake, result
+        
+        fake, result = asyncio.run(run())
+        
+        assert [float(v[0]) for v in result] == [float(i + 1) for i in range(10)]
+        assert len(fake.calls) == 5
+        assert fake.max_running == 2
+    
+    def test_embed_uses_cache(self, tmp_path):
+        """测试命中缓存的文本不再请求 API"""
+        cache = EmbeddingCache(str(tmp_path / "cache.db"))
+        cache.put("m", "已缓存", np.array([9.0]))
+        
+        async def run():
+            service, fake = build_service({'model_name': 'm'}, cache=cache)
+            cached = await service.embed("已缓存")
+            fresh = await service.embed("新题目")
+            again = await service.embed("新题目")
+            await service.aclose()
+            return fake, cached, fresh, again
+        
+        fake, cached, fresh, again = asyncio.run(run())
+        cache.close()
+        
+        assert float(cached[0]) == 9.0
+        assert float(fresh[0]) == float(again[0]) == 3.0
+        assert fake.calls == [["新题目"]]
+    
+    def test_request_error_propagates(self):
+        """测试 API 异常抛给调用方"""
+        async def run():
+            service, fake = build_service({'model_name': 'm'})
+            fake.create = Mock(side_effect=TimeoutError("请求超时"))
+            try:
+                await service.embed("题目")
+            finally:
+                await service.aclose()
+        
+        with pytest.raises(TimeoutError, match="请求超时"):
+            asyncio.run(run())
+    
+    @patch('openai.AsyncOpenAI')
+    def test_service_per_loop(self, mock_openai):
+        """测试同一事件循环内复用实例，配置变化时重新创建"""
+        async def run():
+            config = {'model_name': 'm', 'cache_enabled': False}
+            first = get_async_embedding_service(config)
+            second = get_async_embedding_service(dict(config))
+            changed = get_async_embedding_service(dict(config, model_name='m2'))
+            await changed.aclose()
+            return first, second, changed
+        
+        first, second, changed = asyncio.run(run())
+        
+        assert first is second
+        assert changed is not first
+        assert changed.model_name == 'm2'
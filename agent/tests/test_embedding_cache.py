@@ -0,0 +1,153 @@
+"""
+EmbeddingCache 测试
+测试向量持久化缓存的读写、LRU 淘汰和命中统计
+"""
+import pytest
+import sys
+import os
+import time
+from unittest.mock import Mock, patch
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from agent.services.embedding_cache import EmbeddingCache, cache_key
+from agent.services.embedding_service import EmbeddingService
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """临时缓存文件"""
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=10)
+    yield cache
+    cache.close()
+
+
+def embedding_response(count, dimension=3):
+    """模拟 embeddings.create 的返回"""
+    response = Mock()
+    response.data = [Mock(embedding=[float(i + 1)] * dimension) for i in range(count)]
+    return response
+
+
+class TestEmbeddingCache:
+    """缓存读写测试"""
+    
+    def test_key_normalization(self):
+        """测试全半角、空白差异使用同一个键，不同模型使用不同的键"""
+        assert cache_key("m", "ｆ(x)  =  1 ") == cache_key("m", "f(x) = 1")
+        assert cache_key("m", "f(x) = 1") != cache_key("m", "f(x) = 1。")
+        assert cache_key("m1", "题目") != cache_key("m2", "题目")
+    
+    def test_get_put_and_stats(self, cache):
+        """测试写入后命中（跨实例持久化），并统计命中和未命中"""
+        cache.put_many("m", ["题目一", "题目二"], [np.array([1.0, 2.0]), np.array([3.0, 4.0])])
+        
+        results = cache.get_many("m", ["题目二", "题目三", "题目一"])
+        
+        np.testing.assert_array_equal(results[0], [3.0, 4.0])
+        assert results[1] is None
+        assert results[0].dtype == np.float32
+        assert cache.get("other-model", "题目一") is None
+        stats = cache.get_stats()
+        assert (stats['entries'], stats['hits'], stats['misses']) == (2, 2, 2)
+        assert stats['hit_rate'] == 0.5
+        
+        reopened = EmbeddingCache(cache.path)
+        np.testing.assert_array_equal(reopened.get("m", "题目一"), [1.0, 2.0])
+        reopened.close()
+    
+    def test_lru_eviction(self, cache):
+        """测试超过上限时淘汰最久未使用的条目"""
+        cache.put_many("m", [f"题目 {i}" for i in range(10)], [np.ones(2)] * 10)
+        time.sleep(0.01)
+        cache.get("m", "题目 0")
+        
+        cache.put("m", "新题目", np.ones(2))
+        
+        stats = cache.get_stats()
+        assert stats['entries'] == 9
+        assert stats['evictions'] == 2
+        assert cache.get("m", "题目 0") is not None
+        assert cache.get("m", "新题目") is not None
+        assert sum(cache.get("m", f"题目 {i}") is not None for i in range(1, 10)) == 7
+    
+    def test_put_many_single_transaction_without_count(self, cache):
+        """测试批量写入只有一个事务，未超过上限时不 COUNT 整张表，覆盖已有条目不增加计数"""
+        statements = []
+        cache._conn.set_trace_callback(statements.append)
+        
+        cache.put_many("m", ["题目一", "题目二", "题目一"], [np.ones(2), np.ones(2), np.zeros(2)])
+        cache.put_many("m", ["题目二", "题目三"], [np.ones(2), np.ones(2)])
+        
+        assert [sql for sql in statements if sql in ("BEGIN IMMEDIATE", "COMMIT")] == \
+            ["BEGIN IMMEDIATE", "COMMIT"] * 2
+        assert not any("COUNT(*)" in sql for sql in statements)
+        assert cache._entries == cache.get_stats()['entries'] == 3
+        np.testing.assert_array_equal(cache.get("m", "题目一"), [0.0, 0.0])
+    
+    def test_eviction_recounts_entries_written_elsewhere(self, cache):
+        """测试其他实例写入同一文件后，淘汰以实际条目数为准"""
+        other = EmbeddingCache(cache.path, max_entries=10)
+        other.put_many("m", [f"其他 {i}" for i in range(8)], [np.ones(2)] * 8)
+        other.close()
+        
+        cache.put_many("m", [f"题目 {i}" for i in range(3)], [np.ones(2)] * 3)
+        assert cache.get_stats()['entries'] == 11
+        
+        cache.put_many("m", [f"新题目 {i}" for i in range(8)], [np.ones(2)] * 8)
+        
+        assert cache.get_stats()['entries'] == cache._entries == 9
+    
+    def test_clear_by_model(self, cache):
+        """测试按模型清空"""
+        cache.put("m1", "题目", np.ones(2))
+        cache.put("m2", "题目", np.ones(2))
+        
+        assert cache.clear("m1") == 1
+        assert cache.get_stats()['models'] == {"m2": 1}
+
+
+class TestEmbeddingServiceCache:
+    """EmbeddingService 经过缓存的测试"""
+    
+    @patch('openai.OpenAI')
+    def test_embed_uses_cache(self, mock_openai, cache):
+        """测试相同文本第二次不调用 API"""
+        mock_client = mock_openai.return_value
+        mock_client.embeddings.create.return_value = embedding_response(1)
+        service = EmbeddingService({'model_name': 'm'}, cache=cache)
+        
+        first = service.embed("题目")
+        second = service.embed(" 题目 ")
+        
+        np.testing.assert_array_equal(first, second)
+        assert mock_client.embeddings.create.call_count == 1
+        assert service.get_cache_stats()['hits'] == 1
+    
+    @patch('openai.OpenAI')
+    def test_embed_batch_requests_only_misses(self, mock_openai, cache):
+        """测试批量向量化只请求未命中的文本，批内重复文本只请求一次，结果顺序不变"""
+        mock_client = mock_openai.return_value
+        mock_client.embeddings.create.return_value = embedding_response(2)
+        service = EmbeddingService({'model_name': 'm'}, cache=cache)
+        cache.put("m", "已缓存", np.array([9.0, 9.0, 9.0]))
+        
+        result = service.embed_batch(["新题目一", "已缓存", "新题目二", "新题目一"])
+        
+        mock_client.embeddings.create.assert_called_once_with(model='m', input=["新题目一", "新题目二"])
+        assert [float(v[0]) for v in result] == [1.0, 9.0, 2.0, 1.0]
+        assert cache.get_stats()['entries'] == 3
+    
+    @patch('openai.OpenAI')
+    def test_cache_failure_falls_back_to_api(self, mock_openai):
+        """测试缓存读写异常时仍调用 API 返回结果"""
+        mock_client = mock_openai.return_value
+        mock_client.embeddings.create.return_value = embedding_response(1)
+        broken = Mock()
+        broken.get_many.side_effect = RuntimeError("disk I/O error")
+        broken.put_many.side_effect = RuntimeError("disk I/O error")
+        service = EmbeddingService({'model_name': 'm'}, cache=broken)
+        
+        assert len(service.embed_batch(["题目"])) == 1
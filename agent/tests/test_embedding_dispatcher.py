@@ -0,0 +1,146 @@
+"""
+EmbeddingDispatcher 测试
+测试并发请求合并、按条数/时间窗口触发、失败隔离和执行中批次上限
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+from unittest.mock import Mock, patch
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from agent.services.embedding_dispatcher import EmbeddingDispatcher
+from agent.services.embedding_service import EmbeddingService
+
+
+class RecordingBackend:
+    """记录每批文本的批量向量化函数：向量为 [len(text)]"""
+    
+    def __init__(self, delay=0.0, fail_on=None):
+        self.batches = []
+        self.delay = delay
+        self.fail_on = fail_on
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+    
+    def __call__(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if self.fail_on and self.fail_on in texts:
+                raise ValueError(f"无法处理：{self.fail_on}")
+            return [np.array([float(len(text))]) for text in texts]
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def embed_concurrently(embed, texts):
+    """多个线程同时调用 embed，返回各自的结果"""
+    results = [None] * len(texts)
+    barrier = threading.Barrier(len(texts))
+    
+    def worker(i):
+        barrier.wait()
+        results[i] = embed(texts[i])
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+
+class TestEmbeddingDispatcher:
+    """微批调度测试"""
+    
+    def test_coalesces_concurrent_requests(self):
+        """测试并发的单条请求合并为一批，每个调用方拿到自己的向量"""
+        backend = RecordingBackend()
+        dispatcher = EmbeddingDispatcher(backend, max_batch_size=32, max_wait_ms=200)
+        texts = ["a" * (i + 1) for i in range(8)]
+        
+        results = embed_concurrently(dispatcher.embed, texts)
+        dispatcher.close()
+        
+        assert [float(r[0]) for r in results] == [float(i + 1) for i in range(8)]
+        assert len(backend.batches) < len(texts)
+        assert sorted(t for batch in backend.batches for t in batch) == sorted(texts)
+        stats = dispatcher.get_stats()
+        assert stats['items'] == 8
+        assert stats['batches'] == len(backend.batches)
+    
+    def test_flush_on_size_and_timeout(self):
+        """测试凑满条数立即执行，不足时等待时间窗口后执行"""
+        backend = RecordingBackend()
+        dispatcher = EmbeddingDispatcher(backend, max_batch_size=3, max_wait_ms=100)
+        
+        futures = [dispatcher.submit(f"题目{i}") for i in range(7)]
+        for future in futures:
+            future.result(timeout=5)
+        dispatcher.close()
+        
+        assert [len(batch) for batch in backend.batches] == [3, 3, 1]
+    
+    def test_failure_isolated_to_bad_text(self):
+        """测试整批失败时逐条重试，只有出错的请求收到异常"""
+        backend = RecordingBackend(fail_on="bad")
+        dispatcher = EmbeddingDispatcher(backend, max_batch_size=3, max_wait_ms=500)
+        
+        futures = [dispatcher.submit(text) for text in ["ok", "bad", "fine"]]
+        
+        assert float(futures[0].result(timeout=5)[0]) == 2.0
+        with pytest.raises(ValueError, match="无法处理"):
+            futures[1].result(timeout=5)
+        assert float(futures[2].result(timeout=5)[0]) == 4.0
+        dispatcher.close()
+    
+    def test_in_flight_bound(self):
+        """测试同时执行的批次数不超过上限"""
+        backend = RecordingBackend(delay=0.05)
+        dispatcher = EmbeddingDispatcher(backend, max_batch_size=2, max_wait_ms=0, max_in_flight=2)
+        
+        futures = [dispatcher.submit(f"题目{i}") for i in range(12)]
+        for future in futures:
+            future.result(timeout=5)
+        dispatcher.close()
+        
+        assert backend.max_running <= 2
+        assert sum(len(batch) for batch in backend.batches) == 12
+    
+    def test_submit_after_close(self):
+        """测试关闭后不再接受请求"""
+        dispatcher = EmbeddingDispatcher(RecordingBackend())
+        dispatcher.close()
+        
+        with pytest.raises(RuntimeError, match="已关闭"):
+            dispatcher.submit("题目")
+
+
+class TestEmbeddingServiceBatching:
+    """EmbeddingService 微批测试"""
+    
+    @patch('openai.OpenAI')
+    def test_concurrent_embed_single_request(self, mock_openai):
+        """测试并发的 embed() 合并为一次 API 调用"""
+        mock_client = mock_openai.return_value
+        mock_client.embeddings.create.side_effect = lambda model, input: Mock(
+            data=[Mock(embedding=[float(len(text))]) for text in input]
+        )
+        service = EmbeddingService({'model_name': 'm', 'batch_max_wait_ms': 200}, batching=True)
+        
+        results = embed_concurrently(service.embed, ["a", "bb", "ccc", "dddd"])
+        service.close()
+        
+        assert [float(r[0]) for r in results] == [1.0, 2.0, 3.0, 4.0]
+        assert mock_client.embeddings.create.call_count < 4
+        assert service.get_batching_stats()['items'] == 4
@@ -0,0 +1,137 @@
+"""
+LocalEmbeddingService 测试
+测试字符 n-gram 哈希、TF-IDF 训练与版本、模型持久化，以及 provider=local 的服务选择
+"""
+import pytest
+import sys
+import os
+import asyncio
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from agent.services.local_embedding_service import (
+    AsyncLocalEmbeddingService, LocalEmbeddingService, char_ngram_counts
+)
+
+BASE = "已知函数 f(x) = x^2 + 2x + 1，求函数 f(x) 在区间 [-3, 2] 上的最小值。"
+NEAR = "已知函数f(x)=x^2+2x+1，求函数f(x)在区间[-3,2]上的最小值"
+OTHER = "下列关于细胞有丝分裂的叙述，正确的是哪一项？"
+CORPUS = [BASE, OTHER, "光合作用的场所是叶绿体", "求不等式 2x + 3 > 7 的解集", "牛顿第一定律又称惯性定律",
+          "下列物质属于电解质的是", "计算 1 + 2 + ... + 100 的值", "中国古代四大发明不包括"]
+
+
+class TestCharNgramCounts:
+    """n-gram 哈希计数测试"""
+    
+    def test_counts_per_document(self):
+        """测试每道题的 n-gram 个数正确，不跨题目取 n-gram，空文本为空行"""
+        matrix = char_ngram_counts(["abc", "", "ab"], 1024, (1, 2))
+        
+        assert matrix.shape == (3, 1024)
+        # abc: 3 个 1-gram + 2 个 2-gram；ab: 2 + 1
+        assert matrix.sum(axis=1).A1.tolist() == [5.0, 0.0, 3.0]
+    
+    def test_deterministic_and_normalized(self):
+        """测试同一文本的哈希与批次无关，全角 / 大小写差异被规范化"""
+        single = char_ngram_counts(["Ｆ(X)"], 256).toarray()
+        batch = char_ngram_counts(["其他题目", "f(x)"], 256).toarray()
+        
+        assert np.array_equal(single[0], batch[1])
+
+
+class TestLocalEmbeddingService:
+    """本地 Embedding 服务测试"""
+    
+    def test_hashing_similarity(self):
+        """测试 hashing 向量为单位长度，近似题目相似度高、无关题目相似度低"""
+        service = LocalEmbeddingService({'local_dimension': 256})
+        base, near, other = service.embed_batch([BASE, NEAR, OTHER])
+        
+        assert base.shape == (256,) and base.dtype == np.float32
+        assert float(base @ base) == pytest.approx(1.0, abs=1e-5)
+        assert float(base @ near) > 0.8
+        assert float(base @ other) < 0.3
+        assert service.get_model_version() == "local-hashing-d256-ng1-3"
+        assert np.allclose(service.embed(BASE), base)
+    
+    def test_tfidf_requires_fit(self, tmp_path):
+        """测试 tfidf 未训练时抛出异常，版本标记为未训练"""
+        service = LocalEmbeddingService({'local_method': 'tfidf', 'local_model_path': str(tmp_path / "m.pkl")})
+        
+        assert not service.fitted
+        assert service.get_model_version().endswith("-unfitted")
+        with pytest.raises(RuntimeError, match="尚未训练"):
+            service.embed(BASE)
+    
+    def test_tfidf_fit_persist_and_version(self, tmp_path):
+        """测试训练后保存模型，重新加载得到相同版本和向量；题库变化后版本变化"""
+        config = {'local_method': 'tfidf', 'local_dimension': 4, 'local_model_path': str(tmp_path / "m.pkl")}
+        service = LocalEmbeddingService(config)
+        version = service.fit(CORPUS)
+        vectors = service.embed_batch([BASE, NEAR])
+        
+        reloaded = LocalEmbeddingService(config)
+        
+        assert vectors[0].shape == (4,)
+        assert float(vectors[0] @ vectors[1]) > 0.8
+        assert reloaded.get_model_version() == version
+        assert np.allclose(reloaded.embed_batch([BASE, NEAR]), vectors, atol=1e-5)
+        assert reloaded.fit(CORPUS + ["新增的题目"]) != version
+    
+    def test_tfidf_reloads_model_fitted_elsewhere(self, tmp_path):
+        """测试运行中的服务发现其他进程训练 / 重新训练后保存的模型，无需重启"""
+        config = {'local_method': 'tfidf', 'local_dimension': 4, 'local_model_path': str(tmp_path / "m.pkl")}
+        running = LocalEmbeddingService(config)
+        assert running.get_model_version().endswith("-unfitted")
+        
+        version = LocalEmbeddingService(config).fit(CORPUS)
+        
+        assert running.get_model_version() == version
+        assert running.embed(BASE).shape == (4,)
+        
+        refit = LocalEmbeddingService(config).fit(CORPUS + ["新增的题目"])
+        assert running.get_model_version() == refit != version
+    
+    def test_tfidf_params_changed_requires_refit(self, tmp_path):
+        """测试配置参数与模型文件不一致时不加载旧模型"""
+        path = str(tmp_path / "m.pkl")
+        LocalEmbeddingService({'local_method': 'tfidf', 'local_dimension': 4, 'local_model_path': path}).fit(CORPUS)
+        
+        service = LocalEmbeddingService({'local_method': 'tfidf', 'local_dimension': 5, 'local_model_path': path})
+        
+        assert not service.fitted
+    
+    def test_invalid_method(self):
+        """测试不支持的本地方法"""
+        with pytest.raises(ValueError, match="不支持"):
+            LocalEmbeddingService({'local_method': 'word2vec'})
+
+
+class TestLocalProviderSelection:
+    """provider=local 的服务选择测试"""
+    
+    def test_get_embedding_service_local(self):
+        """测试同步服务按 provider 选择本地模型，不创建 API 客户端"""
+        from agent.services.embedding_service import get_embedding_service
+        service = get_embedding_service({'provider': 'local', 'local_dimension': 64})
+        
+        assert isinstance(service, LocalEmbeddingService)
+        assert service.get_cache_stats() is None
+    
+    def test_get_async_embedding_service_local(self):
+        """测试异步服务包装同一个本地模型"""
+        from agent.services.async_embedding_service import get_async_embedding_service
+        
+        async def run():
+            service = get_async_embedding_service({'provider': 'local', 'local_dimension': 64})
+            vectors = await service.embed_batch([BASE, OTHER])
+            await service.aclose()
+            return service, vectors
+        
+        service, vectors = asyncio.run(run())
+        
+        assert isinstance(service, AsyncLocalEmbeddingService)
+        assert service.get_model_version() == "local-hashing-d64-ng1-3"
+        assert len(vectors) == 2 and vectors[0].shape == (64,)
@@ -1,35 +1,292 @@
 """
 数据库连接管理
 提供SQLite数据库连接和连接池管理
+
+连接模型：
+- 一个共享写连接：所有写操作经由同一个连接串行执行（进程内不会互相锁库）
+- 有上限的读连接池：查询时借出、用完归还；WAL 模式下读不等待写
+- 跨进程（Web/MCP/微信入口共用一个数据库文件）的锁冲突由 busy_timeout 等待
 """
 
 import sqlite3
 import threading
+import queue
 from contextlib import contextmanager
-from typing import Generator, Optional
+from typing import Callable, Dict, Generator, Iterable, Iterator, List, Optional, Sequence
 import os
 
+from shared.config import config
+from core.exceptions import DatabaseException
+
+
+# 单条 IN 查询的最大参数个数（低于 SQLite 默认变量上限 999）
+IN_QUERY_BATCH_SIZE = 500
+
+
+def chunked(values: Sequence, size: int = IN_QUERY_BATCH_SIZE) -> Iterator[list]:
+    """
+    按 IN 查询参数个数上限切分
+    
+    参数:
+        values: 参数序列
+        size: 每批个数
+    
+    返回:
+        依次产出每批参数列表
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def fetch_all_in(connection, sql: str, values: Sequence, params: tuple = ()) -> list:
+    """
+    按 IN 参数个数上限分批查询并合并结果（各批之间不保证顺序）
+    
+    参数:
+        connection: DatabaseConnection（或提供 fetch_all 的对象）
+        sql: SQL查询语句，IN 列表处写 {placeholders}，且位于其他参数之后
+        values: IN 列表的值
+        params: IN 列表之前的参数
+    
+    返回:
+        list: 所有记录（列表字典格式）
+    """
+    rows = []
+    for batch in chunked(values):
+        placeholders = ", ".join("?" for _ in batch)
+        rows.extend(connection.fetch_all(sql.format(placeholders=placeholders), tuple(params) + tuple(batch)))
+    return rows
+
 
 @contextmanager
 def transaction():
     """
-    事务上下文管理器
+    事务上下文管理器（工作单元）
+    
+    事务内当前线程的 db.execute / fetch_one / fetch_all 都在同一个写连接上执行，
+    结束时只提交一次；异常时整体回滚。嵌套使用时内层为 SAVEPOINT，
+    内层失败只回滚内层的修改。
+    
+    持有写锁直到事务结束，期间其他线程的写操作会等待（读操作不受影响）
     
     用法:
         with transaction():
             # 执行数据库操作
             db.execute("INSERT INTO ...")
+            db.execute("UPDATE ...")
     """
     db = DatabaseConnection()
-    conn = db.get_connection()
-    try:
+    with db.pool.transaction() as conn:
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
 
-from shared.config import config
+
+class ConnectionPool:
+    """SQLite 连接池（一个共享写连接 + 有上限的读连接池）"""
+    
+    def __init__(self,
+                 db_path: str,
+                 size: int = 5,
+                 timeout: float = 30.0,
+                 busy_timeout_ms: int = 5000,
+                 journal_mode: str = "WAL",
+                 cache_size_kb: int = 8192,
+                 mmap_size_mb: int = 256):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.journal_mode = journal_mode
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.RLock()
+        # 当前事务的嵌套层数和所属线程（只有持有写锁的线程能修改）
+        self._tx_depth = 0
+        self._tx_owner: Optional[int] = None
+        self._trace_callback: Optional[Callable[[str], None]] = None
+    
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        """创建并配置一个连接"""
+        # 连接会在线程间借用，由连接池保证同一时刻只有一个线程使用
+        # isolation_level=None：不自动开启事务，事务边界由 transaction() 显式控制，
+        # 事务外的单条语句自动提交
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000,
+                               check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size_mb) * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if not readonly:
+            # journal_mode 持久化在数据库文件中，由写连接设置一次即可
+            conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        # WAL 下 NORMAL 只在检查点时同步，崩溃不会损坏数据库
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        if self._trace_callback is not None:
+            conn.set_trace_callback(self._trace_callback)
+        return conn
+    
+    @staticmethod
+    def _is_open(conn: sqlite3.Connection) -> bool:
+        """检查连接是否仍可用（调用方可能误关闭了共享连接）"""
+        try:
+            conn.total_changes
+            return True
+        except sqlite3.ProgrammingError:
+            return False
+    
+    def get_writer(self) -> sqlite3.Connection:
+        """获取共享写连接（不加锁，需要加锁时使用 writer()）"""
+        with self._write_lock:
+            if self._writer is None or not self._is_open(self._writer):
+                self._writer = self._connect(readonly=False)
+            return self._writer
+    
+    @contextmanager
+    def writer(self) -> Generator[sqlite3.Connection, None, None]:
+        """持有写锁并返回写连接（同一线程可重入）"""
+        with self._write_lock:
+            yield self.get_writer()
+    
+    def in_transaction(self) -> bool:
+        """当前线程是否处于 transaction() 内"""
+        return self._tx_depth > 0 and self._tx_owner == threading.get_ident()
+    
+    @contextmanager
+    def transaction(self) -> Generator[sqlite3.Connection, None, None]:
+        """
+        在写连接上开启事务（外层 BEGIN IMMEDIATE，内层 SAVEPOINT）
+        
+        外层立即获取数据库写锁，避免读后升级写时与其他进程死锁
+        """
+        with self._write_lock:
+            conn = self.get_writer()
+            depth = self._tx_depth
+            savepoint = f"sp_{depth}"
+            if depth == 0:
+                conn.execute("BEGIN IMMEDIATE")
+                self._tx_owner = threading.get_ident()
+            else:
+                conn.execute(f"SAVEPOINT {savepoint}")
+            self._tx_depth += 1
+            
+            try:
+                yield conn
+            except BaseException:
+                self._tx_depth -= 1
+                if depth == 0:
+                    self._tx_owner = None
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                else:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    conn.execute(f"RELEASE {savepoint}")
+                raise
+            
+            self._tx_depth -= 1
+            if depth == 0:
+                self._tx_owner = None
+                try:
+                    conn.execute("COMMIT")
+                except Exception:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+            else:
+                conn.execute(f"RELEASE {savepoint}")
+    
+    def checkout(self) -> sqlite3.Connection:
+        """
+        借出一个读连接
+        
+        无空闲连接且未达上限时新建；达到上限时最多等待 timeout 秒
+        
+        Raises:
+            DatabaseException: 等待超时
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._readers_lock:
+            if len(self._readers) < self.size:
+                conn = self._connect(readonly=True)
+                self._readers.append(conn)
+                return conn
+        
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise DatabaseException(f"获取数据库连接超时（连接池大小 {self.size}）")
+    
+    def checkin(self, conn: sqlite3.Connection):
+        """归还读连接"""
+        if not self._is_open(conn):
+            with self._readers_lock:
+                if conn in self._readers:
+                    self._readers.remove(conn)
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+    
+    @contextmanager
+    def reader(self) -> Generator[sqlite3.Connection, None, None]:
+        """借出读连接，退出时自动归还"""
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+    
+    def set_trace_callback(self, callback: Optional[Callable[[str], None]]):
+        """为所有连接（含之后新建的连接）设置 SQL 跟踪回调"""
+        self._trace_callback = callback
+        with self._readers_lock:
+            connections = list(self._readers)
+        if self._writer is not None:
+            connections.append(self._writer)
+        for conn in connections:
+            conn.set_trace_callback(callback)
+    
+    def stats(self) -> Dict[str, int]:
+        """连接池状态"""
+        with self._readers_lock:
+            created = len(self._readers)
+        idle = self._idle.qsize()
+        return {
+            "size": self.size,
+            "readers": created,
+            "idle": idle,
+            "in_use": created - idle,
+        }
+    
+    def close_all(self):
+        """关闭所有连接（之后再次使用时会重新创建）"""
+        with self._write_lock:
+            if self._tx_depth:
+                raise DatabaseException("事务进行中，不能关闭数据库连接")
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for conn in readers:
+            conn.close()
 
 
 class DatabaseConnection:
@@ -46,67 +303,84 @@ class DatabaseConnection:
         return cls._instance
     
     def _init_connection(self):
-        """初始化数据库连接"""
+        """初始化数据库连接池"""
         self.db_path = config.get_database_path()
-        self._local = threading.local()
         
         # 确保数据库文件目录存在
         db_dir = os.path.dirname(self.db_path)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
+        
+        self.pool = ConnectionPool(
+            self.db_path,
+            size=config.DB_POOL_SIZE,
+            timeout=config.DB_POOL_TIMEOUT,
+            busy_timeout_ms=config.DB_BUSY_TIMEOUT_MS,
+            journal_mode=config.DB_JOURNAL_MODE,
+            cache_size_kb=config.DB_CACHE_SIZE_KB,
+            mmap_size_mb=config.DB_MMAP_SIZE_MB,
+        )
     
     def get_connection(self) -> sqlite3.Connection:
         """
-        获取数据库连接（线程安全）
+        获取共享写连接
+        
+        所有线程共享同一个写连接；执行多条语句时请使用 transaction() 加锁
         
         返回:
             sqlite3.Connection: SQLite数据库连接
         """
-        if not hasattr(self._local, 'connection'):
-            self._local.connection = sqlite3.connect(self.db_path)
-            # 启用外键约束
-            self._local.connection.execute("PRAGMA foreign_keys = ON")
-            # 设置行工厂，返回字典格式
-            self._local.connection.row_factory = sqlite3.Row
-        return self._local.connection
+        return self.pool.get_writer()
     
     def close_connection(self):
-        """关闭当前线程的数据库连接"""
-        if hasattr(self._local, 'connection'):
-            self._local.connection.close()
-            delattr(self._local, 'connection')
+        """关闭连接池中的所有连接"""
+        self.pool.close_all()
+    
+    def set_trace_callback(self, callback: Optional[Callable[[str], None]]):
+        """为所有连接设置 SQL 跟踪回调（用于统计查询次数）"""
+        self.pool.set_trace_callback(callback)
+    
+    def in_transaction(self) -> bool:
+        """当前线程是否处于 transaction() 内"""
+        return self.pool.in_transaction()
     
     @contextmanager
     def get_cursor(self) -> Generator[sqlite3.Cursor, None, None]:
         """
-        获取数据库游标的上下文管理器
+        获取写连接游标的上下文管理器
+        
+        在 transaction() 内时语句加入当前事务，否则每条语句自动提交
         
         使用示例:
         ```
         with db.get_cursor() as cursor:
-            cursor.execute("SELECT * FROM table")
-            result = cursor.fetchall()
+            cursor.execute("UPDATE table SET ...")
         ```
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        try:
-            yield cursor
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
-        finally:
-            cursor.close()
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+    
+    @contextmanager
+    def _read_connection(self) -> Generator[sqlite3.Connection, None, None]:
+        """查询用连接：事务内使用写连接（能读到未提交的修改），否则借用读连接"""
+        if self.pool.in_transaction():
+            yield self.pool.get_writer()
+        else:
+            with self.pool.reader() as conn:
+                yield conn
     
     def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
         """
-        执行SQL语句
+        执行SQL语句（使用写连接）
         
         参数:
             sql: SQL语句
             params: 参数元组
-            
+        
         返回:
             sqlite3.Cursor: 执行后的游标
         """
@@ -114,36 +388,58 @@ class DatabaseConnection:
             cursor.execute(sql, params)
             return cursor
     
+    def executemany(self, sql: str, params_list: Iterable[tuple]) -> sqlite3.Cursor:
+        """
+        批量执行SQL语句（使用写连接，事务外整体作为一个事务提交）
+        
+        参数:
+            sql: SQL语句
+            params_list: 参数元组序列
+            
+        返回:
+            sqlite3.Cursor: 执行后的游标
+        """
+        with self.pool.transaction() as conn:
+            cursor = conn.executemany(sql, params_list)
+            cursor.close()
+            return cursor
+    
     def fetch_one(self, sql: str, params: tuple = ()) -> Optional[dict]:
         """
-        执行查询并返回单条记录
+        执行查询并返回单条记录（事务外使用读连接）
         
         参数:
             sql: SQL查询语句
             params: 参数元组
-            
+        
         返回:
             dict: 单条记录（字典格式）或None
         """
-        with self.get_cursor() as cursor:
-            cursor.execute(sql, params)
-            row = cursor.fetchone()
+        with self._read_connection() as conn:
+            cursor = conn.execute(sql, params)
+            try:
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
             return dict(row) if row else None
     
     def fetch_all(self, sql: str, params: tuple = ()) -> list:
         """
-        执行查询并返回所有记录
+        执行查询并返回所有记录（事务外使用读连接）
         
         参数:
             sql: SQL查询语句
             params: 参数元组
-            
+        
         返回:
             list: 所有记录（列表字典格式）
         """
-        with self.get_cursor() as cursor:
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
+        with self._read_connection() as conn:
+            cursor = conn.execute(sql, params)
+            try:
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
             return [dict(row) for row in rows]
     
     def table_exists(self, table_name: str) -> bool:
@@ -152,12 +448,12 @@ class DatabaseConnection:
         
         参数:
             table_name: 表名
-            
+        
         返回:
             bool: 表是否存在
         """
         sql = """
-        SELECT name FROM sqlite_master 
+        SELECT name FROM sqlite_master
         WHERE type='table' AND name=?
         """
         result = self.fetch_one(sql, (table_name,))
@@ -165,4 +461,4 @@ class DatabaseConnection:
 
 
 # 创建全局数据库连接实例
-db = DatabaseConnection()
\ No newline at end of file
+db = DatabaseConnection()
@@ -0,0 +1,99 @@
+"""
+题目全文检索（SQLite FTS5）
+
+FTS5 自带的 unicode61 分词器会把连续的中文当成一个词，无法按词检索中文。
+这里使用 FTS5 内置的 trigram 分词器（SQLite 3.34+）：按字符三元组建立索引，
+可以匹配任意长度不少于 3 个字符的子串，中英文一视同仁：
+
+    关键词 "函数的" → 短语 "函数的"，命中包含该子串的题目（与 LIKE '%函数的%' 相同）
+
+两个字符的关键词（中文常见的双字词）无法用三元组表达。每个文本列另有一个字符二元组列，
+内容是原文每个相邻字符对后接分隔符 \x1f（"求函\x1f函数\x1f数的\x1f..."），
+"函数\x1f" 这个三元组只会出现在对齐的二元组上，于是双字词也能走索引并按 bm25 排序：
+
+    关键词 "函数" → {content_bigrams answer_bigrams explanation_bigrams} : "函数\x1f"
+
+二元组列由 SQL 表达式借助位置表（1..N 的整数）生成。索引完全由 SQL 触发器维护，
+不依赖应用注册的自定义函数，其他程序写入题目也会同步。
+FTS5 的 rowid 取自键映射表的 INTEGER PRIMARY KEY（VACUUM 不会改变），
+而不是题目表的隐式 rowid。只有单个字符的关键词回退到 LIKE。
+"""
+
+import sqlite3
+from typing import Optional
+
+# FTS5 虚拟表名
+FTS_TABLE = "questions_fts"
+
+# 题目 ID → FTS5 rowid 的键映射表
+FTS_KEYS_TABLE = "questions_fts_keys"
+
+# 字符二元组列使用的位置表（n = 1..N，生成二元组时按位置截取）
+FTS_POSITIONS_TABLE = "questions_fts_positions"
+
+# 位置表的最少行数；启动时还会扩展到题库中最长文本的长度
+MIN_FTS_POSITIONS = 65536
+
+# 可以走全文检索的最短关键词长度（2 个字符用二元组列，3 个及以上用原文列）
+MIN_MATCH_LENGTH = 2
+
+# trigram 分词器可直接索引的最短子串长度
+TRIGRAM_LENGTH = 3
+
+# 二元组列中每个字符二元组后的分隔符（ASCII 单元分隔符，正常题目文本中不会出现）
+BIGRAM_SEPARATOR = "\x1f"
+
+# 原文列及对应的字符二元组列
+TEXT_COLUMNS = ("content", "answer", "explanation")
+BIGRAM_COLUMNS = tuple(f"{column}_bigrams" for column in TEXT_COLUMNS)
+
+# bm25 列权重：题干 > 答案 > 解析（二元组列与对应原文列相同）
+BM25_WEIGHTS = (10.0, 5.0, 2.0) * 2
+
+
+def build_match_query(keyword: Optional[str]) -> Optional[str]:
+    """
+    将搜索关键词转换为 FTS5 MATCH 表达式
+    
+    整个关键词作为一个短语做子串匹配，结果与 LIKE '%关键词%' 一致（不区分大小写）。
+    两个字符的关键词匹配二元组列；单个字符无法用索引表达，返回 None，调用方应回退到 LIKE。
+    
+    Args:
+        keyword: 搜索关键词
+    
+    Returns:
+        MATCH 表达式，或 None
+    """
+    if not keyword or len(keyword) < MIN_MATCH_LENGTH:
+        return None
+    # 短语内的双引号需转义为两个双引号
+    phrase = keyword.replace('"', '""')
+    if len(keyword) < TRIGRAM_LENGTH:
+        return "{" + " ".join(BIGRAM_COLUMNS) + '} : "' + phrase + BIGRAM_SEPARATOR + '"'
+    return '"' + phrase + '"'
+
+
+def bigram_sql(expression: str) -> str:
+    """
+    生成某个文本表达式的字符二元组列内容的 SQL（触发器和重建索引共用）
+    
+    各二元组之间互不依赖，group_concat 的拼接顺序不影响匹配结果；文本为 NULL 或只有一个字符时结果为 NULL。
+    
+    Args:
+        expression: 文本 SQL 表达式，如 new.content
+    
+    Returns:
+        标量子查询 SQL
+    """
+    return (f"(SELECT group_concat(substr({expression}, n, 2) || char({ord(BIGRAM_SEPARATOR)}), '') "
+            f"FROM {FTS_POSITIONS_TABLE} WHERE n < length({expression}))")
+
+
+def is_fts5_supported(connection: sqlite3.Connection) -> bool:
+    """检查当前 SQLite 是否编译了 FTS5 且支持 trigram 分词器"""
+    try:
+        connection.execute("CREATE VIRTUAL TABLE temp.qb_fts5_probe USING fts5(x, tokenize = 'trigram')")
+        connection.execute("DROP TABLE temp.qb_fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
@@ -10,8 +10,13 @@
 
 import os
 import json
+import sqlite3
 from datetime import datetime
-from core.database.connection import db
+from core.database.connection import db, transaction
+from core.database.fts import (
+    BIGRAM_COLUMNS, FTS_KEYS_TABLE, FTS_POSITIONS_TABLE, FTS_TABLE, MIN_FTS_POSITIONS, TEXT_COLUMNS,
+    bigram_sql, is_fts5_supported
+)
 
 # 迁移版本号
 MIGRATION_VERSION = "20260308"
@@ -27,11 +32,24 @@ EXPECTED_SCHEMA = {
             "explanation": "TEXT",
             "category_id": "TEXT",
             "created_at": "TEXT",
-            "updated_at": "TEXT",
+            "updated_at": "TEXT"
+        }
+    },
+    "category_closure": {
+        "columns": {
+            "ancestor_id": "TEXT",
+            "descendant_id": "TEXT",
+            "depth": "INTEGER"
+        }
+    },
+    "question_embeddings": {
+        "columns": {
+            "question_id": "TEXT",
             "embedding": "BLOB",
             "embedding_version": "TEXT",
             "content_hash": "TEXT",
-            "embedding_updated_at": "TEXT"
+            "embedding_updated_at": "TEXT",
+            "embedding_dtype": "TEXT"
         }
     },
     "categories": {
@@ -97,6 +115,290 @@ EXPECTED_SCHEMA = {
 }
 
 
+# 查询优化索引（新建库和已有库都会创建）
+QUERY_INDEXES = [
+    # 游标分页按 (created_at, id) 键集定位
+    "CREATE INDEX IF NOT EXISTS idx_questions_created_id ON questions(created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_questions_category_created_id ON questions(category_id, created_at, id)",
+]
+
+
+# 分类闭包表：每个分类与其所有祖先（含自身，depth = 0）各一行，由触发器维护
+CATEGORY_CLOSURE_TABLE = "category_closure"
+
+CATEGORY_CLOSURE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {CATEGORY_CLOSURE_TABLE} (
+    ancestor_id TEXT NOT NULL,
+    descendant_id TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+) WITHOUT ROWID
+"""
+
+CATEGORY_CLOSURE_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS idx_category_closure_descendant ON {CATEGORY_CLOSURE_TABLE}(descendant_id, depth)",
+]
+
+CATEGORY_CLOSURE_TRIGGERS = [
+    # 新分类：自身一行 + 继承父分类的所有祖先
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {CATEGORY_CLOSURE_TABLE}_ai AFTER INSERT ON categories BEGIN
+        INSERT INTO {CATEGORY_CLOSURE_TABLE} (ancestor_id, descendant_id, depth)
+        SELECT new.id, new.id, 0
+        UNION ALL
+        SELECT ancestor_id, new.id, depth + 1
+        FROM {CATEGORY_CLOSURE_TABLE}
+        WHERE descendant_id = new.parent_id;
+    END
+    """,
+    # 禁止把分类移动到自己的子孙分类下
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {CATEGORY_CLOSURE_TABLE}_bu BEFORE UPDATE OF parent_id ON categories
+    WHEN new.parent_id IS NOT NULL AND EXISTS (
+        SELECT 1 FROM {CATEGORY_CLOSURE_TABLE}
+        WHERE ancestor_id = new.id AND descendant_id = new.parent_id
+    )
+    BEGIN
+        SELECT RAISE(ABORT, 'category cycle');
+    END
+    """,
+    # 移动分类：断开整棵子树与原祖先的关系，再挂到新父分类的祖先下
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {CATEGORY_CLOSURE_TABLE}_au AFTER UPDATE OF parent_id ON categories
+    WHEN old.parent_id IS NOT new.parent_id
+    BEGIN
+        DELETE FROM {CATEGORY_CLOSURE_TABLE}
+        WHERE descendant_id IN (
+            SELECT descendant_id FROM {CATEGORY_CLOSURE_TABLE} WHERE ancestor_id = new.id
+        )
+        AND ancestor_id NOT IN (
+            SELECT descendant_id FROM {CATEGORY_CLOSURE_TABLE} WHERE ancestor_id = new.id
+        );
+        INSERT INTO {CATEGORY_CLOSURE_TABLE} (ancestor_id, descendant_id, depth)
+        SELECT p.ancestor_id, s.descendant_id, p.depth + s.depth + 1
+        FROM {CATEGORY_CLOSURE_TABLE} p, {CATEGORY_CLOSURE_TABLE} s
+        WHERE p.descendant_id = new.parent_id AND s.ancestor_id = new.id;
+    END
+    """,
+    # 删除分类：移除其祖先（含自身）到其子树的所有关系，子分类成为独立子树
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {CATEGORY_CLOSURE_TABLE}_ad AFTER DELETE ON categories BEGIN
+        DELETE FROM {CATEGORY_CLOSURE_TABLE}
+        WHERE descendant_id IN (
+            SELECT descendant_id FROM {CATEGORY_CLOSURE_TABLE} WHERE ancestor_id = old.id
+        )
+        AND ancestor_id IN (
+            SELECT ancestor_id FROM {CATEGORY_CLOSURE_TABLE} WHERE descendant_id = old.id
+        );
+    END
+    """,
+]
+
+
+# 题目向量表：向量 BLOB 单独存放，题目列表查询不再读取大字段
+EMBEDDINGS_TABLE = "question_embeddings"
+
+EMBEDDINGS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {EMBEDDINGS_TABLE} (
+    question_id TEXT PRIMARY KEY,
+    embedding BLOB NOT NULL,
+    embedding_version TEXT,
+    content_hash TEXT,
+    embedding_updated_at TEXT,
+    embedding_dtype TEXT NOT NULL DEFAULT 'float32'
+)
+"""
+
+EMBEDDINGS_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS idx_question_embeddings_version ON {EMBEDDINGS_TABLE}(embedding_version)",
+]
+
+# 旧版本直接存放在 questions 表中的向量列
+LEGACY_EMBEDDING_COLUMNS = ["embedding", "embedding_version", "content_hash", "embedding_updated_at"]
+
+
+# 向量模型版本：question_embeddings 只存放当前生效（active）版本的向量，
+# 新模型的向量在影子表中后台构建，构建完成后在一个事务内与当前版本互换（切换）
+EMBEDDING_VERSIONS_TABLE = "embedding_versions"
+SHADOW_EMBEDDINGS_TABLE = "question_embeddings_shadow"
+
+EMBEDDING_VERSIONS_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {EMBEDDING_VERSIONS_TABLE} (
+        version TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        dimension INTEGER,
+        total INTEGER NOT NULL DEFAULT 0,
+        built INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TEXT NOT NULL,
+        finished_at TEXT,
+        activated_at TEXT,
+        retired_at TEXT
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {SHADOW_EMBEDDINGS_TABLE} (
+        embedding_version TEXT NOT NULL,
+        question_id TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        content_hash TEXT,
+        embedding_updated_at TEXT,
+        embedding_dtype TEXT NOT NULL DEFAULT 'float32',
+        PRIMARY KEY (embedding_version, question_id)
+    )
+    """,
+]
+
+
+# 题目文本指纹：规范化文本的哈希（完全重复）+ MinHash 签名，LSH 分段桶用于快速召回近似重复
+FINGERPRINTS_TABLE = "question_fingerprints"
+FINGERPRINT_BUCKETS_TABLE = "question_fingerprint_buckets"
+
+FINGERPRINT_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {FINGERPRINTS_TABLE} (
+        question_id TEXT PRIMARY KEY,
+        text_hash TEXT NOT NULL,
+        signature BLOB NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_question_fingerprints_hash ON {FINGERPRINTS_TABLE}(text_hash)",
+    f"""
+    CREATE TABLE IF NOT EXISTS {FINGERPRINT_BUCKETS_TABLE} (
+        bucket INTEGER NOT NULL,
+        question_id TEXT NOT NULL,
+        PRIMARY KEY (bucket, question_id)
+    ) WITHOUT ROWID
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_fingerprint_buckets_question ON {FINGERPRINT_BUCKETS_TABLE}(question_id)",
+]
+
+
+# 向量化任务队列：题目写入后只登记任务，由后台 worker 批量向量化（每道题最多一条任务）
+EMBEDDING_JOBS_TABLE = "embedding_jobs"
+
+EMBEDDING_JOBS_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {EMBEDDING_JOBS_TABLE} (
+        question_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        enqueued_at REAL NOT NULL,
+        locked_at REAL,
+        last_error TEXT
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_embedding_jobs_due ON {EMBEDDING_JOBS_TABLE}(status, next_attempt_at)",
+]
+
+
+# 全库近似重复扫描报告：每次扫描一条运行记录，命中的题目对边扫描边写入，结束后写入聚类结果
+DUPLICATE_RUNS_TABLE = "duplicate_scan_runs"
+DUPLICATE_PAIRS_TABLE = "duplicate_pairs"
+DUPLICATE_CLUSTERS_TABLE = "duplicate_clusters"
+
+DUPLICATE_REPORT_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {DUPLICATE_RUNS_TABLE} (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        method TEXT,
+        threshold REAL NOT NULL,
+        total_vectors INTEGER NOT NULL DEFAULT 0,
+        scanned INTEGER NOT NULL DEFAULT 0,
+        pair_count INTEGER NOT NULL DEFAULT 0,
+        cluster_count INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        started_at TEXT NOT NULL,
+        finished_at TEXT
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {DUPLICATE_PAIRS_TABLE} (
+        run_id TEXT NOT NULL,
+        question_id TEXT NOT NULL,
+        duplicate_id TEXT NOT NULL,
+        similarity REAL NOT NULL,
+        PRIMARY KEY (run_id, question_id, duplicate_id)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {DUPLICATE_CLUSTERS_TABLE} (
+        run_id TEXT NOT NULL,
+        cluster_id INTEGER NOT NULL,
+        question_id TEXT NOT NULL,
+        PRIMARY KEY (run_id, question_id)
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_duplicate_clusters_cluster ON {DUPLICATE_CLUSTERS_TABLE}(run_id, cluster_id)",
+]
+
+
+# 题目全文检索：trigram 分词的 FTS5 表（原文列 + 字符二元组列），rowid 取自键映射表的稳定整数键，触发器同步原文
+FTS_TABLE_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    {", ".join(TEXT_COLUMNS + BIGRAM_COLUMNS)},
+    tokenize = 'trigram'
+)
+"""
+
+FTS_KEYS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {FTS_KEYS_TABLE} (
+    key INTEGER PRIMARY KEY,
+    question_id TEXT NOT NULL UNIQUE
+)
+"""
+
+FTS_POSITIONS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {FTS_POSITIONS_TABLE} (
+    n INTEGER PRIMARY KEY
+)
+"""
+
+# 将位置表补齐到 1..?（已有的位置保持不变）
+FTS_POSITIONS_FILL_SQL = f"""
+INSERT OR IGNORE INTO {FTS_POSITIONS_TABLE} (n)
+WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+SELECT n FROM seq
+"""
+
+# 写入 new 行的原文列和二元组列（触发器共用）
+_FTS_INSERT_NEW_SQL = f"""INSERT INTO {FTS_TABLE} (rowid, {", ".join(TEXT_COLUMNS + BIGRAM_COLUMNS)})
+        SELECT key, new.content, new.answer, new.explanation,
+               {bigram_sql("new.content")}, {bigram_sql("new.answer")}, {bigram_sql("new.explanation")}
+        FROM {FTS_KEYS_TABLE} WHERE question_id = new.id;"""
+
+# 触发器名固定，启动时先删除再创建，保证定义与当前版本一致
+FTS_TRIGGER_NAMES = [f"{FTS_TABLE}_ai", f"{FTS_TABLE}_ad", f"{FTS_TABLE}_au"]
+
+FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON questions BEGIN
+        INSERT OR IGNORE INTO {FTS_KEYS_TABLE} (question_id) VALUES (new.id);
+        DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT key FROM {FTS_KEYS_TABLE} WHERE question_id = new.id);
+        {_FTS_INSERT_NEW_SQL}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON questions BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT key FROM {FTS_KEYS_TABLE} WHERE question_id = old.id);
+        DELETE FROM {FTS_KEYS_TABLE} WHERE question_id = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF id, content, answer, explanation ON questions BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT key FROM {FTS_KEYS_TABLE} WHERE question_id = old.id);
+        UPDATE {FTS_KEYS_TABLE} SET question_id = new.id WHERE question_id = old.id;
+        INSERT OR IGNORE INTO {FTS_KEYS_TABLE} (question_id) VALUES (new.id);
+        {_FTS_INSERT_NEW_SQL}
+    END
+    """,
+]
+
+
 def get_current_schema():
     """获取当前数据库表结构"""
     schema = {}
@@ -244,6 +546,7 @@ def create_tables():
     indexes_sql = [
         "CREATE INDEX IF NOT EXISTS idx_questions_category ON questions(category_id)",
         "CREATE INDEX IF NOT EXISTS idx_questions_created ON questions(created_at)",
+        *QUERY_INDEXES,
         "CREATE INDEX IF NOT EXISTS idx_categories_name ON categories(name)",
         "CREATE INDEX IF NOT EXISTS idx_tags_name ON tags(name)",
         "CREATE INDEX IF NOT EXISTS idx_question_tags_question ON question_tags(question_id)",
@@ -266,6 +569,8 @@ def create_tables():
         for index_sql in indexes_sql:
             db.execute(index_sql)
         
+        ensure_category_closure()
+        
         print("✅ 数据库表创建完成")
         return True
         
@@ -344,13 +649,213 @@ def apply_schema_migrations():
     print("检查表结构变更...")
     ensure_migrations_table()
     add_column_if_not_exists("questions", "options", "TEXT", "DEFAULT '[]'")
-    add_column_if_not_exists("questions", "embedding", "BLOB")
-    add_column_if_not_exists("questions", "embedding_version", "TEXT")
-    add_column_if_not_exists("questions", "content_hash", "TEXT")
-    add_column_if_not_exists("questions", "embedding_updated_at", "TEXT")
+    ensure_indexes()
+    ensure_category_closure()
+    ensure_embeddings_table()
+    ensure_embedding_versions_tables()
+    ensure_fingerprint_tables()
+    ensure_embedding_jobs_table()
+    ensure_duplicate_report_tables()
+    ensure_fts_index()
     print("✅ 表结构检查完成")
 
 
+def ensure_indexes():
+    """确保查询优化索引存在"""
+    for index_sql in QUERY_INDEXES:
+        db.execute(index_sql)
+
+
+def ensure_category_closure():
+    """
+    确保分类闭包表和维护触发器存在
+    
+    首次创建或闭包表与分类不一致时（例如旧版本程序写入过分类）重建。
+    """
+    db.execute(CATEGORY_CLOSURE_TABLE_SQL)
+    for index_sql in CATEGORY_CLOSURE_INDEXES:
+        db.execute(index_sql)
+    for trigger_sql in CATEGORY_CLOSURE_TRIGGERS:
+        db.execute(trigger_sql)
+    
+    closed = db.fetch_one(
+        f"SELECT COUNT(*) as count FROM {CATEGORY_CLOSURE_TABLE} WHERE depth = 0"
+    )['count']
+    total = db.fetch_one("SELECT COUNT(*) as count FROM categories")['count']
+    if closed != total:
+        rebuild_category_closure()
+        print(f"✅ 分类闭包表已重建：{total} 个分类")
+
+
+def rebuild_category_closure():
+    """根据 categories.parent_id 重建分类闭包表（单个事务内完成）"""
+    with transaction() as conn:
+        conn.execute(f"DELETE FROM {CATEGORY_CLOSURE_TABLE}")
+        # 深度上限防止历史数据中的循环引用导致无限递归
+        conn.execute(f"""
+            INSERT INTO {CATEGORY_CLOSURE_TABLE} (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM categories
+                UNION ALL
+                SELECT tree.ancestor_id, c.id, tree.depth + 1
+                FROM tree
+                INNER JOIN categories c ON c.parent_id = tree.descendant_id
+                WHERE tree.depth < 64
+            )
+            SELECT ancestor_id, descendant_id, MIN(depth)
+            FROM tree
+            GROUP BY ancestor_id, descendant_id
+        """)
+
+
+def ensure_embeddings_table():
+    """确保题目向量表存在，并迁移旧版本存放在 questions 表中的向量"""
+    db.execute(EMBEDDINGS_TABLE_SQL)
+    add_column_if_not_exists(EMBEDDINGS_TABLE, "embedding_dtype", "TEXT NOT NULL", "'float32'")
+    for index_sql in EMBEDDINGS_INDEXES:
+        db.execute(index_sql)
+    
+    question_columns = get_current_schema().get("questions", {}).get("columns", {})
+    if "embedding" in question_columns:
+        moved = migrate_legacy_embeddings()
+        if moved:
+            print(f"✅ 已迁移 {moved} 条题目向量到 {EMBEDDINGS_TABLE} 表")
+
+
+def migrate_legacy_embeddings() -> int:
+    """
+    将 questions 表中的向量列迁移到题目向量表
+    
+    已迁移的数据以向量表为准；迁移后删除旧列（SQLite < 3.35 不支持 DROP COLUMN，
+    此时只清空旧列数据）。
+    
+    Returns:
+        迁移的向量条数
+    """
+    with transaction() as conn:
+        cursor = conn.execute(f"""
+            INSERT OR IGNORE INTO {EMBEDDINGS_TABLE}
+                (question_id, embedding, embedding_version, content_hash, embedding_updated_at)
+            SELECT id, embedding, embedding_version, content_hash, embedding_updated_at
+            FROM questions
+            WHERE embedding IS NOT NULL
+        """)
+        moved = cursor.rowcount
+        try:
+            for column in LEGACY_EMBEDDING_COLUMNS:
+                conn.execute(f"ALTER TABLE questions DROP COLUMN {column}")
+        except sqlite3.OperationalError:
+            conn.execute(
+                "UPDATE questions SET " +
+                ", ".join(f"{column} = NULL" for column in LEGACY_EMBEDDING_COLUMNS) +
+                " WHERE embedding IS NOT NULL"
+            )
+    return moved
+
+
+def ensure_embedding_versions_tables():
+    """确保向量模型版本表和影子向量表存在"""
+    for sql in EMBEDDING_VERSIONS_SQL:
+        db.execute(sql)
+
+
+def ensure_fingerprint_tables():
+    """确保题目文本指纹表存在"""
+    for sql in FINGERPRINT_SQL:
+        db.execute(sql)
+
+
+def ensure_embedding_jobs_table():
+    """确保向量化任务队列表存在"""
+    for sql in EMBEDDING_JOBS_SQL:
+        db.execute(sql)
+
+
+def ensure_duplicate_report_tables():
+    """确保近似重复扫描报告表存在"""
+    for sql in DUPLICATE_REPORT_SQL:
+        db.execute(sql)
+
+
+def ensure_fts_index() -> bool:
+    """
+    确保题目全文检索索引存在
+    
+    旧版本的索引（非 trigram 分词、没有二元组列，或依赖自定义分词函数的触发器）整体替换；
+    触发器每次启动按当前定义重建。位置表补齐到题库中最长文本的长度（至少 MIN_FTS_POSITIONS）。
+    索引与题目不一致时（例如 FTS5 不可用期间写入过题目，或键映射缺失）重建索引。
+    SQLite 不支持 FTS5 trigram 时跳过，搜索会回退到 LIKE。
+    """
+    if not is_fts5_supported(db.get_connection()):
+        print("⚠️  当前 SQLite 不支持 FTS5 trigram 分词，题目搜索将使用 LIKE")
+        return False
+    
+    existing = db.fetch_one("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,))
+    if existing:
+        existing_sql = (existing['sql'] or "").lower()
+        if "trigram" not in existing_sql or BIGRAM_COLUMNS[0] not in existing_sql:
+            db.execute(f"DROP TABLE {FTS_TABLE}")
+            print("✅ 已移除旧版全文检索索引")
+    
+    db.execute(FTS_TABLE_SQL)
+    db.execute(FTS_KEYS_TABLE_SQL)
+    db.execute(FTS_POSITIONS_TABLE_SQL)
+    ensure_fts_positions()
+    for name in FTS_TRIGGER_NAMES:
+        db.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for trigger_sql in FTS_TRIGGERS:
+        db.execute(trigger_sql)
+    
+    if not fts_index_consistent():
+        rebuild_fts_index()
+        total = db.fetch_one("SELECT COUNT(*) as count FROM questions")['count']
+        print(f"✅ 全文检索索引已重建：{total} 道题目")
+    return True
+
+
+def ensure_fts_positions():
+    """将位置表补齐到题库中最长文本的长度（至少 MIN_FTS_POSITIONS），否则超出部分的二元组不会被索引"""
+    longest = db.fetch_one(
+        "SELECT MAX(MAX(COALESCE(length(content), 0), COALESCE(length(answer), 0), "
+        "COALESCE(length(explanation), 0))) as length FROM questions"
+    )['length'] or 0
+    target = max(MIN_FTS_POSITIONS, longest)
+    current = db.fetch_one(f"SELECT COUNT(*) as count FROM {FTS_POSITIONS_TABLE}")['count']
+    if current < target:
+        db.execute(FTS_POSITIONS_FILL_SQL, (target,))
+
+
+def fts_index_consistent() -> bool:
+    """检查每道题目恰好有一个键，且每个键都有对应的索引行"""
+    total = db.fetch_one("SELECT COUNT(*) as count FROM questions")['count']
+    keys = db.fetch_one(f"SELECT COUNT(*) as count FROM {FTS_KEYS_TABLE}")['count']
+    indexed = db.fetch_one(f"SELECT COUNT(*) as count FROM {FTS_TABLE}")['count']
+    if not total == keys == indexed:
+        return False
+    missing = db.fetch_one(
+        f"SELECT COUNT(*) as count FROM questions q "
+        f"LEFT JOIN {FTS_KEYS_TABLE} k ON k.question_id = q.id WHERE k.key IS NULL"
+    )['count']
+    linked = db.fetch_one(
+        f"SELECT COUNT(*) as count FROM {FTS_KEYS_TABLE} k JOIN {FTS_TABLE} f ON f.rowid = k.key"
+    )['count']
+    return missing == 0 and linked == total
+
+
+def rebuild_fts_index():
+    """重建题目全文检索索引和键映射（单个事务内完成）"""
+    with transaction() as conn:
+        conn.execute(f"DELETE FROM {FTS_TABLE}")
+        conn.execute(f"DELETE FROM {FTS_KEYS_TABLE}")
+        conn.execute(f"INSERT INTO {FTS_KEYS_TABLE} (question_id) SELECT id FROM questions")
+        conn.execute(f"""
+            INSERT INTO {FTS_TABLE} (rowid, {", ".join(TEXT_COLUMNS + BIGRAM_COLUMNS)})
+            SELECT k.key, q.content, q.answer, q.explanation,
+                   {bigram_sql("q.content")}, {bigram_sql("q.answer")}, {bigram_sql("q.explanation")}
+            FROM questions q JOIN {FTS_KEYS_TABLE} k ON k.question_id = q.id
+        """)
+
+
 def migrate_database(auto: bool = True):
     """执行数据库迁移"""
     
@@ -10,9 +10,15 @@
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Any, TypeVar, Generic
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Iterable, Set, Tuple, TypeVar, Generic
 from datetime import datetime
+import base64
 import json
+import logging
+import sqlite3
+import threading
+import time
 import uuid
 
 from core.models import (
@@ -21,7 +27,18 @@ from core.models import (
     Question, QuestionCreate, QuestionUpdate, QuestionWithTags,
     StagingQuestion, StagingQuestionCreate, StagingQuestionUpdate
 )
-from core.database.connection import db, transaction
+from core.database.connection import IN_QUERY_BATCH_SIZE, db, fetch_all_in, transaction
+from core.database.fts import FTS_KEYS_TABLE, FTS_TABLE, BM25_WEIGHTS, build_match_query
+from core.database.migrations import CATEGORY_CLOSURE_TABLE
+
+logger = logging.getLogger(__name__)
+
+
+def _fetch_existing_ids(table: str, ids: Iterable[str]) -> Set[str]:
+    """返回 ids 中在表内存在的 ID（分批 IN 查询）"""
+    unique_ids = list(dict.fromkeys(i for i in ids if i))
+    rows = fetch_all_in(db, f"SELECT id FROM {table} WHERE id IN ({{placeholders}})", unique_ids)
+    return {row['id'] for row in rows}
 
 
 T = TypeVar('T')
@@ -56,9 +73,91 @@ class Repository(Generic[T, ID], ABC):
         pass
 
 
+class CategoryCache:
+    """
+    分类缓存快照（只读）
+    
+    包含 id → 分类映射和父子关系索引，由 CategoryRepository 在进程内共享
+    """
+    
+    def __init__(self, categories: List[Category], version: int):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.categories = categories
+        self.by_id: Dict[str, Category] = {cat.id: cat for cat in categories}
+        self.children: Dict[Optional[str], List[Category]] = {}
+        for cat in categories:
+            self.children.setdefault(cat.parent_id, []).append(cat)
+
+
 class CategoryRepository(Repository[Category, str]):
     """分类仓库"""
     
+    # 进程级分类缓存（所有实例共享），写操作递增版本号使其失效
+    # TTL 用于兜底其他进程（微信/MCP 入口）写入造成的不一致
+    CACHE_TTL_SECONDS = 300
+    _cache: Optional[CategoryCache] = None
+    _cache_version = 0
+    _cache_lock = threading.Lock()
+    
+    @classmethod
+    def invalidate_cache(cls):
+        """使分类缓存失效（创建/更新/删除分类后调用）"""
+        with cls._cache_lock:
+            cls._cache_version += 1
+            cls._cache = None
+    
+    def get_cache(self) -> CategoryCache:
+        """
+        获取分类缓存快照
+        
+        缓存命中时不访问数据库；失效或过期时重新加载全部分类
+        """
+        cls = CategoryRepository
+        cache = cls._cache
+        if (cache is not None and cache.version == cls._cache_version
+                and time.monotonic() - cache.loaded_at < cls.CACHE_TTL_SECONDS):
+            return cache
+        
+        with cls._cache_lock:
+            cache = cls._cache
+            if (cache is not None and cache.version == cls._cache_version
+                    and time.monotonic() - cache.loaded_at < cls.CACHE_TTL_SECONDS):
+                return cache
+            cache = CategoryCache(self.get_all(), cls._cache_version)
+            cls._cache = cache
+            return cache
+    
+    def get_category_map(self) -> Dict[str, Category]:
+        """获取 id → 分类映射（来自缓存）"""
+        return self.get_cache().by_id
+    
+    def get_cached(self, category_id: str) -> Optional[Category]:
+        """根据 ID 获取分类（来自缓存）"""
+        return self.get_cache().by_id.get(category_id)
+    
+    def get_breadcrumb(self, category_id: str) -> List[Dict[str, str]]:
+        """获取从根分类到当前分类的路径（闭包表单次查询）"""
+        sql = f"""
+        SELECT c.id, c.name
+        FROM {CATEGORY_CLOSURE_TABLE} cc
+        INNER JOIN categories c ON c.id = cc.ancestor_id
+        WHERE cc.descendant_id = ?
+        ORDER BY cc.depth DESC
+        """
+        rows = db.fetch_all(sql, (category_id,))
+        return [{"id": row['id'], "name": row['name']} for row in rows]
+    
+    def get_descendant_ids(self, category_id: str) -> List[str]:
+        """获取分类自身及所有子孙分类 ID（按层级由浅到深）"""
+        sql = f"""
+        SELECT descendant_id FROM {CATEGORY_CLOSURE_TABLE}
+        WHERE ancestor_id = ?
+        ORDER BY depth
+        """
+        rows = db.fetch_all(sql, (category_id,))
+        return [row['descendant_id'] for row in rows]
+    
     def create(self, category_data: CategoryCreate) -> Category:
         """创建分类（支持层级）"""
         category_id = str(uuid.uuid4())
@@ -79,6 +178,7 @@ class CategoryRepository(Repository[Category, str]):
                 now
             ))
         
+        self.invalidate_cache()
         return self.get_by_id(category_id)
     
     def get_by_id(self, category_id: str) -> Optional[Category]:
@@ -115,6 +215,10 @@ class CategoryRepository(Repository[Category, str]):
             for row in rows
         ]
     
+    def get_existing_ids(self, category_ids: Iterable[str]) -> Set[str]:
+        """批量检查分类是否存在，返回存在的 ID 集合"""
+        return _fetch_existing_ids("categories", category_ids)
+    
     def update(self, category_id: str, update_data: CategoryUpdate) -> Optional[Category]:
         """更新分类（支持移动层级）"""
         # 构建更新字段
@@ -130,6 +234,8 @@ class CategoryRepository(Repository[Category, str]):
             params.append(update_data.description)
         
         if update_data.parent_id is not None:
+            if update_data.parent_id in self.get_descendant_ids(category_id):
+                raise ValueError("不能将分类移动到自身或其子分类下")
             updates.append("parent_id = ?")
             params.append(update_data.parent_id)
         
@@ -145,6 +251,7 @@ class CategoryRepository(Repository[Category, str]):
         with transaction():
             db.execute(sql, tuple(params))
         
+        self.invalidate_cache()
         return self.get_by_id(category_id)
     
     def delete(self, category_id: str) -> bool:
@@ -153,7 +260,9 @@ class CategoryRepository(Repository[Category, str]):
         
         with transaction():
             cursor = db.execute(sql, (category_id,))
-            return cursor.rowcount > 0
+        
+        self.invalidate_cache()
+        return cursor.rowcount > 0
     
     def search(self, keyword: str) -> List[Category]:
         """搜索分类"""
@@ -196,26 +305,59 @@ class CategoryRepository(Repository[Category, str]):
             for row in rows
         ]
     
-    def get_tree(self) -> List[Dict[str, Any]]:
-        """获取完整的分类树形结构"""
-        categories = self.get_all()
-        return self._build_tree(categories, None)
+    def get_tree(self, parent_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        获取分类树形结构
+        
+        完整树来自分类缓存；指定 parent_id 时通过闭包表只加载该子树
+        """
+        if parent_id is None:
+            return self._build_tree(self.get_cache().children, None)
+        
+        sql = f"""
+        SELECT c.*
+        FROM {CATEGORY_CLOSURE_TABLE} cc
+        INNER JOIN categories c ON c.id = cc.descendant_id
+        WHERE cc.ancestor_id = ? AND cc.depth > 0
+        ORDER BY c.created_at DESC
+        """
+        children: Dict[Optional[str], List[Category]] = {}
+        for row in db.fetch_all(sql, (parent_id,)):
+            cat = self._row_to_category(row)
+            children.setdefault(cat.parent_id, []).append(cat)
+        return self._build_tree(children, parent_id)
+    
+    @staticmethod
+    def _row_to_category(row: Dict) -> Category:
+        """将数据库行转换为分类模型"""
+        return Category(
+            id=row['id'],
+            name=row['name'],
+            description=row['description'],
+            parent_id=row['parent_id'],
+            created_at=datetime.fromisoformat(row['created_at']),
+            updated_at=datetime.fromisoformat(row['updated_at'])
+        )
     
-    def _build_tree(self, categories: List[Category], parent_id: Optional[str]) -> List[Dict[str, Any]]:
-        """递归构建分类树"""
+    def _build_tree(self, children: Dict[Optional[str], List[Category]], parent_id: Optional[str],
+                    visited: Optional[set] = None) -> List[Dict[str, Any]]:
+        """根据父子索引递归构建分类树（O(n)）"""
+        visited = visited if visited is not None else set()
         tree = []
-        for cat in categories:
-            if cat.parent_id == parent_id:
-                node = {
-                    "id": cat.id,
-                    "name": cat.name,
-                    "description": cat.description,
-                    "parent_id": cat.parent_id,
-                    "created_at": cat.created_at.isoformat() if cat.created_at else None,
-                    "updated_at": cat.updated_at.isoformat() if cat.updated_at else None,
-                    "children": self._build_tree(categories, cat.id)
-                }
-                tree.append(node)
+        for cat in children.get(parent_id, []):
+            if cat.id in visited:
+                continue  # 防止循环引用
+            visited.add(cat.id)
+            node = {
+                "id": cat.id,
+                "name": cat.name,
+                "description": cat.description,
+                "parent_id": cat.parent_id,
+                "created_at": cat.created_at.isoformat() if cat.created_at else None,
+                "updated_at": cat.updated_at.isoformat() if cat.updated_at else None,
+                "children": self._build_tree(children, cat.id, visited)
+            }
+            tree.append(node)
         return tree
 
 
@@ -303,15 +445,17 @@ class TagRepository(Repository[Tag, str]):
         
         return self.get_by_id(tag_id)
     
+    def get_existing_ids(self, tag_ids: Iterable[str]) -> Set[str]:
+        """批量检查标签是否存在，返回存在的 ID 集合"""
+        return _fetch_existing_ids("tags", tag_ids)
+    
     def get_by_names(self, names: List[str]) -> List[Tag]:
         """通过名称列表获取标签"""
         if not names:
             return []
         
         # 使用参数化查询防止 SQL 注入
-        placeholders = ', '.join(['?' for _ in names])
-        sql = f"SELECT * FROM tags WHERE name IN ({placeholders})"
-        rows = db.fetch_all(sql, tuple(names))
+        rows = fetch_all_in(db, "SELECT * FROM tags WHERE name IN ({placeholders})", names)
         
         return [
             Tag(
@@ -332,8 +476,9 @@ class TagRepository(Repository[Tag, str]):
             
             sql2 = "DELETE FROM tags WHERE id = ?"
             cursor = db.execute(sql2, (tag_id,))
-            
-            return cursor.rowcount > 0
+        
+        QuestionRepository.invalidate_count_cache()
+        return cursor.rowcount > 0
     
     def search(self, keyword: str) -> List[Tag]:
         """搜索标签"""
@@ -355,6 +500,28 @@ class TagRepository(Repository[Tag, str]):
 class QuestionRepository(Repository[Question, str]):
     """题目仓库"""
     
+    # 批量加载标签时单条 IN 查询的最大参数个数
+    TAG_BATCH_SIZE = IN_QUERY_BATCH_SIZE
+    
+    # 列表和详情读取的列（显式列出，避免读取历史遗留的向量列）
+    SELECT_COLUMNS = (
+        "q.id, q.content, q.options, q.answer, q.explanation, "
+        "q.category_id, q.created_at, q.updated_at"
+    )
+    
+    # 题目总数缓存：类级版本号在所有实例间共享，写操作后递增；
+    # 键包含搜索关键词，按最近使用淘汰，条目数不超过 COUNT_CACHE_MAX_ENTRIES
+    COUNT_CACHE_TTL_SECONDS = 30
+    COUNT_CACHE_MAX_ENTRIES = 256
+    _count_version = 0
+    
+    def __init__(self):
+        # {筛选条件: (版本号, 总数, 缓存时间)}，按使用先后排列
+        self._count_cache: "OrderedDict[tuple, Tuple[int, int, float]]" = OrderedDict()
+        self._count_cache_lock = threading.Lock()
+        # 全文检索索引是否可用（首次搜索时检查）
+        self._fts_available: Optional[bool] = None
+    
     def create(self, question_data: QuestionCreate) -> Question:
         """创建题目"""
         question_id = str(uuid.uuid4())
@@ -381,16 +548,72 @@ class QuestionRepository(Repository[Question, str]):
                 now
             ))
         
+        self.invalidate_count_cache()
         return self.get_by_id(question_id)
     
+    def create_many(self, questions: List[QuestionCreate]) -> List[str]:
+        """
+        批量创建题目
+        
+        单个事务内用 executemany 插入题目和标签关联（重复的标签关联忽略），
+        不回读题目；调用方需自行保证分类和标签存在
+        
+        Returns:
+            题目 ID 列表（与输入顺序一致）
+        """
+        if not questions:
+            return []
+        
+        now = datetime.now().isoformat()
+        question_ids = []
+        question_rows = []
+        tag_links = []
+        for question_data in questions:
+            question_id = str(uuid.uuid4())
+            question_ids.append(question_id)
+            question_rows.append((
+                question_id,
+                question_data.content,
+                json.dumps(question_data.options or []),
+                question_data.answer,
+                question_data.explanation,
+                question_data.category_id,
+                now,
+                now
+            ))
+            for tag_id in dict.fromkeys(question_data.tag_ids or []):
+                tag_links.append((question_id, tag_id))
+        
+        with transaction():
+            db.executemany("""
+            INSERT INTO questions (id, content, options, answer, explanation, category_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, question_rows)
+            if tag_links:
+                db.executemany(
+                    "INSERT OR IGNORE INTO question_tags (question_id, tag_id) VALUES (?, ?)",
+                    tag_links
+                )
+        
+        self.invalidate_count_cache()
+        return question_ids
+    
     def get_by_id(self, question_id: str) -> Optional[Question]:
         """根据 ID 获取题目"""
-        sql = "SELECT * FROM questions WHERE id = ?"
+        sql = f"SELECT {self.SELECT_COLUMNS} FROM questions q WHERE q.id = ?"
         row = db.fetch_one(sql, (question_id,))
         
         if not row:
             return None
         
+        # 获取标签
+        tags = self.get_question_tags(question_id)
+        
+        return self._row_to_question(row, tags)
+    
+    @staticmethod
+    def _row_to_question(row: Dict, tags: List[Tag]) -> Question:
+        """将数据库行转换为题目模型"""
         # 解析选项（确保返回列表）
         options = []
         if row['options']:
@@ -401,9 +624,6 @@ class QuestionRepository(Repository[Question, str]):
             except:
                 options = []
         
-        # 获取标签
-        tags = self.get_question_tags(question_id)
-        
         return Question(
             id=row['id'],
             content=row['content'],
@@ -416,94 +636,227 @@ class QuestionRepository(Repository[Question, str]):
             updated_at=datetime.fromisoformat(row['updated_at'])
         )
     
-    def get_all(self, 
-                category_id: Optional[str] = None,
-                tag_id: Optional[str] = None,
-                keyword: Optional[str] = None,
-                page: int = 1,
-                limit: int = 20) -> Dict[str, Any]:
-        """获取所有题目（支持筛选和分页）"""
-        # 构建查询条件
+    def _fts_match_query(self, keyword: Optional[str]) -> Optional[str]:
+        """返回关键词的 FTS5 MATCH 表达式；索引不可用或无法表达时返回 None（使用 LIKE）"""
+        if not keyword:
+            return None
+        if self._fts_available is None:
+            self._fts_available = bool(db.table_exists(FTS_TABLE))
+        if not self._fts_available:
+            return None
+        return build_match_query(keyword)
+    
+    def _build_filters(self,
+                       category_id: Optional[str] = None,
+                       tag_id: Optional[str] = None,
+                       keyword: Optional[str] = None,
+                       match_query: Optional[str] = None,
+                       include_descendants: bool = False) -> Tuple[str, List[Any]]:
+        """
+        构建题目筛选条件
+        
+        提供 match_query 时关键词走全文检索索引，否则使用 LIKE 扫描；
+        include_descendants 时通过分类闭包表匹配分类子树
+        
+        Returns:
+            (FROM/JOIN/WHERE 子句, 参数列表)
+        """
         conditions = []
         params = []
         
-        if category_id:
+        # 如果有标签筛选，需要连接 question_tags 表
+        from_sql = "FROM questions q"
+        if tag_id:
+            from_sql += " INNER JOIN question_tags qt ON q.id = qt.question_id"
+            conditions.append("qt.tag_id = ?")
+            params.append(tag_id)
+        
+        if category_id and include_descendants:
+            from_sql += f" INNER JOIN {CATEGORY_CLOSURE_TABLE} cc ON cc.descendant_id = q.category_id"
+            conditions.append("cc.ancestor_id = ?")
+            params.append(category_id)
+        elif category_id:
             conditions.append("q.category_id = ?")
             params.append(category_id)
         
-        if keyword:
+        if match_query:
+            from_sql += (f" INNER JOIN {FTS_KEYS_TABLE} fk ON fk.question_id = q.id"
+                         f" INNER JOIN {FTS_TABLE} ON {FTS_TABLE}.rowid = fk.key")
+            conditions.append(f"{FTS_TABLE} MATCH ?")
+            params.append(match_query)
+        elif keyword:
             conditions.append("(q.content LIKE ? OR q.answer LIKE ? OR q.explanation LIKE ?)")
             search_term = f"%{keyword}%"
             params.extend([search_term, search_term, search_term])
         
-        # 如果有标签筛选，需要连接 question_tags 表
-        if tag_id:
-            base_sql = """
-            SELECT q.* FROM questions q
-            INNER JOIN question_tags qt ON q.id = qt.question_id
-            WHERE qt.tag_id = ?
-            """
-            if conditions:
-                base_sql += " AND " + " AND ".join(conditions)
-                params = [tag_id] + params
-            else:
-                params = [tag_id]
-        else:
-            base_sql = "SELECT q.* FROM questions q"
-            if conditions:
-                base_sql += " WHERE " + " AND ".join(conditions)
+        if conditions:
+            from_sql += " WHERE " + " AND ".join(conditions)
         
-        # 添加排序
-        base_sql += " ORDER BY q.created_at DESC"
+        return from_sql, params
+    
+    @classmethod
+    def invalidate_count_cache(cls):
+        """使题目总数缓存失效（题目或题目标签变更后调用）"""
+        cls._count_version += 1
+    
+    def _count(self, from_sql: str, params: List[Any], cache_key: tuple) -> int:
+        """
+        统计筛选结果总数（带缓存）
         
-        # 获取总数
-        count_sql = f"SELECT COUNT(*) as total FROM ({base_sql})"
-        total_row = db.fetch_one(count_sql, tuple(params))
+        写操作通过类级版本号使所有实例的缓存失效，TTL 兜底其他进程的写入；
+        失效的条目读取时删除，超过条目上限时淘汰最久未使用的条目
+        """
+        with self._count_cache_lock:
+            cached = self._count_cache.get(cache_key)
+            if cached is not None:
+                if (cached[0] == QuestionRepository._count_version
+                        and time.monotonic() - cached[2] < self.COUNT_CACHE_TTL_SECONDS):
+                    self._count_cache.move_to_end(cache_key)
+                    return cached[1]
+                del self._count_cache[cache_key]
+        
+        version = QuestionRepository._count_version
+        total_row = db.fetch_one(f"SELECT COUNT(*) as total {from_sql}", tuple(params))
         total = total_row['total'] if total_row else 0
+        with self._count_cache_lock:
+            self._count_cache[cache_key] = (version, total, time.monotonic())
+            self._count_cache.move_to_end(cache_key)
+            while len(self._count_cache) > self.COUNT_CACHE_MAX_ENTRIES:
+                self._count_cache.popitem(last=False)
+        return total
+    
+    @staticmethod
+    def encode_cursor(created_at: str, question_id: str) -> str:
+        """将 (created_at, id) 编码为不透明游标"""
+        raw = json.dumps([created_at, question_id], ensure_ascii=False).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        """
+        解码游标
         
-        # 添加分页
-        offset = (page - 1) * limit
-        paginated_sql = f"{base_sql} LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
+        Raises:
+            ValueError: 游标格式无效
+        """
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, question_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if not isinstance(created_at, str) or not isinstance(question_id, str):
+                raise ValueError
+            return created_at, question_id
+        except Exception:
+            raise ValueError(f"无效的分页游标：{cursor}")
+    
+    def get_all(self, 
+                category_id: Optional[str] = None,
+                tag_id: Optional[str] = None,
+                keyword: Optional[str] = None,
+                page: int = 1,
+                limit: int = 20,
+                cursor: Optional[str] = None,
+                include_total: Optional[bool] = None,
+                include_descendants: bool = False) -> Dict[str, Any]:
+        """
+        获取所有题目（支持筛选和分页）
         
-        # 执行查询
-        rows = db.fetch_all(paginated_sql, tuple(params))
+        include_descendants 为 True 时按分类筛选包含其所有子孙分类（通过分类闭包表 JOIN）
         
-        # 转换为模型
-        questions = []
-        for row in rows:
-            # 解析选项
-            options = None
-            if row['options']:
-                try:
-                    options = json.loads(row['options'])
-                except:
-                    options = []
-            
-            # 获取标签
-            tags = self.get_question_tags(row['id'])
-            
-            questions.append(Question(
-                id=row['id'],
-                content=row['content'],
-                options=options,
-                answer=row['answer'],
-                explanation=row['explanation'],
-                category_id=row['category_id'],
-                tags=tags,
-                created_at=datetime.fromisoformat(row['created_at']),
-                updated_at=datetime.fromisoformat(row['updated_at'])
-            ))
+        分页模式：
+        - 偏移分页（cursor 为 None）：按 page/limit 返回，默认包含总数
+        - 游标分页（cursor 不为 None，首页传空字符串）：按 (created_at, id) 键集定位，
+          深分页代价与首页相同，默认不统计总数
+        
+        两种模式都会返回 next_cursor，可以从任意一页切换到游标分页
+        （偏移分页下的关键词搜索按相关度排序，不返回 next_cursor）
+        
+        关键词优先使用全文检索索引，索引不可用或查询失败时回退到 LIKE
+        
+        Raises:
+            ValueError: 游标格式无效
+        """
+        match_query = self._fts_match_query(keyword)
+        if match_query:
+            try:
+                return self._query_page(category_id, tag_id, keyword, page, limit,
+                                        cursor, include_total, match_query, include_descendants)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"全文检索失败，回退到 LIKE：keyword={keyword}, error={e}")
+        return self._query_page(category_id, tag_id, keyword, page, limit,
+                                cursor, include_total, None, include_descendants)
+    
+    def _query_page(self,
+                    category_id: Optional[str],
+                    tag_id: Optional[str],
+                    keyword: Optional[str],
+                    page: int,
+                    limit: int,
+                    cursor: Optional[str],
+                    include_total: Optional[bool],
+                    match_query: Optional[str],
+                    include_descendants: bool = False) -> Dict[str, Any]:
+        """执行一页题目查询（get_all 的实现）"""
+        from_sql, params = self._build_filters(category_id, tag_id, keyword, match_query,
+                                               include_descendants)
+        cursor_mode = cursor is not None
+        ranked = bool(match_query) and not cursor_mode
+        if include_total is None:
+            include_total = not cursor_mode
+        
+        total = None
+        if include_total:
+            total = self._count(from_sql, params, (category_id, tag_id, keyword, bool(match_query),
+                                                    include_descendants))
+        
+        if cursor_mode:
+            page_params = list(params)
+            page_sql = f"SELECT {self.SELECT_COLUMNS} {from_sql}"
+            if cursor:
+                cursor_created_at, cursor_id = self.decode_cursor(cursor)
+                page_sql += " AND " if " WHERE " in from_sql else " WHERE "
+                page_sql += "(q.created_at < ? OR (q.created_at = ? AND q.id < ?))"
+                page_params.extend([cursor_created_at, cursor_created_at, cursor_id])
+            # 多取一条用于判断是否还有下一页
+            page_sql += " ORDER BY q.created_at DESC, q.id DESC LIMIT ?"
+            page_params.append(limit + 1)
+            rows = db.fetch_all(page_sql, tuple(page_params))
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            offset = (page - 1) * limit
+            order_sql = "q.created_at DESC, q.id DESC"
+            if ranked:
+                weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+                order_sql = f"bm25({FTS_TABLE}, {weights}), " + order_sql
+            page_sql = f"SELECT {self.SELECT_COLUMNS} {from_sql} ORDER BY {order_sql} LIMIT ? OFFSET ?"
+            rows = db.fetch_all(page_sql, tuple(params) + (limit, offset))
+            if total is not None:
+                has_more = page * limit < total
+            else:
+                has_more = len(rows) == limit
+        
+        # 转换为模型（整页标签一次查询加载，避免 N+1）
+        tags_map = self.get_tags_for_questions([row['id'] for row in rows])
+        questions = [
+            self._row_to_question(row, tags_map.get(row['id'], []))
+            for row in rows
+        ]
+        
+        next_cursor = None
+        if has_more and rows and not ranked:
+            next_cursor = self.encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
         
         # 计算总页数
-        pages = (total + limit - 1) // limit
+        pages = (total + limit - 1) // limit if total is not None else None
         
         return {
             "data": questions,
             "total": total,
-            "page": page,
+            "page": None if cursor_mode else page,
             "limit": limit,
-            "pages": pages
+            "pages": pages,
+            "next_cursor": next_cursor,
+            "has_more": has_more
         }
     
     def update(self, question_id: str, update_data: QuestionUpdate) -> Optional[Question]:
@@ -545,6 +898,7 @@ class QuestionRepository(Repository[Question, str]):
         with transaction():
             db.execute(sql, tuple(params))
         
+        self.invalidate_count_cache()
         return self.get_by_id(question_id)
     
     def delete(self, question_id: str) -> bool:
@@ -553,18 +907,87 @@ class QuestionRepository(Repository[Question, str]):
             # 先删除题目标签关联
             sql1 = "DELETE FROM question_tags WHERE question_id = ?"
             db.execute(sql1, (question_id,))
+            db.execute("DELETE FROM question_embeddings WHERE question_id = ?", (question_id,))
             
             # 再删除题目
             sql2 = "DELETE FROM questions WHERE id = ?"
             cursor = db.execute(sql2, (question_id,))
-            
-            return cursor.rowcount > 0
+        
+        self.invalidate_count_cache()
+        return cursor.rowcount > 0
     
     def search(self, keyword: str) -> List[Question]:
         """搜索题目"""
         result = self.get_all(keyword=keyword, page=1, limit=100)
         return result["data"]
     
+    def lexical_search(self,
+                       keyword: str,
+                       limit: int = 50,
+                       category_id: Optional[str] = None,
+                       tag_id: Optional[str] = None,
+                       include_descendants: bool = False) -> List[Tuple[str, float]]:
+        """
+        关键词检索，只返回题目 ID 和相关度（混合检索的词法部分）
+        
+        使用全文检索索引按 bm25 排序（题干 > 答案 > 解析）；索引不可用或无法表达时
+        回退到 LIKE，相关度统一为 0，按创建时间倒序
+        
+        Args:
+            keyword: 搜索关键词
+            limit: 最多返回条数
+            category_id: 按分类筛选
+            tag_id: 按标签筛选
+            include_descendants: 分类筛选是否包含子分类
+        
+        Returns:
+            按相关度降序的 (题目 ID, 相关度) 列表，相关度为 bm25 取负（越大越相关）
+        """
+        match_query = self._fts_match_query(keyword)
+        if match_query:
+            from_sql, params = self._build_filters(category_id, tag_id, keyword, match_query,
+                                                   include_descendants)
+            weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+            try:
+                rows = db.fetch_all(
+                    f"SELECT q.id, bm25({FTS_TABLE}, {weights}) as rank {from_sql} "
+                    f"ORDER BY rank, q.created_at DESC LIMIT ?",
+                    tuple(params) + (limit,)
+                )
+                return [(row['id'], -float(row['rank'])) for row in rows]
+            except sqlite3.OperationalError as e:
+                logger.warning(f"全文检索失败，回退到 LIKE：keyword={keyword}, error={e}")
+        
+        from_sql, params = self._build_filters(category_id, tag_id, keyword, None, include_descendants)
+        rows = db.fetch_all(
+            f"SELECT q.id {from_sql} ORDER BY q.created_at DESC, q.id DESC LIMIT ?",
+            tuple(params) + (limit,)
+        )
+        return [(row['id'], 0.0) for row in rows]
+    
+    def get_by_ids(self, question_ids: List[str]) -> List[Question]:
+        """
+        批量获取题目（按传入顺序返回，不存在的 ID 跳过；标签一次查询加载）
+        
+        Args:
+            question_ids: 题目 ID 列表
+        
+        Returns:
+            题目列表
+        """
+        if not question_ids:
+            return []
+        rows = fetch_all_in(
+            db, f"SELECT {self.SELECT_COLUMNS} FROM questions q WHERE q.id IN ({{placeholders}})",
+            list(dict.fromkeys(question_ids))
+        )
+        by_id = {row['id']: row for row in rows}
+        tags_map = self.get_tags_for_questions(list(by_id))
+        return [
+            self._row_to_question(by_id[question_id], tags_map.get(question_id, []))
+            for question_id in question_ids if question_id in by_id
+        ]
+    
     def get_question_tags(self, question_id: str) -> List[Tag]:
         """获取题目的标签"""
         sql = """
@@ -585,6 +1008,38 @@ class QuestionRepository(Repository[Question, str]):
             for row in rows
         ]
     
+    def get_tags_for_questions(self, question_ids: List[str]) -> Dict[str, List[Tag]]:
+        """
+        批量获取多道题目的标签
+        
+        使用 IN 查询一次加载整页题目的标签并在内存中分组，
+        查询次数与题目数量无关（超过 IN_QUERY_BATCH_SIZE 时分批）
+        
+        Returns:
+            {question_id: [Tag, ...]}，没有标签的题目不在字典中
+        """
+        tags_map: Dict[str, List[Tag]] = {}
+        if not question_ids:
+            return tags_map
+        
+        # 同一道题的标签都在同一批内，批内按创建时间倒序
+        rows = fetch_all_in(db, """
+            SELECT qt.question_id, t.id, t.name, t.color, t.created_at FROM question_tags qt
+            INNER JOIN tags t ON t.id = qt.tag_id
+            WHERE qt.question_id IN ({placeholders})
+            ORDER BY t.created_at DESC
+        """, question_ids)
+        
+        for row in rows:
+            tags_map.setdefault(row['question_id'], []).append(Tag(
+                id=row['id'],
+                name=row['name'],
+                color=row['color'],
+                created_at=datetime.fromisoformat(row['created_at'])
+            ))
+        
+        return tags_map
+    
     def add_tag(self, question_id: str, tag_id: str) -> bool:
         """为题目添加标签"""
         # 检查是否已存在
@@ -603,6 +1058,7 @@ class QuestionRepository(Repository[Question, str]):
         try:
             with transaction():
                 db.execute(sql, (question_id, tag_id))
+            self.invalidate_count_cache()
             return True
         except:
             return False
@@ -623,7 +1079,9 @@ class QuestionRepository(Repository[Question, str]):
         
         with transaction():
             cursor = db.execute(sql, (question_id, tag_id))
-            return cursor.rowcount > 0
+        
+        self.invalidate_count_cache()
+        return cursor.rowcount > 0
     
     def get_by_category(self, category_id: str) -> List[Question]:
         """获取指定分类下的题目"""
@@ -639,19 +1097,17 @@ class QuestionRepository(Repository[Question, str]):
 class StagingQuestionRepository:
     """预备题目数据访问（AI 提取）"""
     
-    @staticmethod
-    def create(question_data: Dict[str, Any]) -> int:
-        """创建预备题目"""
-        sql = """
+    INSERT_SQL = """
         INSERT INTO staging_questions 
         (source_type, source_file, content, type, options, answer, explanation, 
          category_id, tags, confidence, status, created_at)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
-        
-        now = datetime.now().isoformat()
-        
-        result = db.execute(sql, (
+    
+    @staticmethod
+    def _insert_params(question_data: Dict[str, Any], now: str) -> tuple:
+        """构建插入参数"""
+        return (
             question_data.get('source_type', 'image'),
             question_data.get('source_file'),
             question_data.get('content', ''),
@@ -664,17 +1120,42 @@ class StagingQuestionRepository:
             question_data.get('confidence', 1.0),
             'pending',
             now
-        ))
+        )
+    
+    @staticmethod
+    def create(question_data: Dict[str, Any]) -> int:
+        """创建预备题目"""
+        now = datetime.now().isoformat()
+        
+        result = db.execute(
+            StagingQuestionRepository.INSERT_SQL,
+            StagingQuestionRepository._insert_params(question_data, now)
+        )
         
         return result.lastrowid
     
     @staticmethod
     def create_batch(questions: List[Dict[str, Any]]) -> List[int]:
-        """批量创建预备题目"""
+        """
+        批量创建预备题目
+        
+        单个事务内逐条插入并通过 RETURNING 取回 ID（SQLite 3.35+），只提交一次；
+        不依赖自增 ID 连续（其他连接的写入、删除最大 ID 后的复用都会打断连续性）
+        
+        Returns:
+            新建 ID 列表（与输入顺序一致）
+        """
+        if not questions:
+            return []
+        
+        now = datetime.now().isoformat()
+        sql = StagingQuestionRepository.INSERT_SQL.rstrip() + " RETURNING id"
+        
         ids = []
-        for q in questions:
-            q_id = StagingQuestionRepository.create(q)
-            ids.append(q_id)
+        with transaction():
+            for question_data in questions:
+                rows = db.fetch_all(sql, StagingQuestionRepository._insert_params(question_data, now))
+                ids.append(rows[0]['id'])
         return ids
     
     @staticmethod
@@ -698,6 +1179,41 @@ class StagingQuestionRepository:
         
         return [StagingQuestionRepository._row_to_dict(row) for row in rows]
     
+    @staticmethod
+    def get_pending(source_file: Optional[str] = None,
+                    ids: Optional[List[int]] = None,
+                    limit: Optional[int] = None) -> List[Dict]:
+        """
+        获取待审核的预备题目（用于批量查重，按 ID 升序）
+        
+        Args:
+            source_file: 只取某个来源文件（一次提取结果）的题目
+            ids: 只取指定 ID 的题目（按 IN 参数上限分批查询）
+            limit: 最多返回条数
+        """
+        conditions = ["status = 'pending'"]
+        params: List[Any] = []
+        if source_file:
+            conditions.append("source_file = ?")
+            params.append(source_file)
+        where = ' AND '.join(conditions)
+        
+        if ids:
+            rows = fetch_all_in(
+                db, f"SELECT * FROM staging_questions WHERE {where} AND id IN ({{placeholders}})",
+                list(dict.fromkeys(ids)), tuple(params)
+            )
+            rows.sort(key=lambda row: row['id'])
+            if limit is not None:
+                rows = rows[:limit]
+        else:
+            sql = f"SELECT * FROM staging_questions WHERE {where} ORDER BY id"
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            rows = db.fetch_all(sql, tuple(params))
+        return [StagingQuestionRepository._row_to_dict(row) for row in rows]
+    
     @staticmethod
     def get_count(status: Optional[str] = None) -> int:
         """获取预备题目数量"""
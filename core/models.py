@@ -131,6 +131,18 @@ class QuestionWithTags(Question):
     tag_ids: List[str] = Field(default=[], description="标签 ID 列表")
 
 
+class QuestionBulkCreate(BaseModel):
+    """批量创建题目请求模型"""
+    questions: List[QuestionCreate] = Field(..., min_items=1, max_items=5000, description="题目列表（最多 5000 道）")
+
+
+class QuestionBulkCreateResponse(BaseModel):
+    """批量创建题目响应模型"""
+    created: int = Field(..., description="创建的题目数量")
+    ids: List[str] = Field(default=[], description="题目 ID 列表（与请求顺序一致）")
+    embedding_queued: bool = Field(default=False, description="是否已加入向量化队列")
+
+
 class PaginatedResponse(BaseModel):
     """分页响应模型"""
     data: List[Any] = Field(..., description="数据列表")
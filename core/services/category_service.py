@@ -4,7 +4,7 @@
 提供分类的 CRUD 操作和层级管理
 """
 
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 import logging
 
 from core.models import Category, CategoryCreate, CategoryUpdate
@@ -57,6 +57,52 @@ class CategoryService:
         logger.debug("获取所有分类")
         return self.repo.get_all()
     
+    def get_category_map(self) -> Dict[str, Category]:
+        """
+        获取 id → 分类映射（进程级缓存，不访问数据库）
+        
+        Returns:
+            分类映射字典
+        """
+        return self.repo.get_category_map()
+    
+    def get_category_tree(self, parent_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        获取分类树形结构（基于分类缓存）
+        
+        Args:
+            parent_id: 子树根节点，为空则返回完整树
+            
+        Returns:
+            嵌套的树形结构
+        """
+        logger.debug(f"获取分类树：parent_id={parent_id}")
+        return self.repo.get_tree(parent_id)
+    
+    def get_breadcrumb(self, category_id: str) -> List[Dict[str, str]]:
+        """
+        获取分类的面包屑路径（基于分类闭包表）
+        
+        Args:
+            category_id: 分类 ID
+            
+        Returns:
+            从根分类到当前分类的路径
+        """
+        return self.repo.get_breadcrumb(category_id)
+    
+    def get_descendant_ids(self, category_id: str) -> List[str]:
+        """
+        获取分类自身及所有子孙分类 ID（基于分类闭包表）
+        
+        Args:
+            category_id: 分类 ID
+            
+        Returns:
+            分类 ID 列表
+        """
+        return self.repo.get_descendant_ids(category_id)
+    
     def update_category(self, category_id: str, update_data: CategoryUpdate) -> Optional[Category]:
         """
         更新分类
@@ -0,0 +1,309 @@
+"""
+全库近似重复扫描
+
+找出题库中所有相似度超过阈值的题目对（包括查重功能上线前入库、或审核时 force 强制入库的题目），
+用并查集合并为重复簇，结果写入报告表供人工审核：
+
+- 精确后端（内存矩阵 / 内存映射存储）：分块自连接，每对块一次矩阵乘法，只计算上三角
+- 近似后端（IVF / HNSW）：逐块批量检索每道题的 top_k 近邻
+
+题目对边扫描边写入 duplicate_pairs，运行进度记录在 duplicate_scan_runs，
+扫描结束后聚类结果写入 duplicate_clusters。
+"""
+
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from core.database.migrations import (
+    DUPLICATE_CLUSTERS_TABLE, DUPLICATE_PAIRS_TABLE, DUPLICATE_REPORT_SQL, DUPLICATE_RUNS_TABLE
+)
+from core.services.vector_backends import EmbeddingMatrix, VectorSnapshot
+from core.services.vector_store import MemmapVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class UnionFind:
+    """并查集（路径减半 + 按大小合并）"""
+    
+    def __init__(self):
+        self._parent: Dict[str, str] = {}
+        self._size: Dict[str, int] = {}
+    
+    def find(self, item: str) -> str:
+        parent = self._parent
+        if item not in parent:
+            parent[item] = item
+            self._size[item] = 1
+            return item
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+    
+    def union(self, a: str, b: str) -> str:
+        """合并两个元素所在的集合，返回新的根"""
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self._size[root_a] < self._size[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._size[root_a] += self._size.pop(root_b)
+        return root_a
+    
+    def groups(self) -> List[List[str]]:
+        """返回所有集合（每个集合按元素排序，集合按大小降序）"""
+        members: Dict[str, List[str]] = {}
+        for item in self._parent:
+            members.setdefault(self.find(item), []).append(item)
+        return sorted((sorted(group) for group in members.values()), key=lambda group: (-len(group), group[0]))
+
+
+def self_join_pairs(backend, threshold: float, block_rows: int
+                    ) -> Iterator[Tuple[int, List[Tuple[str, str, float]]]]:
+    """
+    分块自连接：第 i 块只与第 i 块及之后的块相乘，块内只取上三角
+    
+    每次只持有两块向量和一个 block_rows² 的得分矩阵，内存与总行数无关。
+    
+    Args:
+        backend: 提供 iter_blocks(block_rows, start) 的精确后端或快照
+        threshold: 相似度阈值
+        block_rows: 每块行数
+    
+    Yields:
+        (本块题目数, [(题目 ID, 重复题目 ID, 相似度), ...])，前者的行号小于后者，每对只出现一次
+    """
+    for i, (ids_a, vectors_a) in enumerate(backend.iter_blocks(block_rows)):
+        pairs = []
+        for j, (ids_b, vectors_b) in enumerate(backend.iter_blocks(block_rows, start=i * block_rows)):
+            if not ids_a or not ids_b:
+                continue
+            scores = vectors_a @ vectors_b.T
+            if j == 0:
+                scores[np.tril_indices(len(ids_a), m=len(ids_b))] = -np.inf
+            rows, cols = np.nonzero(scores >= threshold)
+            pairs.extend((ids_a[r], ids_b[c], float(scores[r, c])) for r, c in zip(rows, cols))
+        yield len(ids_a), pairs
+
+
+class DuplicateScanner:
+    """全库近似重复扫描任务"""
+    
+    # 精确自连接每块行数（块得分矩阵 BLOCK_ROWS² 个 float32，约 16MB）
+    BLOCK_ROWS = 2048
+    
+    # 近似后端每道题检索的近邻数
+    ANN_TOP_K = 20
+    
+    # 聚类结果每批写入行数
+    INSERT_BATCH_SIZE = 5000
+    
+    def __init__(self, db_connection, vector_index=None):
+        """
+        初始化扫描任务
+        
+        Args:
+            db_connection: SQLite 数据库连接
+            vector_index: 向量索引（默认使用全局单例）
+        """
+        self.db = db_connection
+        self._vector_index = vector_index
+        for sql in DUPLICATE_REPORT_SQL:
+            self.db.execute(sql)
+    
+    @property
+    def vector_index(self):
+        if self._vector_index is None:
+            from core.services.vector_index import get_vector_index
+            self._vector_index = get_vector_index(self.db)
+        return self._vector_index
+    
+    # ---------- 扫描 ----------
+    
+    @staticmethod
+    def method_for(backend) -> str:
+        """扫描方式：精确后端分块自连接，近似后端批量检索近邻"""
+        if isinstance(backend, VectorSnapshot):
+            return "exact" if backend.exact else "ann"
+        return "exact" if isinstance(backend, (EmbeddingMatrix, MemmapVectorStore)) else "ann"
+    
+    def iter_pairs(self, backend, threshold: float, top_k: Optional[int] = None
+                   ) -> Iterator[Tuple[int, List[Tuple[str, str, float]]]]:
+        """
+        逐块产出相似度不低于阈值的题目对
+        
+        Args:
+            backend: 检索后端
+            threshold: 相似度阈值
+            top_k: 近似后端每道题检索的近邻数
+        
+        Yields:
+            (本块题目数, [(题目 ID, 重复题目 ID, 相似度), ...])，每对只出现一次
+        """
+        if self.method_for(backend) == "exact":
+            yield from self._self_join(backend, threshold)
+        else:
+            yield from self._neighbour_pairs(backend, threshold, top_k or self.ANN_TOP_K)
+    
+    def _self_join(self, backend, threshold: float) -> Iterator[Tuple[int, List[Tuple[str, str, float]]]]:
+        """精确后端：分块自连接"""
+        return self_join_pairs(backend, threshold, self.BLOCK_ROWS)
+    
+    def _neighbour_pairs(self, backend, threshold: float, top_k: int
+                         ) -> Iterator[Tuple[int, List[Tuple[str, str, float]]]]:
+        """近似后端：每块批量检索近邻，题目对按 ID 排序去重"""
+        seen = set()
+        for ids, vectors in backend.iter_blocks(self.BLOCK_ROWS):
+            if not ids:
+                continue
+            pairs = []
+            for question_id, hits in zip(ids, backend.search_batch(vectors, top_k + 1, threshold)):
+                for other_id, similarity in hits:
+                    key = (question_id, other_id) if question_id < other_id else (other_id, question_id)
+                    if other_id == question_id or key in seen:
+                        continue
+                    seen.add(key)
+                    pairs.append((key[0], key[1], similarity))
+            yield len(ids), pairs
+    
+    def start_run(self, threshold: float = 0.95) -> str:
+        """
+        创建扫描运行记录（状态为 pending），返回运行 ID
+        
+        Args:
+            threshold: 相似度阈值
+        """
+        run_id = str(uuid.uuid4())
+        self.db.execute(
+            f"INSERT INTO {DUPLICATE_RUNS_TABLE} (id, status, threshold, started_at) VALUES (?, 'pending', ?, ?)",
+            (run_id, threshold, datetime.now().isoformat())
+        )
+        return run_id
+    
+    def run(self, threshold: float = 0.95, run_id: Optional[str] = None, top_k: Optional[int] = None) -> Dict:
+        """
+        扫描全库并写入报告
+        
+        Args:
+            threshold: 相似度阈值
+            run_id: 已创建的运行记录 ID（由 start_run 返回，API 后台任务使用）
+            top_k: 近似后端每道题检索的近邻数
+        
+        Returns:
+            运行记录（含题目对数和重复簇数）
+        """
+        run_id = run_id or self.start_run(threshold)
+        started = datetime.now()
+        try:
+            # 扫描快照：扫描期间题目的增删改不会移动或改写正在遍历的行
+            backend = self.vector_index.snapshot_backend()
+            method = self.method_for(backend)
+            self.db.execute(
+                f"UPDATE {DUPLICATE_RUNS_TABLE} SET status = 'running', method = ?, total_vectors = ? WHERE id = ?",
+                (method, len(backend), run_id)
+            )
+            logger.info(f"开始全库查重：run_id={run_id}, method={method}, vectors={len(backend)}, "
+                        f"threshold={threshold}")
+            
+            clusters = UnionFind()
+            scanned = pair_count = 0
+            for block_size, pairs in self.iter_pairs(backend, threshold, top_k):
+                scanned += block_size
+                pair_count += len(pairs)
+                for question_id, duplicate_id, _ in pairs:
+                    clusters.union(question_id, duplicate_id)
+                if pairs:
+                    self.db.executemany(
+                        f"INSERT OR REPLACE INTO {DUPLICATE_PAIRS_TABLE} "
+                        f"(run_id, question_id, duplicate_id, similarity) VALUES (?, ?, ?, ?)",
+                        [(run_id, *pair) for pair in pairs]
+                    )
+                self.db.execute(
+                    f"UPDATE {DUPLICATE_RUNS_TABLE} SET scanned = ?, pair_count = ? WHERE id = ?",
+                    (scanned, pair_count, run_id)
+                )
+            
+            groups = clusters.groups()
+            rows = [(run_id, cluster_id, question_id)
+                    for cluster_id, group in enumerate(groups, start=1) for question_id in group]
+            for offset in range(0, len(rows), self.INSERT_BATCH_SIZE):
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO {DUPLICATE_CLUSTERS_TABLE} (run_id, cluster_id, question_id) "
+                    f"VALUES (?, ?, ?)",
+                    rows[offset:offset + self.INSERT_BATCH_SIZE]
+                )
+            self.db.execute(
+                f"UPDATE {DUPLICATE_RUNS_TABLE} SET status = 'completed', cluster_count = ?, finished_at = ? "
+                f"WHERE id = ?",
+                (len(groups), datetime.now().isoformat(), run_id)
+            )
+            logger.info(f"全库查重完成：run_id={run_id}, pairs={pair_count}, clusters={len(groups)}, "
+                        f"elapsed={(datetime.now() - started).total_seconds():.1f}s")
+        except Exception as e:
+            logger.error(f"全库查重失败：run_id={run_id}, {e}", exc_info=True)
+            self.db.execute(
+                f"UPDATE {DUPLICATE_RUNS_TABLE} SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (str(e), datetime.now().isoformat(), run_id)
+            )
+        return self.get_run(run_id)
+    
+    # ---------- 报告 ----------
+    
+    def get_run(self, run_id: str) -> Optional[Dict]:
+        """获取运行记录"""
+        return self.db.fetch_one(f"SELECT * FROM {DUPLICATE_RUNS_TABLE} WHERE id = ?", (run_id,))
+    
+    def list_runs(self, limit: int = 20) -> List[Dict]:
+        """最近的运行记录"""
+        return self.db.fetch_all(
+            f"SELECT * FROM {DUPLICATE_RUNS_TABLE} ORDER BY started_at DESC LIMIT ?", (limit,)
+        )
+    
+    def get_clusters(self, run_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        """
+        获取重复簇（按簇大小降序）
+        
+        Args:
+            run_id: 运行记录 ID
+            limit: 返回簇数
+            offset: 跳过的簇数
+        
+        Returns:
+            [{cluster_id, size, max_similarity, questions: [{id, content}, ...]}, ...]
+        """
+        members = self.db.fetch_all(f"""
+            SELECT c.cluster_id, c.question_id, q.content
+            FROM {DUPLICATE_CLUSTERS_TABLE} c
+            LEFT JOIN questions q ON q.id = c.question_id
+            WHERE c.run_id = ? AND c.cluster_id > ? AND c.cluster_id <= ?
+            ORDER BY c.cluster_id, c.question_id
+        """, (run_id, offset, offset + limit))
+        if not members:
+            return []
+        
+        similarities = self.db.fetch_all(f"""
+            SELECT c.cluster_id, MAX(p.similarity) as max_similarity
+            FROM {DUPLICATE_PAIRS_TABLE} p
+            INNER JOIN {DUPLICATE_CLUSTERS_TABLE} c ON c.run_id = p.run_id AND c.question_id = p.question_id
+            WHERE p.run_id = ? AND c.cluster_id > ? AND c.cluster_id <= ?
+            GROUP BY c.cluster_id
+        """, (run_id, offset, offset + limit))
+        max_similarity = {row['cluster_id']: row['max_similarity'] for row in similarities}
+        
+        clusters: Dict[int, Dict] = {}
+        for row in members:
+            cluster = clusters.setdefault(row['cluster_id'], {
+                'cluster_id': row['cluster_id'],
+                'size': 0,
+                'max_similarity': max_similarity.get(row['cluster_id']),
+                'questions': []
+            })
+            cluster['size'] += 1
+            cluster['questions'].append({'id': row['question_id'], 'content': row['content']})
+        return list(clusters.values())
@@ -0,0 +1,396 @@
+"""
+后台向量化任务队列
+
+题目创建/更新时不再同步等待 Embedding API：只在 embedding_jobs 表中登记任务（每道题最多一条），
+请求立即返回；后台 worker 线程批量领取任务，用 embed_batch 一次向量化一批题目。
+
+- 持久化：任务存放在 SQLite 中，进程重启后继续处理；领取后超过租约时间未完成的任务（worker 崩溃）重新排队
+- 重试：失败的任务第 n 次后等待 BACKOFF × 2^(n-1) 秒再重试，超过 MAX_ATTEMPTS 次标记为 failed
+- 状态：队列深度、执行中 / 失败任务数、最早任务的等待时间（延迟）
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.database.connection import fetch_all_in
+from core.database.migrations import EMBEDDING_JOBS_SQL, EMBEDDING_JOBS_TABLE
+from shared.config import config
+
+logger = logging.getLogger(__name__)
+
+# 领取后超过该时间仍未完成的任务视为 worker 已退出，重新排队
+LEASE_SECONDS = 300.0
+
+# 退避等待时间上限
+MAX_BACKOFF_SECONDS = 3600.0
+
+
+class EmbeddingJobQueue:
+    """向量化任务队列（SQLite 持久化）"""
+    
+    def __init__(self, db_connection):
+        """
+        初始化任务队列
+        
+        Args:
+            db_connection: SQLite 数据库连接
+        """
+        self.db = db_connection
+        for sql in EMBEDDING_JOBS_SQL:
+            self.db.execute(sql)
+        # 登记任务时唤醒本进程的 worker，不必等到下一次轮询
+        self.wakeup = threading.Event()
+    
+    def enqueue(self, question_ids: Iterable[str]) -> int:
+        """
+        登记向量化任务（已有任务的题目重新排队，重置重试次数）
+        
+        Args:
+            question_ids: 题目 ID 列表
+        
+        Returns:
+            登记的任务数
+        """
+        now = time.time()
+        params = [(question_id, now, now) for question_id in dict.fromkeys(question_ids)]
+        if not params:
+            return 0
+        self.db.executemany(f"""
+            INSERT INTO {EMBEDDING_JOBS_TABLE} (question_id, status, attempts, next_attempt_at, enqueued_at)
+            VALUES (?, 'pending', 0, ?, ?)
+            ON CONFLICT(question_id) DO UPDATE SET
+                status = 'pending', attempts = 0, next_attempt_at = excluded.next_attempt_at,
+                enqueued_at = excluded.enqueued_at, locked_at = NULL, last_error = NULL
+        """, params)
+        self.wakeup.set()
+        logger.debug(f"登记向量化任务：count={len(params)}")
+        return len(params)
+    
+    def claim(self, limit: int) -> List[str]:
+        """
+        领取到期的任务（单个写事务内标记为 running，多个 worker 不会领取到同一任务）
+        
+        Args:
+            limit: 最多领取的任务数
+        
+        Returns:
+            题目 ID 列表（按登记时间先后）
+        """
+        now = time.time()
+        with self.db.pool.transaction():
+            rows = self.db.fetch_all(f"""
+                SELECT question_id FROM {EMBEDDING_JOBS_TABLE}
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'running' AND locked_at <= ?)
+                ORDER BY enqueued_at, question_id
+                LIMIT ?
+            """, (now, now - LEASE_SECONDS, limit))
+            question_ids = [row['question_id'] for row in rows]
+            if question_ids:
+                self.db.executemany(
+                    f"UPDATE {EMBEDDING_JOBS_TABLE} SET status = 'running', locked_at = ? WHERE question_id = ?",
+                    [(now, question_id) for question_id in question_ids]
+                )
+        return question_ids
+    
+    def complete(self, question_ids: List[str]):
+        """
+        删除已完成的任务（处理期间被重新登记的任务已回到 pending，保留下来稍后再处理）
+        
+        Args:
+            question_ids: 题目 ID 列表
+        """
+        self.db.executemany(
+            f"DELETE FROM {EMBEDDING_JOBS_TABLE} WHERE question_id = ? AND status = 'running'",
+            [(question_id,) for question_id in question_ids]
+        )
+    
+    def fail(self, question_ids: List[str], error: str):
+        """
+        记录失败：按指数退避重新排队，超过重试次数上限标记为 failed
+        
+        Args:
+            question_ids: 题目 ID 列表
+            error: 错误信息
+        """
+        now = time.time()
+        max_attempts = max(1, config.EMBEDDING_QUEUE_MAX_ATTEMPTS)
+        backoff = max(0.0, config.EMBEDDING_QUEUE_BACKOFF_SECONDS)
+        with self.db.pool.transaction():
+            rows = fetch_all_in(self.db, f"""
+                SELECT question_id, attempts FROM {EMBEDDING_JOBS_TABLE} WHERE question_id IN ({{placeholders}})
+            """, question_ids)
+            params = []
+            for row in rows:
+                attempts = row['attempts'] + 1
+                status = 'failed' if attempts >= max_attempts else 'pending'
+                delay = min(backoff * (2 ** (attempts - 1)), MAX_BACKOFF_SECONDS)
+                params.append((status, attempts, now + delay, error[:500], row['question_id']))
+            self.db.executemany(f"""
+                UPDATE {EMBEDDING_JOBS_TABLE}
+                SET status = ?, attempts = ?, next_attempt_at = ?, locked_at = NULL, last_error = ?
+                WHERE question_id = ?
+            """, params)
+        logger.warning(f"向量化任务失败：count={len(question_ids)}, error={error}")
+    
+    def retry_failed(self) -> int:
+        """失败的任务重新排队，返回任务数"""
+        failed = self.db.fetch_one(
+            f"SELECT COUNT(*) as total FROM {EMBEDDING_JOBS_TABLE} WHERE status = 'failed'"
+        )['total']
+        self.db.execute(f"""
+            UPDATE {EMBEDDING_JOBS_TABLE}
+            SET status = 'pending', attempts = 0, next_attempt_at = ?, last_error = NULL
+            WHERE status = 'failed'
+        """, (time.time(),))
+        if failed:
+            self.wakeup.set()
+        return failed
+    
+    def get_status(self) -> Dict[str, Any]:
+        """
+        队列状态
+        
+        Returns:
+            {depth, pending, running, failed, lag_seconds, oldest_enqueued_at, recent_errors}
+            depth 为待处理任务数（pending + running），lag_seconds 为最早的待处理任务已等待的秒数
+        """
+        counts = {row['status']: row['total'] for row in self.db.fetch_all(
+            f"SELECT status, COUNT(*) as total FROM {EMBEDDING_JOBS_TABLE} GROUP BY status"
+        )}
+        oldest = self.db.fetch_one(f"""
+            SELECT MIN(enqueued_at) as oldest FROM {EMBEDDING_JOBS_TABLE} WHERE status IN ('pending', 'running')
+        """)['oldest']
+        errors = self.db.fetch_all(f"""
+            SELECT question_id, attempts, last_error FROM {EMBEDDING_JOBS_TABLE}
+            WHERE last_error IS NOT NULL ORDER BY next_attempt_at DESC LIMIT 5
+        """)
+        pending, running = counts.get('pending', 0), counts.get('running', 0)
+        return {
+            'depth': pending + running,
+            'pending': pending,
+            'running': running,
+            'failed': counts.get('failed', 0),
+            'lag_seconds': round(time.time() - oldest, 1) if oldest else 0.0,
+            'oldest_enqueued_at': oldest,
+            'recent_errors': errors
+        }
+
+
+def default_embedding_provider() -> Tuple[Optional[Any], Optional[Any]]:
+    """按 agent.json 和生效向量版本创建 (embedding_service, vector_index)，未配置时返回 (None, None)"""
+    from agent.config import AgentConfig
+    from agent.services.embedding_service import get_embedding_service
+    from core.database.connection import db
+    from core.services.embedding_versions import resolve_embedding_config
+    from core.services.vector_index import get_vector_index
+    
+    embedding_config = AgentConfig._load_config().get('embedding', {})
+    if not embedding_config:
+        return None, None
+    vector_index = get_vector_index(db)
+    embedding_config = resolve_embedding_config(embedding_config, vector_index.get_active_version())
+    return get_embedding_service(embedding_config), vector_index
+
+
+class EmbeddingWorker:
+    """后台向量化 worker（一个或多个线程从队列批量领取任务）"""
+    
+    # Embedding 服务的缓存时间：到期后重新读取配置（生效版本切换时立即更新）
+    PROVIDER_REFRESH_SECONDS = 30.0
+    
+    def __init__(self, job_queue: EmbeddingJobQueue,
+                 db_connection,
+                 embedding_provider: Callable[[], Tuple[Any, Any]] = default_embedding_provider,
+                 batch_size: Optional[int] = None,
+                 workers: Optional[int] = None,
+                 poll_seconds: Optional[float] = None):
+        """
+        初始化 worker
+        
+        Args:
+            job_queue: 任务队列
+            db_connection: SQLite 数据库连接（读取待向量化的题目）
+            embedding_provider: 返回 (embedding_service, vector_index) 的函数
+            batch_size: 每次领取的任务数（默认 EMBEDDING_QUEUE_BATCH_SIZE）
+            workers: 线程数（默认 EMBEDDING_QUEUE_WORKERS）
+            poll_seconds: 队列为空时的轮询间隔（默认 EMBEDDING_QUEUE_POLL_SECONDS）
+        """
+        self.queue = job_queue
+        self.db = db_connection
+        self.embedding_provider = embedding_provider
+        self._components: Optional[Tuple[Any, Any]] = None
+        self._components_at = 0.0
+        self._components_lock = threading.Lock()
+        self.batch_size = max(1, batch_size or config.EMBEDDING_QUEUE_BATCH_SIZE)
+        self.workers = max(1, workers or config.EMBEDDING_QUEUE_WORKERS)
+        self.poll_seconds = poll_seconds if poll_seconds is not None else config.EMBEDDING_QUEUE_POLL_SECONDS
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self.processed = 0
+        self.failed = 0
+    
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+    
+    def start(self):
+        """启动 worker 线程（已启动时忽略）"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"embedding-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"后台向量化 worker 已启动：workers={self.workers}, batch_size={self.batch_size}")
+    
+    def stop(self, timeout: float = 10.0):
+        """停止 worker（当前批次处理完后退出；未完成的任务留在队列中）"""
+        self._stop.set()
+        self.queue.wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+    
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                handled = self.run_once()
+            except Exception as e:
+                logger.error(f"后台向量化异常：{e}", exc_info=True)
+                handled = 0
+            if not handled:
+                self.queue.wakeup.wait(self.poll_seconds)
+                self.queue.wakeup.clear()
+    
+    def _get_components(self) -> Tuple[Any, Any]:
+        """
+        Embedding 服务和向量索引（缓存 PROVIDER_REFRESH_SECONDS 秒，不在每次轮询时读取配置文件）
+        
+        生效向量版本与服务的模型版本不一致时（刚切换过版本）立即重新获取，不用旧模型写入。
+        """
+        with self._components_lock:
+            now = time.monotonic()
+            stale = self._components is None or now - self._components_at >= self.PROVIDER_REFRESH_SECONDS
+            if not stale:
+                embedding_service, vector_index = self._components
+                if embedding_service and vector_index:
+                    active = vector_index.get_active_version()
+                    stale = active is not None and active != embedding_service.get_model_version()
+            if stale:
+                self._components = self.embedding_provider()
+                self._components_at = now
+            return self._components
+    
+    def run_once(self) -> int:
+        """
+        领取并处理一批任务
+        
+        Returns:
+            领取的任务数（0 表示没有到期任务或未配置 Embedding 服务）
+        """
+        embedding_service, vector_index = self._get_components()
+        if not embedding_service or not vector_index:
+            return 0
+        
+        question_ids = self.queue.claim(self.batch_size)
+        if not question_ids:
+            return 0
+        
+        try:
+            model_version = embedding_service.get_model_version()
+            todo = []
+            questions = fetch_all_in(
+                self.db, "SELECT id, content, options FROM questions WHERE id IN ({placeholders})", question_ids
+            )
+            for question in questions:
+                # 与同步向量化相同的选项格式，内容哈希保持一致
+                options = json.loads(question['options'] or '[]')
+                item = (question['id'], question['content'], str(options) if options else None)
+                needs_update, _ = vector_index.needs_reembedding(item[0], item[1], item[2], model_version)
+                if needs_update:
+                    todo.append(item)
+        except Exception as e:
+            self._fail(question_ids, e)
+            return len(question_ids)
+        
+        failed = self._embed(embedding_service, vector_index, model_version, todo)
+        
+        # 题目已删除或向量已是最新的任务同样完成
+        done = [question_id for question_id in question_ids if question_id not in failed]
+        self.queue.complete(done)
+        self.processed += len(done)
+        logger.info(f"后台向量化：claimed={len(question_ids)}, embedded={len(todo) - len(failed)}, "
+                    f"failed={len(failed)}")
+        return len(question_ids)
+    
+    def _embed(self, embedding_service, vector_index, model_version: str,
+               items: List[Tuple[str, str, Optional[str]]]) -> set:
+        """
+        向量化并保存一批题目；整批失败时逐题重试，失败的任务按退避策略重新排队
+        
+        Returns:
+            失败的题目 ID 集合
+        """
+        if not items:
+            return set()
+        try:
+            embeddings = embedding_service.embed_batch([content for _, content, _ in items])
+            vector_index.update_embeddings(
+                [(question_id, embedding, content, options)
+                 for (question_id, content, options), embedding in zip(items, embeddings)],
+                model_version
+            )
+            return set()
+        except Exception as e:
+            if len(items) == 1:
+                self._fail([items[0][0]], e)
+                return {items[0][0]}
+            logger.warning(f"批量向量化失败，逐题重试：size={len(items)}, error={e}")
+        
+        failed = set()
+        for item in items:
+            failed |= self._embed(embedding_service, vector_index, model_version, [item])
+        return failed
+    
+    def _fail(self, question_ids: List[str], error: Exception):
+        """任务重新排队并计数"""
+        self.queue.fail(question_ids, str(error))
+        self.failed += len(question_ids)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """worker 运行状态"""
+        return {
+            'running': self.running,
+            'workers': self.workers,
+            'batch_size': self.batch_size,
+            'processed': self.processed,
+            'failed': self.failed
+        }
+
+
+# 单例实例（延迟初始化）
+_job_queue: Optional[EmbeddingJobQueue] = None
+_worker: Optional[EmbeddingWorker] = None
+
+
+def get_embedding_job_queue(db_connection) -> EmbeddingJobQueue:
+    """获取任务队列单例"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = EmbeddingJobQueue(db_connection)
+    return _job_queue
+
+
+def get_embedding_worker(db_connection) -> EmbeddingWorker:
+    """获取后台 worker 单例（不自动启动）"""
+    global _worker
+    if _worker is None:
+        _worker = EmbeddingWorker(get_embedding_job_queue(db_connection), db_connection)
+    return _worker
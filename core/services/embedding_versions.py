@@ -0,0 +1,356 @@
+"""
+向量模型版本管理（影子索引）
+
+切换 Embedding 模型时不再原地覆盖 question_embeddings：
+
+1. 登记新版本（building），后台把全部题目用新模型向量化写入影子表；
+   期间检索和在线写入继续使用当前生效版本，两种维度的向量不会混在一起比较
+2. 构建可中断、可续建：只处理影子表中缺少向量或题目内容已变更的题目，
+   最后一轮补齐构建期间新增 / 修改的题目，全部覆盖后状态变为 ready
+3. 切换（activate）在一个事务内完成：当前版本的向量归档到影子表（retired），
+   新版本的向量移入 question_embeddings（active），各进程按向量表指纹重新加载检索后端
+4. 确认无需回滚后清理（gc）已退役版本的影子向量；回滚即重新切换到退役版本
+
+版本状态：building → ready → active → retired（→ 清理）；构建失败为 failed
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from core.database.migrations import (
+    EMBEDDING_VERSIONS_SQL, EMBEDDING_VERSIONS_TABLE, EMBEDDINGS_TABLE, SHADOW_EMBEDDINGS_TABLE
+)
+from core.services.vector_quantization import dimension_of
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingVersionManager:
+    """向量模型版本的后台构建、切换和清理"""
+    
+    # 每批向量化的题目数
+    BATCH_SIZE = 64
+    
+    # 构建时最多补齐的轮数（每轮处理上一轮期间新增 / 修改的题目）
+    MAX_PASSES = 3
+    
+    def __init__(self, db_connection, vector_index=None):
+        """
+        初始化版本管理
+        
+        Args:
+            db_connection: SQLite 数据库连接
+            vector_index: 向量索引（默认使用全局单例）
+        """
+        self.db = db_connection
+        self._vector_index = vector_index
+        for sql in EMBEDDING_VERSIONS_SQL:
+            self.db.execute(sql)
+    
+    @property
+    def vector_index(self):
+        if self._vector_index is None:
+            from core.services.vector_index import get_vector_index
+            self._vector_index = get_vector_index(self.db)
+        return self._vector_index
+    
+    # ---------- 查询 ----------
+    
+    def get_version(self, version: str) -> Optional[Dict]:
+        """获取版本记录"""
+        return self.db.fetch_one(f"SELECT * FROM {EMBEDDING_VERSIONS_TABLE} WHERE version = ?", (version,))
+    
+    def list_versions(self) -> List[Dict]:
+        """所有版本记录（含影子表中的向量数）"""
+        return self.db.fetch_all(f"""
+            SELECT v.*, (
+                SELECT COUNT(*) FROM {SHADOW_EMBEDDINGS_TABLE} s WHERE s.embedding_version = v.version
+            ) as shadow_count
+            FROM {EMBEDDING_VERSIONS_TABLE} v
+            ORDER BY v.created_at
+        """)
+    
+    def pending(self, version: str) -> List[Dict]:
+        """
+        还需要用该版本向量化的题目（没有该版本向量，或向量化后题目内容已变更）
+        
+        Args:
+            version: 模型版本
+        
+        Returns:
+            [{id, content, options}, ...]
+        """
+        table, version_sql = EMBEDDINGS_TABLE, ""
+        params: tuple = ()
+        if self.vector_index.is_shadow_version(version):
+            table, version_sql, params = SHADOW_EMBEDDINGS_TABLE, "WHERE embedding_version = ?", (version,)
+        hashes = {
+            row['question_id']: row['content_hash']
+            for row in self.db.fetch_all(f"SELECT question_id, content_hash FROM {table} {version_sql}", params)
+        }
+        questions = self.db.fetch_all("SELECT id, content, options FROM questions ORDER BY created_at, id")
+        compute_hash = self.vector_index._compute_content_hash
+        return [
+            question for question in questions
+            if hashes.get(question['id']) != compute_hash(question['content'], question['options'])
+        ]
+    
+    # ---------- 构建 ----------
+    
+    def _record_active(self):
+        """
+        旧数据库没有版本记录时，把 question_embeddings 中占多数的版本登记为生效版本
+        
+        Returns:
+            生效版本（向量表为空时为 None）
+        """
+        active = self.vector_index.get_active_version()
+        if active:
+            return active
+        row = self.db.fetch_one(f"""
+            SELECT embedding_version, COUNT(*) as total
+            FROM {EMBEDDINGS_TABLE}
+            WHERE embedding_version IS NOT NULL
+            GROUP BY embedding_version
+            ORDER BY total DESC
+            LIMIT 1
+        """)
+        if not row:
+            return None
+        version = row['embedding_version']
+        sample = self.db.fetch_one(
+            f"SELECT embedding, embedding_dtype FROM {EMBEDDINGS_TABLE} WHERE embedding_version = ? LIMIT 1",
+            (version,)
+        )
+        now = datetime.now().isoformat()
+        self.db.execute(f"""
+            INSERT OR REPLACE INTO {EMBEDDING_VERSIONS_TABLE}
+                (version, status, dimension, total, built, created_at, finished_at, activated_at)
+            VALUES (?, 'active', ?, ?, ?, ?, ?, ?)
+        """, (version, dimension_of(sample['embedding'], sample['embedding_dtype'] or "float32"),
+              row['total'], row['total'], now, now, now))
+        logger.info(f"登记当前生效的向量版本：{version}")
+        return version
+    
+    def start_build(self, version: str) -> Dict:
+        """
+        登记要构建的版本（已登记的版本继续构建）
+        
+        向量表为空时没有需要迁移的数据，直接登记为生效版本。
+        
+        Args:
+            version: 新模型版本
+        
+        Returns:
+            版本记录
+        
+        Raises:
+            ValueError: 该版本已是生效版本
+        """
+        active = self._record_active()
+        if version == active:
+            raise ValueError(f"{version} 已是当前生效的向量版本")
+        
+        now = datetime.now().isoformat()
+        status = 'building' if active else 'active'
+        if self.get_version(version):
+            self.db.execute(
+                f"UPDATE {EMBEDDING_VERSIONS_TABLE} SET status = ?, error = NULL, finished_at = NULL "
+                f"WHERE version = ?",
+                (status, version)
+            )
+        else:
+            self.db.execute(
+                f"INSERT INTO {EMBEDDING_VERSIONS_TABLE} (version, status, created_at, activated_at) "
+                f"VALUES (?, ?, ?, ?)",
+                (version, status, now, None if active else now)
+            )
+        logger.info(f"开始构建向量版本：version={version}, active={active or '-'}")
+        return self.get_version(version)
+    
+    def build(self, embedding_service, version: str, batch_size: Optional[int] = None) -> Dict:
+        """
+        用新模型向量化全部题目（写入影子表，不影响当前检索）
+        
+        Args:
+            embedding_service: 新模型的 EmbeddingService 实例
+            version: 新模型版本（embedding_service.get_model_version()）
+            batch_size: 每批向量化的题目数
+        
+        Returns:
+            版本记录（全部题目覆盖后状态为 ready）
+        """
+        batch_size = batch_size or self.BATCH_SIZE
+        record = self.start_build(version)
+        dimension = record.get('dimension')
+        
+        try:
+            for _ in range(self.MAX_PASSES):
+                pending = self.pending(version)
+                if not pending:
+                    break
+                total = self.db.fetch_one("SELECT COUNT(*) as total FROM questions")['total']
+                built = total - len(pending)
+                self._update(version, total=total, built=built)
+                
+                for offset in range(0, len(pending), batch_size):
+                    batch = pending[offset:offset + batch_size]
+                    embeddings = embedding_service.embed_batch([question['content'] for question in batch])
+                    for embedding in embeddings:
+                        if dimension is None:
+                            dimension = len(embedding)
+                            self._update(version, dimension=dimension)
+                        elif len(embedding) != dimension:
+                            raise ValueError(f"向量维度不一致：{len(embedding)} != {dimension}")
+                    self.vector_index.update_embeddings([
+                        (question['id'], embedding, question['content'], question['options'])
+                        for question, embedding in zip(batch, embeddings)
+                    ], version)
+                    built += len(batch)
+                    self._update(version, built=built)
+                    logger.info(f"构建向量版本：version={version}, 进度 {built}/{total}")
+        except Exception as e:
+            logger.error(f"构建向量版本失败：version={version}, {e}", exc_info=True)
+            self._update(version, status='failed', error=str(e), finished_at=datetime.now().isoformat())
+            return self.get_version(version)
+        
+        remaining = len(self.pending(version))
+        if self.get_version(version)['status'] == 'building':
+            if remaining:
+                logger.warning(f"构建期间题目持续变更，仍有 {remaining} 题待向量化，请重新运行构建")
+            else:
+                self._update(version, status='ready', finished_at=datetime.now().isoformat())
+        logger.info(f"向量版本构建结束：version={version}, remaining={remaining}")
+        return self.get_version(version)
+    
+    def _update(self, version: str, **fields):
+        """更新版本记录的若干字段"""
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.db.execute(
+            f"UPDATE {EMBEDDING_VERSIONS_TABLE} SET {assignments} WHERE version = ?",
+            tuple(fields.values()) + (version,)
+        )
+    
+    # ---------- 切换与清理 ----------
+    
+    def activate(self, version: str, force: bool = False) -> Dict:
+        """
+        切换生效版本（单个事务）
+        
+        当前版本的向量归档到影子表并标记为 retired，新版本的向量移入 question_embeddings。
+        切换到 retired 版本即回滚。
+        
+        Args:
+            version: 要生效的版本
+            force: 仍有题目缺少该版本向量时也切换（这些题目切换后没有向量，需补建）
+        
+        Returns:
+            版本记录
+        
+        Raises:
+            ValueError: 版本不存在、已生效或尚未覆盖全部题目
+        """
+        record = self.get_version(version)
+        if not record:
+            raise ValueError(f"向量版本不存在：{version}")
+        if record['status'] == 'active':
+            raise ValueError(f"{version} 已是当前生效的向量版本")
+        remaining = len(self.pending(version))
+        if remaining and not force:
+            raise ValueError(f"还有 {remaining} 道题目缺少 {version} 的向量，请先完成构建")
+        
+        now = datetime.now().isoformat()
+        with self.db.pool.transaction():
+            previous = self.vector_index.get_active_version()
+            self.db.execute(f"""
+                INSERT OR REPLACE INTO {SHADOW_EMBEDDINGS_TABLE}
+                    (embedding_version, question_id, embedding, content_hash, embedding_updated_at, embedding_dtype)
+                SELECT COALESCE(embedding_version, 'unknown'), question_id, embedding, content_hash,
+                       embedding_updated_at, embedding_dtype
+                FROM {EMBEDDINGS_TABLE}
+            """)
+            self.db.execute(f"DELETE FROM {EMBEDDINGS_TABLE}")
+            # 更新时间取切换时刻：向量表指纹随之变化，其他进程据此重新加载检索后端
+            self.db.execute(f"""
+                INSERT INTO {EMBEDDINGS_TABLE}
+                    (question_id, embedding, embedding_version, content_hash, embedding_updated_at, embedding_dtype)
+                SELECT question_id, embedding, embedding_version, content_hash, ?, embedding_dtype
+                FROM {SHADOW_EMBEDDINGS_TABLE}
+                WHERE embedding_version = ? AND question_id IN (SELECT id FROM questions)
+            """, (now, version))
+            self.db.execute(f"DELETE FROM {SHADOW_EMBEDDINGS_TABLE} WHERE embedding_version = ?", (version,))
+            self.db.execute(
+                f"UPDATE {EMBEDDING_VERSIONS_TABLE} SET status = 'retired', retired_at = ? WHERE status = 'active'",
+                (now,)
+            )
+            self.db.execute(
+                f"UPDATE {EMBEDDING_VERSIONS_TABLE} SET status = 'active', activated_at = ?, retired_at = NULL, "
+                f"finished_at = COALESCE(finished_at, ?) WHERE version = ?",
+                (now, now, version)
+            )
+        self.vector_index.invalidate()
+        logger.info(f"向量版本已切换：{previous or '-'} → {version}（缺少向量 {remaining} 题）")
+        return self.get_version(version)
+    
+    def gc(self, keep_latest_retired: bool = False) -> Dict[str, int]:
+        """
+        清理不再需要的影子向量：已退役 / 构建失败的版本，以及没有版本记录的残留数据
+        
+        Args:
+            keep_latest_retired: 保留最近退役的版本（仍可回滚）
+        
+        Returns:
+            {版本: 删除的向量数}
+        """
+        keep = {row['version'] for row in self.db.fetch_all(
+            f"SELECT version FROM {EMBEDDING_VERSIONS_TABLE} WHERE status IN ('building', 'ready')"
+        )}
+        if keep_latest_retired:
+            latest = self.db.fetch_one(
+                f"SELECT version FROM {EMBEDDING_VERSIONS_TABLE} WHERE status = 'retired' "
+                f"ORDER BY retired_at DESC LIMIT 1"
+            )
+            if latest:
+                keep.add(latest['version'])
+        
+        removed = {}
+        for row in self.db.fetch_all(f"""
+            SELECT embedding_version, COUNT(*) as total FROM {SHADOW_EMBEDDINGS_TABLE} GROUP BY embedding_version
+        """):
+            if row['embedding_version'] not in keep:
+                removed[row['embedding_version']] = row['total']
+        
+        with self.db.pool.transaction():
+            for version in removed:
+                self.db.execute(f"DELETE FROM {SHADOW_EMBEDDINGS_TABLE} WHERE embedding_version = ?", (version,))
+            versions = self.db.fetch_all(
+                f"SELECT version FROM {EMBEDDING_VERSIONS_TABLE} WHERE status IN ('retired', 'failed')"
+            )
+            for row in versions:
+                if row['version'] not in keep:
+                    self.db.execute(f"DELETE FROM {EMBEDDING_VERSIONS_TABLE} WHERE version = ?", (row['version'],))
+        logger.info(f"清理影子向量：{removed}")
+        return removed
+
+
+def resolve_embedding_config(embedding_config: Dict, active_version: Optional[str]) -> Dict:
+    """
+    按生效版本确定 Embedding 配置：activate 切换版本后，查询和写入都使用生效版本的模型
+    
+    API 模型的版本即模型名，生效版本与 agent.json 中的模型不同时覆盖 model_name（其余连接配置不变）；
+    本地模型的版本由训练参数决定，无法从版本号还原，保持原配置。
+    检索时仍会校验查询向量的版本（见 VectorIndex.search_similar），配置不一致会明确报错。
+    
+    Args:
+        embedding_config: agent.json 中的 embedding 配置
+        active_version: 当前生效的模型版本（未记录时为 None）
+    
+    Returns:
+        Embedding 配置（需要覆盖模型时为新字典）
+    """
+    if not embedding_config or not active_version or embedding_config.get('provider') == 'local':
+        return embedding_config
+    if embedding_config.get('model_name') == active_version:
+        return embedding_config
+    return dict(embedding_config, model_name=active_version)
@@ -0,0 +1,337 @@
+"""
+题目文本指纹索引（本地近似重复检测）
+
+不依赖 Embedding 服务：Embedding 服务未配置或不可用时，审核入库和批量查重仍能发现
+完全重复和近似重复（改了几个字、标点、空格、全半角）的题目。
+
+- 文本规范化：NFKC（统一全半角）、转小写、去掉空白和句读标点（保留公式符号）
+- 完全重复：规范化文本的 MD5，按索引一次查询
+- 近似重复：字符 3-gram 集合的 MinHash 签名（64 个哈希），估计 Jaccard 相似度；
+  签名分为 16 段（每段 4 个哈希），每段的哈希值作为 LSH 桶，至少一段相同的题目才是候选，
+  Jaccard ≥ 0.8 的题目对被召回的概率 > 99.9%
+
+检索只查桶表（按主键）和候选的签名，不扫描全库，不发起网络请求。
+"""
+
+import hashlib
+import logging
+import unicodedata
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.database.connection import fetch_all_in
+from core.database.migrations import FINGERPRINT_BUCKETS_TABLE, FINGERPRINT_SQL, FINGERPRINTS_TABLE
+from shared.config import config
+
+logger = logging.getLogger(__name__)
+
+# MinHash 哈希函数个数与 LSH 分段（BANDS × ROWS = NUM_PERM）
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# 字符 n-gram 长度（中文题目按字切分，不依赖分词）
+SHINGLE_SIZE = 3
+
+# 规范化时去掉的句读标点（公式中的 + - * / = ^ ( ) 等保留）
+_PUNCTUATION = set(",.;:?!'\"`、。…“”‘’·《》「」【】")
+
+# 随机置换 h(x) = (a·x + b) mod P：P 为大于 2^32 的素数，a、b < 2^32 时 uint64 运算不溢出
+_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(20240101)
+_PERM_A = _rng.integers(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize_text(text: str) -> str:
+    """规范化题目文本：统一全半角、小写，去掉空白和句读标点"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return "".join(ch for ch in text if not ch.isspace() and ch not in _PUNCTUATION)
+
+
+def text_hash(normalized: str) -> str:
+    """规范化文本的哈希（完全重复判定）"""
+    return hashlib.md5(normalized.encode("utf-8")).hexdigest()
+
+
+def minhash_signature(normalized: str) -> Optional[np.ndarray]:
+    """
+    计算 MinHash 签名
+    
+    Args:
+        normalized: 规范化后的文本
+    
+    Returns:
+        长度为 NUM_PERM 的 uint64 数组；空文本返回 None
+    """
+    if not normalized:
+        return None
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    values = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    hashed = (_PERM_A[:, None] * values[None, :] + _PERM_B[:, None]) % _PRIME
+    return hashed.min(axis=1)
+
+
+def band_buckets(signature: np.ndarray) -> List[int]:
+    """签名各段的 LSH 桶（段号参与哈希，不同段的桶互不冲突）"""
+    buckets = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(
+            signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8, person=band.to_bytes(16, "little")
+        ).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """由两个签名估计 Jaccard 相似度"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class FingerprintIndex:
+    """题目文本指纹索引"""
+    
+    def __init__(self, db_connection):
+        """
+        初始化指纹索引
+        
+        Args:
+            db_connection: SQLite 数据库连接
+        """
+        self.db = db_connection
+        for sql in FINGERPRINT_SQL:
+            self.db.execute(sql)
+    
+    # ---------- 写入 ----------
+    
+    def update(self, question_id: str, content: str):
+        """写入（覆盖）单道题目的指纹"""
+        self.update_many([(question_id, content)])
+    
+    def update_many(self, items: Iterable[Tuple[str, str]]) -> int:
+        """
+        批量写入题目指纹（单个事务）
+        
+        Args:
+            items: (题目 ID, 题干) 列表
+        
+        Returns:
+            写入的指纹数（空题干不写入）
+        """
+        now = datetime.now().isoformat()
+        rows, buckets, question_ids = [], [], []
+        for question_id, content in items:
+            question_ids.append(question_id)
+            normalized = normalize_text(content)
+            signature = minhash_signature(normalized)
+            if signature is None:
+                continue
+            rows.append((question_id, text_hash(normalized), signature.tobytes(), now))
+            buckets.extend((bucket, question_id) for bucket in band_buckets(signature))
+        if not question_ids:
+            return 0
+        
+        with self.db.pool.transaction():
+            self.db.executemany(f"DELETE FROM {FINGERPRINT_BUCKETS_TABLE} WHERE question_id = ?",
+                                [(question_id,) for question_id in question_ids])
+            self.db.executemany(f"DELETE FROM {FINGERPRINTS_TABLE} WHERE question_id = ?",
+                                [(question_id,) for question_id in question_ids])
+            if rows:
+                self.db.executemany(
+                    f"INSERT INTO {FINGERPRINTS_TABLE} (question_id, text_hash, signature, updated_at) "
+                    f"VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self.db.executemany(
+                    f"INSERT OR IGNORE INTO {FINGERPRINT_BUCKETS_TABLE} (bucket, question_id) VALUES (?, ?)",
+                    buckets
+                )
+        logger.debug(f"更新题目指纹：count={len(rows)}")
+        return len(rows)
+    
+    def delete(self, question_id: str):
+        """删除题目指纹"""
+        self.db.execute(f"DELETE FROM {FINGERPRINT_BUCKETS_TABLE} WHERE question_id = ?", (question_id,))
+        self.db.execute(f"DELETE FROM {FINGERPRINTS_TABLE} WHERE question_id = ?", (question_id,))
+    
+    def rebuild_all(self, batch_size: int = 1000) -> Dict[str, int]:
+        """
+        为全部题目重新计算指纹（分批写入）
+        
+        Args:
+            batch_size: 每批写入的题目数
+        
+        Returns:
+            {total, indexed}
+        """
+        questions = self.db.fetch_all("SELECT id, content FROM questions ORDER BY created_at, id")
+        indexed = 0
+        for start in range(0, len(questions), batch_size):
+            batch = questions[start:start + batch_size]
+            indexed += self.update_many((q['id'], q['content']) for q in batch)
+        self.db.execute(
+            f"DELETE FROM {FINGERPRINTS_TABLE} WHERE question_id NOT IN (SELECT id FROM questions)"
+        )
+        self.db.execute(
+            f"DELETE FROM {FINGERPRINT_BUCKETS_TABLE} WHERE question_id NOT IN (SELECT id FROM questions)"
+        )
+        logger.info(f"重建题目指纹：total={len(questions)}, indexed={indexed}")
+        return {'total': len(questions), 'indexed': indexed}
+    
+    def get_stats(self) -> Dict[str, int]:
+        """指纹覆盖情况"""
+        total = self.db.fetch_one("SELECT COUNT(*) as total FROM questions")['total']
+        indexed = self.db.fetch_one(f"""
+            SELECT COUNT(*) as total FROM {FINGERPRINTS_TABLE} f
+            INNER JOIN questions q ON q.id = f.question_id
+        """)['total']
+        return {'total_questions': total, 'indexed': indexed, 'missing': total - indexed}
+    
+    # ---------- 检索 ----------
+    
+    def find_similar(self, content: str, threshold: Optional[float] = None, top_k: int = 5,
+                     exclude_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        查找与文本完全重复或近似重复的题目
+        
+        Args:
+            content: 题干
+            threshold: 最低相似度（默认 FINGERPRINT_THRESHOLD）
+            top_k: 返回最多结果数
+            exclude_ids: 排除的题目 ID
+        
+        Returns:
+            [{question_id, similarity, content, exact}, ...]，按相似度降序；完全重复的相似度为 1.0
+        """
+        return self.find_similar_batch([content], threshold, top_k, exclude_ids)[0]
+    
+    def find_similar_batch(self, contents: Sequence[str], threshold: Optional[float] = None, top_k: int = 5,
+                           exclude_ids: Optional[List[str]] = None) -> List[List[Dict]]:
+        """
+        批量查找重复题目（所有查询的桶、候选签名和题干各查询一次）
+        
+        Args:
+            contents: 题干列表
+            threshold: 最低相似度（默认 FINGERPRINT_THRESHOLD）
+            top_k: 每个查询返回最多结果数
+            exclude_ids: 对所有查询排除的题目 ID
+        
+        Returns:
+            与查询一一对应的结果列表
+        """
+        threshold = config.FINGERPRINT_THRESHOLD if threshold is None else threshold
+        excluded = set(exclude_ids or [])
+        queries = []
+        for content in contents:
+            normalized = normalize_text(content)
+            signature = minhash_signature(normalized)
+            buckets = band_buckets(signature) if signature is not None else []
+            queries.append((text_hash(normalized), signature, buckets))
+        
+        hashes = list({query[0] for query in queries if query[1] is not None})
+        bucket_ids = list({bucket for query in queries for bucket in query[2]})
+        exact: Dict[str, set] = {}
+        for row in fetch_all_in(
+            self.db, f"SELECT question_id, text_hash FROM {FINGERPRINTS_TABLE} WHERE text_hash IN ({{placeholders}})",
+            hashes
+        ):
+            exact.setdefault(row['text_hash'], set()).add(row['question_id'])
+        bucket_members: Dict[int, set] = {}
+        for row in fetch_all_in(
+            self.db, f"SELECT bucket, question_id FROM {FINGERPRINT_BUCKETS_TABLE} WHERE bucket IN ({{placeholders}})",
+            bucket_ids
+        ):
+            bucket_members.setdefault(row['bucket'], set()).add(row['question_id'])
+        
+        candidates_per_query = []
+        for hash_value, signature, buckets in queries:
+            candidates = set(exact.get(hash_value, ()))
+            for bucket in buckets:
+                candidates |= bucket_members.get(bucket, set())
+            candidates_per_query.append(candidates - excluded)
+        
+        candidate_ids = list(set().union(*candidates_per_query)) if candidates_per_query else []
+        stored = {
+            row['question_id']: row
+            for row in fetch_all_in(self.db, f"""
+                SELECT f.question_id, f.text_hash, f.signature, q.content
+                FROM {FINGERPRINTS_TABLE} f
+                INNER JOIN questions q ON q.id = f.question_id
+                WHERE f.question_id IN ({{placeholders}})""", candidate_ids)
+        }
+        
+        results = []
+        for (hash_value, signature, _), candidates in zip(queries, candidates_per_query):
+            hits = []
+            for question_id in candidates:
+                row = stored.get(question_id)
+                if row is None:
+                    continue
+                is_exact = row['text_hash'] == hash_value
+                similarity = 1.0 if is_exact else estimate_similarity(
+                    signature, np.frombuffer(row['signature'], dtype=np.uint64)
+                )
+                if similarity >= threshold:
+                    hits.append({
+                        'question_id': question_id,
+                        'similarity': similarity,
+                        'content': row['content'],
+                        'exact': is_exact
+                    })
+            hits.sort(key=lambda hit: (-hit['similarity'], hit['question_id']))
+            results.append(hits[:top_k])
+        return results
+    
+    @staticmethod
+    def find_batch_duplicates(contents: Sequence[str],
+                              threshold: Optional[float] = None) -> List[Tuple[int, int, float]]:
+        """
+        找出一批文本之间的重复（不访问数据库）
+        
+        与库内查询相同，先按 LSH 桶分组，只比较至少共享一个桶的文本对，避免两两比较。
+        
+        Args:
+            contents: 题干列表
+            threshold: 最低相似度（默认 FINGERPRINT_THRESHOLD）
+        
+        Returns:
+            [(前一题下标, 后一题下标, 相似度), ...]，按后一题、前一题下标排序
+        """
+        threshold = config.FINGERPRINT_THRESHOLD if threshold is None else threshold
+        signatures = [minhash_signature(normalize_text(content)) for content in contents]
+        
+        buckets: Dict[int, List[int]] = {}
+        for index, signature in enumerate(signatures):
+            if signature is not None:
+                for bucket in band_buckets(signature):
+                    buckets.setdefault(bucket, []).append(index)
+        
+        candidates = set()
+        for members in buckets.values():
+            for position, j in enumerate(members):
+                candidates.update((i, j) for i in members[:position])
+        
+        pairs = []
+        for i, j in sorted(candidates, key=lambda pair: (pair[1], pair[0])):
+            similarity = estimate_similarity(signatures[i], signatures[j])
+            if similarity >= threshold:
+                pairs.append((i, j, similarity))
+        return pairs
+
+
+# 单例实例（延迟初始化）
+_fingerprint_index: Optional[FingerprintIndex] = None
+
+
+def get_fingerprint_index(db_connection):
+    """获取指纹索引单例"""
+    global _fingerprint_index
+    if _fingerprint_index is None:
+        _fingerprint_index = FingerprintIndex(db_connection)
+    return _fingerprint_index
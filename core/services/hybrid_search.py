@@ -0,0 +1,189 @@
+"""
+混合检索服务
+
+关键词检索（FTS5 bm25，覆盖公式、术语等精确匹配）和向量相似度检索（覆盖同义改写）
+并发执行，用倒数排名融合（RRF）合并两路排名：
+
+    得分(d) = Σ_来源 1 / (k + 排名_来源(d))
+
+RRF 只依赖排名，不需要把 bm25 和余弦相似度归一化到同一尺度。
+每个来源最多取 HYBRID_SEARCH_CANDIDATES 个候选，整体等待不超过 HYBRID_SEARCH_TIMEOUT_MS，
+超时或失败的来源不参与融合（结果中标注各来源状态）。
+
+检索是异步的：查询向量用异步 Embedding 客户端计算，数据库查询和矩阵检索在线程池中执行，
+等待期间不阻塞事件循环。
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from shared.config import config
+
+logger = logging.getLogger(__name__)
+
+# 检索模式：仅关键词 / 仅向量 / 混合
+SEARCH_MODES = ("keyword", "vector", "hybrid")
+
+# 执行数据库查询和矩阵检索的线程池（超时的任务在后台执行完后结果被丢弃）
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[Tuple[str, float]]],
+                           k: int = 60) -> List[Tuple[str, float, Dict[str, Dict]]]:
+    """
+    倒数排名融合
+    
+    Args:
+        rankings: {来源名: 按相关度降序的 (题目 ID, 来源得分) 列表}
+        k: 融合常数，越大排名靠后的结果权重衰减越慢
+    
+    Returns:
+        按融合得分降序的 (题目 ID, 融合得分, {来源名: {rank, score}}) 列表
+    """
+    fused: Dict[str, float] = {}
+    details: Dict[str, Dict[str, Dict]] = {}
+    for source, hits in rankings.items():
+        for rank, (question_id, score) in enumerate(hits, start=1):
+            fused[question_id] = fused.get(question_id, 0.0) + 1.0 / (k + rank)
+            details.setdefault(question_id, {})[source] = {"rank": rank, "score": score}
+    
+    # 得分相同时最好的单路排名优先
+    order = sorted(fused, key=lambda question_id: (
+        -fused[question_id], min(d["rank"] for d in details[question_id].values())
+    ))
+    return [(question_id, fused[question_id], details[question_id]) for question_id in order]
+
+
+class HybridSearchService:
+    """题目混合检索服务"""
+    
+    def __init__(self, question_repo, embedding_provider: Callable[[], Tuple[Any, Any]]):
+        """
+        初始化混合检索服务
+        
+        Args:
+            question_repo: 题目仓库（提供 lexical_search / get_by_ids）
+            embedding_provider: 返回 (embedding_config, vector_index) 的函数，未配置时返回 (None, None)；
+                                在线程池中调用，查询向量用 embedding_config 创建的异步客户端计算
+        """
+        self.question_repo = question_repo
+        self.embedding_provider = embedding_provider
+    
+    async def search(self,
+                     query: str,
+                     mode: str = "hybrid",
+                     limit: int = 20,
+                     category_id: Optional[str] = None,
+                     include_descendants: bool = False,
+                     tag_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        检索题目
+        
+        Args:
+            query: 查询文本
+            mode: keyword（仅关键词）/ vector（仅向量）/ hybrid（两路融合）
+            limit: 返回条数（不超过每个来源的候选上限）
+            category_id: 按分类筛选
+            include_descendants: 分类筛选是否包含子分类
+            tag_id: 按标签筛选
+        
+        Returns:
+            {mode, results: [{question, score, lexical, vector}], sources: {来源名: {status, ...}}, elapsed_ms}
+            lexical / vector 为该来源的 {rank, score}（未命中为 None）
+        
+        Raises:
+            ValueError: 检索模式无效
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索模式：{mode}（可选：{', '.join(SEARCH_MODES)}）")
+        
+        started = time.monotonic()
+        candidates = max(1, config.HYBRID_SEARCH_CANDIDATES)
+        limit = max(1, min(limit, candidates))
+        filters = {"category_id": category_id, "include_descendants": include_descendants, "tag_id": tag_id}
+        
+        loop = asyncio.get_running_loop()
+        tasks = {}
+        if mode in ("keyword", "hybrid"):
+            tasks["lexical"] = asyncio.ensure_future(self._timed(
+                loop.run_in_executor(_executor, self._lexical, query, candidates, filters)
+            ))
+        if mode in ("vector", "hybrid"):
+            tasks["vector"] = asyncio.ensure_future(self._timed(self._vector(query, candidates, filters)))
+        done, pending = await asyncio.wait(tasks.values(), timeout=config.HYBRID_SEARCH_TIMEOUT_MS / 1000.0)
+        for task in pending:
+            task.cancel()
+        
+        rankings: Dict[str, List[Tuple[str, float]]] = {}
+        sources: Dict[str, Dict[str, Any]] = {}
+        for source, future in tasks.items():
+            if future not in done:
+                logger.warning(f"混合检索来源超时：source={source}, budget={config.HYBRID_SEARCH_TIMEOUT_MS}ms")
+                sources[source] = {"status": "timeout"}
+                continue
+            try:
+                hits, elapsed_ms = future.result()
+            except Exception as e:
+                logger.warning(f"混合检索来源失败：source={source}, error={e}")
+                sources[source] = {"status": "error", "error": str(e)}
+                continue
+            if hits is None:
+                sources[source] = {"status": "unavailable"}
+                continue
+            rankings[source] = hits
+            sources[source] = {"status": "ok", "count": len(hits), "elapsed_ms": elapsed_ms}
+        
+        fused = reciprocal_rank_fusion(rankings, config.HYBRID_RRF_K)[:limit]
+        rows = await loop.run_in_executor(
+            _executor, self.question_repo.get_by_ids, [question_id for question_id, _, _ in fused]
+        )
+        questions = {q.id: q for q in rows}
+        results = [
+            {
+                "question": questions[question_id],
+                "score": score,
+                "lexical": details.get("lexical"),
+                "vector": details.get("vector"),
+            }
+            for question_id, score, details in fused if question_id in questions
+        ]
+        
+        elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        statuses = {source: info['status'] for source, info in sources.items()}
+        logger.info(f"混合检索：mode={mode}, results={len(results)}, elapsed={elapsed_ms}ms, sources={statuses}")
+        return {"mode": mode, "results": results, "sources": sources, "elapsed_ms": elapsed_ms}
+    
+    @staticmethod
+    async def _timed(awaitable) -> Tuple[Any, float]:
+        """等待并返回 (结果, 耗时毫秒)"""
+        started = time.monotonic()
+        result = await awaitable
+        return result, round((time.monotonic() - started) * 1000, 1)
+    
+    def _lexical(self, query: str, candidates: int, filters: Dict) -> List[Tuple[str, float]]:
+        """关键词来源：bm25 排名（在线程池中执行）"""
+        return self.question_repo.lexical_search(query, limit=candidates, **filters)
+    
+    async def _vector(self, query: str, candidates: int, filters: Dict) -> Optional[List[Tuple[str, float]]]:
+        """向量来源：查询向量与题目向量的余弦相似度排名（未配置 Embedding 服务时返回 None）"""
+        from agent.services.async_embedding_service import get_async_embedding_service
+        
+        loop = asyncio.get_running_loop()
+        embedding_config, vector_index = await loop.run_in_executor(_executor, self.embedding_provider)
+        if not embedding_config or not vector_index:
+            return None
+        embedding_service = get_async_embedding_service(embedding_config)
+        embedding = await embedding_service.embed(query)
+        similar = await loop.run_in_executor(_executor, partial(
+            vector_index.search_similar,
+            embedding,
+            threshold=config.HYBRID_MIN_SIMILARITY,
+            top_k=candidates,
+            model_version=embedding_service.get_model_version(),
+            **filters
+        ))
+        return [(item['question_id'], item['similarity']) for item in similar]
@@ -1,10 +1,12 @@
 """
 题目管理服务
 
-提供题目的 CRUD 操作、标签管理和向量索引
+提供题目的 CRUD 操作、标签管理、向量索引和文本指纹索引
+向量化提供同步和异步两种钩子：异步接口中使用 *_async 方法，不阻塞事件循环；
+启用后台向量化队列（EMBEDDING_QUEUE_ENABLED）时只登记任务，由 EmbeddingWorker 批量处理
 """
 
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import logging
 
 from core.models import (
@@ -15,7 +17,8 @@ from core.models import (
 from core.database.repositories import (
     CategoryRepository, TagRepository, QuestionRepository
 )
-from core.database.connection import db
+from core.database.connection import db, transaction
+from shared.config import config
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,9 @@ logger = logging.getLogger(__name__)
 class QuestionService:
     """题目管理服务"""
     
+    # 批量向量化时每次请求 Embedding 服务的文本数
+    EMBED_BATCH_SIZE = 64
+    
     def __init__(self, question_repo: QuestionRepository, 
                  category_repo: CategoryRepository,
                  tag_repo: TagRepository):
@@ -32,27 +38,122 @@ class QuestionService:
         self._embedding_service = None
         self._vector_index = None
         self._model_version = None
+        self._embedding_config = None
+        self._active_version = None
+        self._fingerprint_index = None
+        self._embedding_queue = None
     
     def _init_embedding(self):
-        """延迟初始化 Embedding 服务"""
-        if self._embedding_service is None:
-            try:
-                from agent.config import AgentConfig
-                from agent.services.embedding_service import get_embedding_service
-                from core.services.vector_index import get_vector_index
-                
-                config = AgentConfig._load_config()
-                embedding_config = config.get('embedding', {})
-                
-                if embedding_config:
-                    self._embedding_service = get_embedding_service(embedding_config)
-                    self._model_version = self._embedding_service.get_model_version()
-                    self._vector_index = get_vector_index(db)
-                    logger.info(f"Embedding 服务已初始化：{self._model_version}")
-                else:
-                    logger.warning("未配置 Embedding 服务，跳过向量化")
-            except Exception as e:
-                logger.warning(f"初始化 Embedding 服务失败：{e}，跳过向量化")
+        """
+        延迟初始化 Embedding 服务
+        
+        使用生效向量版本的模型（见 resolve_embedding_config）；
+        之后生效版本被切换（activate）时重新初始化，查询和写入随之使用新模型。
+        """
+        if self._embedding_service is not None:
+            if self._embedding_config is None or self._vector_index.get_active_version() == self._active_version:
+                return
+            logger.info("生效向量版本已切换，重新初始化 Embedding 服务")
+        try:
+            from agent.config import AgentConfig
+            from agent.services.embedding_service import get_embedding_service
+            from core.services.embedding_versions import resolve_embedding_config
+            from core.services.vector_index import get_vector_index
+            
+            config = AgentConfig._load_config()
+            embedding_config = config.get('embedding', {})
+            
+            if embedding_config:
+                self._vector_index = get_vector_index(db)
+                self._active_version = self._vector_index.get_active_version()
+                self._embedding_config = resolve_embedding_config(embedding_config, self._active_version)
+                self._embedding_service = get_embedding_service(self._embedding_config)
+                self._model_version = self._embedding_service.get_model_version()
+                logger.info(f"Embedding 服务已初始化：{self._model_version}")
+            else:
+                logger.warning("未配置 Embedding 服务，跳过向量化")
+        except Exception as e:
+            logger.warning(f"初始化 Embedding 服务失败：{e}，跳过向量化")
+    
+    def get_embedding_config(self) -> Tuple[Optional[Dict], Optional[Any]]:
+        """
+        获取 Embedding 配置（生效版本的模型）和向量索引（延迟初始化）
+        
+        异步调用方用该配置创建异步客户端（get_async_embedding_service）计算查询向量。
+        
+        Returns:
+            (embedding_config, vector_index)，未配置 Embedding 服务时均为 None
+        """
+        self._init_embedding()
+        if not self._embedding_service:
+            return None, None
+        return self._embedding_config, self._vector_index
+    
+    def _get_fingerprint_index(self):
+        """文本指纹索引（本地计算，不依赖 Embedding 服务）"""
+        if self._fingerprint_index is None:
+            from core.services.fingerprint_index import get_fingerprint_index
+            self._fingerprint_index = get_fingerprint_index(db)
+        return self._fingerprint_index
+    
+    def _try_fingerprint_questions(self, items: List[Tuple[str, str]]):
+        """
+        写入题目文本指纹；失败不影响题目创建/更新
+        
+        Args:
+            items: (题目 ID, 题干) 列表
+        """
+        try:
+            self._get_fingerprint_index().update_many(items)
+        except Exception as e:
+            logger.error(f"题目指纹写入失败：{e}")
+    
+    def _get_embedding_queue(self):
+        """后台向量化任务队列"""
+        if self._embedding_queue is None:
+            from core.services.embedding_queue import get_embedding_job_queue
+            self._embedding_queue = get_embedding_job_queue(db)
+        return self._embedding_queue
+    
+    def _try_enqueue_embeddings(self, question_ids: List[str]):
+        """
+        登记后台向量化任务；失败不影响题目创建/更新（可通过 rebuild_embeddings 脚本补齐）
+        
+        Args:
+            question_ids: 题目 ID 列表
+        """
+        try:
+            self._get_embedding_queue().enqueue(question_ids)
+        except Exception as e:
+            logger.error(f"登记向量化任务失败：{e}")
+    
+    def schedule_embedding(self, question_id: str, content: str, options=None):
+        """
+        题目内容变更后安排向量化：启用队列时登记任务，否则同步生成
+        
+        Args:
+            question_id: 题目 ID
+            content: 题目内容
+            options: 选项列表
+        """
+        if config.EMBEDDING_QUEUE_ENABLED:
+            self._try_enqueue_embeddings([question_id])
+        else:
+            self._try_embed_question(question_id, content, options)
+    
+    async def schedule_embedding_async(self, question_id: str, content: str, options=None):
+        """
+        schedule_embedding 的异步版本：未启用队列时 await embed_question_async
+        
+        Args:
+            question_id: 题目 ID
+            content: 题目内容
+            options: 选项列表
+        """
+        if config.EMBEDDING_QUEUE_ENABLED:
+            self._try_enqueue_embeddings([question_id])
+        else:
+            await self.embed_question_async(question_id, content, options)
     
     def _try_embed_question(self, question_id: str, content: str, options: str = None):
         """
@@ -83,21 +184,56 @@ class QuestionService:
                 )
             else:
                 logger.debug(f"题目 {question_id} 无需重新向量化：{reason}")
-                
+        
+        except Exception as e:
+            logger.error(f"题目向量化失败 {question_id}: {e}")
+            # 向量化失败不影响题目创建/更新
+    
+    async def embed_question_async(self, question_id: str, content: str, options=None):
+        """
+        异步为题目生成向量（与 _try_embed_question 相同的智能检测，API 调用不阻塞事件循环）
+        
+        Args:
+            question_id: 题目 ID
+            content: 题目内容
+            options: 选项列表
+        """
+        try:
+            self._init_embedding()
+            
+            if not self._embedding_service or not self._vector_index:
+                return
+            
+            options_json = str(options) if options else None
+            needs_update, reason = self._vector_index.needs_reembedding(
+                question_id, content, options_json, self._model_version
+            )
+            
+            if needs_update:
+                logger.debug(f"题目 {question_id} 需要重新向量化：{reason}")
+                from agent.services.async_embedding_service import get_async_embedding_service
+                embedding = await get_async_embedding_service(self._embedding_config).embed(content)
+                self._vector_index.update_embedding(
+                    question_id, embedding, self._model_version, content, options_json
+                )
+            else:
+                logger.debug(f"题目 {question_id} 无需重新向量化：{reason}")
+        
         except Exception as e:
             logger.error(f"题目向量化失败 {question_id}: {e}")
             # 向量化失败不影响题目创建/更新
     
-    def create_question(self, question_data: QuestionCreate) -> Question:
+    def create_question(self, question_data: QuestionCreate, embed: bool = True) -> Question:
         """
         创建题目
         
         Args:
             question_data: 题目创建数据
-            
+            embed: 是否安排向量化（异步接口传 False，随后 await schedule_embedding_async）
+        
         Returns:
             创建的题目对象（包含标签）
-            
+        
         Raises:
             ValueError: 分类或标签不存在
         """
@@ -118,35 +254,113 @@ class QuestionService:
                     logger.warning(f"标签不存在：{tag_id}")
                     raise ValueError(f"标签不存在：{tag_id}")
         
-        # 创建题目
-        question = self.question_repo.create(question_data)
+        # 创建题目并关联标签（同一事务，只提交一次）
+        with transaction():
+            question = self.question_repo.create(question_data)
+            
+            if question_data.tag_ids:
+                self.question_repo.add_tags(question.id, question_data.tag_ids)
+                logger.debug(f"关联标签：question_id={question.id}, tag_ids={question_data.tag_ids}")
         logger.info(f"题目创建成功：id={question.id}")
         
-        # 关联标签
-        if question_data.tag_ids:
-            self.question_repo.add_tags(question.id, question_data.tag_ids)
-            logger.debug(f"关联标签：question_id={question.id}, tag_ids={question_data.tag_ids}")
-        
-        # 生成向量（智能检测）
-        self._try_embed_question(question.id, question_data.content, question_data.options)
+        # 生成文本指纹和向量（智能检测）
+        self._try_fingerprint_questions([(question.id, question_data.content)])
+        if embed:
+            self.schedule_embedding(question.id, question_data.content, question_data.options)
         
         # 获取完整的题目信息（包含标签）
         return self.get_question_with_tags(question.id)
     
+    def create_questions(self, questions: List[QuestionCreate]) -> List[str]:
+        """
+        批量创建题目
+        
+        分类和标签用集合查询一次性校验，题目和标签关联在单个事务内批量写入。
+        文本指纹随即批量写入；启用后台向量化队列时登记向量化任务，
+        否则不生成向量，调用方可随后（例如在后台任务中）调用 embed_questions。
+        
+        Args:
+            questions: 题目创建数据列表
+        
+        Returns:
+            题目 ID 列表（与输入顺序一致）
+        
+        Raises:
+            ValueError: 分类或标签不存在
+        """
+        logger.info(f"批量创建题目：count={len(questions)}")
+        
+        category_ids = {q.category_id for q in questions if q.category_id}
+        missing_categories = category_ids - self.category_repo.get_existing_ids(category_ids)
+        if missing_categories:
+            logger.warning(f"分类不存在：{missing_categories}")
+            raise ValueError(f"分类不存在：{', '.join(sorted(missing_categories))}")
+        
+        tag_ids = {tag_id for q in questions for tag_id in (q.tag_ids or [])}
+        missing_tags = tag_ids - self.tag_repo.get_existing_ids(tag_ids)
+        if missing_tags:
+            logger.warning(f"标签不存在：{missing_tags}")
+            raise ValueError(f"标签不存在：{', '.join(sorted(missing_tags))}")
+        
+        question_ids = self.question_repo.create_many(questions)
+        self._try_fingerprint_questions([(question_id, q.content) for question_id, q in zip(question_ids, questions)])
+        if config.EMBEDDING_QUEUE_ENABLED:
+            self._try_enqueue_embeddings(question_ids)
+        logger.info(f"批量创建题目成功：count={len(question_ids)}")
+        return question_ids
+    
+    def embed_questions(self, question_ids: List[str], questions: List[QuestionCreate]) -> int:
+        """
+        批量生成题目向量（按 EMBED_BATCH_SIZE 分批调用 Embedding 服务）
+        
+        Args:
+            question_ids: 题目 ID 列表
+            questions: 与 question_ids 一一对应的题目数据
+        
+        Returns:
+            成功向量化的题目数量
+        """
+        self._init_embedding()
+        if not self._embedding_service or not self._vector_index:
+            return 0
+        
+        embedded = 0
+        for start in range(0, len(question_ids), self.EMBED_BATCH_SIZE):
+            batch_ids = question_ids[start:start + self.EMBED_BATCH_SIZE]
+            batch = questions[start:start + self.EMBED_BATCH_SIZE]
+            try:
+                embeddings = self._embedding_service.embed_batch(
+                    [q.content for q in batch], batch_size=self.EMBED_BATCH_SIZE
+                )
+                self._vector_index.update_embeddings(
+                    [
+                        (question_id, embedding, q.content, str(q.options) if q.options else None)
+                        for question_id, embedding, q in zip(batch_ids, embeddings, batch)
+                    ],
+                    self._model_version
+                )
+                embedded += len(batch_ids)
+            except Exception as e:
+                # 向量化失败不影响题目创建，可通过 rebuild_embeddings 脚本补齐
+                logger.error(f"批量向量化失败（第 {start} 条起）：{e}")
+        
+        logger.info(f"批量向量化完成：{embedded}/{len(question_ids)}")
+        return embedded
+    
     def get_question(self, question_id: str) -> Optional[Question]:
         """
         获取单个题目（包含分类名称）
         
         Args:
             question_id: 题目 ID
-            
+        
         Returns:
             题目对象，不存在则返回 None
         """
         logger.debug(f"获取题目：id={question_id}")
         question = self.question_repo.get_by_id(question_id)
         if question and question.category_id:
-            category = self.category_repo.get_by_id(question.category_id)
+            category = self.category_repo.get_category_map().get(question.category_id)
             if category:
                 question.category_name = category.name
         return question
@@ -157,7 +371,7 @@ class QuestionService:
         
         Args:
             question_id: 题目 ID
-            
+        
         Returns:
             题目对象（包含标签 ID），不存在则返回 None
         """
@@ -182,7 +396,8 @@ class QuestionService:
                          tag_id: Optional[str] = None,
                          keyword: Optional[str] = None,
                          page: int = 1,
-                         limit: int = 20) -> Dict[str, Any]:
+                         limit: int = 20,
+                         include_descendants: bool = False) -> Dict[str, Any]:
         """
         获取所有题目（支持筛选和分页，包含分类名称）
         
@@ -192,7 +407,8 @@ class QuestionService:
             keyword: 搜索关键词（可选）
             page: 页码
             limit: 每页数量
-            
+            include_descendants: 按分类筛选时是否包含子孙分类
+        
         Returns:
             分页响应字典 {data, total, page, limit, pages}
         """
@@ -202,27 +418,76 @@ class QuestionService:
             tag_id=tag_id,
             keyword=keyword,
             page=page,
-            limit=limit
+            limit=limit,
+            include_descendants=include_descendants
+        )
+        
+        # 为每个题目添加分类名称（使用进程级分类缓存，不逐条查询）
+        if result.get('data'):
+            category_map = self.category_repo.get_category_map()
+            for question in result['data']:
+                category = category_map.get(question.category_id) if question.category_id else None
+                if category:
+                    question.category_name = category.name
+        
+        return result
+    
+    def get_questions_by_cursor(self,
+                                cursor: str = "",
+                                category_id: Optional[str] = None,
+                                tag_id: Optional[str] = None,
+                                keyword: Optional[str] = None,
+                                limit: int = 20,
+                                include_total: bool = False,
+                                include_descendants: bool = False) -> Dict[str, Any]:
+        """
+        游标分页获取题目（深分页代价与首页相同，包含分类名称）
+        
+        Args:
+            cursor: 上一页返回的 next_cursor，首页传空字符串
+            category_id: 分类 ID（可选）
+            tag_id: 标签 ID（可选）
+            keyword: 搜索关键词（可选）
+            limit: 每页数量
+            include_total: 是否返回总数（来自缓存，失效时才重新统计）
+            include_descendants: 按分类筛选时是否包含子孙分类
+        
+        Returns:
+            分页响应字典 {data, total, limit, next_cursor, has_more}
+        
+        Raises:
+            ValueError: 游标格式无效
+        """
+        logger.debug(f"游标分页获取题目：cursor={cursor}, category_id={category_id}, tag_id={tag_id}, limit={limit}")
+        result = self.question_repo.get_all(
+            category_id=category_id,
+            tag_id=tag_id,
+            keyword=keyword,
+            limit=limit,
+            cursor=cursor or "",
+            include_total=include_total,
+            include_descendants=include_descendants
         )
         
-        # 为每个题目添加分类名称
         if result.get('data'):
+            category_map = self.category_repo.get_category_map()
             for question in result['data']:
-                if question.category_id:
-                    category = self.category_repo.get_by_id(question.category_id)
-                    if category:
-                        question.category_name = category.name
+                category = category_map.get(question.category_id) if question.category_id else None
+                if category:
+                    question.category_name = category.name
         
         return result
     
-    def update_question(self, question_id: str, update_data: QuestionUpdate) -> Optional[Question]:
+    def update_question(self, question_id: str, update_data: QuestionUpdate,
+                        embed: bool = True) -> Optional[Question]:
         """
         更新题目
         
         Args:
             question_id: 题目 ID
             update_data: 更新数据
-            
+            embed: 内容变更时是否安排重新向量化（异步接口传 False，随后 await schedule_embedding_async）
+        
         Returns:
             更新后的题目对象，不存在则返回 None
         """
@@ -241,7 +506,10 @@ class QuestionService:
             if update_data.content or update_data.options:
                 content = update_data.content or (old_question.content if old_question else '')
                 options = update_data.options or (old_question.options if old_question else [])
-                self._try_embed_question(question_id, content, options)
+                if update_data.content:
+                    self._try_fingerprint_questions([(question_id, content)])
+                if embed:
+                    self.schedule_embedding(question_id, content, options)
         else:
             logger.warning(f"题目未找到：id={question_id}")
         
@@ -253,13 +521,23 @@ class QuestionService:
         
         Args:
             question_id: 题目 ID
-            
+        
         Returns:
             是否删除成功
         """
         logger.info(f"删除题目：id={question_id}")
         success = self.question_repo.delete(question_id)
         if success:
+            # 不依赖 Embedding 服务是否可用：服务未配置时题目也可能有历史向量
+            try:
+                from core.services.vector_index import get_vector_index
+                get_vector_index(db).delete_embedding(question_id)
+            except Exception as e:
+                logger.error(f"题目向量删除失败 {question_id}: {e}")
+            try:
+                self._get_fingerprint_index().delete(question_id)
+            except Exception as e:
+                logger.error(f"题目指纹删除失败 {question_id}: {e}")
             logger.info(f"题目删除成功：id={question_id}")
         else:
             logger.warning(f"题目删除失败：id={question_id}")
@@ -272,7 +550,7 @@ class QuestionService:
         Args:
             question_id: 题目 ID
             tag_id: 标签 ID
-            
+        
         Returns:
             是否添加成功
         """
@@ -298,7 +576,7 @@ class QuestionService:
         Args:
             question_id: 题目 ID
             tag_id: 标签 ID
-            
+        
         Returns:
             是否移除成功
         """
@@ -316,7 +594,7 @@ class QuestionService:
         
         Args:
             category_id: 分类 ID
-            
+        
         Returns:
             题目列表
         """
@@ -329,7 +607,7 @@ class QuestionService:
         
         Args:
             tag_id: 标签 ID
-            
+        
         Returns:
             题目列表
         """
@@ -342,9 +620,92 @@ class QuestionService:
         
         Args:
             keyword: 搜索关键词
-            
+        
         Returns:
             匹配的题目列表
         """
         logger.debug(f"搜索题目：keyword={keyword}")
         return self.question_repo.search(keyword)
+    
+    def find_similar_questions(self,
+                               question_id: str,
+                               threshold: float = 0.8,
+                               top_k: int = 10,
+                               category_id: Optional[str] = None,
+                               include_descendants: bool = False,
+                               tag_id: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        检索与指定题目相似的题目（可限定分类/标签范围）
+        
+        优先使用已保存的向量，题目尚未向量化时才调用 Embedding 服务
+        
+        Args:
+            question_id: 题目 ID
+            threshold: 相似度阈值
+            top_k: 返回最多结果数
+            category_id: 只在该分类下检索
+            include_descendants: 分类筛选是否包含子分类
+            tag_id: 只在带该标签的题目中检索
+        
+        Returns:
+            相似题目列表 [{question_id, similarity, content}, ...]；题目不存在返回 None，
+            未配置 Embedding 服务返回空列表
+        """
+        question = self.question_repo.get_by_id(question_id)
+        if not question:
+            return None
+        
+        self._init_embedding()
+        if not self._vector_index:
+            return []
+        
+        embedding, model_version = self._vector_index.get_embedding(question_id), None
+        if embedding is None:
+            embedding, model_version = self._embedding_service.embed(question.content), self._model_version
+        
+        return self._search_similar(question_id, embedding, threshold, top_k,
+                                    category_id, include_descendants, tag_id, model_version)
+    
+    async def find_similar_questions_async(self,
+                                           question_id: str,
+                                           threshold: float = 0.8,
+                                           top_k: int = 10,
+                                           category_id: Optional[str] = None,
+                                           include_descendants: bool = False,
+                                           tag_id: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        find_similar_questions 的异步版本：题目尚未向量化时用异步客户端调用 Embedding 服务
+        
+        Args / Returns 同 find_similar_questions
+        """
+        question = self.question_repo.get_by_id(question_id)
+        if not question:
+            return None
+        
+        self._init_embedding()
+        if not self._vector_index:
+            return []
+        
+        embedding, model_version = self._vector_index.get_embedding(question_id), None
+        if embedding is None:
+            from agent.services.async_embedding_service import get_async_embedding_service
+            embedding = await get_async_embedding_service(self._embedding_config).embed(question.content)
+            model_version = self._model_version
+        
+        return self._search_similar(question_id, embedding, threshold, top_k,
+                                    category_id, include_descendants, tag_id, model_version)
+    
+    def _search_similar(self, question_id: str, embedding, threshold: float, top_k: int,
+                        category_id: Optional[str], include_descendants: bool,
+                        tag_id: Optional[str], model_version: Optional[str] = None) -> List[Dict[str, Any]]:
+        """用题目向量检索相似题目（排除题目自身；新计算的向量校验模型版本）"""
+        return self._vector_index.search_similar(
+            embedding,
+            threshold=threshold,
+            top_k=top_k,
+            exclude_ids=[question_id],
+            category_id=category_id,
+            include_descendants=include_descendants,
+            tag_id=tag_id,
+            model_version=model_version
+        )
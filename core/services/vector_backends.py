@@ -0,0 +1,918 @@
+"""
+向量检索后端
+
+VectorIndex 的内存检索结构，均提供相同的接口：
+upsert(ids, vectors) / remove(id) / search(query, top_k, threshold, exclude_ids, candidate_ids) / len()
+
+candidate_ids 为预过滤的候选集合（例如某分类/标签下的题目）：只对这些行打分，
+近似后端在候选集合内也做精确计算（过滤后的集合通常远小于全量）。
+
+- exact: EmbeddingMatrix，暴力矩阵乘法，结果精确
+- ivf:   IVFFlatIndex，纯 NumPy 倒排索引（球面 k-means 聚类，只扫描最近的 nprobe 个簇）
+- hnsw:  HnswIndex，基于 hnswlib（可选依赖，未安装时不可用）
+
+近似后端可以保存到磁盘（附带向量表指纹），进程重启时指纹一致则直接加载，不必重新训练/建图。
+"""
+
+import json
+import logging
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from core.services.vector_quantization import QUANT_DTYPES, quantize_int8
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+# 支持的检索模式
+INDEX_MODES = ("exact", "ivf", "hnsw")
+
+
+# 批量检索时每块得分矩阵（查询数 × 行数）的元素上限（约 16MB float32）
+BATCH_BLOCK_ELEMENTS = 4 * 1024 * 1024
+
+
+def batch_top_k(score_block: Callable[[int, int], np.ndarray],
+                count: int,
+                num_queries: int,
+                chunk: int,
+                top_k: int,
+                threshold: float) -> List[List[Tuple[int, float]]]:
+    """
+    分块计算 Q×N 得分并为每个查询保留 top_k
+    
+    Args:
+        score_block: (start, end) → 该块的得分矩阵 (Q, end - start)，不参与的行为 -inf
+        count: 总行数 N
+        num_queries: 查询数 Q
+        chunk: 每块行数
+        top_k: 每个查询返回的最多结果数
+        threshold: 相似度阈值
+    
+    Returns:
+        每个查询按相似度降序的 (行号, 相似度) 列表
+    """
+    best_rows = np.zeros((num_queries, 0), dtype=np.int64)
+    best_scores = np.zeros((num_queries, 0), dtype=np.float32)
+    for start in range(0, count, chunk):
+        end = min(start + chunk, count)
+        scores = score_block(start, end)
+        rows = np.broadcast_to(np.arange(start, end), scores.shape)
+        if scores.shape[1] > top_k:
+            top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            scores = np.take_along_axis(scores, top, axis=1)
+            rows = np.take_along_axis(rows, top, axis=1)
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        if best_scores.shape[1] > top_k:
+            top = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+    
+    results = []
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    for q in range(num_queries):
+        hits = []
+        for i in order[q]:
+            score = float(best_scores[q, i])
+            if score < threshold or score == -np.inf:
+                break
+            hits.append((int(best_rows[q, i]), score))
+        results.append(hits)
+    return results
+
+
+def check_dimension(vectors: np.ndarray, dimension: int):
+    """向量维度与检索后端不一致时抛出 ValueError（不同模型的向量不可比较，不能静默返回空结果）"""
+    if vectors.shape[1] != dimension:
+        raise ValueError(f"向量维度不一致：{vectors.shape[1]} != {dimension}")
+
+
+def subset_rows(rows: Dict[str, int],
+                candidate_ids: Iterable[str],
+                exclude_ids: Optional[Iterable[str]] = None,
+                is_live: Optional[Callable[[int], bool]] = None) -> np.ndarray:
+    """
+    把候选题目 ID 映射为升序行号（去掉不在索引中、已排除和已删除的行）
+    
+    Args:
+        rows: 题目 ID → 行号
+        candidate_ids: 候选题目 ID
+        exclude_ids: 排除的题目 ID
+        is_live: 行是否有效（磁盘存储的删除位图）
+    
+    Returns:
+        int64 行号数组
+    """
+    excluded = set(exclude_ids or ())
+    selected = {
+        row for row in (rows.get(question_id) for question_id in candidate_ids if question_id not in excluded)
+        if row is not None and (is_live is None or is_live(row))
+    }
+    return np.array(sorted(selected), dtype=np.int64)
+
+
+def exact_subset_search(ids: List[str],
+                        vectors: np.ndarray,
+                        queries: np.ndarray,
+                        top_k: int,
+                        threshold: float) -> List[List[Tuple[str, float]]]:
+    """近似后端的候选集合检索：把候选向量放入临时矩阵后精确计算"""
+    if not ids:
+        return [[] for _ in range(len(np.atleast_2d(queries)))]
+    matrix = EmbeddingMatrix(vectors.shape[1])
+    matrix.upsert(ids, vectors)
+    return matrix.search_batch(queries, top_k, threshold)
+
+
+class VectorSnapshot:
+    """
+    检索后端的只读快照（全库批处理任务使用）
+    
+    由后端在 VectorIndex 的锁内创建：遍历期间的写入和删除（EmbeddingMatrix 删除时会移动行）
+    不影响已取得的快照。近似后端的快照只固定向量，近邻检索仍访问实时索引（由 search_batch 加锁）。
+    """
+    
+    # 复制近似后端向量时每次读取的行数
+    COPY_BLOCK_ROWS = 4096
+    
+    def __init__(self,
+                 name: str,
+                 count: int,
+                 read_rows: Callable[[int, int], Tuple[List[str], np.ndarray]],
+                 search_batch: Optional[Callable] = None):
+        """
+        Args:
+            name: 后端名称
+            count: 快照行数
+            read_rows: 读取 [start, end) 行的 (题目 ID 列表, float32 向量)
+            search_batch: 近似后端的批量近邻检索（精确后端为 None）
+        """
+        self.name = name
+        self._count = count
+        self._read_rows = read_rows
+        self._search_batch = search_batch
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def exact(self) -> bool:
+        return self._search_batch is None
+    
+    def iter_blocks(self, block_rows: int, start: int = 0) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """从第 start 行起按块遍历快照中的向量"""
+        for offset in range(start, self._count, block_rows):
+            yield self._read_rows(offset, min(offset + block_rows, self._count))
+    
+    def search_batch(self, *args, **kwargs) -> List[List[Tuple[str, float]]]:
+        """批量近邻检索（仅近似后端）"""
+        if self._search_batch is None:
+            raise TypeError("精确后端快照不支持近邻检索，请使用 iter_blocks 分块自连接")
+        return self._search_batch(*args, **kwargs)
+    
+    @classmethod
+    def copy_of(cls, backend, search_batch: Callable) -> "VectorSnapshot":
+        """复制近似后端的全部向量（近似后端内部结构会随写入变化）"""
+        ids: List[str] = []
+        parts: List[np.ndarray] = []
+        for block_ids, vectors in backend.iter_blocks(cls.COPY_BLOCK_ROWS):
+            ids.extend(block_ids)
+            parts.append(vectors)
+        data = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+        return cls(backend.name, len(ids), lambda start, end: (ids[start:end], data[start:end]), search_batch)
+
+
+class EmbeddingMatrix:
+    """
+    内存向量矩阵
+    
+    按行保存 L2 归一化后的向量（容量倍增的连续数组），
+    余弦相似度即矩阵与查询向量的点积。删除时用最后一行填补空位。
+    
+    dtype 为 float16 / int8 时按量化精度保存（int8 另存逐行缩放系数），
+    检索时分块转换为 float32 计算，内存分别约为 float32 的 1/2 和 1/4。
+    """
+    
+    name = "exact"
+    
+    INITIAL_CAPACITY = 1024
+    
+    # 量化矩阵检索时每块转换为 float32 的元素数（约 1MB，留在 CPU 缓存内）
+    SEARCH_CHUNK_ELEMENTS = 262144
+    
+    def __init__(self, dimension: int, dtype: str = "float32"):
+        if dtype not in QUANT_DTYPES:
+            raise ValueError(f"不支持的向量精度：{dtype}（可选：{', '.join(QUANT_DTYPES)}）")
+        self.dimension = dimension
+        self.dtype = dtype
+        self.ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._data = np.zeros((0, dimension), dtype=dtype)
+        self._scales = np.zeros(0, dtype=np.float32) if dtype == "int8" else None
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self._rows
+    
+    @property
+    def nbytes(self) -> int:
+        """已分配的矩阵内存（字节）"""
+        return self._data.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+    
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按行 L2 归一化
+        
+        Returns:
+            (归一化后的 float32 矩阵, 非零向量掩码)
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1)
+        valid = norms > 0
+        normalized = np.zeros_like(vectors)
+        normalized[valid] = vectors[valid] / norms[valid, None]
+        return normalized, valid
+    
+    def _reserve(self, size: int):
+        """保证容量不小于 size（倍增，摊还 O(1) 追加）"""
+        capacity = self._data.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, self.INITIAL_CAPACITY)
+        data = np.zeros((new_capacity, self.dimension), dtype=self.dtype)
+        data[:len(self.ids)] = self._data[:len(self.ids)]
+        self._data = data
+        if self._scales is not None:
+            scales = np.zeros(new_capacity, dtype=np.float32)
+            scales[:len(self.ids)] = self._scales[:len(self.ids)]
+            self._scales = scales
+    
+    def _encode(self, normalized: np.ndarray):
+        """按矩阵精度编码（返回编码后的行和 int8 缩放系数）"""
+        if self.dtype == "int8":
+            return quantize_int8(normalized)
+        return normalized.astype(self.dtype, copy=False), None
+    
+    def vectors(self, rows) -> np.ndarray:
+        """取出指定行的 float32 向量（量化矩阵为反量化结果）"""
+        data = np.asarray(self._data[rows], dtype=np.float32)
+        if self._scales is not None:
+            data = data * self._scales[rows][..., None]
+        return data
+    
+    def iter_blocks(self, block_rows: int, start: int = 0) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        从第 start 行起按块遍历向量（批处理任务使用）
+        
+        Yields:
+            (题目 ID 列表, float32 归一化向量 (n, d))，每块对应 [s, s + block_rows) 行
+        """
+        for offset in range(start, len(self.ids), block_rows):
+            end = min(offset + block_rows, len(self.ids))
+            yield self.ids[offset:end], self.vectors(slice(offset, end))
+    
+    def snapshot(self) -> VectorSnapshot:
+        """复制当前的题目 ID 和向量（按存储精度复制，内存与矩阵相同）"""
+        count = len(self.ids)
+        ids = list(self.ids)
+        data = self._data[:count].copy()
+        scales = self._scales[:count].copy() if self._scales is not None else None
+        
+        def read_rows(start: int, end: int) -> Tuple[List[str], np.ndarray]:
+            vectors = np.asarray(data[start:end], dtype=np.float32)
+            if scales is not None:
+                vectors = vectors * scales[start:end, None]
+            return ids[start:end], vectors
+        
+        return VectorSnapshot(self.name, count, read_rows)
+    
+    def upsert(self, question_ids: List[str], vectors: np.ndarray):
+        """写入或覆盖向量（零向量视为无向量并移除）"""
+        normalized, valid = self.normalize(vectors)
+        check_dimension(normalized, self.dimension)
+        
+        encoded, scales = self._encode(normalized)
+        self._reserve(len(self.ids) + int(valid.sum()))
+        for i, (question_id, ok) in enumerate(zip(question_ids, valid)):
+            if not ok:
+                self.remove(question_id)
+                continue
+            row = self._rows.get(question_id)
+            if row is None:
+                row = len(self.ids)
+                self.ids.append(question_id)
+                self._rows[question_id] = row
+            self._data[row] = encoded[i]
+            if scales is not None:
+                self._scales[row] = scales[i]
+    
+    def remove(self, question_id: str) -> bool:
+        """移除向量，返回是否存在"""
+        row = self._rows.pop(question_id, None)
+        if row is None:
+            return False
+        last = len(self.ids) - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self._data[row] = self._data[last]
+            if self._scales is not None:
+                self._scales[row] = self._scales[last]
+            self.ids[row] = moved_id
+            self._rows[moved_id] = row
+        self.ids.pop()
+        return True
+    
+    def search(self,
+               query: np.ndarray,
+               top_k: int,
+               threshold: float,
+               exclude_ids: Optional[Iterable[str]] = None,
+               candidate_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        检索与查询向量最相似的行
+        
+        Args:
+            query: 查询向量（无需归一化）
+            top_k: 返回最多结果数
+            threshold: 相似度阈值
+            exclude_ids: 排除的题目 ID
+            candidate_ids: 候选题目 ID（None 表示全部行）
+        
+        Returns:
+            按相似度降序的 (题目 ID, 相似度) 列表
+        """
+        if candidate_ids is not None:
+            return self.search_batch(query, top_k, threshold, exclude_ids, candidate_ids)[0]
+        count = len(self.ids)
+        if count == 0 or top_k <= 0:
+            return []
+        
+        normalized, valid = self.normalize(query)
+        check_dimension(normalized, self.dimension)
+        if not valid[0]:
+            return []
+        
+        scores = self._scores(normalized[0], count)
+        for question_id in exclude_ids or ():
+            row = self._rows.get(question_id)
+            if row is not None:
+                scores[row] = -np.inf
+        
+        candidates = np.flatnonzero(scores >= threshold)
+        if len(candidates) > top_k:
+            top = np.argpartition(scores[candidates], -top_k)[-top_k:]
+            candidates = candidates[top]
+        order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.ids[row], float(scores[row])) for row in order]
+    
+    
+    def _scores(self, query: np.ndarray, count: int) -> np.ndarray:
+        """前 count 行与（已归一化）查询向量的相似度"""
+        if self.dtype == "float32":
+            return self._data[:count] @ query
+        scores = np.empty(count, dtype=np.float32)
+        chunk = max(64, self.SEARCH_CHUNK_ELEMENTS // max(self.dimension, 1))
+        for start in range(0, count, chunk):
+            end = min(start + chunk, count)
+            scores[start:end] = self._data[start:end].astype(np.float32) @ query
+        if self._scales is not None:
+            scores *= self._scales[:count]
+        return scores
+    
+    
+    def search_batch(self,
+                     queries: np.ndarray,
+                     top_k: int,
+                     threshold: float,
+                     exclude_ids: Optional[Iterable[str]] = None,
+                     candidate_ids: Optional[Iterable[str]] = None) -> List[List[Tuple[str, float]]]:
+        """
+        批量检索：分块计算 Q×N 得分矩阵，每块一次矩阵乘法
+        
+        Args:
+            queries: 查询矩阵 (Q, d)（无需归一化）
+            top_k: 每个查询返回的最多结果数
+            threshold: 相似度阈值
+            exclude_ids: 对所有查询排除的题目 ID
+            candidate_ids: 候选题目 ID（None 表示全部行）
+        
+        Returns:
+            与查询一一对应的 (题目 ID, 相似度) 列表
+        """
+        normalized, valid = self.normalize(queries)
+        count = len(self.ids)
+        if count == 0 or top_k <= 0:
+            return [[] for _ in range(len(normalized))]
+        check_dimension(normalized, self.dimension)
+        
+        if candidate_ids is not None:
+            subset = subset_rows(self._rows, candidate_ids, exclude_ids)
+            
+            def score_subset(start: int, end: int) -> np.ndarray:
+                rows = subset[start:end]
+                scores = normalized @ self._data[rows].astype(np.float32, copy=False).T
+                if self._scales is not None:
+                    scores *= self._scales[rows]
+                scores[~valid] = -np.inf
+                return scores
+            
+            chunk = max(64, BATCH_BLOCK_ELEMENTS // max(len(normalized), self.dimension, 1))
+            hits = batch_top_k(score_subset, len(subset), len(normalized), chunk, top_k, threshold)
+            return [[(self.ids[subset[row]], score) for row, score in query_hits] for query_hits in hits]
+        
+        excluded = np.array([self._rows[qid] for qid in exclude_ids or () if qid in self._rows], dtype=np.int64)
+        
+        def score_block(start: int, end: int) -> np.ndarray:
+            block = self._data[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores = normalized @ block.T
+            if self._scales is not None:
+                scores *= self._scales[start:end]
+            scores[~valid] = -np.inf
+            inside = excluded[(excluded >= start) & (excluded < end)]
+            scores[:, inside - start] = -np.inf
+            return scores
+        
+        chunk = max(64, BATCH_BLOCK_ELEMENTS // max(len(normalized), self.dimension, 1))
+        hits = batch_top_k(score_block, count, len(normalized), chunk, top_k, threshold)
+        return [[(self.ids[row], score) for row, score in query_hits] for query_hits in hits]
+
+
+class IVFFlatIndex:
+    """
+    倒排文件索引（IVF-Flat）
+    
+    训练时用球面 k-means 把向量划分为 nlist 个簇，每个簇是一个 EmbeddingMatrix；
+    查询只在与查询向量最相近的 nprobe 个簇内做精确计算。
+    新向量分配到最近的簇，无需重新训练。
+    """
+    
+    name = "ivf"
+    
+    # k-means 训练的最大采样数和每个簇的最少样本数
+    TRAIN_SAMPLE_SIZE = 50_000
+    MIN_POINTS_PER_LIST = 39
+    
+    def __init__(self, centroids: np.ndarray, nprobe: int = 16):
+        centroids, _ = EmbeddingMatrix.normalize(centroids)
+        self.centroids = centroids
+        self.dimension = centroids.shape[1]
+        self.nprobe = nprobe
+        self.lists = [EmbeddingMatrix(self.dimension) for _ in range(len(centroids))]
+        self._assign: Dict[str, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self._assign)
+    
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self._assign
+    
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+    
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + sum(lst.nbytes for lst in self.lists)
+    
+    @classmethod
+    def default_nlist(cls, size: int) -> int:
+        """簇数量：约 4·√n，且保证每个簇有足够的训练样本"""
+        sample = min(size, cls.TRAIN_SAMPLE_SIZE)
+        return int(max(1, min(4 * np.sqrt(max(size, 1)), sample // cls.MIN_POINTS_PER_LIST)))
+    
+    @classmethod
+    def train(cls,
+              vectors: np.ndarray,
+              nlist: Optional[int] = None,
+              nprobe: int = 16,
+              iterations: int = 10,
+              seed: int = 0) -> "IVFFlatIndex":
+        """
+        用球面 k-means 训练簇中心（不写入向量）
+        
+        Args:
+            vectors: 训练向量 (n, d)
+            nlist: 簇数量，默认按数据量自动选择
+            nprobe: 查询时扫描的簇数量
+            iterations: k-means 迭代次数
+            seed: 随机种子
+        """
+        normalized, valid = EmbeddingMatrix.normalize(vectors)
+        normalized = normalized[valid]
+        if len(normalized) == 0:
+            raise ValueError("没有可用于训练的向量")
+        
+        rng = np.random.default_rng(seed)
+        if len(normalized) > cls.TRAIN_SAMPLE_SIZE:
+            normalized = normalized[rng.choice(len(normalized), cls.TRAIN_SAMPLE_SIZE, replace=False)]
+        nlist = min(nlist or cls.default_nlist(len(normalized)), len(normalized))
+        
+        centroids = normalized[rng.choice(len(normalized), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = cls._nearest(centroids, normalized)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, normalized)
+            counts = np.bincount(labels, minlength=nlist)
+            # 空簇重新取随机样本作为中心
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = normalized[rng.choice(len(normalized), int(empty.sum()))]
+            centroids, _ = EmbeddingMatrix.normalize(sums)
+        
+        return cls(centroids, nprobe=nprobe)
+    
+    @staticmethod
+    def _nearest(centroids: np.ndarray, vectors: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        """返回每个（已归一化）向量最近的簇编号（分块计算，控制内存）"""
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk):
+            labels[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+        return labels
+    
+    def upsert(self, question_ids: List[str], vectors: np.ndarray):
+        """写入或覆盖向量（分配到最近的簇）"""
+        normalized, valid = EmbeddingMatrix.normalize(vectors)
+        check_dimension(normalized, self.dimension)
+        
+        labels = self._nearest(self.centroids, normalized)
+        groups: Dict[int, List[int]] = {}
+        for i, (question_id, ok) in enumerate(zip(question_ids, valid)):
+            old = self._assign.get(question_id)
+            if not ok or (old is not None and old != labels[i]):
+                self.remove(question_id)
+            if ok:
+                groups.setdefault(int(labels[i]), []).append(i)
+        
+        for label, indexes in groups.items():
+            self.lists[label].upsert([question_ids[i] for i in indexes], normalized[indexes])
+            for i in indexes:
+                self._assign[question_ids[i]] = label
+    
+    def remove(self, question_id: str) -> bool:
+        label = self._assign.pop(question_id, None)
+        if label is None:
+            return False
+        return self.lists[label].remove(question_id)
+    
+    def search(self,
+               query: np.ndarray,
+               top_k: int,
+               threshold: float,
+               exclude_ids: Optional[Iterable[str]] = None,
+               candidate_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """只在最近的 nprobe 个簇内检索（近似结果）；指定候选集合时在候选内精确检索"""
+        if candidate_ids is not None:
+            return self.search_batch(query, top_k, threshold, exclude_ids, candidate_ids)[0]
+        if not self._assign or top_k <= 0:
+            return []
+        normalized, valid = EmbeddingMatrix.normalize(query)
+        check_dimension(normalized, self.dimension)
+        if not valid[0]:
+            return []
+        
+        nprobe = min(self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ normalized[0]
+        probes = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        
+        exclude_ids = list(exclude_ids or ())
+        hits = []
+        for label in probes:
+            hits.extend(self.lists[label].search(normalized[0], top_k, threshold, exclude_ids))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+    
+    def search_batch(self,
+                     queries: np.ndarray,
+                     top_k: int,
+                     threshold: float,
+                     exclude_ids: Optional[Iterable[str]] = None,
+                     candidate_ids: Optional[Iterable[str]] = None) -> List[List[Tuple[str, float]]]:
+        """批量检索：按探测的簇分组查询，每个簇一次矩阵乘法；指定候选集合时在候选内精确检索"""
+        if candidate_ids is not None:
+            excluded = set(exclude_ids or ())
+            groups: Dict[int, List[str]] = {}
+            for question_id in candidate_ids:
+                label = self._assign.get(question_id)
+                if label is not None and question_id not in excluded:
+                    groups.setdefault(label, []).append(question_id)
+            ids = [question_id for label in groups for question_id in groups[label]]
+            vectors = [self.lists[label].vectors([self.lists[label]._rows[question_id] for question_id in group])
+                       for label, group in groups.items()]
+            vectors = np.concatenate(vectors) if vectors else np.zeros((0, self.dimension), dtype=np.float32)
+            return exact_subset_search(ids, vectors, queries, top_k, threshold)
+        
+        normalized, valid = EmbeddingMatrix.normalize(queries)
+        results: List[List[Tuple[str, float]]] = [[] for _ in range(len(normalized))]
+        if not self._assign or top_k <= 0:
+            return results
+        check_dimension(normalized, self.dimension)
+        
+        # 按簇分组查询：每个簇对探测它的所有查询做一次批量检索
+        nprobe = min(self.nprobe, self.nlist)
+        probes = np.argpartition(-(normalized @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        labels = probes.ravel()
+        query_rows = np.repeat(np.arange(len(normalized)), nprobe)
+        order = np.argsort(labels, kind='stable')
+        labels, query_rows = labels[order], query_rows[order]
+        bounds = np.flatnonzero(np.diff(labels)) + 1
+        exclude_ids = list(exclude_ids or ())
+        for label, members in zip(labels[np.r_[0, bounds]], np.split(query_rows, bounds)):
+            members = members[valid[members]]
+            if len(members) == 0 or len(self.lists[label]) == 0:
+                continue
+            hits_lists = self.lists[label].search_batch(normalized[members], top_k, threshold, exclude_ids)
+            for row, hits in zip(members, hits_lists):
+                results[row].extend(hits)
+        
+        for hits in results:
+            hits.sort(key=lambda hit: hit[1], reverse=True)
+            del hits[top_k:]
+        return results
+    
+    def iter_blocks(self, block_rows: int) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """按簇顺序逐块遍历向量（批处理任务使用，小簇合并为满块）"""
+        ids: List[str] = []
+        parts: List[np.ndarray] = []
+        for lst in self.lists:
+            for block_ids, vectors in lst.iter_blocks(block_rows):
+                ids.extend(block_ids)
+                parts.append(vectors)
+                if len(ids) >= block_rows:
+                    yield ids, np.concatenate(parts)
+                    ids, parts = [], []
+        if ids:
+            yield ids, np.concatenate(parts)
+    
+    def save(self, path: str, fingerprint: Tuple):
+        """保存簇中心和各簇向量"""
+        ids = [question_id for lst in self.lists for question_id in lst.ids]
+        labels = np.array([self._assign[question_id] for question_id in ids], dtype=np.int32)
+        vectors = np.concatenate([lst._data[:len(lst)] for lst in self.lists]) if ids else \
+            np.zeros((0, self.dimension), dtype=np.float32)
+        _atomic_savez(
+            path,
+            centroids=self.centroids,
+            ids=np.array(ids, dtype=str),
+            labels=labels,
+            vectors=vectors,
+            meta=np.array(json.dumps({"nprobe": self.nprobe, "fingerprint": list(fingerprint)})),
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> Tuple["IVFFlatIndex", Tuple]:
+        """从文件加载，返回 (索引, 保存时的指纹)"""
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            index = cls(data["centroids"], nprobe=meta["nprobe"])
+            ids = data["ids"].tolist()
+            labels = data["labels"]
+            vectors = data["vectors"]
+        for label in np.unique(labels):
+            rows = np.flatnonzero(labels == label)
+            index.lists[label].upsert([ids[i] for i in rows], vectors[rows])
+            for i in rows:
+                index._assign[ids[i]] = int(label)
+        return index, tuple(meta["fingerprint"])
+
+
+class HnswIndex:
+    """
+    HNSW 图索引（基于 hnswlib，需要 pip install hnswlib）
+    
+    hnswlib 使用整数标签，这里维护题目 ID ↔ 标签映射；删除只做标记，覆盖写入复用原标签。
+    """
+    
+    name = "hnsw"
+    
+    def __init__(self, dimension: int, capacity: int = 1024, m: int = 16,
+                 ef_construction: int = 200, ef_search: int = 64):
+        if hnswlib is None:
+            raise RuntimeError("未安装 hnswlib，无法使用 hnsw 检索模式（pip install hnswlib）")
+        self.dimension = dimension
+        self.m = m
+        self.ef_search = ef_search
+        self._index = hnswlib.Index(space="ip", dim=dimension)
+        self._index.init_index(max_elements=max(capacity, 1), M=m, ef_construction=ef_construction)
+        self._index.set_ef(ef_search)
+        self._labels: Dict[str, int] = {}
+        self._ids: Dict[int, str] = {}
+        self._next_label = 0
+    
+    def __len__(self) -> int:
+        return len(self._labels)
+    
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self._labels
+    
+    @property
+    def nbytes(self) -> int:
+        # 向量 + 每个节点约 2M 个邻居（估算）
+        return self._index.get_max_elements() * (self.dimension * 4 + 2 * self.m * 4)
+    
+    def upsert(self, question_ids: List[str], vectors: np.ndarray):
+        normalized, valid = EmbeddingMatrix.normalize(vectors)
+        check_dimension(normalized, self.dimension)
+        
+        labels = []
+        rows = []
+        for i, (question_id, ok) in enumerate(zip(question_ids, valid)):
+            if not ok:
+                self.remove(question_id)
+                continue
+            label = self._labels.get(question_id)
+            if label is None:
+                label = self._next_label
+                self._next_label += 1
+                self._labels[question_id] = label
+                self._ids[label] = question_id
+            labels.append(label)
+            rows.append(i)
+        if not labels:
+            return
+        
+        needed = self._index.get_current_count() + len(labels)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+        self._index.add_items(normalized[rows], np.array(labels))
+    
+    def remove(self, question_id: str) -> bool:
+        label = self._labels.pop(question_id, None)
+        if label is None:
+            return False
+        del self._ids[label]
+        self._index.mark_deleted(label)
+        return True
+    
+    def search(self,
+               query: np.ndarray,
+               top_k: int,
+               threshold: float,
+               exclude_ids: Optional[Iterable[str]] = None,
+               candidate_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        if candidate_ids is not None:
+            return self.search_batch(query, top_k, threshold, exclude_ids, candidate_ids)[0]
+        if not self._labels or top_k <= 0:
+            return []
+        normalized, valid = EmbeddingMatrix.normalize(query)
+        check_dimension(normalized, self.dimension)
+        if not valid[0]:
+            return []
+        
+        exclude = set(exclude_ids or ())
+        k = min(top_k + len(exclude), len(self._labels))
+        self._index.set_ef(max(self.ef_search, k))
+        labels, distances = self._index.knn_query(normalized, k=k)
+        hits = []
+        for label, distance in zip(labels[0], distances[0]):
+            question_id = self._ids.get(int(label))
+            score = 1.0 - float(distance)
+            if question_id is None or question_id in exclude or score < threshold:
+                continue
+            hits.append((question_id, score))
+        return hits[:top_k]
+    
+    def search_batch(self,
+                     queries: np.ndarray,
+                     top_k: int,
+                     threshold: float,
+                     exclude_ids: Optional[Iterable[str]] = None,
+                     candidate_ids: Optional[Iterable[str]] = None) -> List[List[Tuple[str, float]]]:
+        """批量检索（近似索引按查询逐个检索；指定候选集合时取出候选向量精确检索）"""
+        if candidate_ids is not None:
+            excluded = set(exclude_ids or ())
+            ids = [question_id for question_id in candidate_ids
+                   if question_id in self._labels and question_id not in excluded]
+            vectors = (np.asarray(self._index.get_items([self._labels[question_id] for question_id in ids]),
+                                  dtype=np.float32)
+                       if ids else np.zeros((0, self.dimension), dtype=np.float32))
+            return exact_subset_search(ids, vectors, queries, top_k, threshold)
+        exclude_ids = list(exclude_ids or ())
+        return [self.search(query, top_k, threshold, exclude_ids) for query in np.atleast_2d(queries)]
+    
+    def iter_blocks(self, block_rows: int) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """逐块取出向量（批处理任务使用）"""
+        labels = list(self._ids)
+        for offset in range(0, len(labels), block_rows):
+            chunk = labels[offset:offset + block_rows]
+            yield [self._ids[label] for label in chunk], np.asarray(self._index.get_items(chunk), dtype=np.float32)
+    
+    def save(self, path: str, fingerprint: Tuple):
+        """保存图索引（.bin）和标签映射（.npz）"""
+        graph_path = path + ".bin"
+        self._index.save_index(graph_path + ".tmp")
+        os.replace(graph_path + ".tmp", graph_path)
+        labels = sorted(self._ids)
+        _atomic_savez(
+            path,
+            labels=np.array(labels, dtype=np.int64),
+            ids=np.array([self._ids[label] for label in labels], dtype=str),
+            meta=np.array(json.dumps({
+                "dimension": self.dimension,
+                "m": self.m,
+                "ef_search": self.ef_search,
+                "next_label": self._next_label,
+                "fingerprint": list(fingerprint),
+            })),
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> Tuple["HnswIndex", Tuple]:
+        if hnswlib is None:
+            raise RuntimeError("未安装 hnswlib，无法使用 hnsw 检索模式（pip install hnswlib）")
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            labels = data["labels"].tolist()
+            ids = data["ids"].tolist()
+        index = cls.__new__(cls)
+        index.dimension = meta["dimension"]
+        index.m = meta["m"]
+        index.ef_search = meta["ef_search"]
+        index._index = hnswlib.Index(space="ip", dim=index.dimension)
+        index._index.load_index(path + ".bin")
+        index._index.set_ef(index.ef_search)
+        index._labels = dict(zip(ids, labels))
+        index._ids = dict(zip(labels, ids))
+        index._next_label = meta["next_label"]
+        return index, tuple(meta["fingerprint"])
+
+
+def _atomic_savez(path: str, **arrays):
+    """写入临时文件后替换，避免读到写了一半的文件"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def index_path(directory: str, mode: str) -> str:
+    """近似索引的持久化文件路径"""
+    return os.path.join(directory, f"{mode}.npz")
+
+
+def build_backend(mode: str, question_ids: List[str], vectors: np.ndarray, options: Optional[Dict] = None):
+    """
+    根据检索模式创建后端并写入向量
+    
+    Args:
+        mode: exact / ivf / hnsw
+        question_ids: 题目 ID 列表
+        vectors: 向量矩阵 (n, d)
+        options: 后端参数（nlist、nprobe、ef_search；精确模式的 dtype）
+    """
+    options = options or {}
+    dimension = vectors.shape[1]
+    if mode == "ivf":
+        backend = IVFFlatIndex.train(vectors, nlist=options.get("nlist") or None,
+                                     nprobe=options.get("nprobe", 16))
+    elif mode == "hnsw":
+        backend = HnswIndex(dimension, capacity=len(question_ids),
+                            ef_search=options.get("ef_search", 64))
+    elif mode == "exact":
+        backend = EmbeddingMatrix(dimension, dtype=options.get("dtype", "float32"))
+    else:
+        raise ValueError(f"未知的向量检索模式：{mode}（可选：{', '.join(INDEX_MODES)}）")
+    
+    if len(question_ids):
+        backend.upsert(question_ids, vectors)
+    return backend
+
+
+def load_backend(mode: str, path: str):
+    """从文件加载近似索引，返回 (后端, 指纹)"""
+    if mode == "ivf":
+        return IVFFlatIndex.load(path)
+    if mode == "hnsw":
+        return HnswIndex.load(path)
+    raise ValueError(f"检索模式 {mode} 不支持持久化")
+
+
+def recall_at_k(approx: List[List[str]], exact: List[List[str]]) -> float:
+    """
+    计算近似检索的 recall@k
+    
+    Args:
+        approx: 每个查询的近似结果 ID 列表
+        exact: 每个查询的精确结果 ID 列表
+    
+    Returns:
+        精确结果中被近似结果命中的比例
+    """
+    total = sum(len(ids) for ids in exact)
+    if total == 0:
+        return 1.0
+    found = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return found / total
@@ -2,46 +2,152 @@
 向量索引服务
 用于题目相似度检索（重复检测、智能问答）
 支持智能检测：只有题目变更或模型变更时才重新向量化
+
+检索使用进程内常驻的检索后端（见 vector_backends）：首次检索时从数据库加载一次，
+之后随 update_embedding / delete_embedding 增量更新。
+默认精确模式每次查询只做一次矩阵向量乘法；配置 VECTOR_INDEX_MODE 可切换到 IVF / HNSW 近似检索。
+精确模式可配置 VECTOR_STORE 使用内存映射的磁盘存储（见 vector_store），多个 worker 共享同一份向量。
+向量的数据库存储精度和内存检索精度可分别量化为 float16 / int8（见 vector_quantization），
+量化检索可再用数据库中的向量对前若干候选重排。
+检索可按分类（可含子分类）/ 标签预过滤：先查出候选题目，只对候选行打分。
+question_embeddings 只存放当前生效模型版本的向量；其他模型版本的向量写入影子表，
+由 embedding_versions 后台构建后整体切换（见 embedding_versions 模块）。
 """
 import numpy as np
 import hashlib
-from typing import List, Dict, Optional, Tuple
+import os
+import threading
+import time
+from collections import Counter
+from typing import List, Dict, Iterable, Optional, Tuple
 from datetime import datetime
 import logging
 
+from core.database.connection import fetch_all_in
+from core.database.migrations import (
+    CATEGORY_CLOSURE_TABLE, EMBEDDINGS_TABLE, EMBEDDINGS_TABLE_SQL, EMBEDDINGS_INDEXES,
+    EMBEDDING_VERSIONS_SQL, EMBEDDING_VERSIONS_TABLE, SHADOW_EMBEDDINGS_TABLE
+)
+from core.services.vector_backends import (
+    EmbeddingMatrix, INDEX_MODES, VectorSnapshot, build_backend, load_backend, index_path, hnswlib
+)
+from core.services.vector_store import MemmapVectorStore, STORE_DTYPES
+from core.services.vector_quantization import QUANT_DTYPES, decode, decode_many, dimension_of, encode
+from shared.config import config
+
 logger = logging.getLogger(__name__)
 
 
+class EmbeddingVersionMismatch(ValueError):
+    """查询向量与检索后端的向量不是同一模型版本生成的（维度或语义空间不同，不可比较）"""
+
+
 class VectorIndex:
     """
     向量索引服务
     使用余弦相似度进行快速检索
-    向量直接存储在 questions 表中
+    向量存储在独立的 question_embeddings 表中（按题目 ID 一对一）
+    记录了生效版本后，其他模型版本的向量写入影子表，不参与检索
+    """
+    
+    # 写入向量：题目已有向量时覆盖
+    UPSERT_SQL = f"""
+        INSERT INTO {EMBEDDINGS_TABLE}
+            (embedding, embedding_version, content_hash, embedding_updated_at, question_id, embedding_dtype)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(question_id) DO UPDATE SET
+            embedding = excluded.embedding,
+            embedding_version = excluded.embedding_version,
+            content_hash = excluded.content_hash,
+            embedding_updated_at = excluded.embedding_updated_at,
+            embedding_dtype = excluded.embedding_dtype
+    """
+    
+    # 写入影子表：按 (模型版本, 题目 ID) 覆盖
+    SHADOW_UPSERT_SQL = f"""
+        INSERT INTO {SHADOW_EMBEDDINGS_TABLE}
+            (embedding, embedding_version, content_hash, embedding_updated_at, question_id, embedding_dtype)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(embedding_version, question_id) DO UPDATE SET
+            embedding = excluded.embedding,
+            content_hash = excluded.content_hash,
+            embedding_updated_at = excluded.embedding_updated_at,
+            embedding_dtype = excluded.embedding_dtype
     """
     
-    def __init__(self, db_connection):
+    # 内存矩阵与数据库一致性检查间隔：兜底其他进程（微信/MCP 入口）写入的向量
+    RELOAD_CHECK_SECONDS = 60
+    
+    # 量化检索召回候选时放宽的相似度阈值（覆盖量化误差，重排后再按原阈值过滤）
+    RERANK_MARGIN = 0.02
+    
+    def __init__(self, db_connection, mode: Optional[str] = None):
         """
         初始化向量索引
         
         Args:
             db_connection: SQLite 数据库连接
+            mode: 检索模式 exact / ivf / hnsw，默认读取 VECTOR_INDEX_MODE 配置
         """
         self.db = db_connection
-        self._ensure_columns()
+        self._ensure_table()
+        
+        self.mode = (mode or config.VECTOR_INDEX_MODE).lower()
+        if self.mode not in INDEX_MODES:
+            logger.warning(f"未知的向量检索模式 {self.mode}，回退到精确模式（可选：{', '.join(INDEX_MODES)}）")
+            self.mode = "exact"
+        elif self.mode == "hnsw" and hnswlib is None:
+            logger.warning("未安装 hnswlib，向量检索回退到精确模式")
+            self.mode = "exact"
+        self.backend_options = {
+            "nlist": config.VECTOR_IVF_NLIST,
+            "nprobe": config.VECTOR_IVF_NPROBE,
+            "ef_search": config.VECTOR_HNSW_EF_SEARCH,
+        }
+        self.ann_min_size = config.VECTOR_ANN_MIN_SIZE
+        
+        self.store_dtype = config.VECTOR_STORE
+        if self.store_dtype not in STORE_DTYPES:
+            if self.store_dtype != "off":
+                logger.warning(f"未知的向量存储精度 {self.store_dtype}，不使用内存映射存储")
+            self.store_dtype = None
+        
+        self.storage_dtype = self._check_dtype("VECTOR_STORAGE_DTYPE", config.VECTOR_STORAGE_DTYPE)
+        self.search_dtype = self._check_dtype("VECTOR_SEARCH_DTYPE", config.VECTOR_SEARCH_DTYPE)
+        self.backend_options["dtype"] = self.search_dtype
+        self.rerank_candidates = max(0, int(config.VECTOR_RERANK_CANDIDATES))
+        
+        # 内存检索后端（首次检索时加载）
+        self._matrix = None
+        self._matrix_version: Optional[str] = None
+        self._lock = threading.RLock()
+        self._db_state: Optional[Tuple] = None
+        self._db_state_dirty = False
+        self._checked_at = 0.0
     
-    def _ensure_columns(self):
-        """确保向量相关列存在"""
-        columns = ['embedding', 'embedding_version', 'content_hash', 'embedding_updated_at']
-        for col in columns:
-            try:
-                self.db.execute(f"ALTER TABLE questions ADD COLUMN {col} TEXT")
-            except:
-                pass  # 列已存在
-        # embedding 是 BLOB 类型，需要单独处理
+    @staticmethod
+    def _check_dtype(name: str, dtype: str) -> str:
+        """校验量化精度配置，无效时使用 float32"""
+        if dtype in QUANT_DTYPES:
+            return dtype
+        logger.warning(f"{name}={dtype} 无效，使用 float32（可选：{', '.join(QUANT_DTYPES)}）")
+        return "float32"
+    
+    def _ensure_table(self):
+        """确保向量表存在（正常情况下已由数据库迁移创建）"""
         try:
-            self.db.execute("ALTER TABLE questions ADD COLUMN embedding BLOB")
-        except:
-            pass  # 列已存在
+            self.db.execute(EMBEDDINGS_TABLE_SQL)
+            columns = {row.get('name') for row in self.db.fetch_all(f"PRAGMA table_info({EMBEDDINGS_TABLE})") or []}
+            if columns and 'embedding_dtype' not in columns:
+                self.db.execute(
+                    f"ALTER TABLE {EMBEDDINGS_TABLE} ADD COLUMN embedding_dtype TEXT NOT NULL DEFAULT 'float32'"
+                )
+            for index_sql in EMBEDDINGS_INDEXES:
+                self.db.execute(index_sql)
+            for sql in EMBEDDING_VERSIONS_SQL:
+                self.db.execute(sql)
+        except Exception as e:
+            logger.warning(f"创建向量表失败：{e}")
     
     def _compute_content_hash(self, content: str, options: str = None) -> str:
         """
@@ -59,6 +165,66 @@ class VectorIndex:
             hash_content += f"|{options}"
         return hashlib.md5(hash_content.encode('utf-8')).hexdigest()
     
+    def get_active_version(self) -> Optional[str]:
+        """当前生效的模型版本（未记录时返回 None，所有版本都写入 question_embeddings）"""
+        row = self.db.fetch_one(
+            f"SELECT version FROM {EMBEDDING_VERSIONS_TABLE} WHERE status = 'active' LIMIT 1"
+        )
+        return row.get('version') if row else None
+    
+    def _fetch_matrix_version(self) -> Optional[str]:
+        """question_embeddings 中向量的模型版本：生效版本，未记录时为占多数的版本"""
+        active = self.get_active_version()
+        if active:
+            return active
+        row = self.db.fetch_one(f"""
+            SELECT embedding_version, COUNT(*) as total
+            FROM {EMBEDDINGS_TABLE}
+            WHERE embedding_version IS NOT NULL
+            GROUP BY embedding_version
+            ORDER BY total DESC
+            LIMIT 1
+        """)
+        return row.get('embedding_version') if row else None
+    
+    def get_model_version(self) -> Optional[str]:
+        """
+        检索后端中向量的模型版本（生效版本已切换时丢弃旧后端并重新加载）
+        
+        查询向量必须用该版本的模型计算，见 search_similar 的 model_version 参数。
+        
+        Returns:
+            模型版本，向量表为空时为 None
+        """
+        with self._lock:
+            active = self.get_active_version()
+            if self._matrix is not None and active and active != self._matrix_version:
+                logger.info(f"生效模型版本已切换为 {active}，重新加载检索后端")
+                self._matrix = None
+            self._get_matrix()
+            return self._matrix_version
+    
+    def _get_matrix_for(self, model_version: Optional[str]):
+        """
+        返回与查询向量同一模型版本的检索后端（调用方持有锁）
+        
+        版本不一致时先确认生效版本是否已被切换（其他进程 activate）并重新加载，仍不一致则抛出异常。
+        """
+        matrix = self._get_matrix()
+        if not model_version or model_version == self._matrix_version:
+            return matrix
+        matrix_version = self.get_model_version()
+        if matrix_version and model_version != matrix_version:
+            raise EmbeddingVersionMismatch(
+                f"查询向量的模型版本 {model_version} 与检索后端的版本 {matrix_version} 不一致"
+            )
+        return self._matrix
+    
+    def is_shadow_version(self, model_version: str) -> bool:
+        """该模型版本的向量是否写入影子表（已记录生效版本且与之不同）"""
+        active = self.get_active_version()
+        return active is not None and model_version != active
+    
     def needs_reembedding(self, question_id: str, content: str, options: str, current_model_version: str) -> Tuple[bool, str]:
         """
         检查题目是否需要重新向量化
@@ -72,12 +238,19 @@ class VectorIndex:
         Returns:
             (是否需要重新向量化，原因)
         """
-        # 获取题目当前的向量化信息
-        row = self.db.fetch_one("""
-            SELECT content_hash, embedding_version, embedding_updated_at
-            FROM questions
-            WHERE id = ?
-        """, (question_id,))
+        # 非生效版本检查影子表中该版本的向量
+        table, version_sql, version_params = EMBEDDINGS_TABLE, "", ()
+        if self.is_shadow_version(current_model_version):
+            table, version_sql = SHADOW_EMBEDDINGS_TABLE, " AND e.embedding_version = ?"
+            version_params = (current_model_version,)
+        
+        # 获取题目当前的向量化信息（题目存在但没有向量时各字段为 NULL）
+        row = self.db.fetch_one(f"""
+            SELECT e.content_hash, e.embedding_version, e.embedding_updated_at
+            FROM questions q
+            LEFT JOIN {table} e ON e.question_id = q.id{version_sql}
+            WHERE q.id = ?
+        """, version_params + (question_id,))
         
         if not row:
             return True, "题目不存在"
@@ -103,8 +276,8 @@ class VectorIndex:
         
         # 检查向量是否存在
         embedding_row = self.db.fetch_one(
-            "SELECT embedding FROM questions WHERE id = ?",
-            (question_id,)
+            f"SELECT embedding, embedding_dtype FROM {table} e WHERE e.question_id = ?{version_sql}",
+            (question_id,) + version_params
         )
         if not embedding_row or not embedding_row.get('embedding'):
             return True, "向量数据丢失"
@@ -123,39 +296,296 @@ class VectorIndex:
             options: 选项（JSON 字符串）
         """
         now = datetime.now().isoformat()
-        embedding_bytes = embedding.astype(np.float32).tobytes()
+        embedding_bytes = encode(embedding, self.storage_dtype)
         content_hash = self._compute_content_hash(content, options)
+        params = (embedding_bytes, model_version, content_hash, now, question_id, self.storage_dtype)
+        
+        if self.is_shadow_version(model_version):
+            self.db.execute(self.SHADOW_UPSERT_SQL, params)
+            logger.info(f"更新影子向量：question_id={question_id}, model_version={model_version}")
+            return
         
-        self.db.execute("""
-            UPDATE questions
-            SET embedding = ?,
-                embedding_version = ?,
-                content_hash = ?,
-                embedding_updated_at = ?
-            WHERE id = ?
-        """, (embedding_bytes, model_version, content_hash, now, question_id))
+        self.db.execute(self.UPSERT_SQL, params)
+        self._apply_to_matrix([question_id], [embedding])
         
         logger.info(f"更新题目向量：question_id={question_id}, model_version={model_version}, dimension={len(embedding)}")
     
+    def update_embeddings(self, items: List[Tuple[str, np.ndarray, str, Optional[str]]], model_version: str):
+        """
+        批量更新题目向量（单个事务；非生效版本写入影子表）
+        
+        Args:
+            items: (题目 ID, 向量, 题干内容, 选项) 列表
+            model_version: 模型版本标识
+        """
+        if not items:
+            return
+        
+        now = datetime.now().isoformat()
+        params = [
+            (
+                encode(embedding, self.storage_dtype),
+                model_version,
+                self._compute_content_hash(content, options),
+                now,
+                question_id,
+                self.storage_dtype
+            )
+            for question_id, embedding, content, options in items
+        ]
+        
+        if self.is_shadow_version(model_version):
+            self.db.executemany(self.SHADOW_UPSERT_SQL, params)
+            logger.info(f"批量更新影子向量：count={len(items)}, model_version={model_version}")
+            return
+        
+        self.db.executemany(self.UPSERT_SQL, params)
+        self._apply_to_matrix([item[0] for item in items], [item[1] for item in items])
+        
+        logger.info(f"批量更新题目向量：count={len(items)}, model_version={model_version}")
+    
+    def delete_embedding(self, question_id: str):
+        """删除题目向量（数据库、影子表和内存矩阵）"""
+        self.db.execute(f"DELETE FROM {EMBEDDINGS_TABLE} WHERE question_id = ?", (question_id,))
+        self.db.execute(f"DELETE FROM {SHADOW_EMBEDDINGS_TABLE} WHERE question_id = ?", (question_id,))
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.remove(question_id)
+                self._mark_store_synced()
+            self._db_state_dirty = True
+    
+    def _apply_to_matrix(self, question_ids: List[str], embeddings: List[np.ndarray]):
+        """将已写入数据库的向量同步到内存矩阵（未加载时跳过，加载时会读到）"""
+        with self._lock:
+            self._db_state_dirty = True
+            if self._matrix is None:
+                return
+            try:
+                self._matrix.upsert(question_ids, np.vstack([np.asarray(e, dtype=np.float32) for e in embeddings]))
+            except ValueError as e:
+                # 维度变化（切换了模型），下次检索时按数据库中占多数的维度重新加载
+                logger.info(f"向量维度变化，重新加载内存矩阵：{e}")
+                self._matrix = None
+                return
+            self._mark_store_synced()
+    
+    def _mark_store_synced(self):
+        """磁盘存储已同步本次写入，记录最新指纹供其他进程判断（调用方持有锁）"""
+        if isinstance(self._matrix, MemmapVectorStore):
+            self._matrix.mark_synced(self._fetch_db_state())
+    
+    def _fetch_db_state(self) -> Tuple:
+        """向量表的轻量指纹（行数 + 最近更新时间），用于发现其他进程的写入"""
+        row = self.db.fetch_one(f"""
+            SELECT COUNT(*) as total, MAX(embedding_updated_at) as last_updated
+            FROM {EMBEDDINGS_TABLE}
+        """)
+        if not row:
+            return (0, None)
+        return (row.get('total'), row.get('last_updated'))
+    
+    def _index_dir(self) -> Optional[str]:
+        """索引文件目录（数据库路径未知时不持久化）"""
+        directory = config.VECTOR_INDEX_DIR
+        if not directory:
+            db_path = getattr(self.db, 'db_path', None)
+            if not isinstance(db_path, str):
+                return None
+            directory = os.path.join(os.path.dirname(os.path.abspath(db_path)), "vector_index")
+        return directory
+    
+    def _index_path(self, mode: str) -> Optional[str]:
+        """近似索引的持久化文件路径"""
+        directory = self._index_dir()
+        return index_path(directory, mode) if directory else None
+    
+    def _store_dir(self) -> Optional[str]:
+        """内存映射向量存储目录（未启用时为 None）"""
+        directory = self._index_dir()
+        if not self.store_dtype or not directory:
+            return None
+        return os.path.join(directory, "store")
+    
+    def _open_store(self) -> Optional[MemmapVectorStore]:
+        """打开与当前向量表指纹一致的磁盘存储"""
+        directory = self._store_dir()
+        store = MemmapVectorStore.open(directory) if directory else None
+        if store is None:
+            return None
+        if store.dtype != self.store_dtype or store.refresh() != tuple(self._db_state or ()):
+            logger.info(f"向量存储与数据库不一致，重新构建：{directory}")
+            store.close()
+            return None
+        logger.info(f"打开向量存储：count={len(store)}, dtype={store.dtype}, path={directory}")
+        return store
+    
+    def _effective_mode(self, total: int) -> str:
+        """向量数较少时近似索引没有收益，使用精确检索"""
+        if self.mode != "exact" and total < self.ann_min_size:
+            return "exact"
+        return self.mode
+    
+    def _load_persisted(self, mode: str):
+        """加载与当前向量表指纹一致的近似索引，不可用时返回 None"""
+        path = self._index_path(mode)
+        if mode == "exact" or not path or not os.path.exists(path):
+            return None
+        try:
+            backend, fingerprint = load_backend(mode, path)
+        except Exception as e:
+            logger.warning(f"加载近似索引失败，重新构建：{path}, {e}")
+            return None
+        if fingerprint != tuple(self._db_state or ()):
+            logger.info(f"近似索引已过期，重新构建：{path}")
+            return None
+        logger.info(f"加载近似索引：mode={mode}, count={len(backend)}, path={path}")
+        return backend
+    
+    def _load_matrix(self):
+        """
+        加载检索后端
+        
+        优先使用磁盘上指纹一致的近似索引或内存映射存储；否则从数据库读取全部向量构建
+        （维度不一致时只保留占多数的维度），近似索引构建后保存到磁盘。
+        """
+        mode = self._effective_mode((self._db_state or (0,))[0] or 0)
+        backend = self._open_store() if mode == "exact" else self._load_persisted(mode)
+        if backend is not None:
+            return backend
+        
+        rows = self.db.fetch_all(f"""
+            SELECT e.question_id as id, e.embedding, e.embedding_dtype
+            FROM {EMBEDDINGS_TABLE} e
+            INNER JOIN questions q ON q.id = e.question_id
+        """)
+        rows = [row for row in rows if row.get('embedding')]
+        if not rows:
+            return EmbeddingMatrix(0, self.search_dtype)
+        
+        for row in rows:
+            row['embedding_dtype'] = row.get('embedding_dtype') or "float32"
+        dimensions = Counter(dimension_of(row['embedding'], row['embedding_dtype']) for row in rows)
+        dimension = dimensions.most_common(1)[0][0]
+        kept = [row for row in rows if dimension_of(row['embedding'], row['embedding_dtype']) == dimension]
+        if len(kept) < len(rows):
+            logger.warning(f"忽略 {len(rows) - len(kept)} 条维度不一致的向量（请重建向量）")
+        
+        # 按存储精度分组批量解码（切换精度后库中可能同时存在多种格式）
+        groups: Dict[str, List[Dict]] = {}
+        for row in kept:
+            groups.setdefault(row['embedding_dtype'], []).append(row)
+        kept = [row for group in groups.values() for row in group]
+        vectors = np.concatenate([
+            decode_many([row['embedding'] for row in group], dtype, dimension)
+            for dtype, group in groups.items()
+        ])
+        question_ids = [row['id'] for row in kept]
+        store_dir = self._store_dir()
+        if mode == "exact" and store_dir:
+            return MemmapVectorStore.create(store_dir, dimension, self.store_dtype,
+                                            question_ids, vectors, self._db_state)
+        backend = build_backend(mode, question_ids, vectors, self.backend_options)
+        logger.info(f"加载向量索引：mode={mode}, count={len(backend)}, dimension={dimension}")
+        if mode != "exact":
+            self._save_backend(backend)
+        return backend
+    
+    def _save_backend(self, backend):
+        """保存近似索引（附带当前向量表指纹）"""
+        path = self._index_path(backend.name)
+        if not path:
+            return
+        try:
+            backend.save(path, self._db_state)
+        except Exception as e:
+            logger.warning(f"保存近似索引失败：{path}, {e}")
+    
+    def persist(self):
+        """将当前近似索引保存到磁盘（进程退出前调用，下次启动可直接加载）"""
+        with self._lock:
+            if self._matrix is None or self._matrix.name == "exact":
+                return
+            state = self._fetch_db_state()
+            if not self._db_state_dirty and state != self._db_state:
+                # 其他进程写入过，内存中的索引已不完整，下次启动重新构建
+                return
+            self._db_state = state
+            self._db_state_dirty = False
+            self._save_backend(self._matrix)
+    
+    def _get_matrix(self):
+        """返回内存矩阵，必要时加载或重新加载"""
+        with self._lock:
+            now = time.monotonic()
+            if self._matrix is not None and now - self._checked_at >= self.RELOAD_CHECK_SECONDS:
+                state = self._fetch_db_state()
+                if self._db_state_dirty:
+                    # 本进程的写入已同步到内存，只更新指纹
+                    self._db_state_dirty = False
+                elif state != self._db_state:
+                    # 磁盘存储可以直接读到其他进程追加的行，不必重新加载
+                    if not (isinstance(self._matrix, MemmapVectorStore) and self._matrix.refresh() == state):
+                        self._matrix = None
+                self._db_state = state
+                self._checked_at = now
+            
+            if self._matrix is None:
+                self._db_state = self._fetch_db_state()
+                self._db_state_dirty = False
+                self._matrix = self._load_matrix()
+                self._matrix_version = self._fetch_matrix_version()
+                self._checked_at = now
+            return self._matrix
+    
+    def invalidate(self):
+        """丢弃内存矩阵，下次检索时重新加载"""
+        with self._lock:
+            self._matrix = None
+    
+    def get_backend(self):
+        """返回当前检索后端（必要时加载）"""
+        return self._get_matrix()
+    
+    def snapshot_backend(self) -> VectorSnapshot:
+        """
+        在锁内取得当前检索后端的只读快照，供全库批处理任务遍历
+        
+        精确后端复制 ID 和向量（内存映射存储只复制 ID 和删除掩码），
+        近似后端复制向量，近邻检索时再加锁访问实时索引。
+        """
+        with self._lock:
+            backend = self._get_matrix()
+            if isinstance(backend, (EmbeddingMatrix, MemmapVectorStore)):
+                return backend.snapshot()
+            
+            def search_batch(*args, **kwargs):
+                with self._lock:
+                    return backend.search_batch(*args, **kwargs)
+            
+            return VectorSnapshot.copy_of(backend, search_batch)
+    
     def get_embedding(self, question_id: str) -> Optional[np.ndarray]:
         """获取题目向量"""
         row = self.db.fetch_one(
-            "SELECT embedding FROM questions WHERE id = ?",
+            f"SELECT embedding, embedding_dtype FROM {EMBEDDINGS_TABLE} WHERE question_id = ?",
             (question_id,)
         )
         
         if not row or not row.get('embedding'):
             return None
         
-        embedding_bytes = row['embedding']
-        return np.frombuffer(embedding_bytes, dtype=np.float32)
+        return decode(row['embedding'], row.get('embedding_dtype') or "float32")
     
     def search_similar(
         self, 
         embedding: np.ndarray, 
         threshold: float = 0.95,
         top_k: int = 10,
-        exclude_ids: Optional[List[str]] = None
+        exclude_ids: Optional[List[str]] = None,
+        category_id: Optional[str] = None,
+        include_descendants: bool = False,
+        tag_id: Optional[str] = None,
+        model_version: Optional[str] = None
     ) -> List[Dict]:
         """
         检索相似题目
@@ -165,81 +595,218 @@ class VectorIndex:
             threshold: 相似度阈值（0-1，越高越严格）
             top_k: 返回最多结果数
             exclude_ids: 排除的题目 ID 列表
+            category_id: 只在该分类下检索
+            include_descendants: 分类筛选是否包含子分类
+            tag_id: 只在带该标签的题目中检索
+            model_version: 查询向量的模型版本（传入时校验与检索后端一致）
             
         Returns:
             相似题目列表：[{question_id, similarity, content}, ...]
+        
+        Raises:
+            EmbeddingVersionMismatch: 查询向量的模型版本与检索后端不一致
+            ValueError: 查询向量维度与检索后端不一致
         """
-        # 获取所有有向量的题目
-        query = """
-            SELECT id, content, embedding 
-            FROM questions 
-            WHERE embedding IS NOT NULL
+        candidate_ids = self._filter_candidates(category_id, include_descendants, tag_id)
+        if candidate_ids is not None and not candidate_ids:
+            return []
+        
+        with self._lock:
+            matrix = self._get_matrix_for(model_version)
+            rerank = self._should_rerank(matrix)
+            if rerank:
+                candidates = matrix.search(embedding, max(top_k, self.rerank_candidates),
+                                           threshold - self.RERANK_MARGIN, exclude_ids, candidate_ids)
+            else:
+                hits = matrix.search(embedding, top_k, threshold, exclude_ids, candidate_ids)
+        if rerank:
+            hits = self._rerank(np.atleast_2d(embedding), [candidates], threshold, top_k)[0]
+        
+        similar_questions = self._attach_contents(matrix, [hits])[0]
+        logger.info(f"检索相似题目：threshold={threshold}, found={len(similar_questions)}")
+        
+        return similar_questions
+    
+    def search_similar_batch(
+        self,
+        embeddings: np.ndarray,
+        threshold: float = 0.95,
+        top_k: int = 10,
+        exclude_ids: Optional[List[str]] = None,
+        category_id: Optional[str] = None,
+        include_descendants: bool = False,
+        tag_id: Optional[str] = None,
+        model_version: Optional[str] = None
+    ) -> List[List[Dict]]:
         """
-        params = []
+        批量检索相似题目
         
-        if exclude_ids:
-            placeholders = ','.join('?' * len(exclude_ids))
-            query += f" AND id NOT IN ({placeholders})"
-            params.extend(exclude_ids)
+        Q 个查询与全部 N 个向量的得分按块计算（每块一次矩阵乘法，内存有上限），
+        比逐个调用 search_similar 少扫描 Q-1 遍矩阵，题干也只查询一次。
         
-        rows = self.db.fetch_all(query, params)
+        Args:
+            embeddings: 查询向量矩阵 (Q, d) 或向量列表
+            threshold: 相似度阈值（0-1，越高越严格）
+            top_k: 每个查询返回最多结果数
+            exclude_ids: 对所有查询排除的题目 ID 列表
+            category_id: 只在该分类下检索
+            include_descendants: 分类筛选是否包含子分类
+            tag_id: 只在带该标签的题目中检索
+            model_version: 查询向量的模型版本（传入时校验与检索后端一致）
+            
+        Returns:
+            与查询一一对应的相似题目列表：[[{question_id, similarity, content}, ...], ...]
         
-        if not rows:
+        Raises:
+            EmbeddingVersionMismatch: 查询向量的模型版本与检索后端不一致
+            ValueError: 查询向量维度与检索后端不一致
+        """
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if queries.size == 0:
             return []
         
-        # 计算相似度
-        similar_questions = []
-        query_norm = np.linalg.norm(embedding)
+        candidate_ids = self._filter_candidates(category_id, include_descendants, tag_id)
+        if candidate_ids is not None and not candidate_ids:
+            return [[] for _ in range(len(queries))]
+        
+        with self._lock:
+            matrix = self._get_matrix_for(model_version)
+            rerank = self._should_rerank(matrix)
+            if rerank:
+                candidates = matrix.search_batch(queries, max(top_k, self.rerank_candidates),
+                                                 threshold - self.RERANK_MARGIN, exclude_ids, candidate_ids)
+            else:
+                hits = matrix.search_batch(queries, top_k, threshold, exclude_ids, candidate_ids)
+        if rerank:
+            hits = self._rerank(queries, candidates, threshold, top_k)
+        
+        results = self._attach_contents(matrix, hits)
+        logger.info(f"批量检索相似题目：queries={len(queries)}, threshold={threshold}, "
+                    f"found={sum(len(r) for r in results)}")
+        return results
+    
+    def _filter_candidates(self,
+                           category_id: Optional[str] = None,
+                           include_descendants: bool = False,
+                           tag_id: Optional[str] = None) -> Optional[List[str]]:
+        """
+        查询满足分类/标签筛选且已向量化的题目 ID
+        
+        分类与标签关系不经过向量索引维护，每次检索从数据库查询（均走索引），
+        保证题目改分类、打标签后立即生效。
         
-        for row in rows:
-            question_id = row['id']
-            content = row['content']
-            emb_bytes = row['embedding']
-            
-            emb = np.frombuffer(emb_bytes, dtype=np.float32)
-            
-            # 余弦相似度
-            emb_norm = np.linalg.norm(emb)
-            if emb_norm == 0 or query_norm == 0:
-                continue
-            
-            similarity = np.dot(embedding, emb) / (query_norm * emb_norm)
-            
-            if similarity >= threshold:
+        Returns:
+            候选题目 ID 列表；未指定筛选条件时返回 None（不过滤）
+        """
+        if not category_id and not tag_id:
+            return None
+        
+        from_sql = f"FROM {EMBEDDINGS_TABLE} e INNER JOIN questions q ON q.id = e.question_id"
+        conditions, params = [], []
+        if tag_id:
+            from_sql += " INNER JOIN question_tags qt ON qt.question_id = q.id"
+            conditions.append("qt.tag_id = ?")
+            params.append(tag_id)
+        if category_id and include_descendants:
+            from_sql += f" INNER JOIN {CATEGORY_CLOSURE_TABLE} cc ON cc.descendant_id = q.category_id"
+            conditions.append("cc.ancestor_id = ?")
+            params.append(category_id)
+        elif category_id:
+            conditions.append("q.category_id = ?")
+            params.append(category_id)
+        
+        rows = self.db.fetch_all(
+            f"SELECT e.question_id {from_sql} WHERE {' AND '.join(conditions)}",
+            tuple(params)
+        )
+        return [row['question_id'] for row in rows]
+    
+    def _should_rerank(self, matrix) -> bool:
+        """量化检索且配置了重排候选数时，用原始向量重排"""
+        return bool(self.rerank_candidates) and getattr(matrix, 'dtype', "float32") != "float32"
+    
+    def _attach_contents(self, matrix, hits_lists: List[List[Tuple[str, float]]]) -> List[List[Dict]]:
+        """只为命中的题目读取题干（所有查询合并为一次查询）"""
+        hit_ids = list({question_id for hits in hits_lists for question_id, _ in hits})
+        if not hit_ids:
+            return [[] for _ in hits_lists]
+        rows = fetch_all_in(self.db, "SELECT id, content FROM questions WHERE id IN ({placeholders})", hit_ids)
+        contents = {row['id']: row['content'] for row in rows}
+        
+        results = []
+        for hits in hits_lists:
+            similar_questions = []
+            for question_id, similarity in hits:
+                if question_id not in contents:
+                    # 题目已被删除（例如其他进程），顺便清理内存矩阵
+                    with self._lock:
+                        matrix.remove(question_id)
+                    continue
                 similar_questions.append({
                     'question_id': question_id,
-                    'similarity': float(similarity),
-                    'content': content
+                    'similarity': similarity,
+                    'content': contents[question_id]
                 })
-        
-        # 按相似度排序
-        similar_questions.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        # 限制返回数量
-        similar_questions = similar_questions[:top_k]
-        
-        logger.info(f"检索相似题目：threshold={threshold}, found={len(similar_questions)}")
-        
-        return similar_questions
+            results.append(similar_questions)
+        return results
+    
+    def _rerank(self, queries: np.ndarray, candidates_lists: List[List[Tuple[str, float]]],
+                threshold: float, top_k: int) -> List[List[Tuple[str, float]]]:
+        """用数据库中保存的向量重新计算候选的相似度（修正量化检索的误差）"""
+        candidate_ids = list({question_id for candidates in candidates_lists for question_id, _ in candidates})
+        if not candidate_ids:
+            return [[] for _ in candidates_lists]
+        rows = fetch_all_in(
+            self.db,
+            f"SELECT question_id, embedding, embedding_dtype FROM {EMBEDDINGS_TABLE} "
+            f"WHERE question_id IN ({{placeholders}})",
+            candidate_ids
+        )
+        stored = {}
+        for row in rows:
+            if row.get('embedding'):
+                vector, ok = EmbeddingMatrix.normalize(decode(row['embedding'], row.get('embedding_dtype') or "float32"))
+                if ok[0]:
+                    stored[row['question_id']] = vector[0]
+        
+        normalized, valid = EmbeddingMatrix.normalize(queries)
+        results = []
+        for query, ok, candidates in zip(normalized, valid, candidates_lists):
+            hits = []
+            for question_id, _ in candidates:
+                vector = stored.get(question_id)
+                if not ok or vector is None or len(vector) != len(query):
+                    continue
+                similarity = float(vector @ query)
+                if similarity >= threshold:
+                    hits.append((question_id, similarity))
+            hits.sort(key=lambda hit: hit[1], reverse=True)
+            results.append(hits[:top_k])
+        return results
     
     def get_stats(self) -> Dict:
         """获取索引统计信息"""
         total = self.db.fetch_one("SELECT COUNT(*) as total FROM questions")['total']
-        with_embedding = self.db.fetch_one("SELECT COUNT(*) as total FROM questions WHERE embedding IS NOT NULL")['total']
+        with_embedding = self.db.fetch_one(f"""
+            SELECT COUNT(*) as total
+            FROM questions q
+            WHERE EXISTS (SELECT 1 FROM {EMBEDDINGS_TABLE} e WHERE e.question_id = q.id)
+        """)['total']
         
         # 获取版本分布
-        version_rows = self.db.fetch_all("""
+        version_rows = self.db.fetch_all(f"""
             SELECT 
                 embedding_version,
                 COUNT(*) as total,
                 MAX(embedding_updated_at) as last_updated
-            FROM questions
+            FROM {EMBEDDINGS_TABLE}
             WHERE embedding_version IS NOT NULL
             GROUP BY embedding_version
         """)
         
         return {
             'total_questions': total,
+            'active_version': self.get_active_version(),
             'with_embedding': with_embedding,
             'without_embedding': total - with_embedding,
             'versions': [
@@ -249,26 +816,58 @@ class VectorIndex:
                     'last_updated': row['last_updated']
                 }
                 for row in version_rows if row['embedding_version']
-            ]
+            ],
+            'memory': self.get_memory_stats()
+        }
+    
+    def get_memory_stats(self) -> Dict:
+        """内存矩阵状态（未加载时不触发加载）"""
+        matrix = self._matrix
+        if matrix is None:
+            return {'loaded': False, 'mode': self.mode, 'backend': None, 'dtype': None,
+                    'vectors': 0, 'dimension': None, 'bytes': 0}
+        return {
+            'loaded': True,
+            'mode': self.mode,
+            'backend': matrix.name,
+            'dtype': getattr(matrix, 'dtype', "float32"),
+            'vectors': len(matrix),
+            'dimension': matrix.dimension,
+            'bytes': matrix.nbytes
         }
     
     def get_missing_embeddings(self) -> List[Dict]:
         """获取未向量化的题目列表"""
-        return self.db.fetch_all("""
-            SELECT id, content, category_id, created_at
-            FROM questions
-            WHERE embedding IS NULL
-            ORDER BY created_at
+        return self.db.fetch_all(f"""
+            SELECT q.id, q.content, q.category_id, q.created_at
+            FROM questions q
+            LEFT JOIN {EMBEDDINGS_TABLE} e ON e.question_id = q.id
+            WHERE e.embedding IS NULL
+            ORDER BY q.created_at
         """)
     
     def get_mismatched_embeddings(self, current_model_version: str) -> List[Dict]:
-        """获取模型版本不匹配的题目列表"""
-        return self.db.fetch_all("""
-            SELECT id, content, category_id, embedding_version, embedding_updated_at
-            FROM questions
-            WHERE embedding IS NOT NULL
-            AND (embedding_version IS NULL OR embedding_version != ?)
-            ORDER BY embedding_updated_at
+        """
+        获取模型版本不匹配的题目列表
+        
+        当前模型不是生效版本时（影子构建中），返回影子表中还没有该版本向量的已向量化题目
+        """
+        if self.is_shadow_version(current_model_version):
+            return self.db.fetch_all(f"""
+                SELECT q.id, q.content, q.category_id, e.embedding_version, e.embedding_updated_at
+                FROM {EMBEDDINGS_TABLE} e
+                INNER JOIN questions q ON q.id = e.question_id
+                LEFT JOIN {SHADOW_EMBEDDINGS_TABLE} s
+                    ON s.question_id = q.id AND s.embedding_version = ?
+                WHERE s.question_id IS NULL
+                ORDER BY e.embedding_updated_at
+            """, (current_model_version,))
+        return self.db.fetch_all(f"""
+            SELECT q.id, q.content, q.category_id, e.embedding_version, e.embedding_updated_at
+            FROM {EMBEDDINGS_TABLE} e
+            INNER JOIN questions q ON q.id = e.question_id
+            WHERE e.embedding_version IS NULL OR e.embedding_version != ?
+            ORDER BY e.embedding_updated_at
         """, (current_model_version,))
     
     def rebuild_all(self, embedding_service, model_version: str, batch_size: int = 100):
@@ -289,28 +888,60 @@ class VectorIndex:
             ORDER BY created_at
         """)
         
-        total = len(all_questions)
+        return self.embed_questions(all_questions, embedding_service, model_version, batch_size)
+    
+    def embed_questions(self, questions: List[Dict], embedding_service, model_version: str, batch_size: int = 100):
+        """
+        按批次向量化并写入指定题目
+        
+        每批调用一次 embed_batch（经过 Embedding 缓存，内容未变的题目不再请求 API），
+        再用 update_embeddings 在单个事务内写入；某批失败时逐题重试，单题失败只计入错误数。
+        
+        Args:
+            questions: 题目列表（需包含 id、content，options 可缺省）
+            embedding_service: EmbeddingService 实例
+            model_version: 模型版本标识
+            batch_size: 批次大小
+            
+        Returns:
+            {'total', 'processed', 'errors'}
+        """
+        total = len(questions)
         processed = 0
         errors = 0
         
-        for i, question in enumerate(all_questions):
+        for start in range(0, total, batch_size):
+            batch = questions[start:start + batch_size]
             try:
-                embedding = embedding_service.embed(question['content'])
-                self.update_embedding(
-                    question['id'],
-                    embedding,
-                    model_version,
-                    question['content'],
-                    question['options']
+                embeddings = list(embedding_service.embed_batch([q['content'] for q in batch]))
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"返回向量数 {len(embeddings)} 与题目数 {len(batch)} 不一致")
+                self.update_embeddings(
+                    [
+                        (q['id'], embedding, q['content'], q.get('options'))
+                        for q, embedding in zip(batch, embeddings)
+                    ],
+                    model_version
                 )
-                processed += 1
-                
-                if (i + 1) % batch_size == 0:
-                    logger.info(f"进度：{i + 1}/{total} ({(i + 1) / total * 100:.1f}%)")
-                    
+                processed += len(batch)
             except Exception as e:
-                logger.error(f"处理题目 {question['id']} 失败：{e}")
-                errors += 1
+                logger.warning(f"批量向量化失败，逐题重试：{e}")
+                for question in batch:
+                    try:
+                        self.update_embedding(
+                            question['id'],
+                            embedding_service.embed(question['content']),
+                            model_version,
+                            question['content'],
+                            question.get('options')
+                        )
+                        processed += 1
+                    except Exception as e:
+                        logger.error(f"处理题目 {question['id']} 失败：{e}")
+                        errors += 1
+            
+            done = start + len(batch)
+            logger.info(f"进度：{done}/{total} ({done / total * 100:.1f}%)")
         
         logger.info(f"重建完成：成功={processed}, 失败={errors}, 总计={total}")
         
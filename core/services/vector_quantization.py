@@ -0,0 +1,84 @@
+"""
+向量量化编码
+
+向量在数据库中的存储格式和内存矩阵的检索精度都可以选择：
+- float32: 原始精度，每维 4 字节
+- float16: 半精度，每维 2 字节（余弦相似度误差约 1e-3）
+- int8:    逐向量对称标量量化，每维 1 字节 + 4 字节缩放系数
+           （x ≈ code × scale，scale = max|x| / 127）
+
+数据库 BLOB 格式（按 question_embeddings.embedding_dtype 区分）：
+- float32 / float16: 按行的原始字节
+- int8: 4 字节 float32 缩放系数 + d 字节 int8 编码
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+# 支持的量化精度
+QUANT_DTYPES = ("float32", "float16", "int8")
+
+# int8 编码的缩放系数字节数
+INT8_SCALE_BYTES = 4
+
+
+def bytes_per_vector(dimension: int, dtype: str) -> int:
+    """单个向量编码后的字节数"""
+    if dtype == "int8":
+        return dimension + INT8_SCALE_BYTES
+    return dimension * np.dtype(dtype).itemsize
+
+
+def dimension_of(blob: bytes, dtype: str) -> int:
+    """由编码字节数推算向量维度"""
+    if dtype == "int8":
+        return len(blob) - INT8_SCALE_BYTES
+    return len(blob) // np.dtype(dtype).itemsize
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    逐向量对称 int8 量化
+    
+    Args:
+        vectors: 向量矩阵 (n, d)
+    
+    Returns:
+        (int8 编码 (n, d), float32 缩放系数 (n,))，零向量的缩放系数为 0
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    safe = np.where(scales > 0, scales, 1.0)
+    codes = np.clip(np.rint(vectors / safe[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def encode(vector: np.ndarray, dtype: str = "float32") -> bytes:
+    """将向量编码为数据库 BLOB"""
+    if dtype == "int8":
+        codes, scales = quantize_int8(vector)
+        return scales.tobytes() + codes.tobytes()
+    if dtype not in QUANT_DTYPES:
+        raise ValueError(f"不支持的向量精度：{dtype}（可选：{', '.join(QUANT_DTYPES)}）")
+    return np.asarray(vector, dtype=np.float32).astype(dtype).tobytes()
+
+
+def decode(blob: bytes, dtype: str = "float32") -> np.ndarray:
+    """将数据库 BLOB 解码为 float32 向量"""
+    if dtype == "int8":
+        scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=INT8_SCALE_BYTES).astype(np.float32) * scale
+    return np.frombuffer(blob, dtype=dtype or "float32").astype(np.float32)
+
+
+def decode_many(blobs: List[bytes], dtype: str, dimension: int) -> np.ndarray:
+    """批量解码同一精度、同一维度的 BLOB 为 float32 矩阵 (n, d)"""
+    if not blobs:
+        return np.zeros((0, dimension), dtype=np.float32)
+    if dtype == "int8":
+        raw = np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(len(blobs), dimension + INT8_SCALE_BYTES)
+        scales = raw[:, :INT8_SCALE_BYTES].copy().view(np.float32)[:, 0]
+        return raw[:, INT8_SCALE_BYTES:].view(np.int8).astype(np.float32) * scales[:, None]
+    matrix = np.frombuffer(b"".join(blobs), dtype=dtype).reshape(len(blobs), dimension)
+    return matrix.astype(np.float32, copy=dtype != "float32")
@@ -0,0 +1,574 @@
+"""
+向量磁盘存储（内存映射）
+
+在数据库同目录下保存一份按行排列的向量副本，通过 np.memmap 打开：
+进程启动时无需从 SQLite 逐行反序列化 BLOB，多个 worker 进程共享操作系统页缓存，
+不再各自持有一份矩阵。数据库中的 question_embeddings 仍是唯一可信来源，
+存储文件只是可随时重建的检索副本（附带向量表指纹，不一致时由 VectorIndex 重建）。
+
+目录结构：
+    meta.json        元数据：维度、dtype、已提交行数、删除数、容量、指纹、代数
+    vectors.bin      定长行（stride = dimension × itemsize），L2 归一化后的 float32/float16
+    ids.txt          每行一个题目 ID，与 vectors.bin 的行一一对应
+    tombstones.bin   删除位图（每行 1 bit）
+    .lock            写入互斥锁（fcntl，不支持的平台上假定单写入进程）
+
+写入只追加：覆盖写入时旧行打删除标记，新向量追加到末尾；删除行过多时整体压缩为新一代文件。
+meta.json 原子替换，是写入的提交点；其他进程在检索前发现 meta.json 变化即增量读取新增的行。
+"""
+
+import json
+import logging
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from core.services.vector_backends import (
+    BATCH_BLOCK_ELEMENTS, EmbeddingMatrix, VectorSnapshot, batch_top_k, check_dimension, subset_rows
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 支持的存储精度
+STORE_DTYPES = ("float32", "float16")
+
+
+class MemmapVectorStore:
+    """
+    内存映射向量存储
+    
+    与 vector_backends 中的后端接口一致（upsert / remove / search / len），
+    可直接作为 VectorIndex 的精确检索后端。
+    """
+    
+    name = "memmap"
+    
+    FORMAT_VERSION = 1
+    INITIAL_CAPACITY = 1024
+    
+    # 检索时每块参与矩阵乘法的元素数（float16 需要先转换为 float32，约 1MB 留在 CPU 缓存内）
+    SEARCH_CHUNK_ELEMENTS = 262144
+    
+    # 删除行超过该比例时压缩
+    COMPACT_RATIO = 0.5
+    
+    META_FILE = "meta.json"
+    VECTORS_FILE = "vectors.bin"
+    IDS_FILE = "ids.txt"
+    TOMBSTONES_FILE = "tombstones.bin"
+    LOCK_FILE = ".lock"
+    
+    def __init__(self, directory: str):
+        """
+        打开已有的存储（请使用 open / create）
+        
+        Args:
+            directory: 存储目录
+        """
+        self.directory = directory
+        self._meta: Dict = {}
+        self._meta_stat = None
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._data = None
+        self._tombstones = None
+        self._lock_fd = None
+    
+    # ---------- 打开与创建 ----------
+    
+    @classmethod
+    def open(cls, directory: str) -> Optional["MemmapVectorStore"]:
+        """打开存储，不存在或格式不兼容时返回 None"""
+        store = cls(directory)
+        if not os.path.exists(store._path(cls.META_FILE)):
+            return None
+        try:
+            with store._locked(exclusive=False):
+                store._reload()
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"向量存储无法打开，将重建：{directory}, {e}")
+            store.close()
+            return None
+        if store._meta.get("version") != cls.FORMAT_VERSION:
+            store.close()
+            return None
+        return store
+    
+    @classmethod
+    def create(cls,
+               directory: str,
+               dimension: int,
+               dtype: str,
+               question_ids: List[str],
+               vectors: np.ndarray,
+               fingerprint: Optional[Tuple] = None) -> "MemmapVectorStore":
+        """
+        用给定向量创建（或整体替换）存储
+        
+        Args:
+            directory: 存储目录
+            dimension: 向量维度
+            dtype: 存储精度 float32 / float16
+            question_ids: 题目 ID 列表
+            vectors: 向量矩阵 (n, d)，无需归一化
+            fingerprint: 向量表指纹
+        """
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"不支持的向量存储精度：{dtype}（可选：{', '.join(STORE_DTYPES)}）")
+        os.makedirs(directory, exist_ok=True)
+        store = cls(directory)
+        
+        normalized, valid = EmbeddingMatrix.normalize(vectors) if len(question_ids) else \
+            (np.zeros((0, dimension), dtype=np.float32), np.zeros(0, dtype=bool))
+        ids = [question_id for question_id, ok in zip(question_ids, valid) if ok]
+        
+        with store._locked(exclusive=True):
+            generation = 0
+            old_meta = store._read_meta()
+            if old_meta:
+                generation = old_meta.get("generation", 0) + 1
+            store._write_generation(ids, normalized[valid], dimension, dtype, fingerprint, generation)
+            store._reload()
+        logger.info(f"创建向量存储：count={len(ids)}, dimension={dimension}, dtype={dtype}, path={directory}")
+        return store
+    
+    def __del__(self):
+        self.close()
+    
+    def close(self):
+        """释放内存映射和锁文件"""
+        self._data = None
+        self._tombstones = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    
+    # ---------- 属性 ----------
+    
+    def __len__(self) -> int:
+        self.refresh()
+        return self._meta.get("count", 0) - self._meta.get("deleted", 0)
+    
+    def __contains__(self, question_id: str) -> bool:
+        return self._live_row(question_id) is not None
+    
+    @property
+    def dimension(self) -> int:
+        return self._meta["dimension"]
+    
+    @property
+    def dtype(self) -> str:
+        return self._meta["dtype"]
+    
+    @property
+    def fingerprint(self) -> Tuple:
+        return tuple(self._meta.get("fingerprint") or ())
+    
+    @property
+    def nbytes(self) -> int:
+        """已提交行占用的映射字节数（进程间共享的页缓存，不是私有内存）"""
+        return self._meta.get("count", 0) * self._stride
+    
+    @property
+    def _stride(self) -> int:
+        return self._meta["dimension"] * np.dtype(self._meta["dtype"]).itemsize
+    
+    # ---------- 文件操作 ----------
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+    
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        """进程间读写锁（写入独占，刷新共享）"""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_fd is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock_fd = os.open(self._path(self.LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+    
+    def _read_meta(self) -> Dict:
+        try:
+            with open(self._path(self.META_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+    
+    def _write_meta(self, meta: Dict):
+        """原子替换 meta.json（写入的提交点）"""
+        tmp_path = self._path(self.META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path(self.META_FILE))
+        self._meta = meta
+        self._meta_stat = self._stat_meta()
+    
+    def _stat_meta(self):
+        try:
+            stat = os.stat(self._path(self.META_FILE))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def _write_generation(self, ids: List[str], normalized: np.ndarray, dimension: int, dtype: str,
+                          fingerprint: Optional[Tuple], generation: int):
+        """写入一整代文件（先写临时文件再替换，最后提交 meta.json）"""
+        capacity = max(self.INITIAL_CAPACITY, len(ids))
+        stride = dimension * np.dtype(dtype).itemsize
+        
+        vectors_tmp = self._path(self.VECTORS_FILE + ".tmp")
+        with open(vectors_tmp, "wb") as f:
+            f.write(np.ascontiguousarray(normalized, dtype=dtype).tobytes())
+            f.truncate(capacity * stride)
+        tombstones_tmp = self._path(self.TOMBSTONES_FILE + ".tmp")
+        with open(tombstones_tmp, "wb") as f:
+            f.truncate((capacity + 7) // 8)
+        ids_payload = "".join(f"{question_id}\n" for question_id in ids).encode("utf-8")
+        ids_tmp = self._path(self.IDS_FILE + ".tmp")
+        with open(ids_tmp, "wb") as f:
+            f.write(ids_payload)
+        
+        os.replace(vectors_tmp, self._path(self.VECTORS_FILE))
+        os.replace(tombstones_tmp, self._path(self.TOMBSTONES_FILE))
+        os.replace(ids_tmp, self._path(self.IDS_FILE))
+        self._write_meta({
+            "version": self.FORMAT_VERSION,
+            "dimension": dimension,
+            "dtype": dtype,
+            "count": len(ids),
+            "deleted": 0,
+            "capacity": capacity,
+            "ids_bytes": len(ids_payload),
+            "generation": generation,
+            "fingerprint": list(fingerprint) if fingerprint is not None else None,
+        })
+    
+    def _map(self):
+        """按当前容量映射向量和删除位图文件"""
+        capacity = self._meta["capacity"]
+        self._data = np.memmap(self._path(self.VECTORS_FILE), dtype=self._meta["dtype"], mode="r+",
+                               shape=(capacity, self._meta["dimension"]))
+        self._tombstones = np.memmap(self._path(self.TOMBSTONES_FILE), dtype=np.uint8, mode="r+",
+                                     shape=((capacity + 7) // 8,))
+    
+    def _reload(self):
+        """完整读取元数据和 ID 映射（调用方持有锁）"""
+        meta = self._read_meta()
+        if not meta:
+            raise ValueError("缺少 meta.json")
+        self._meta = meta
+        self._meta_stat = self._stat_meta()
+        self._ids = []
+        self._rows = {}
+        self._map()
+        self._read_ids(0, meta["ids_bytes"])
+    
+    def _read_ids(self, offset: int, end: int):
+        """读取 ids.txt 中 [offset, end) 的新行并更新映射"""
+        if end <= offset:
+            return
+        with open(self._path(self.IDS_FILE), "rb") as f:
+            f.seek(offset)
+            new_ids = f.read(end - offset).decode("utf-8").split("\n")[:-1]
+        start = len(self._ids)
+        self._ids.extend(new_ids)
+        dead = self._dead_mask(start, len(self._ids))
+        for row, question_id in enumerate(new_ids, start):
+            if not dead[row - start]:
+                self._rows[question_id] = row
+    
+    def _sync(self):
+        """读取其他进程已提交的写入（调用方持有锁）"""
+        meta = self._read_meta()
+        if meta.get("generation") != self._meta.get("generation"):
+            self._reload()
+            return
+        old_meta = self._meta
+        self._meta = meta
+        self._meta_stat = self._stat_meta()
+        if meta["capacity"] != old_meta["capacity"]:
+            self._map()
+        self._read_ids(old_meta["ids_bytes"], meta["ids_bytes"])
+    
+    def refresh(self) -> Tuple:
+        """meta.json 有变化时同步其他进程的写入，返回当前指纹"""
+        if self._stat_meta() != self._meta_stat:
+            with self._locked(exclusive=False):
+                self._sync()
+        return self.fingerprint
+    
+    # ---------- 删除位图 ----------
+    
+    def _is_dead(self, row: int) -> bool:
+        return bool(self._tombstones[row >> 3] & (1 << (row & 7)))
+    
+    def _mark_dead(self, row: int):
+        self._tombstones[row >> 3] |= np.uint8(1 << (row & 7))
+    
+    def _dead_mask(self, start: int, end: int) -> np.ndarray:
+        """返回 [start, end) 行的删除掩码"""
+        if end <= start:
+            return np.zeros(0, dtype=bool)
+        first, last = start >> 3, (end + 7) >> 3
+        bits = np.unpackbits(np.asarray(self._tombstones[first:last]), bitorder="little")
+        offset = start - (first << 3)
+        return bits[offset:offset + end - start].astype(bool)
+    
+    def _live_row(self, question_id: str) -> Optional[int]:
+        row = self._rows.get(question_id)
+        if row is None or self._is_dead(row):
+            return None
+        return row
+    
+    # ---------- 写入 ----------
+    
+    def _grow(self, size: int):
+        """扩展文件容量（倍增）"""
+        capacity = self._meta["capacity"]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2)
+        with open(self._path(self.VECTORS_FILE), "r+b") as f:
+            f.truncate(new_capacity * self._stride)
+        with open(self._path(self.TOMBSTONES_FILE), "r+b") as f:
+            f.truncate((new_capacity + 7) // 8)
+        self._meta = dict(self._meta, capacity=new_capacity)
+        self._map()
+    
+    def upsert(self, question_ids: List[str], vectors: np.ndarray):
+        """追加向量，已有的题目旧行打删除标记（零向量视为无向量并移除）"""
+        normalized, valid = EmbeddingMatrix.normalize(vectors)
+        check_dimension(normalized, self.dimension)
+        
+        with self._locked(exclusive=True):
+            self._sync()
+            meta = dict(self._meta)
+            count = meta["count"]
+            
+            # 同一批次内重复的 ID 以最后一次为准
+            latest: Dict[str, int] = {}
+            for i, (question_id, ok) in enumerate(zip(question_ids, valid)):
+                latest[question_id] = i if ok else -1
+            
+            deleted = 0
+            for question_id in latest:
+                row = self._live_row(question_id)
+                if row is not None:
+                    self._mark_dead(row)
+                    deleted += 1
+                    self._rows.pop(question_id)
+            appended = [(question_id, i) for question_id, i in latest.items() if i >= 0]
+            
+            if appended:
+                self._grow(count + len(appended))
+                self._data[count:count + len(appended)] = normalized[[i for _, i in appended]]
+                self._data.flush()
+                payload = "".join(f"{question_id}\n" for question_id, _ in appended).encode("utf-8")
+                with open(self._path(self.IDS_FILE), "r+b") as f:
+                    f.truncate(meta["ids_bytes"])
+                    f.seek(meta["ids_bytes"])
+                    f.write(payload)
+                for offset, (question_id, _) in enumerate(appended):
+                    self._ids.append(question_id)
+                    self._rows[question_id] = count + offset
+                meta["ids_bytes"] += len(payload)
+            self._tombstones.flush()
+            
+            meta.update(count=count + len(appended), deleted=meta["deleted"] + deleted,
+                        capacity=self._meta["capacity"], fingerprint=None)
+            self._write_meta(meta)
+            self._maybe_compact()
+    
+    def remove(self, question_id: str) -> bool:
+        """删除向量，返回是否存在"""
+        with self._locked(exclusive=True):
+            self._sync()
+            row = self._live_row(question_id)
+            self._rows.pop(question_id, None)
+            if row is None:
+                return False
+            self._mark_dead(row)
+            self._tombstones.flush()
+            self._write_meta(dict(self._meta, deleted=self._meta["deleted"] + 1, fingerprint=None))
+            self._maybe_compact()
+            return True
+    
+    def mark_synced(self, fingerprint: Tuple):
+        """记录与向量表一致时的指纹（写入数据库并同步到存储后调用）"""
+        with self._locked(exclusive=True):
+            self._sync()
+            self._write_meta(dict(self._meta, fingerprint=list(fingerprint)))
+    
+    def _maybe_compact(self):
+        """删除行过多时压缩（调用方持有写锁）"""
+        count, deleted = self._meta["count"], self._meta["deleted"]
+        if deleted >= self.INITIAL_CAPACITY and deleted >= count * self.COMPACT_RATIO:
+            self._compact_locked()
+    
+    def _compact_locked(self):
+        """只保留未删除的行，重写为新一代文件（调用方持有写锁）"""
+        count = self._meta["count"]
+        live = np.flatnonzero(~self._dead_mask(0, count))
+        ids = [self._ids[row] for row in live]
+        vectors = np.asarray(self._data[live], dtype=np.float32)
+        self._write_generation(ids, vectors, self.dimension, self.dtype, self._meta.get("fingerprint"),
+                               self._meta.get("generation", 0) + 1)
+        self._reload()
+        logger.info(f"压缩向量存储：{count} → {len(ids)} 行")
+    
+    def compact(self):
+        """立即压缩（去掉所有已删除的行）"""
+        with self._locked(exclusive=True):
+            self._sync()
+            self._compact_locked()
+    
+    # ---------- 检索 ----------
+    
+    def iter_blocks(self, block_rows: int, start: int = 0) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        从第 start 行起按块遍历有效向量（批处理任务使用，跳过已删除的行）
+        
+        Yields:
+            (题目 ID 列表, float32 向量 (n, d))，每块对应 [s, s + block_rows) 行
+        """
+        self.refresh()
+        count = self._meta.get("count", 0)
+        for offset in range(start, count, block_rows):
+            end = min(offset + block_rows, count)
+            live = np.flatnonzero(~self._dead_mask(offset, end))
+            yield ([self._ids[offset + row] for row in live],
+                   np.asarray(self._data[offset:end], dtype=np.float32)[live])
+    
+    def snapshot(self) -> VectorSnapshot:
+        """
+        固定当前已提交的行（不复制向量）
+        
+        写入只追加、压缩时替换为新文件，已映射的行不会被改写；
+        只需复制 ID 列表和删除掩码，之后的删除不影响快照。
+        """
+        self.refresh()
+        count = self._meta.get("count", 0)
+        ids = self._ids[:count]
+        dead = self._dead_mask(0, count).copy()
+        data = self._data
+        
+        def read_rows(start: int, end: int) -> Tuple[List[str], np.ndarray]:
+            live = np.flatnonzero(~dead[start:end])
+            return [ids[start + row] for row in live], np.asarray(data[start:end], dtype=np.float32)[live]
+        
+        return VectorSnapshot(self.name, count, read_rows)
+    
+    def search(self,
+               query: np.ndarray,
+               top_k: int,
+               threshold: float,
+               exclude_ids: Optional[Iterable[str]] = None,
+               candidate_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        分块扫描全部行（精确检索）
+        
+        Args:
+            query: 查询向量（无需归一化）
+            top_k: 返回最多结果数
+            threshold: 相似度阈值
+            exclude_ids: 排除的题目 ID
+            candidate_ids: 候选题目 ID（None 表示全部行）
+        
+        Returns:
+            按相似度降序的 (题目 ID, 相似度) 列表
+        """
+        if candidate_ids is not None:
+            return self.search_batch(query, top_k, threshold, exclude_ids, candidate_ids)[0]
+        self.refresh()
+        count = self._meta.get("count", 0)
+        if count == 0 or top_k <= 0:
+            return []
+        
+        normalized, valid = EmbeddingMatrix.normalize(query)
+        check_dimension(normalized, self.dimension)
+        if not valid[0]:
+            return []
+        query = normalized[0]
+        
+        excluded = [row for row in (self._rows.get(question_id) for question_id in exclude_ids or ())
+                    if row is not None]
+        rows_parts, scores_parts = [], []
+        chunk = max(64, self.SEARCH_CHUNK_ELEMENTS // self.dimension)
+        for start in range(0, count, chunk):
+            end = min(start + chunk, count)
+            block = self._data[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores = block @ query
+            scores[self._dead_mask(start, end)] = -np.inf
+            for row in excluded:
+                if start <= row < end:
+                    scores[row - start] = -np.inf
+            candidates = np.flatnonzero(scores >= threshold)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+            rows_parts.append(candidates + start)
+            scores_parts.append(scores[candidates])
+        
+        rows = np.concatenate(rows_parts)
+        scores = np.concatenate(scores_parts)
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [(self._ids[rows[i]], float(scores[i])) for i in order]
+    
+    def search_batch(self,
+                     queries: np.ndarray,
+                     top_k: int,
+                     threshold: float,
+                     exclude_ids: Optional[Iterable[str]] = None,
+                     candidate_ids: Optional[Iterable[str]] = None) -> List[List[Tuple[str, float]]]:
+        """批量检索：分块计算 Q×N 得分矩阵（见 batch_top_k）；指定候选集合时只读取候选行"""
+        self.refresh()
+        normalized, valid = EmbeddingMatrix.normalize(queries)
+        count = self._meta.get("count", 0)
+        if count == 0 or top_k <= 0:
+            return [[] for _ in range(len(normalized))]
+        check_dimension(normalized, self.dimension)
+        
+        if candidate_ids is not None:
+            subset = subset_rows(self._rows, candidate_ids, exclude_ids,
+                                 is_live=lambda row: row < count and not self._is_dead(row))
+            
+            def score_subset(start: int, end: int) -> np.ndarray:
+                scores = normalized @ np.asarray(self._data[subset[start:end]], dtype=np.float32).T
+                scores[~valid] = -np.inf
+                return scores
+            
+            chunk = max(64, BATCH_BLOCK_ELEMENTS // max(len(normalized), self.dimension))
+            hits = batch_top_k(score_subset, len(subset), len(normalized), chunk, top_k, threshold)
+            return [[(self._ids[subset[row]], score) for row, score in query_hits] for query_hits in hits]
+        
+        excluded = np.array([row for row in (self._rows.get(question_id) for question_id in exclude_ids or ())
+                             if row is not None], dtype=np.int64)
+        
+        def score_block(start: int, end: int) -> np.ndarray:
+            block = self._data[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores = normalized @ block.T
+            scores[~valid] = -np.inf
+            scores[:, self._dead_mask(start, end)] = -np.inf
+            inside = excluded[(excluded >= start) & (excluded < end)]
+            scores[:, inside - start] = -np.inf
+            return scores
+        
+        chunk = max(64, BATCH_BLOCK_ELEMENTS // max(len(normalized), self.dimension))
+        hits = batch_top_k(score_block, count, len(normalized), chunk, top_k, threshold)
+        return [[(self._ids[row], score) for row, score in query_hits] for query_hits in hits]
@@ -0,0 +1,37 @@
+"""
+core 测试公共 fixture
+"""
+import pytest
+
+from core.database.connection import ConnectionPool, DatabaseConnection
+
+
+@pytest.fixture
+def temp_db_factory(tmp_path):
+    """
+    临时 SQLite 数据库工厂（不影响单例 db），测试结束时关闭连接
+    
+    每个参数是一条建表 SQL，或 (SQL, 参数列表) 形式的批量写入：
+        
+        db = temp_db_factory(
+            "CREATE TABLE questions (id TEXT PRIMARY KEY, content TEXT)",
+            ("INSERT INTO questions VALUES (?, ?)", [("q1", "题目1")]),
+        )
+    """
+    connections = []
+    
+    def create(*statements) -> DatabaseConnection:
+        conn = object.__new__(DatabaseConnection)
+        conn.db_path = str(tmp_path / f"test_{len(connections)}.db")
+        conn.pool = ConnectionPool(conn.db_path, size=2)
+        connections.append(conn)
+        for statement in statements:
+            if isinstance(statement, tuple):
+                conn.executemany(*statement)
+            else:
+                conn.execute(statement)
+        return conn
+    
+    yield create
+    for conn in connections:
+        conn.pool.close_all()
@@ -6,6 +6,7 @@ import pytest
 import sys
 import os
 from datetime import datetime
+from unittest.mock import patch
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -13,12 +14,14 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspa
 from core.database.repositories import CategoryRepository
 from core.models import Category, CategoryCreate, CategoryUpdate
 from core.database.connection import DatabaseConnection
+from core.database.migrations import ensure_category_closure, rebuild_category_closure
 
 
 @pytest.fixture
 def db_connection():
     """数据库连接 fixture"""
     db = DatabaseConnection()
+    ensure_category_closure()
     yield db
     # 清理测试数据
     cleanup_test_categories(db)
@@ -378,5 +381,144 @@ class TestCategoryRepositoryGetTree:
         assert root1.id in root_ids or root2.id in root_ids  # 至少有一个根节点
 
 
+class TestCategoryRepositoryCache:
+    """测试进程级分类缓存"""
+    
+    def test_cache_hit_does_not_query_database(self, category_repo, db_connection):
+        """测试缓存命中时不访问数据库"""
+        category_repo.get_cache()
+        
+        with patch('core.database.repositories.db') as mock_db:
+            category_map = category_repo.get_category_map()
+            category_repo.get_tree()
+            
+            mock_db.fetch_all.assert_not_called()
+            mock_db.fetch_one.assert_not_called()
+        
+        assert isinstance(category_map, dict)
+    
+    def test_cache_shared_between_instances(self, category_repo, db_connection):
+        """测试缓存在所有仓库实例间共享"""
+        created = category_repo.create(CategoryCreate(name="测试分类 - 共享缓存", description="测试用"))
+        
+        other_repo = CategoryRepository()
+        
+        assert other_repo.get_cache() is category_repo.get_cache()
+        assert other_repo.get_cached(created.id).name == "测试分类 - 共享缓存"
+    
+    def test_cache_invalidated_on_create(self, category_repo, db_connection):
+        """测试创建分类后缓存失效"""
+        version = category_repo.get_cache().version
+        
+        created = category_repo.create(CategoryCreate(name="测试分类 - 缓存创建", description="测试用"))
+        
+        cache = category_repo.get_cache()
+        assert cache.version > version
+        assert created.id in cache.by_id
+    
+    def test_cache_invalidated_on_update(self, category_repo, db_connection):
+        """测试更新分类后缓存失效"""
+        created = category_repo.create(CategoryCreate(name="测试分类 - 缓存更新前", description="测试用"))
+        category_repo.get_cache()
+        
+        category_repo.update(created.id, CategoryUpdate(name="测试分类 - 缓存更新后"))
+        
+        assert category_repo.get_cached(created.id).name == "测试分类 - 缓存更新后"
+    
+    def test_cache_invalidated_on_delete(self, category_repo, db_connection):
+        """测试删除分类后缓存失效"""
+        created = category_repo.create(CategoryCreate(name="测试分类 - 缓存删除", description="测试用"))
+        assert category_repo.get_cached(created.id) is not None
+        
+        category_repo.delete(created.id)
+        
+        assert category_repo.get_cached(created.id) is None
+    
+    def test_breadcrumb_and_descendants(self, category_repo, db_connection):
+        """测试基于缓存的面包屑与子孙分类"""
+        level1 = category_repo.create(CategoryCreate(name="测试分类-缓存L1", description="测试用"))
+        level2 = category_repo.create(CategoryCreate(name="测试分类-缓存L2", description="测试用", parent_id=level1.id))
+        level3 = category_repo.create(CategoryCreate(name="测试分类-缓存L3", description="测试用", parent_id=level2.id))
+        
+        breadcrumb = category_repo.get_breadcrumb(level3.id)
+        descendants = category_repo.get_descendant_ids(level1.id)
+        
+        assert [b['id'] for b in breadcrumb] == [level1.id, level2.id, level3.id]
+        assert descendants[0] == level1.id
+        assert set(descendants) == {level1.id, level2.id, level3.id}
+        assert category_repo.get_descendant_ids(level3.id) == [level3.id]
+
+
+class TestCategoryClosure:
+    """测试分类闭包表维护"""
+    
+    @pytest.fixture
+    def hierarchy(self, category_repo, db_connection):
+        """A → B → C，另有独立的 D"""
+        a = category_repo.create(CategoryCreate(name="测试分类-闭包A", description="测试用"))
+        b = category_repo.create(CategoryCreate(name="测试分类-闭包B", description="测试用", parent_id=a.id))
+        c = category_repo.create(CategoryCreate(name="测试分类-闭包C", description="测试用", parent_id=b.id))
+        d = category_repo.create(CategoryCreate(name="测试分类-闭包D", description="测试用"))
+        return a, b, c, d
+    
+    @staticmethod
+    def _closure_rows(db, ids):
+        placeholders = ', '.join('?' for _ in ids)
+        rows = db.fetch_all(
+            f"SELECT ancestor_id, descendant_id, depth FROM category_closure "
+            f"WHERE descendant_id IN ({placeholders})",
+            tuple(ids)
+        )
+        return {(r['ancestor_id'], r['descendant_id'], r['depth']) for r in rows}
+    
+    def test_move_subtree(self, category_repo, db_connection, hierarchy):
+        """测试移动分类后整棵子树的祖先随之更新"""
+        a, b, c, d = hierarchy
+        
+        category_repo.update(b.id, CategoryUpdate(parent_id=d.id))
+        
+        assert [x['id'] for x in category_repo.get_breadcrumb(c.id)] == [d.id, b.id, c.id]
+        assert category_repo.get_descendant_ids(a.id) == [a.id]
+        assert category_repo.get_descendant_ids(d.id) == [d.id, b.id, c.id]
+    
+    def test_move_under_descendant_rejected(self, category_repo, db_connection, hierarchy):
+        """测试不能移动到自己的子孙分类下"""
+        a, b, c, d = hierarchy
+        
+        with pytest.raises(ValueError):
+            category_repo.update(a.id, CategoryUpdate(parent_id=c.id))
+        
+        assert category_repo.get_by_id(a.id).parent_id is None
+    
+    def test_delete_detaches_children(self, category_repo, db_connection, hierarchy):
+        """测试删除分类后子分类不再属于原祖先"""
+        a, b, c, d = hierarchy
+        
+        category_repo.delete(b.id)
+        
+        assert category_repo.get_descendant_ids(a.id) == [a.id]
+        assert category_repo.get_breadcrumb(c.id)[-1]['id'] == c.id
+        assert b.id not in {row[0] for row in self._closure_rows(db_connection, [c.id])}
+    
+    def test_subtree(self, category_repo, db_connection, hierarchy):
+        """测试通过闭包表加载子树"""
+        a, b, c, d = hierarchy
+        
+        tree = category_repo.get_tree(a.id)
+        
+        assert [node['id'] for node in tree] == [b.id]
+        assert [node['id'] for node in tree[0]['children']] == [c.id]
+    
+    def test_rebuild_matches_triggers(self, category_repo, db_connection, hierarchy):
+        """测试重建结果与触发器维护的结果一致"""
+        ids = [cat.id for cat in hierarchy]
+        category_repo.update(hierarchy[1].id, CategoryUpdate(parent_id=hierarchy[3].id))
+        before = self._closure_rows(db_connection, ids)
+        
+        rebuild_category_closure()
+        
+        assert self._closure_rows(db_connection, ids) == before
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,198 @@
+"""
+数据库连接池测试
+
+使用临时数据库文件测试 ConnectionPool 的 PRAGMA 配置、借出/归还、
+读写分离和并发写入
+"""
+
+import pytest
+import sqlite3
+import threading
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from core.database.connection import ConnectionPool, db, transaction
+from core.exceptions import DatabaseException
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """临时数据库连接池 fixture"""
+    pool = ConnectionPool(str(tmp_path / "test.db"), size=2, timeout=0.1, busy_timeout_ms=2000)
+    with pool.writer() as conn:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    yield pool
+    pool.close_all()
+
+
+class TestConnectionPoolPragmas:
+    """测试连接配置"""
+    
+    def test_writer_pragmas(self, pool):
+        """测试写连接使用 WAL 和 synchronous=NORMAL"""
+        conn = pool.get_writer()
+        
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 2000
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    
+    def test_reader_is_query_only(self, pool):
+        """测试读连接不能写入"""
+        with pool.reader() as conn:
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("INSERT INTO items (name) VALUES ('x')")
+
+
+class TestConnectionPoolCheckout:
+    """测试借出和归还"""
+    
+    def test_checkin_reuses_connection(self, pool):
+        """测试归还后复用同一连接"""
+        conn = pool.checkout()
+        pool.checkin(conn)
+        
+        assert pool.checkout() is conn
+        assert pool.stats()["readers"] == 1
+    
+    def test_pool_is_bounded(self, pool):
+        """测试达到上限后等待超时"""
+        first = pool.checkout()
+        second = pool.checkout()
+        
+        with pytest.raises(DatabaseException):
+            pool.checkout()
+        
+        assert pool.stats() == {"size": 2, "readers": 2, "idle": 0, "in_use": 2}
+        pool.checkin(first)
+        pool.checkin(second)
+    
+    def test_closed_writer_is_reopened(self, pool):
+        """测试调用方误关闭共享写连接后自动重建"""
+        conn = pool.get_writer()
+        conn.close()
+        
+        new_conn = pool.get_writer()
+        
+        assert new_conn is not conn
+        assert new_conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+
+
+class TestConnectionPoolTransaction:
+    """测试事务（工作单元）"""
+    
+    @staticmethod
+    def _count(pool):
+        with pool.reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    
+    def test_commits_once(self, pool):
+        """测试事务内多条语句只提交一次"""
+        statements = []
+        pool.set_trace_callback(statements.append)
+        
+        with pool.transaction() as conn:
+            for i in range(5):
+                conn.execute("INSERT INTO items (name) VALUES (?)", (str(i),))
+        
+        pool.set_trace_callback(None)
+        assert statements.count("COMMIT") == 1
+        assert self._count(pool) == 5
+    
+    def test_rollback_on_error(self, pool):
+        """测试异常时整体回滚"""
+        with pytest.raises(RuntimeError):
+            with pool.transaction() as conn:
+                conn.execute("INSERT INTO items (name) VALUES ('a')")
+                raise RuntimeError("boom")
+        
+        assert self._count(pool) == 0
+        assert not pool.in_transaction()
+    
+    def test_nested_savepoint_rollback(self, pool):
+        """测试内层失败只回滚内层"""
+        with pool.transaction() as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('outer')")
+            with pytest.raises(RuntimeError):
+                with pool.transaction():
+                    conn.execute("INSERT INTO items (name) VALUES ('inner')")
+                    raise RuntimeError("boom")
+            assert pool.in_transaction()
+        
+        with pool.reader() as reader:
+            rows = reader.execute("SELECT name FROM items").fetchall()
+        assert [row[0] for row in rows] == ["outer"]
+    
+    def test_in_transaction_is_per_thread(self, pool):
+        """测试事务状态只对所属线程可见"""
+        seen = []
+        
+        with pool.transaction():
+            thread = threading.Thread(target=lambda: seen.append(pool.in_transaction()))
+            thread.start()
+            thread.join()
+            assert pool.in_transaction()
+        
+        assert seen == [False]
+
+
+class TestConnectionPoolConcurrency:
+    """测试并发读写"""
+    
+    def test_reader_not_blocked_by_open_write(self, pool):
+        """测试写事务未提交时读连接仍可读取已提交数据"""
+        with pool.writer() as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('committed')")
+        
+        with pool.transaction() as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('pending')")
+            
+            with pool.reader() as reader:
+                rows = reader.execute("SELECT name FROM items").fetchall()
+        
+        assert [row[0] for row in rows] == ["committed"]
+    
+    def test_concurrent_writes(self, pool):
+        """测试多线程并发写入不会出现 database is locked"""
+        errors = []
+        
+        def worker(n):
+            try:
+                for i in range(20):
+                    with pool.transaction() as conn:
+                        conn.execute("INSERT INTO items (name) VALUES (?)", (f"{n}-{i}",))
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert errors == []
+        with pool.reader() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 160
+
+
+class TestDatabaseConnectionTransaction:
+    """测试 db.execute / fetch_* 在事务内复用同一连接"""
+    
+    def test_fetch_sees_uncommitted_writes(self):
+        """测试事务内查询能读到未提交的写入，回滚后消失"""
+        tag_id = "test-uow-tag"
+        
+        with pytest.raises(RuntimeError):
+            with transaction():
+                db.execute(
+                    "INSERT INTO tags (id, name, color, created_at) VALUES (?, ?, ?, ?)",
+                    (tag_id, "测试标签-事务", "#000000", "2024-01-01T00:00:00")
+                )
+                assert db.in_transaction()
+                assert db.fetch_one("SELECT id FROM tags WHERE id = ?", (tag_id,)) is not None
+                raise RuntimeError("rollback")
+        
+        assert db.fetch_one("SELECT id FROM tags WHERE id = ?", (tag_id,)) is None
@@ -0,0 +1,170 @@
+"""
+全库近似重复扫描测试
+测试分块自连接、近邻检索、并查集聚类和报告表
+"""
+import pytest
+import sys
+import os
+import numpy as np
+from unittest.mock import Mock, patch
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services.duplicate_scanner import DuplicateScanner, UnionFind
+from core.services.vector_backends import VectorSnapshot, build_backend
+from core.services.vector_store import MemmapVectorStore
+
+
+def duplicated_vectors(size=300, dim=16, seed=0):
+    """随机向量，其中 q0/q1/q2 与 q10/q11 为两组近似重复"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((size, dim)).astype(np.float32)
+    vectors[1] = vectors[0] + 0.01
+    vectors[2] = vectors[1] + 0.01
+    vectors[11] = vectors[10] - 0.01
+    return [f"q{i}" for i in range(size)], vectors
+
+
+def brute_force_pairs(ids, vectors, threshold):
+    """逐对计算的期望结果"""
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ normalized.T
+    return {tuple(sorted((ids[i], ids[j]))) for i in range(len(ids)) for j in range(i + 1, len(ids))
+            if scores[i, j] >= threshold}
+
+
+@pytest.fixture
+def report_db(temp_db_factory):
+    """临时 SQLite 数据库：300 道题目"""
+    return temp_db_factory(
+        "CREATE TABLE questions (id TEXT PRIMARY KEY, content TEXT)",
+        ("INSERT INTO questions VALUES (?, ?)", [(f"q{i}", f"题目{i}") for i in range(300)]),
+    )
+
+
+def scanner_for(db, backend):
+    vector_index = Mock()
+    vector_index.snapshot_backend.side_effect = lambda: (
+        backend.snapshot() if hasattr(backend, "snapshot") else VectorSnapshot.copy_of(backend, backend.search_batch)
+    )
+    return DuplicateScanner(db, vector_index)
+
+
+class TestUnionFind:
+    """并查集测试"""
+    
+    def test_groups(self):
+        """测试传递合并和按大小排序"""
+        clusters = UnionFind()
+        clusters.union("b", "c")
+        clusters.union("x", "y")
+        clusters.union("a", "b")
+        
+        assert clusters.find("a") == clusters.find("c")
+        assert clusters.groups() == [["a", "b", "c"], ["x", "y"]]
+
+
+class TestDuplicateScanner:
+    """全库查重测试（真实 SQLite）"""
+    
+    @pytest.mark.parametrize("dtype", ["float32", "int8"])
+    def test_self_join_matches_brute_force(self, report_db, dtype):
+        """测试分块自连接（块大小不整除行数）与逐对计算一致"""
+        ids, vectors = duplicated_vectors()
+        backend = build_backend("exact", ids, vectors, {"dtype": dtype})
+        scanner = scanner_for(report_db, backend)
+        
+        with patch.object(DuplicateScanner, 'BLOCK_ROWS', 64):
+            found = {tuple(sorted(pair[:2])) for _, pairs in scanner.iter_pairs(backend, 0.99) for pair in pairs}
+        
+        assert found == brute_force_pairs(ids, vectors, 0.99)
+        assert found == {("q0", "q1"), ("q0", "q2"), ("q1", "q2"), ("q10", "q11")}
+    
+    def test_run_writes_report(self, report_db):
+        """测试运行记录、题目对和重复簇写入报告表"""
+        ids, vectors = duplicated_vectors()
+        scanner = scanner_for(report_db, build_backend("exact", ids, vectors))
+        
+        with patch.object(DuplicateScanner, 'BLOCK_ROWS', 64):
+            run = scanner.run(threshold=0.99)
+        
+        assert run['status'] == 'completed'
+        assert run['method'] == 'exact'
+        assert (run['total_vectors'], run['scanned']) == (300, 300)
+        assert (run['pair_count'], run['cluster_count']) == (4, 2)
+        clusters = scanner.get_clusters(run['id'])
+        assert [[q['id'] for q in c['questions']] for c in clusters] == [["q0", "q1", "q2"], ["q10", "q11"]]
+        assert clusters[0]['questions'][0]['content'] == "题目0"
+        assert clusters[0]['max_similarity'] > 0.99
+        assert scanner.get_clusters(run['id'], limit=1, offset=1)[0]['cluster_id'] == 2
+        assert [r['id'] for r in scanner.list_runs()] == [run['id']]
+    
+    def test_memmap_store_skips_deleted(self, report_db, tmp_path):
+        """测试内存映射存储按块遍历时跳过已删除的行"""
+        ids, vectors = duplicated_vectors()
+        store = MemmapVectorStore.create(str(tmp_path / "store"), 16, "float16", ids, vectors)
+        store.remove("q2")
+        scanner = scanner_for(report_db, store)
+        
+        with patch.object(DuplicateScanner, 'BLOCK_ROWS', 64):
+            run = scanner.run(threshold=0.99)
+        
+        assert run['pair_count'] == 2
+        assert [[q['id'] for q in c['questions']] for c in scanner.get_clusters(run['id'])] == \
+            [["q0", "q1"], ["q10", "q11"]]
+    
+    def test_snapshot_unaffected_by_concurrent_removal(self, report_db):
+        """测试扫描快照期间删除题目（矩阵用最后一行填补空位）不影响遍历结果"""
+        ids, vectors = duplicated_vectors()
+        backend = build_backend("exact", ids, vectors)
+        scanner = scanner_for(report_db, backend)
+        snapshot = backend.snapshot()
+        
+        found = set()
+        with patch.object(DuplicateScanner, 'BLOCK_ROWS', 64):
+            for i, (_, pairs) in enumerate(scanner.iter_pairs(snapshot, 0.99)):
+                if i == 0:
+                    for question_id in ("q0", "q10", "q150"):
+                        backend.remove(question_id)
+                found.update(tuple(sorted(pair[:2])) for pair in pairs)
+        
+        assert len(snapshot) == 300
+        assert found == brute_force_pairs(ids, vectors, 0.99)
+    
+    def test_memmap_snapshot_ignores_later_writes(self, report_db, tmp_path):
+        """测试内存映射存储的快照不受之后的删除和追加影响"""
+        ids, vectors = duplicated_vectors()
+        store = MemmapVectorStore.create(str(tmp_path / "store"), 16, "float32", ids, vectors)
+        snapshot = store.snapshot()
+        store.remove("q0")
+        store.upsert(["q1"], vectors[200:201])
+        
+        rows = [(block_ids, block) for block_ids, block in snapshot.iter_blocks(64)]
+        
+        assert [question_id for block_ids, _ in rows for question_id in block_ids] == ids
+        assert np.allclose(rows[0][1][1], vectors[1] / np.linalg.norm(vectors[1]), atol=1e-6)
+    
+    def test_ann_backend(self, report_db):
+        """测试近似后端通过批量近邻检索找出题目对（每对只记录一次）"""
+        ids, vectors = duplicated_vectors()
+        scanner = scanner_for(report_db, build_backend("ivf", ids, vectors, {"nlist": 4, "nprobe": 4}))
+        
+        run = scanner.run(threshold=0.99, top_k=5)
+        
+        assert run['method'] == 'ann'
+        assert run['pair_count'] == 4
+        assert run['cluster_count'] == 2
+    
+    def test_failure_recorded(self, report_db):
+        """测试扫描异常时记录失败状态"""
+        vector_index = Mock()
+        vector_index.snapshot_backend.side_effect = RuntimeError("加载失败")
+        scanner = DuplicateScanner(report_db, vector_index)
+        
+        run = scanner.run()
+        
+        assert run['status'] == 'failed'
+        assert "加载失败" in run['error']
+        assert run['finished_at'] is not None
@@ -0,0 +1,225 @@
+"""
+后台向量化任务队列测试
+测试任务登记去重、领取与租约、失败退避、队列状态和 worker 批处理
+"""
+import pytest
+import sys
+import os
+import time
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services import embedding_queue
+from core.services.embedding_queue import EmbeddingJobQueue, EmbeddingWorker
+
+
+@pytest.fixture
+def queue_db(temp_db_factory):
+    """临时 SQLite 数据库：三道题目"""
+    return temp_db_factory(
+        "CREATE TABLE questions (id TEXT PRIMARY KEY, content TEXT, options TEXT)",
+        ("INSERT INTO questions (id, content, options) VALUES (?, ?, ?)", [
+            ("q1", "题目 1", '["A", "B"]'), ("q2", "题目 2", "[]"), ("q3", "题目 3", "[]")
+        ]),
+    )
+
+
+def job(db, question_id):
+    return db.fetch_one("SELECT * FROM embedding_jobs WHERE question_id = ?", (question_id,))
+
+
+class TestEmbeddingJobQueue:
+    """任务队列测试（真实 SQLite）"""
+    
+    def test_enqueue_dedup_and_reset(self, queue_db):
+        """测试同一道题只保留一条任务，重新登记时回到 pending 并清空重试次数"""
+        queue = EmbeddingJobQueue(queue_db)
+        assert queue.enqueue(["q1", "q2", "q1"]) == 2
+        assert queue.wakeup.is_set()
+        
+        queue_db.execute("UPDATE embedding_jobs SET status = 'failed', attempts = 5, last_error = 'x' "
+                         "WHERE question_id = 'q1'")
+        queue.enqueue(["q1"])
+        
+        row = job(queue_db, "q1")
+        assert (row['status'], row['attempts'], row['last_error']) == ('pending', 0, None)
+        assert queue.get_status()['depth'] == 2
+    
+    def test_claim_marks_running_and_respects_due_time(self, queue_db):
+        """测试领取的任务标记为 running 不会再被领取，未到重试时间的任务不领取"""
+        queue = EmbeddingJobQueue(queue_db)
+        queue.enqueue(["q1", "q2", "q3"])
+        queue_db.execute("UPDATE embedding_jobs SET next_attempt_at = ? WHERE question_id = 'q3'",
+                         (time.time() + 60,))
+        
+        assert queue.claim(1) == ["q1"]
+        assert queue.claim(10) == ["q2"]
+        assert queue.claim(10) == []
+        assert job(queue_db, "q1")['status'] == 'running'
+    
+    def test_stale_lease_reclaimed(self, queue_db):
+        """测试超过租约时间未完成的任务（worker 退出）重新领取"""
+        queue = EmbeddingJobQueue(queue_db)
+        queue.enqueue(["q1"])
+        queue.claim(10)
+        queue_db.execute("UPDATE embedding_jobs SET locked_at = ?",
+                         (time.time() - embedding_queue.LEASE_SECONDS - 1,))
+        
+        assert queue.claim(10) == ["q1"]
+    
+    @patch('core.services.embedding_queue.config')
+    def test_fail_backoff_then_failed(self, mock_config, queue_db):
+        """测试失败后按指数退避重新排队，达到重试上限后标记为 failed，可手动重新排队"""
+        mock_config.EMBEDDING_QUEUE_MAX_ATTEMPTS = 3
+        mock_config.EMBEDDING_QUEUE_BACKOFF_SECONDS = 10.0
+        queue = EmbeddingJobQueue(queue_db)
+        queue.enqueue(["q1"])
+        
+        now = time.time()
+        queue.fail(["q1"], "timeout")
+        first = job(queue_db, "q1")
+        queue.fail(["q1"], "timeout")
+        second = job(queue_db, "q1")
+        assert (first['status'], first['attempts']) == ('pending', 1)
+        assert first['next_attempt_at'] == pytest.approx(now + 10, abs=1)
+        assert second['next_attempt_at'] == pytest.approx(now + 20, abs=1)
+        assert queue.claim(10) == []
+        
+        queue.fail(["q1"], "timeout")
+        status = queue.get_status()
+        assert (status['failed'], status['depth']) == (1, 0)
+        assert status['recent_errors'][0]['last_error'] == "timeout"
+        
+        assert queue.retry_failed() == 1
+        assert queue.claim(10) == ["q1"]
+    
+    def test_complete_keeps_requeued_job(self, queue_db):
+        """测试处理期间题目再次修改（重新登记）时任务保留，稍后重新向量化"""
+        queue = EmbeddingJobQueue(queue_db)
+        queue.enqueue(["q1", "q2"])
+        queue.claim(10)
+        queue.enqueue(["q2"])
+        
+        queue.complete(["q1", "q2"])
+        
+        assert job(queue_db, "q1") is None
+        assert job(queue_db, "q2")['status'] == 'pending'
+    
+    def test_status_lag(self, queue_db):
+        """测试队列延迟为最早待处理任务的等待时间"""
+        queue = EmbeddingJobQueue(queue_db)
+        assert queue.get_status()['lag_seconds'] == 0.0
+        
+        queue.enqueue(["q1", "q2"])
+        queue_db.execute("UPDATE embedding_jobs SET enqueued_at = ? WHERE question_id = 'q1'",
+                         (time.time() - 30,))
+        
+        status = queue.get_status()
+        assert (status['depth'], status['pending'], status['running']) == (2, 2, 0)
+        assert status['lag_seconds'] == pytest.approx(30, abs=2)
+
+
+class TestEmbeddingWorker:
+    """worker 批处理测试"""
+    
+    def _worker(self, queue, embedding_service, vector_index):
+        return EmbeddingWorker(queue, queue.db, lambda: (embedding_service, vector_index), batch_size=10, workers=1)
+    
+    def test_run_once_embeds_batch(self, queue_db):
+        """测试一次领取的任务合并为一次 embed_batch，已是最新或已删除的题目直接完成"""
+        queue = EmbeddingJobQueue(queue_db)
+        queue.enqueue(["q1", "q2", "deleted"])
+        embedding_service = Mock()
+        embedding_service.get_model_version.return_value = "m"
+        embedding_service.embed_batch.side_effect = lambda texts: [np.ones(4) for _ in texts]
+        vector_index = Mock()
+        vector_index.needs_reembedding.side_effect = lambda qid, *args: (qid == "q1", "")
+        
+        assert self._worker(queue, embedding_service, vector_index).run_once() == 3
+        
+        embedding_service.embed_batch.assert_called_once_with(["题目 1"])
+        items, model_version = vector_index.update_embeddings.call_args[0]
+        assert model_version == "m"
+        assert [(qid, content, options) for qid, _, content, options in items] == [("q1", "题目 1", "['A', 'B']")]
+        assert queue.get_status()['depth'] == 0
+    
+    def test_run_once_failure_requeues_bad_item(self, queue_db):
+        """测试整批失败时逐题重试，只有出错的题目按退避策略重新排队"""
+        queue = EmbeddingJobQueue(queue_db)
+        queue.enqueue(["q1", "q2"])
+        embedding_service = Mock()
+        embedding_service.get_model_version.return_value = "m"
+        
+        def embed_batch(texts):
+            if "题目 2" in texts:
+                raise TimeoutError("请求超时")
+            return [np.ones(4) for _ in texts]
+        
+        embedding_service.embed_batch.side_effect = embed_batch
+        vector_index = Mock()
+        vector_index.needs_reembedding.return_value = (True, "未向量化")
+        worker = self._worker(queue, embedding_service, vector_index)
+        
+        worker.run_once()
+        
+        assert job(queue_db, "q1") is None
+        row = job(queue_db, "q2")
+        assert (row['status'], row['attempts'], row['last_error']) == ('pending', 1, "请求超时")
+        assert worker.get_stats()['processed'] == 1
+        assert worker.get_stats()['failed'] == 1
+    
+    def test_run_once_without_embedding_service(self, queue_db):
+        """测试未配置 Embedding 服务时不领取任务"""
+        queue = EmbeddingJobQueue(queue_db)
+        queue.enqueue(["q1"])
+        
+        assert EmbeddingWorker(queue, queue_db, lambda: (None, None)).run_once() == 0
+        assert queue.get_status()['pending'] == 1
+    
+    def test_provider_cached_until_version_changes(self, queue_db):
+        """测试轮询时复用 Embedding 服务，生效版本切换或缓存到期后重新获取"""
+        queue = EmbeddingJobQueue(queue_db)
+        embedding_service = Mock()
+        embedding_service.get_model_version.return_value = "m1"
+        vector_index = Mock()
+        vector_index.get_active_version.return_value = "m1"
+        provider = Mock(return_value=(embedding_service, vector_index))
+        worker = EmbeddingWorker(queue, queue_db, provider)
+        
+        for _ in range(3):
+            worker.run_once()
+        assert provider.call_count == 1
+        
+        vector_index.get_active_version.return_value = "m2"
+        worker.run_once()
+        assert provider.call_count == 2
+        
+        worker.PROVIDER_REFRESH_SECONDS = 0
+        vector_index.get_active_version.return_value = "m1"
+        worker.run_once()
+        assert provider.call_count == 3
+    
+    def test_start_and_stop(self, queue_db):
+        """测试 worker 线程处理登记的任务后停止"""
+        queue = EmbeddingJobQueue(queue_db)
+        embedding_service = Mock()
+        embedding_service.get_model_version.return_value = "m"
+        embedding_service.embed_batch.side_effect = lambda texts: [np.ones(4) for _ in texts]
+        vector_index = Mock()
+        vector_index.needs_reembedding.return_value = (True, "未向量化")
+        worker = EmbeddingWorker(queue, queue_db, lambda: (embedding_service, vector_index), poll_seconds=0.05)
+        
+        worker.start()
+        queue.enqueue(["q1", "q2"])
+        deadline = time.time() + 5
+        while queue.get_status()['depth'] and time.time() < deadline:
+            time.sleep(0.02)
+        worker.stop()
+        
+        assert queue.get_status()['depth'] == 0
+        assert not worker.running
@@ -0,0 +1,201 @@
+"""
+向量模型版本管理测试
+测试影子构建、在线写入路由、原子切换、回滚和清理
+"""
+import pytest
+import sys
+import os
+import numpy as np
+from unittest.mock import Mock
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services.embedding_versions import EmbeddingVersionManager, resolve_embedding_config
+from core.services.vector_index import EmbeddingVersionMismatch, VectorIndex
+
+
+@pytest.fixture
+def sqlite_db(temp_db_factory):
+    """临时 SQLite 数据库：三道题目"""
+    return temp_db_factory(
+        "CREATE TABLE questions (id TEXT PRIMARY KEY, content TEXT, options TEXT, category_id TEXT, "
+        "created_at TEXT)",
+        ("INSERT INTO questions VALUES (?, ?, NULL, 'c1', ?)",
+         [(f"q{i}", f"题目{i}", f"2024-01-0{i + 1}") for i in range(3)]),
+    )
+
+
+@pytest.fixture
+def legacy_index(sqlite_db):
+    """已有 v1 二维向量、但没有版本记录的旧数据库"""
+    index = VectorIndex(sqlite_db)
+    index.update_embeddings([
+        (f"q{i}", np.array([1.0, float(i)]), f"题目{i}", None) for i in range(3)
+    ], "v1")
+    return index
+
+
+def new_model(dimension=3):
+    """新模型：按题号生成三维向量"""
+    service = Mock()
+    service.embed_batch.side_effect = lambda texts: [
+        np.eye(dimension)[int(text[-1]) % dimension] for text in texts
+    ]
+    return service
+
+
+def count(db, table, version=None):
+    sql = f"SELECT COUNT(*) as c FROM {table}" + (" WHERE embedding_version = ?" if version else "")
+    return db.fetch_one(sql, (version,) if version else ())['c']
+
+
+class TestShadowBuild:
+    """影子构建测试"""
+    
+    def test_build_keeps_serving_old_version(self, sqlite_db, legacy_index):
+        """测试构建写入影子表，检索仍使用旧版本"""
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        
+        version = manager.build(new_model(), "v2", batch_size=2)
+        
+        assert version['status'] == 'ready'
+        assert (version['dimension'], version['built'], version['total']) == (3, 3, 3)
+        assert legacy_index.get_active_version() == "v1"
+        assert count(sqlite_db, "question_embeddings_shadow", "v2") == 3
+        assert count(sqlite_db, "question_embeddings", "v1") == 3
+        hits = legacy_index.search_similar(np.array([1.0, 0.0]), threshold=0.99)
+        assert [hit['question_id'] for hit in hits] == ["q0"]
+        assert manager.pending("v2") == []
+    
+    def test_online_writes_routed_by_version(self, sqlite_db, legacy_index):
+        """测试构建期间生效版本写入正式表，新版本写入影子表"""
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        manager.start_build("v2")
+        
+        legacy_index.update_embedding("q0", np.array([0.0, 1.0]), "v1", "题目0")
+        legacy_index.update_embedding("q1", np.array([0.0, 0.0, 1.0]), "v2", "题目1")
+        
+        assert np.allclose(legacy_index.get_embedding("q0"), [0.0, 1.0])
+        assert np.allclose(legacy_index.get_embedding("q1"), [1.0, 1.0])
+        assert legacy_index.needs_reembedding("q1", "题目1", None, "v2") == (False, "无需重新向量化")
+        assert legacy_index.needs_reembedding("q2", "题目2", None, "v2")[0] is True
+        assert {q['id'] for q in legacy_index.get_mismatched_embeddings("v2")} == {"q0", "q2"}
+        assert [q['id'] for q in manager.pending("v2")] == ["q0", "q2"]
+    
+    def test_build_failure_recorded(self, sqlite_db, legacy_index):
+        """测试构建失败时记录状态，已写入的影子向量不影响检索"""
+        service = Mock()
+        service.embed_batch.side_effect = RuntimeError("服务不可用")
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        
+        version = manager.build(service, "v2")
+        
+        assert version['status'] == 'failed'
+        assert "服务不可用" in version['error']
+        assert legacy_index.get_active_version() == "v1"
+    
+    def test_empty_bank_activates_directly(self, sqlite_db):
+        """测试向量表为空时直接登记为生效版本"""
+        index = VectorIndex(sqlite_db)
+        manager = EmbeddingVersionManager(sqlite_db, index)
+        
+        version = manager.build(new_model(), "v2")
+        
+        assert version['status'] == 'active'
+        assert count(sqlite_db, "question_embeddings", "v2") == 3
+        assert count(sqlite_db, "question_embeddings_shadow") == 0
+
+
+class TestActivate:
+    """切换、回滚和清理测试"""
+    
+    def test_activate_swaps_versions(self, sqlite_db, legacy_index):
+        """测试切换后检索使用新版本，旧版本归档到影子表"""
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        manager.build(new_model(), "v2")
+        legacy_index.search_similar(np.array([1.0, 0.0]))
+        
+        version = manager.activate("v2")
+        
+        assert version['status'] == 'active'
+        assert manager.get_version("v1")['status'] == 'retired'
+        assert count(sqlite_db, "question_embeddings", "v2") == 3
+        assert count(sqlite_db, "question_embeddings_shadow", "v1") == 3
+        assert count(sqlite_db, "question_embeddings_shadow", "v2") == 0
+        hits = legacy_index.search_similar(np.array([0.0, 1.0, 0.0]), threshold=0.99)
+        assert [hit['question_id'] for hit in hits] == ["q1"]
+        assert legacy_index.get_memory_stats()['dimension'] == 3
+    
+    def test_search_follows_active_version(self, sqlite_db, legacy_index):
+        """测试切换后其他实例（进程）按生效版本重新加载，旧模型的查询向量明确报错"""
+        other = VectorIndex(sqlite_db)
+        other.search_similar(np.array([1.0, 0.0]), model_version="v1")
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        manager.build(new_model(), "v2")
+        
+        manager.activate("v2")
+        
+        hits = other.search_similar(np.array([0.0, 1.0, 0.0]), threshold=0.99, model_version="v2")
+        assert [hit['question_id'] for hit in hits] == ["q1"]
+        assert other.get_model_version() == "v2"
+        with pytest.raises(EmbeddingVersionMismatch):
+            other.search_similar(np.array([1.0, 0.0]), model_version="v1")
+    
+    def test_activate_requires_complete_build(self, sqlite_db, legacy_index):
+        """测试构建后题目变更需补齐才能切换"""
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        manager.build(new_model(), "v2")
+        sqlite_db.execute("UPDATE questions SET content = '题目修改1' WHERE id = 'q1'")
+        
+        with pytest.raises(ValueError, match="1 道题目"):
+            manager.activate("v2")
+        with pytest.raises(ValueError):
+            manager.activate("v3")
+        
+        manager.build(new_model(), "v2")
+        assert manager.activate("v2")['status'] == 'active'
+    
+    def test_rollback_and_gc(self, sqlite_db, legacy_index):
+        """测试切换回旧版本，以及清理退役版本"""
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        manager.build(new_model(), "v2")
+        manager.activate("v2")
+        
+        manager.activate("v1")
+        assert legacy_index.get_active_version() == "v1"
+        assert np.allclose(legacy_index.get_embedding("q2"), [1.0, 2.0])
+        
+        assert manager.gc(keep_latest_retired=True) == {}
+        assert manager.gc() == {"v2": 3}
+        assert count(sqlite_db, "question_embeddings_shadow") == 0
+        assert [v['version'] for v in manager.list_versions()] == ["v1"]
+    
+    def test_delete_removes_shadow_rows(self, sqlite_db, legacy_index):
+        """测试删除题目向量时同时删除影子向量"""
+        manager = EmbeddingVersionManager(sqlite_db, legacy_index)
+        manager.build(new_model(), "v2")
+        
+        legacy_index.delete_embedding("q0")
+        
+        assert count(sqlite_db, "question_embeddings_shadow", "v2") == 2
+
+
+class TestResolveEmbeddingConfig:
+    """按生效版本确定 Embedding 配置测试"""
+    
+    def test_api_model_follows_active_version(self):
+        """测试生效版本与配置的模型不同时覆盖模型名，其余配置不变"""
+        config = {'model_name': 'v1', 'base_url': 'http://api'}
+        
+        assert resolve_embedding_config(config, "v2") == {'model_name': 'v2', 'base_url': 'http://api'}
+        assert config['model_name'] == 'v1'
+        assert resolve_embedding_config(config, "v1") is config
+        assert resolve_embedding_config(config, None) is config
+    
+    def test_local_provider_unchanged(self):
+        """测试本地模型的版本无法还原为配置，保持原配置"""
+        config = {'provider': 'local', 'local_dimension': 64}
+        
+        assert resolve_embedding_config(config, "local-hashing-d256-ng1-3") is config
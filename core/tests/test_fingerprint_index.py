@@ -0,0 +1,109 @@
+"""
+文本指纹索引测试
+测试文本规范化、MinHash 相似度估计和 LSH 桶检索
+"""
+import pytest
+import sys
+import os
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services.fingerprint_index import (
+    FingerprintIndex, estimate_similarity, minhash_signature, normalize_text
+)
+
+BASE = "已知函数 f(x) = x^2 + 2x + 1，求函数 f(x) 在区间 [-3, 2] 上的最小值和最大值。"
+NEAR = "已知函数f(x)=x^2+2x+1，求函数f(x)在区间[-3,2]上的最小值与最大值"
+OTHER = "下列关于细胞有丝分裂的叙述，正确的是哪一项？"
+
+
+@pytest.fixture
+def fingerprint_db(temp_db_factory):
+    """临时 SQLite 数据库：两道相关题目和一道空题目"""
+    return temp_db_factory(
+        "CREATE TABLE questions (id TEXT PRIMARY KEY, content TEXT, created_at TEXT)",
+        ("INSERT INTO questions (id, content, created_at) VALUES (?, ?, ?)", [
+            ("q1", BASE, "2024-01-01"), ("q2", OTHER, "2024-01-02"), ("q3", "", "2024-01-03")
+        ]),
+    )
+
+
+class TestFingerprintFunctions:
+    """规范化与签名测试"""
+    
+    def test_normalize_text(self):
+        """测试统一全半角、大小写，去掉空白和句读标点，保留公式符号"""
+        assert normalize_text("Ｆ(x) = X + 1，求 值。") == "f(x)=x+1求值"
+    
+    def test_similarity_estimate(self):
+        """测试近似文本相似度高，无关文本相似度低"""
+        base = minhash_signature(normalize_text(BASE))
+        assert estimate_similarity(base, base) == 1.0
+        assert estimate_similarity(base, minhash_signature(normalize_text(NEAR))) >= 0.8
+        assert estimate_similarity(base, minhash_signature(normalize_text(OTHER))) < 0.2
+        assert minhash_signature(normalize_text("  。")) is None
+
+
+class TestFingerprintIndex:
+    """指纹索引测试（真实 SQLite）"""
+    
+    def test_find_exact_and_near(self, fingerprint_db):
+        """测试完全重复（仅标点空格不同）和近似重复都能召回，无关文本不召回"""
+        index = FingerprintIndex(fingerprint_db)
+        assert index.rebuild_all(batch_size=2) == {'total': 3, 'indexed': 2}
+        
+        exact = index.find_similar(BASE.replace("，", ",").replace(" ", ""))
+        assert [(h['question_id'], h['similarity'], h['exact']) for h in exact] == [("q1", 1.0, True)]
+        
+        near = index.find_similar(NEAR)
+        assert [h['question_id'] for h in near] == ["q1"]
+        assert not near[0]['exact']
+        assert near[0]['content'] == BASE
+        
+        assert index.find_similar("完全无关的一道英语阅读理解题目") == []
+        assert index.find_similar(NEAR, exclude_ids=["q1"]) == []
+    
+    def test_find_similar_batch(self, fingerprint_db):
+        """测试批量检索结果与查询一一对应"""
+        index = FingerprintIndex(fingerprint_db)
+        index.rebuild_all()
+        
+        results = index.find_similar_batch([OTHER, "无关题目内容示例", BASE])
+        
+        assert [[h['question_id'] for h in hits] for hits in results] == [["q2"], [], ["q1"]]
+    
+    def test_update_and_delete(self, fingerprint_db):
+        """测试覆盖写入、删除和覆盖统计；题目已删除的指纹不返回"""
+        index = FingerprintIndex(fingerprint_db)
+        index.update("q1", BASE)
+        index.update("q1", OTHER)
+        assert index.find_similar(BASE) == []
+        assert [h['question_id'] for h in index.find_similar(OTHER)] == ["q1"]
+        
+        index.delete("q1")
+        assert index.find_similar(OTHER) == []
+        
+        index.update("gone", BASE)
+        assert index.find_similar(BASE) == []
+        assert index.get_stats() == {'total_questions': 3, 'indexed': 0, 'missing': 3}
+    
+    def test_find_batch_duplicates(self):
+        """测试一批文本之间的重复"""
+        pairs = FingerprintIndex.find_batch_duplicates([BASE, OTHER, NEAR, BASE])
+        
+        assert [(i, j) for i, j, _ in pairs] == [(0, 2), (0, 3), (2, 3)]
+        assert pairs[1][2] == 1.0
+    
+    def test_find_batch_duplicates_only_compares_shared_buckets(self):
+        """测试只比较共享 LSH 桶的文本对，而不是两两比较"""
+        import core.services.fingerprint_index as module
+        contents = [f"第 {i} 题：计算 {i} 乘以 {i * 7 + 3} 再减去 {i * 13} 的结果是多少" for i in range(60)]
+        
+        with patch.object(module, 'estimate_similarity', wraps=module.estimate_similarity) as estimate:
+            pairs = FingerprintIndex.find_batch_duplicates(contents + [contents[5]])
+        
+        assert (5, 60, 1.0) in pairs
+        assert estimate.call_count < 60 * 61 // 2 // 10
@@ -0,0 +1,207 @@
+"""
+全文检索测试
+
+测试 core/database/fts.py 的查询构建，
+以及迁移中的 trigram FTS5 表（含字符二元组列）、键映射表和触发器在真实 SQLite 上的行为
+"""
+
+import pytest
+import sqlite3
+import sys
+import os
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from core.database.fts import build_match_query, is_fts5_supported
+from core.database.migrations import (
+    FTS_KEYS_TABLE_SQL, FTS_POSITIONS_FILL_SQL, FTS_POSITIONS_TABLE_SQL, FTS_TABLE_SQL, FTS_TRIGGERS
+)
+
+
+class TestBuildMatchQuery:
+    """测试查询表达式构建"""
+    
+    def test_phrase(self):
+        """测试关键词整体作为短语做子串匹配"""
+        assert build_match_query("的导数") == '"的导数"'
+        assert build_match_query("导数 x") == '"导数 x"'
+    
+    @pytest.mark.parametrize("keyword", [None, "", "导", "a"])
+    def test_too_short_returns_none(self, keyword):
+        """测试单个字符的关键词返回 None"""
+        assert build_match_query(keyword) is None
+    
+    def test_two_chars_match_bigram_columns(self):
+        """测试两个字符的关键词匹配二元组列中对齐的二元组"""
+        assert build_match_query("导数") == \
+            '{content_bigrams answer_bigrams explanation_bigrams} : "导数\x1f"'
+        assert build_match_query('a"') == \
+            '{content_bigrams answer_bigrams explanation_bigrams} : "a""\x1f"'
+    
+    def test_quotes_are_escaped(self):
+        """测试关键词中的引号不会破坏 MATCH 语法"""
+        assert build_match_query('a"bc') == '"a""bc"'
+
+
+@pytest.mark.skipif(not is_fts5_supported(sqlite3.connect(":memory:")), reason="SQLite 未编译 FTS5")
+class TestFtsTriggers:
+    """测试 FTS5 表与触发器"""
+    
+    @pytest.fixture
+    def conn(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE questions (id TEXT PRIMARY KEY, content TEXT, answer TEXT, explanation TEXT)")
+        conn.execute(FTS_TABLE_SQL)
+        conn.execute(FTS_KEYS_TABLE_SQL)
+        conn.execute(FTS_POSITIONS_TABLE_SQL)
+        conn.execute(FTS_POSITIONS_FILL_SQL, (100,))
+        for trigger_sql in FTS_TRIGGERS:
+            conn.execute(trigger_sql)
+        yield conn
+        conn.close()
+    
+    @staticmethod
+    def _search(conn, keyword):
+        rows = conn.execute(
+            "SELECT q.id FROM questions q JOIN questions_fts_keys k ON k.question_id = q.id "
+            "JOIN questions_fts ON questions_fts.rowid = k.key "
+            "WHERE questions_fts MATCH ? ORDER BY bm25(questions_fts)",
+            (build_match_query(keyword),)
+        ).fetchall()
+        return [row[0] for row in rows]
+    
+    def test_insert_update_delete_sync(self, conn):
+        """测试增删改同步索引"""
+        conn.execute("INSERT INTO questions VALUES ('q1', '求函数的导数', '2x', '幂函数求导')")
+        conn.execute("INSERT INTO questions VALUES ('q2', '中国的首都', '北京', '')")
+        
+        assert self._search(conn, "的导数") == ["q1"]
+        assert self._search(conn, "国的首") == ["q2"]
+        
+        conn.execute("UPDATE questions SET content = '法国的首都', answer = '巴黎' WHERE id = 'q2'")
+        assert self._search(conn, "中国的") == []
+        assert self._search(conn, "法国的") == ["q2"]
+        
+        conn.execute("DELETE FROM questions WHERE id = 'q1'")
+        assert self._search(conn, "的导数") == []
+        assert conn.execute("SELECT COUNT(*) FROM questions_fts_keys").fetchone()[0] == 1
+    
+    def test_other_writers_and_vacuum(self, conn):
+        """测试不注册任何自定义函数的连接写入也同步索引，VACUUM 后键不变"""
+        conn.execute("INSERT INTO questions VALUES ('q1', 'Compute the Derivative', '', '')")
+        conn.execute("INSERT INTO questions VALUES ('q2', '求极限', '', '')")
+        conn.execute("DELETE FROM questions WHERE id = 'q1'")
+        conn.execute("INSERT INTO questions VALUES ('q3', '求导数', '', '')")
+        conn.commit()
+        conn.execute("VACUUM")
+        
+        assert self._search(conn, "求极限") == ["q2"]
+        assert self._search(conn, "求导数") == ["q3"]
+        assert self._search(conn, "derivative") == []
+        
+        conn.execute("UPDATE questions SET content = 'compute the DERIVATIVE' WHERE id = 'q3'")
+        assert self._search(conn, "derivative") == ["q3"]
+    
+    def test_two_char_keywords(self, conn):
+        """测试双字词走二元组列：只命中真正包含该二元组的题目，增删改同样同步"""
+        conn.execute("INSERT INTO questions VALUES ('q1', '求函数的导数', '2x', NULL)")
+        conn.execute("INSERT INTO questions VALUES ('q2', '数函的关系', 'A', '')")
+        conn.execute("INSERT INTO questions VALUES ('q3', 'Log', '', '函')")
+        
+        assert self._search(conn, "函数") == ["q1"]
+        assert self._search(conn, "数函") == ["q2"]
+        assert self._search(conn, "2X") == ["q1"]
+        assert self._search(conn, "og") == ["q3"]
+        assert self._search(conn, "的数") == []
+        
+        conn.execute("UPDATE questions SET content = '求极限' WHERE id = 'q1'")
+        assert self._search(conn, "函数") == []
+        assert self._search(conn, "极限") == ["q1"]
+        
+        conn.execute("DELETE FROM questions WHERE id = 'q2'")
+        assert self._search(conn, "数函") == []
+    
+    def test_bm25_ranks_content_first(self, conn):
+        """测试题干命中排在解析命中之前"""
+        conn.execute("INSERT INTO questions VALUES ('q1', '其他题目', 'A', '考查导数的应用')")
+        conn.execute("INSERT INTO questions VALUES ('q2', '导数的定义', 'B', '')")
+        
+        rows = conn.execute(
+            "SELECT q.id FROM questions q JOIN questions_fts_keys k ON k.question_id = q.id "
+            "JOIN questions_fts ON questions_fts.rowid = k.key "
+            "WHERE questions_fts MATCH ? ORDER BY bm25(questions_fts, 10.0, 5.0, 2.0, 10.0, 5.0, 2.0)",
+            (build_match_query("导数的"),)
+        ).fetchall()
+        assert [row[0] for row in rows] == ["q2", "q1"]
+        
+        rows = conn.execute(
+            "SELECT q.id FROM questions q JOIN questions_fts_keys k ON k.question_id = q.id "
+            "JOIN questions_fts ON questions_fts.rowid = k.key "
+            "WHERE questions_fts MATCH ? ORDER BY bm25(questions_fts, 10.0, 5.0, 2.0, 10.0, 5.0, 2.0)",
+            (build_match_query("导数"),)
+        ).fetchall()
+        assert [row[0] for row in rows] == ["q2", "q1"]
+
+
+@pytest.mark.skipif(not is_fts5_supported(sqlite3.connect(":memory:")), reason="SQLite 未编译 FTS5")
+class TestEnsureFtsIndex:
+    """测试迁移时索引的替换与一致性检查"""
+    
+    @pytest.fixture
+    def temp_db(self, temp_db_factory):
+        conn = temp_db_factory(
+            "CREATE TABLE questions (id TEXT PRIMARY KEY, content TEXT, answer TEXT, explanation TEXT)",
+            ("INSERT INTO questions VALUES (?, ?, '', '')", [("q1", "求函数的导数"), ("q2", "求极限")]),
+        )
+        with patch('core.database.migrations.db', conn), \
+                patch('core.database.migrations.transaction', conn.pool.transaction):
+            yield conn
+    
+    def test_replaces_legacy_index(self, temp_db):
+        """测试旧版 unicode61 索引和触发器被替换为 trigram 索引"""
+        from core.database.migrations import ensure_fts_index
+        temp_db.execute("CREATE VIRTUAL TABLE questions_fts USING fts5(content, answer, explanation, "
+                        "tokenize = 'unicode61 remove_diacritics 2')")
+        temp_db.execute("CREATE TRIGGER questions_fts_ad AFTER DELETE ON questions BEGIN "
+                        "DELETE FROM questions_fts WHERE rowid = old.rowid; END")
+        
+        assert ensure_fts_index()
+        
+        sql = temp_db.fetch_one("SELECT sql FROM sqlite_master WHERE name = 'questions_fts'")['sql']
+        assert "trigram" in sql and "content_bigrams" in sql
+        trigger = temp_db.fetch_one("SELECT sql FROM sqlite_master WHERE name = 'questions_fts_ad'")['sql']
+        assert "questions_fts_keys" in trigger
+        assert temp_db.fetch_one("SELECT COUNT(*) as count FROM questions_fts")['count'] == 2
+    
+    def test_replaces_index_without_bigram_columns(self, temp_db):
+        """测试没有二元组列的 trigram 索引被替换，重建后双字词可以检索"""
+        from core.database.migrations import ensure_fts_index
+        temp_db.execute("CREATE VIRTUAL TABLE questions_fts USING fts5(content, answer, explanation, "
+                        "tokenize = 'trigram')")
+        
+        assert ensure_fts_index()
+        
+        row = temp_db.fetch_one(
+            "SELECT k.question_id FROM questions_fts_keys k JOIN questions_fts f ON f.rowid = k.key "
+            "WHERE questions_fts MATCH ?", (build_match_query("极限"),)
+        )
+        assert row['question_id'] == 'q2'
+        assert temp_db.fetch_one("SELECT COUNT(*) as count FROM questions_fts_positions")['count'] >= 65536
+    
+    def test_rebuilds_on_key_mismatch(self, temp_db):
+        """测试行数一致但键映射错位时重建索引"""
+        from core.database.migrations import ensure_fts_index, fts_index_consistent
+        ensure_fts_index()
+        temp_db.execute("UPDATE questions_fts_keys SET question_id = 'gone' WHERE question_id = 'q2'")
+        
+        assert not fts_index_consistent()
+        ensure_fts_index()
+        
+        assert fts_index_consistent()
+        row = temp_db.fetch_one(
+            "SELECT k.question_id FROM questions_fts_keys k JOIN questions_fts f ON f.rowid = k.key "
+            "WHERE questions_fts MATCH ?", (build_match_query("求极限"),)
+        )
+        assert row['question_id'] == 'q2'
@@ -0,0 +1,203 @@
+"""
+混合检索测试
+测试倒数排名融合、两路并行检索、来源降级和超时
+"""
+import pytest
+import sys
+import os
+import asyncio
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services.hybrid_search import HybridSearchService, reciprocal_rank_fusion
+
+
+def make_config(**overrides):
+    settings = {
+        'HYBRID_SEARCH_CANDIDATES': 50,
+        'HYBRID_SEARCH_TIMEOUT_MS': 1500,
+        'HYBRID_RRF_K': 60,
+        'HYBRID_MIN_SIMILARITY': 0.3,
+    }
+    settings.update(overrides)
+    return Mock(**settings)
+
+
+def make_repo(lexical_hits):
+    repo = Mock()
+    repo.lexical_search.return_value = lexical_hits
+    repo.get_by_ids.side_effect = lambda ids: [Mock(id=question_id) for question_id in ids]
+    return repo
+
+
+def make_provider(vector_hits):
+    vector_index = Mock()
+    vector_index.search_similar.return_value = [
+        {'question_id': question_id, 'similarity': similarity} for question_id, similarity in vector_hits
+    ]
+    return Mock(return_value=({'model_name': 'm1'}, vector_index)), vector_index
+
+
+@pytest.fixture(autouse=True)
+def async_embedding():
+    """异步 Embedding 客户端：查询向量固定为 [0.1, 0.2]"""
+    service = Mock()
+    service.embed = AsyncMock(return_value=[0.1, 0.2])
+    service.get_model_version.return_value = 'm1'
+    with patch('agent.services.async_embedding_service.get_async_embedding_service',
+               return_value=service) as get_service:
+        yield get_service
+
+
+def search(service, *args, **kwargs):
+    return asyncio.run(service.search(*args, **kwargs))
+
+
+class TestReciprocalRankFusion:
+    """倒数排名融合测试"""
+    
+    def test_fusion_scores(self):
+        """测试两路都命中的题目得分累加并排在前面"""
+        fused = reciprocal_rank_fusion({
+            'lexical': [('a', 9.0), ('b', 5.0)],
+            'vector': [('b', 0.9), ('c', 0.8)],
+        }, k=60)
+        
+        assert [question_id for question_id, _, _ in fused] == ['b', 'a', 'c']
+        assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+        assert fused[0][2] == {'lexical': {'rank': 2, 'score': 5.0}, 'vector': {'rank': 1, 'score': 0.9}}
+        assert fused[1][1] == pytest.approx(1 / 61)
+    
+    def test_empty(self):
+        """测试没有来源时返回空列表"""
+        assert reciprocal_rank_fusion({}) == []
+
+
+class TestHybridSearchService:
+    """混合检索服务测试"""
+    
+    @patch('core.services.hybrid_search.config', make_config())
+    def test_hybrid_mode(self, async_embedding):
+        """测试两路结果融合并带上各来源排名"""
+        repo = make_repo([('q1', 4.0), ('q2', 2.0)])
+        provider, vector_index = make_provider([('q3', 0.9), ('q1', 0.8)])
+        service = HybridSearchService(repo, provider)
+        
+        result = search(service, '求导', category_id='c1', tag_id='t1')
+        
+        assert result['mode'] == 'hybrid'
+        assert [hit['question'].id for hit in result['results']] == ['q1', 'q3', 'q2']
+        assert result['results'][0]['lexical'] == {'rank': 1, 'score': 4.0}
+        assert result['results'][0]['vector'] == {'rank': 2, 'score': 0.8}
+        assert result['results'][1]['lexical'] is None
+        assert result['sources']['lexical']['status'] == 'ok'
+        assert result['sources']['vector']['count'] == 2
+        repo.lexical_search.assert_called_once_with(
+            '求导', limit=50, category_id='c1', include_descendants=False, tag_id='t1'
+        )
+        vector_index.search_similar.assert_called_once_with(
+            [0.1, 0.2], threshold=0.3, top_k=50, model_version='m1',
+            category_id='c1', include_descendants=False, tag_id='t1'
+        )
+        async_embedding.assert_called_once_with({'model_name': 'm1'})
+        async_embedding.return_value.embed.assert_awaited_once_with('求导')
+    
+    @patch('core.services.hybrid_search.config', make_config())
+    def test_keyword_mode_skips_vector(self, async_embedding):
+        """测试仅关键词模式不调用 Embedding 服务"""
+        repo = make_repo([('q1', 4.0)])
+        provider, _ = make_provider([])
+        
+        result = search(HybridSearchService(repo, provider), '求导', mode='keyword')
+        
+        assert list(result['sources']) == ['lexical']
+        provider.assert_not_called()
+        async_embedding.assert_not_called()
+    
+    @patch('core.services.hybrid_search.config', make_config())
+    def test_vector_unavailable(self):
+        """测试未配置 Embedding 服务时只返回关键词结果"""
+        repo = make_repo([('q1', 4.0)])
+        service = HybridSearchService(repo, Mock(return_value=(None, None)))
+        
+        result = search(service, '求导')
+        
+        assert result['sources']['vector'] == {'status': 'unavailable'}
+        assert [hit['question'].id for hit in result['results']] == ['q1']
+    
+    @patch('core.services.hybrid_search.config', make_config())
+    def test_source_error(self):
+        """测试单个来源出错时降级为另一来源的结果"""
+        repo = make_repo([])
+        repo.lexical_search.side_effect = RuntimeError("数据库繁忙")
+        provider, _ = make_provider([('q3', 0.9)])
+        
+        result = search(HybridSearchService(repo, provider), '求导')
+        
+        assert result['sources']['lexical']['status'] == 'error'
+        assert [hit['question'].id for hit in result['results']] == ['q3']
+    
+    @patch('core.services.hybrid_search.config', make_config(HYBRID_SEARCH_TIMEOUT_MS=50))
+    def test_vector_timeout(self):
+        """测试超出时间预算的来源被丢弃"""
+        repo = make_repo([('q1', 4.0)])
+        provider, vector_index = make_provider([('q3', 0.9)])
+        vector_index.search_similar.side_effect = lambda *args, **kwargs: time.sleep(0.5) or []
+        
+        started = time.monotonic()
+        result = search(HybridSearchService(repo, provider), '求导')
+        
+        assert time.monotonic() - started < 0.4
+        assert result['sources']['vector'] == {'status': 'timeout'}
+        assert [hit['question'].id for hit in result['results']] == ['q1']
+    
+    @patch('core.services.hybrid_search.config', make_config(HYBRID_SEARCH_TIMEOUT_MS=50))
+    def test_slow_embedding_does_not_block_loop(self, async_embedding):
+        """测试等待 Embedding 服务时事件循环继续运行，超时后取消向量来源"""
+        async def slow_embed(text):
+            await asyncio.sleep(0.5)
+            return [0.1, 0.2]
+        
+        async_embedding.return_value.embed = slow_embed
+        repo = make_repo([('q1', 4.0)])
+        provider, vector_index = make_provider([('q3', 0.9)])
+        
+        async def run():
+            ticks = []
+            
+            async def tick():
+                while True:
+                    ticks.append(time.monotonic())
+                    await asyncio.sleep(0.01)
+            
+            ticker = asyncio.ensure_future(tick())
+            result = await HybridSearchService(repo, provider).search('求导')
+            ticker.cancel()
+            return result, ticks
+        
+        result, ticks = asyncio.run(run())
+        
+        assert len(ticks) > 2
+        assert result['sources']['vector'] == {'status': 'timeout'}
+        assert [hit['question'].id for hit in result['results']] == ['q1']
+        vector_index.search_similar.assert_not_called()
+    
+    @patch('core.services.hybrid_search.config', make_config(HYBRID_SEARCH_CANDIDATES=2))
+    def test_limit_capped_by_candidates(self):
+        """测试返回条数不超过每个来源的候选上限"""
+        repo = make_repo([('q1', 3.0), ('q2', 2.0)])
+        provider, _ = make_provider([('q3', 0.9), ('q4', 0.8)])
+        
+        result = search(HybridSearchService(repo, provider), '求导', limit=100)
+        
+        assert len(result['results']) == 2
+        assert repo.lexical_search.call_args[1]['limit'] == 2
+    
+    def test_invalid_mode(self):
+        """测试无效检索模式"""
+        with pytest.raises(ValueError):
+            search(HybridSearchService(Mock(), Mock()), '求导', mode='fuzzy')
@@ -5,7 +5,7 @@ QuestionService 测试
 import pytest
 import sys
 import os
-from unittest.mock import Mock, MagicMock, patch
+from unittest.mock import AsyncMock, Mock, MagicMock, patch
 from datetime import datetime
 
 # 添加项目根目录到路径
@@ -29,7 +29,10 @@ def mock_repos():
 def question_service(mock_repos):
     """创建 QuestionService 实例"""
     question_repo, category_repo, tag_repo = mock_repos
-    return QuestionService(question_repo, category_repo, tag_repo)
+    service = QuestionService(question_repo, category_repo, tag_repo)
+    service._fingerprint_index = Mock()
+    service._embedding_queue = Mock()
+    return service
 
 
 class TestQuestionServiceCreate:
@@ -149,6 +152,91 @@ class TestQuestionServiceCreate:
             question_service.create_question(question_data)
 
 
+class TestQuestionServiceBulkCreate:
+    """测试 QuestionService 批量创建"""
+    
+    @staticmethod
+    def _questions(count, category_id="cat-1", tag_ids=None):
+        return [
+            QuestionCreate(content=f"题目 {i}", options=[], answer="答案", explanation="解析",
+                           category_id=category_id, tag_ids=tag_ids or [])
+            for i in range(count)
+        ]
+    
+    def test_create_questions_validates_with_set_queries(self, question_service, mock_repos):
+        """测试分类和标签各用一次集合查询校验"""
+        question_repo, category_repo, tag_repo = mock_repos
+        category_repo.get_existing_ids.return_value = {"cat-1"}
+        tag_repo.get_existing_ids.return_value = {"tag-1", "tag-2"}
+        question_repo.create_many.return_value = ["q-1", "q-2", "q-3"]
+        questions = self._questions(3, tag_ids=["tag-1", "tag-2"])
+        
+        result = question_service.create_questions(questions)
+        
+        assert result == ["q-1", "q-2", "q-3"]
+        category_repo.get_existing_ids.assert_called_once_with({"cat-1"})
+        tag_repo.get_existing_ids.assert_called_once_with({"tag-1", "tag-2"})
+        category_repo.get_by_id.assert_not_called()
+        tag_repo.get_by_id.assert_not_called()
+        question_repo.create_many.assert_called_once_with(questions)
+    
+    def test_create_questions_writes_fingerprints(self, question_service, mock_repos):
+        """测试批量创建后一次写入全部题目指纹"""
+        question_repo, category_repo, tag_repo = mock_repos
+        category_repo.get_existing_ids.return_value = {"cat-1"}
+        tag_repo.get_existing_ids.return_value = set()
+        question_repo.create_many.return_value = ["q-1", "q-2"]
+        questions = self._questions(2)
+        
+        question_service.create_questions(questions)
+        
+        question_service._fingerprint_index.update_many.assert_called_once_with(
+            [("q-1", questions[0].content), ("q-2", questions[1].content)]
+        )
+    
+    def test_create_questions_missing_tag(self, question_service, mock_repos):
+        """测试标签不存在时整体失败"""
+        question_repo, category_repo, tag_repo = mock_repos
+        category_repo.get_existing_ids.return_value = {"cat-1"}
+        tag_repo.get_existing_ids.return_value = {"tag-1"}
+        
+        with pytest.raises(ValueError, match="tag-9"):
+            question_service.create_questions(self._questions(2, tag_ids=["tag-1", "tag-9"]))
+        
+        question_repo.create_many.assert_not_called()
+    
+    def test_create_questions_missing_category(self, question_service, mock_repos):
+        """测试分类不存在时整体失败"""
+        question_repo, category_repo, tag_repo = mock_repos
+        category_repo.get_existing_ids.return_value = set()
+        
+        with pytest.raises(ValueError, match="分类不存在"):
+            question_service.create_questions(self._questions(1, category_id="cat-x"))
+        
+        question_repo.create_many.assert_not_called()
+    
+    def test_embed_questions_in_batches(self, question_service):
+        """测试按批次调用 Embedding 服务并批量写入向量"""
+        import numpy as np
+        embedding_service = Mock()
+        embedding_service.embed_batch.side_effect = lambda texts, batch_size: [np.ones(4) for _ in texts]
+        vector_index = Mock()
+        question_service._embedding_service = embedding_service
+        question_service._vector_index = vector_index
+        question_service._model_version = "test-model"
+        question_service.EMBED_BATCH_SIZE = 2
+        questions = self._questions(5)
+        
+        embedded = question_service.embed_questions([f"q-{i}" for i in range(5)], questions)
+        
+        assert embedded == 5
+        assert embedding_service.embed_batch.call_count == 3
+        assert vector_index.update_embeddings.call_count == 3
+        items, version = vector_index.update_embeddings.call_args_list[0][0]
+        assert [item[0] for item in items] == ["q-0", "q-1"]
+        assert version == "test-model"
+
+
 class TestQuestionServiceGet:
     """测试 QuestionService 获取题目方法"""
     
@@ -167,7 +255,7 @@ class TestQuestionServiceGet:
         )
         
         question_repo.get_by_id.return_value = question
-        category_repo.get_by_id.return_value = category
+        category_repo.get_category_map.return_value = {"cat-1": category}
         
         result = question_service.get_question("q-1")
         
@@ -224,13 +312,18 @@ class TestQuestionServiceGet:
             "limit": 20,
             "pages": 1
         }
-        category_repo.get_by_id.return_value = Category(id="cat-1", name="测试分类", description="测试", parent_id=None)
+        category_repo.get_category_map.return_value = {
+            "cat-1": Category(id="cat-1", name="测试分类", description="测试", parent_id=None)
+        }
         
         result = question_service.get_all_questions(page=1, limit=20)
         
         assert result["total"] == 2
         assert len(result["data"]) == 2
         assert result["data"][0].category_name == "测试分类"
+        # 分类名称来自缓存，不逐条查询
+        category_repo.get_category_map.assert_called_once()
+        category_repo.get_by_id.assert_not_called()
     
     def test_get_all_questions_with_filters(self, question_service, mock_repos):
         """测试带筛选条件获取题目"""
@@ -257,9 +350,43 @@ class TestQuestionServiceGet:
             tag_id="tag-1",
             keyword="测试",
             page=1,
-            limit=10
+            limit=10,
+            include_descendants=False
         )
 
+    
+    def test_get_questions_by_cursor(self, question_service, mock_repos):
+        """测试游标分页获取题目"""
+        question_repo, category_repo, tag_repo = mock_repos
+        
+        question_repo.get_all.return_value = {
+            "data": [
+                Question(id="q-1", content="题目 1", options=[], answer="A", explanation="解析 1", category_id="cat-1")
+            ],
+            "total": None,
+            "page": None,
+            "limit": 1,
+            "pages": None,
+            "next_cursor": "abc",
+            "has_more": True
+        }
+        category_repo.get_category_map.return_value = {
+            "cat-1": Category(id="cat-1", name="测试分类", description="测试", parent_id=None)
+        }
+        
+        result = question_service.get_questions_by_cursor(cursor="", category_id="cat-1", limit=1)
+        
+        question_repo.get_all.assert_called_with(
+            category_id="cat-1",
+            tag_id=None,
+            keyword=None,
+            limit=1,
+            cursor="",
+            include_total=False,
+            include_descendants=False
+        )
+        assert result["next_cursor"] == "abc"
+        assert result["data"][0].category_name == "测试分类"
 
 class TestQuestionServiceUpdate:
     """测试 QuestionService.update_question 方法"""
@@ -311,8 +438,9 @@ class TestQuestionServiceUpdate:
 class TestQuestionServiceDelete:
     """测试 QuestionService.delete_question 方法"""
     
-    def test_delete_question_success(self, question_service, mock_repos):
-        """测试成功删除题目"""
+    @patch('core.services.vector_index.get_vector_index')
+    def test_delete_question_success(self, mock_get_index, question_service, mock_repos):
+        """测试成功删除题目，Embedding 服务未初始化时也删除向量"""
         question_repo, category_repo, tag_repo = mock_repos
         
         question_repo.delete.return_value = True
@@ -321,8 +449,23 @@ class TestQuestionServiceDelete:
         
         assert result is True
         question_repo.delete.assert_called_with("q-1")
+        assert question_service._vector_index is None
+        mock_get_index.return_value.delete_embedding.assert_called_once_with("q-1")
+        question_service._fingerprint_index.delete.assert_called_once_with("q-1")
+    
+    @patch('core.services.vector_index.get_vector_index')
+    def test_delete_question_vector_failure_still_succeeds(self, mock_get_index, question_service, mock_repos):
+        """测试向量删除失败不影响题目删除和指纹删除"""
+        question_repo, category_repo, tag_repo = mock_repos
+        
+        question_repo.delete.return_value = True
+        mock_get_index.return_value.delete_embedding.side_effect = Exception("database is locked")
+        
+        assert question_service.delete_question("q-1") is True
+        question_service._fingerprint_index.delete.assert_called_once_with("q-1")
     
-    def test_delete_question_not_found(self, question_service, mock_repos):
+    @patch('core.services.vector_index.get_vector_index')
+    def test_delete_question_not_found(self, mock_get_index, question_service, mock_repos):
         """测试删除不存在的题目"""
         question_repo, category_repo, tag_repo = mock_repos
         
@@ -331,6 +474,7 @@ class TestQuestionServiceDelete:
         result = question_service.delete_question("nonexistent-id")
         
         assert result is False
+        mock_get_index.assert_not_called()
 
 
 class TestQuestionServiceTagManagement:
@@ -431,6 +575,192 @@ class TestQuestionServiceSearch:
         assert len(result) == 1
         question_repo.search.assert_called_with("测试")
 
+    
+    def test_find_similar_questions_uses_stored_embedding(self, question_service, mock_repos):
+        """测试相似检索复用已保存的向量并透传筛选条件"""
+        import numpy as np
+        question_repo, category_repo, tag_repo = mock_repos
+        question_repo.get_by_id.return_value = Question(
+            id="q-1", content="题目 1", options=[], answer="A", explanation="解析", category_id="cat-1"
+        )
+        embedding_service = Mock()
+        vector_index = Mock()
+        vector_index.get_embedding.return_value = np.ones(4)
+        vector_index.search_similar.return_value = [{'question_id': 'q-2', 'similarity': 0.9, 'content': '题目 2'}]
+        question_service._embedding_service = embedding_service
+        question_service._vector_index = vector_index
+        
+        result = question_service.find_similar_questions("q-1", threshold=0.9, category_id="cat-1",
+                                                         include_descendants=True)
+        
+        assert result[0]['question_id'] == 'q-2'
+        embedding_service.embed.assert_not_called()
+        kwargs = vector_index.search_similar.call_args[1]
+        assert kwargs['exclude_ids'] == ["q-1"]
+        assert kwargs['category_id'] == "cat-1"
+        assert kwargs['include_descendants'] is True
+        assert kwargs['tag_id'] is None
+    
+    def test_find_similar_questions_missing(self, question_service, mock_repos):
+        """测试题目不存在时返回 None"""
+        question_repo, category_repo, tag_repo = mock_repos
+        question_repo.get_by_id.return_value = None
+        
+        assert question_service.find_similar_questions("q-x") is None
+    
+    def test_find_similar_questions_async_embeds_missing(self, question_service, mock_repos):
+        """测试异步相似检索：题目未向量化时用异步客户端计算向量"""
+        import asyncio
+        import numpy as np
+        question_repo, category_repo, tag_repo = mock_repos
+        question_repo.get_by_id.return_value = Question(
+            id="q-1", content="题目 1", options=[], answer="A", explanation="解析", category_id="cat-1"
+        )
+        vector_index = Mock()
+        vector_index.get_embedding.return_value = None
+        vector_index.search_similar.return_value = []
+        question_service._embedding_service = Mock()
+        question_service._vector_index = vector_index
+        async_service = Mock()
+        async_service.embed = AsyncMock(return_value=np.ones(4))
+        
+        with patch('agent.services.async_embedding_service.get_async_embedding_service',
+                   return_value=async_service):
+            result = asyncio.run(question_service.find_similar_questions_async("q-1", tag_id="t1"))
+        
+        assert result == []
+        async_service.embed.assert_awaited_once_with("题目 1")
+        question_service._embedding_service.embed.assert_not_called()
+        assert vector_index.search_similar.call_args[1]['tag_id'] == "t1"
+
+
+class TestQuestionServiceEmbeddingInit:
+    """测试 Embedding 服务初始化"""
+    
+    def test_init_follows_active_version(self, question_service):
+        """测试使用生效版本的模型，生效版本切换后重新初始化"""
+        vector_index = Mock()
+        vector_index.get_active_version.return_value = "m2"
+        
+        with patch('agent.config.AgentConfig._load_config', return_value={'embedding': {'model_name': 'm1'}}), \
+                patch('agent.services.embedding_service.get_embedding_service') as get_service, \
+                patch('core.services.vector_index.get_vector_index', return_value=vector_index):
+            question_service._init_embedding()
+            question_service._init_embedding()
+            vector_index.get_active_version.return_value = "m3"
+            question_service._init_embedding()
+        
+        assert [c.args[0] for c in get_service.call_args_list] == [{'model_name': 'm2'}, {'model_name': 'm3'}]
+
+
+class TestQuestionServiceAsyncEmbedding:
+    """测试异步向量化钩子"""
+    
+    def test_embed_question_async(self, question_service):
+        """测试需要重新向量化时 await 异步客户端并保存向量"""
+        import asyncio
+        import numpy as np
+        vector_index = Mock()
+        vector_index.needs_reembedding.return_value = (True, "内容变化")
+        question_service._embedding_service = Mock()
+        question_service._vector_index = vector_index
+        question_service._model_version = "m"
+        async_service = Mock()
+        async_service.embed = AsyncMock(return_value=np.ones(4))
+        
+        with patch('agent.services.async_embedding_service.get_async_embedding_service',
+                   return_value=async_service):
+            asyncio.run(question_service.embed_question_async("q-1", "题目", ["A", "B"]))
+        
+        async_service.embed.assert_awaited_once_with("题目")
+        args = vector_index.update_embedding.call_args[0]
+        assert (args[0], args[2], args[3], args[4]) == ("q-1", "m", "题目", "['A', 'B']")
+        question_service._embedding_service.embed.assert_not_called()
+    
+    def test_embed_question_async_failure_swallowed(self, question_service):
+        """测试异步向量化失败不抛出"""
+        import asyncio
+        vector_index = Mock()
+        vector_index.needs_reembedding.return_value = (True, "未向量化")
+        question_service._embedding_service = Mock()
+        question_service._vector_index = vector_index
+        
+        with patch('agent.services.async_embedding_service.get_async_embedding_service',
+                   side_effect=RuntimeError("连接失败")):
+            asyncio.run(question_service.embed_question_async("q-1", "题目"))
+        
+        vector_index.update_embedding.assert_not_called()
+    
+    def test_create_question_without_sync_embedding(self, question_service, mock_repos):
+        """测试 embed=False 时创建题目不调用同步向量化"""
+        question_repo, category_repo, tag_repo = mock_repos
+        category_repo.get_by_id.return_value = Category(id="cat-1", name="分类", description="", parent_id=None)
+        created = Question(id="q-1", content="题目", options=[], answer="A", explanation="解析", category_id="cat-1")
+        question_repo.create.return_value = created
+        question_repo.get_by_id.return_value = created
+        question_repo.get_question_tags.return_value = []
+        
+        with patch.object(question_service, '_try_embed_question') as try_embed:
+            question_service.create_question(
+                QuestionCreate(content="题目", options=[], answer="A", explanation="解析", category_id="cat-1"),
+                embed=False
+            )
+        
+        try_embed.assert_not_called()
+
+
+class TestQuestionServiceEmbeddingQueue:
+    """测试后台向量化队列钩子"""
+    
+    def _create(self, question_service, mock_repos):
+        question_repo, category_repo, tag_repo = mock_repos
+        category_repo.get_by_id.return_value = Category(id="cat-1", name="分类", description="", parent_id=None)
+        created = Question(id="q-1", content="题目", options=[], answer="A", explanation="解析", category_id="cat-1")
+        question_repo.create.return_value = created
+        question_repo.get_by_id.return_value = created
+        question_repo.get_question_tags.return_value = []
+        return question_service.create_question(
+            QuestionCreate(content="题目", options=[], answer="A", explanation="解析", category_id="cat-1")
+        )
+    
+    @patch('core.services.question_service.config')
+    def test_create_question_enqueues(self, mock_config, question_service, mock_repos):
+        """测试启用队列时创建题目只登记任务，不同步调用 Embedding 服务"""
+        mock_config.EMBEDDING_QUEUE_ENABLED = True
+        
+        with patch.object(question_service, '_try_embed_question') as try_embed:
+            self._create(question_service, mock_repos)
+        
+        question_service._embedding_queue.enqueue.assert_called_once_with(["q-1"])
+        try_embed.assert_not_called()
+    
+    @patch('core.services.question_service.config')
+    def test_create_question_sync_when_disabled(self, mock_config, question_service, mock_repos):
+        """测试关闭队列时回到同步向量化"""
+        mock_config.EMBEDDING_QUEUE_ENABLED = False
+        
+        with patch.object(question_service, '_try_embed_question') as try_embed:
+            self._create(question_service, mock_repos)
+        
+        try_embed.assert_called_once_with("q-1", "题目", [])
+        question_service._embedding_queue.enqueue.assert_not_called()
+    
+    @patch('core.services.question_service.config')
+    def test_create_questions_enqueues_all(self, mock_config, question_service, mock_repos):
+        """测试批量创建后一次登记全部向量化任务；登记失败不影响创建"""
+        mock_config.EMBEDDING_QUEUE_ENABLED = True
+        question_repo, category_repo, tag_repo = mock_repos
+        category_repo.get_existing_ids.return_value = {"cat-1"}
+        tag_repo.get_existing_ids.return_value = set()
+        question_repo.create_many.return_value = ["q-1", "q-2"]
+        question_service._embedding_queue.enqueue.side_effect = RuntimeError("database is locked")
+        questions = [
+            QuestionCreate(content=f"题目 {i}", options=[], answer="A", explanation="解析", category_id="cat-1")
+            for i in range(2)
+        ]
+        
+        assert question_service.create_questions(questions) == ["q-1", "q-2"]
+        question_service._embedding_queue.enqueue.assert_called_once_with(["q-1", "q-2"])
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -109,6 +109,55 @@ class TestQuestionRepositoryCreate:
             assert options_json == '[]'
 
 
+class TestQuestionRepositoryCreateMany:
+    """测试批量创建题目"""
+    
+    @patch('core.database.repositories.transaction')
+    @patch('core.database.repositories.db')
+    def test_create_many_uses_executemany(self, mock_db, mock_transaction):
+        """测试题目和标签关联各用一次 executemany 写入"""
+        questions = [
+            QuestionCreate(content=f'题目{i}', options=['A', 'B'], answer='A', explanation='解析',
+                           category_id='cat1', tag_ids=['tag1', 'tag1', 'tag2'])
+            for i in range(3)
+        ]
+        repo = QuestionRepository()
+        
+        ids = repo.create_many(questions)
+        
+        assert len(ids) == 3
+        assert len(set(ids)) == 3
+        assert mock_db.executemany.call_count == 2
+        question_sql, question_rows = mock_db.executemany.call_args_list[0][0]
+        assert 'INSERT INTO questions' in question_sql
+        assert [row[0] for row in question_rows] == ids
+        assert question_rows[0][2] == '["A", "B"]'
+        link_sql, links = mock_db.executemany.call_args_list[1][0]
+        assert 'INSERT OR IGNORE INTO question_tags' in link_sql
+        # 同一题目的重复标签只插入一次
+        assert len(links) == 6
+        mock_db.execute.assert_not_called()
+        mock_db.fetch_one.assert_not_called()
+    
+    @patch('core.database.repositories.db')
+    def test_create_many_empty(self, mock_db):
+        """测试空列表不访问数据库"""
+        assert QuestionRepository().create_many([]) == []
+        mock_db.executemany.assert_not_called()
+    
+    @patch('core.database.repositories.db')
+    def test_get_existing_ids_chunked(self, mock_db):
+        """测试批量存在性检查分批查询并去重"""
+        from core.database.repositories import TagRepository, IN_QUERY_BATCH_SIZE
+        mock_db.fetch_all.return_value = [{'id': 't0'}]
+        ids = [f't{i}' for i in range(IN_QUERY_BATCH_SIZE + 1)] + ['t0']
+        
+        result = TagRepository().get_existing_ids(ids)
+        
+        assert result == {'t0'}
+        assert mock_db.fetch_all.call_count == 2
+
+
 class TestQuestionRepositoryGetById:
     """测试根据 ID 获取题目"""
     
@@ -228,11 +277,28 @@ class TestQuestionRepositoryGetAll:
         queries = [q[0] for q in mock_db.fetch_all.call_args_list]
         assert any('category_id' in str(q) for q in queries)
     
+    @patch('core.database.repositories.db')
+    def test_get_all_with_category_descendants(self, mock_db):
+        """测试按分类子树筛选使用闭包表 JOIN"""
+        repo = QuestionRepository()
+        
+        mock_db.fetch_one.return_value = {'total': 0}
+        mock_db.fetch_all.return_value = []
+        
+        repo.get_all(category_id='cat1', include_descendants=True)
+        
+        query, params = mock_db.fetch_all.call_args_list[0][0]
+        assert 'INNER JOIN category_closure cc ON cc.descendant_id = q.category_id' in query
+        assert 'cc.ancestor_id = ?' in query
+        assert 'q.category_id = ?' not in query
+        assert params[0] == 'cat1'
+    
     @patch('core.database.repositories.db')
     def test_get_all_with_keyword(self, mock_db):
-        """测试按关键词搜索"""
+        """测试按关键词搜索（无全文索引时使用 LIKE）"""
         repo = QuestionRepository()
         
+        mock_db.table_exists.return_value = False
         mock_db.fetch_one.return_value = {'total': 0}
         mock_db.fetch_all.return_value = []
         
@@ -242,6 +308,69 @@ class TestQuestionRepositoryGetAll:
         queries = [q[0] for q in mock_db.fetch_all.call_args_list]
         assert any('LIKE' in str(q) for q in queries)
     
+    @patch('core.database.repositories.db')
+    def test_get_all_with_keyword_fts(self, mock_db):
+        """测试关键词优先使用全文索引并按相关度排序"""
+        repo = QuestionRepository()
+        
+        mock_db.table_exists.return_value = True
+        mock_db.fetch_one.return_value = {'total': 0}
+        mock_db.fetch_all.return_value = []
+        
+        repo.get_all(keyword='求导数')
+        
+        query, params = mock_db.fetch_all.call_args_list[0][0]
+        assert 'questions_fts MATCH ?' in query
+        assert 'bm25(questions_fts' in query
+        assert 'LIKE' not in query
+        assert params[0] == '"求导数"'
+    
+    @patch('core.database.repositories.db')
+    def test_get_all_with_keyword_fts_error_falls_back(self, mock_db):
+        """测试全文检索出错时回退到 LIKE"""
+        import sqlite3
+        repo = QuestionRepository()
+        
+        mock_db.table_exists.return_value = True
+        mock_db.fetch_one.return_value = {'total': 0}
+        mock_db.fetch_all.side_effect = [sqlite3.OperationalError("no such table"), []]
+        
+        result = repo.get_all(keyword='求导数')
+        
+        assert result['data'] == []
+        query = mock_db.fetch_all.call_args_list[-1][0][0]
+        assert 'LIKE' in query
+    
+    @patch('core.database.repositories.db')
+    def test_get_all_with_two_char_keyword_uses_bigram_columns(self, mock_db):
+        """测试两个字符的关键词匹配二元组列，仍走全文索引"""
+        repo = QuestionRepository()
+        
+        mock_db.table_exists.return_value = True
+        mock_db.fetch_one.return_value = {'total': 0}
+        mock_db.fetch_all.return_value = []
+        
+        repo.get_all(keyword='导数')
+        
+        query, params = mock_db.fetch_all.call_args_list[0][0]
+        assert 'questions_fts MATCH ?' in query
+        assert 'LIKE' not in query
+        assert params[0] == '{content_bigrams answer_bigrams explanation_bigrams} : "导数\x1f"'
+    
+    @patch('core.database.repositories.db')
+    def test_get_all_with_single_char_keyword_uses_like(self, mock_db):
+        """测试单个字符的关键词无法用索引表达，使用 LIKE"""
+        repo = QuestionRepository()
+        
+        mock_db.table_exists.return_value = True
+        mock_db.fetch_one.return_value = {'total': 0}
+        mock_db.fetch_all.return_value = []
+        
+        repo.get_all(keyword='导')
+        
+        query = mock_db.fetch_all.call_args_list[0][0][0]
+        assert 'LIKE' in query
+    
     @patch('core.database.repositories.db')
     def test_get_all_with_tag(self, mock_db):
         """测试按标签筛选"""
@@ -271,6 +400,206 @@ class TestQuestionRepositoryGetAll:
         assert result['pages'] == 5  # 50/10 = 5
 
 
+class TestQuestionRepositoryBatchTags:
+    """测试整页标签批量加载（无 N+1 查询）"""
+
+    @staticmethod
+    def _question_rows(count):
+        return [
+            {
+                'id': f'q{i}',
+                'content': f'题目{i}',
+                'options': '["A", "B"]',
+                'answer': 'A',
+                'explanation': '解析',
+                'category_id': 'cat1',
+                'created_at': '2024-01-01T00:00:00',
+                'updated_at': '2024-01-01T00:00:00'
+            }
+            for i in range(count)
+        ]
+
+    @pytest.mark.parametrize("page_size", [1, 20, 100])
+    @patch('core.database.repositories.db')
+    def test_get_all_query_count_constant(self, mock_db, page_size):
+        """测试每页查询次数与题目数量无关"""
+        repo = QuestionRepository()
+        rows = self._question_rows(page_size)
+        tag_rows = [
+            {'question_id': row['id'], 'id': 'tag1', 'name': '标签 1',
+             'color': '#FF0000', 'created_at': '2024-01-01T00:00:00'}
+            for row in rows
+        ]
+
+        mock_db.fetch_one.return_value = {'total': page_size}
+        mock_db.fetch_all.side_effect = [rows, tag_rows]
+
+        result = repo.get_all(page=1, limit=page_size)
+
+        assert len(result['data']) == page_size
+        assert mock_db.fetch_one.call_count == 1
+        assert mock_db.fetch_all.call_count == 2
+        assert all(q.tags[0].id == 'tag1' for q in result['data'])
+
+    @patch('core.database.repositories.db')
+    def test_get_tags_for_questions_groups_by_question(self, mock_db):
+        """测试按题目分组标签"""
+        repo = QuestionRepository()
+        mock_db.fetch_all.return_value = [
+            {'question_id': 'q1', 'id': 'tag1', 'name': '标签 1',
+             'color': '#FF0000', 'created_at': '2024-01-02T00:00:00'},
+            {'question_id': 'q1', 'id': 'tag2', 'name': '标签 2',
+             'color': '#00FF00', 'created_at': '2024-01-01T00:00:00'},
+            {'question_id': 'q2', 'id': 'tag1', 'name': '标签 1',
+             'color': '#FF0000', 'created_at': '2024-01-02T00:00:00'},
+        ]
+
+        result = repo.get_tags_for_questions(['q1', 'q2', 'q3'])
+
+        assert [t.id for t in result['q1']] == ['tag1', 'tag2']
+        assert [t.id for t in result['q2']] == ['tag1']
+        assert 'q3' not in result
+        query, params = mock_db.fetch_all.call_args[0]
+        assert 'IN (?, ?, ?)' in query
+        assert params == ('q1', 'q2', 'q3')
+
+    @patch('core.database.repositories.db')
+    def test_get_tags_for_questions_empty(self, mock_db):
+        """测试空列表不查询数据库"""
+        repo = QuestionRepository()
+
+        assert repo.get_tags_for_questions([]) == {}
+        mock_db.fetch_all.assert_not_called()
+
+    @patch('core.database.repositories.db')
+    def test_get_tags_for_questions_chunked(self, mock_db):
+        """测试超过批次大小时分批查询"""
+        repo = QuestionRepository()
+        mock_db.fetch_all.return_value = []
+        ids = [f'q{i}' for i in range(QuestionRepository.TAG_BATCH_SIZE + 1)]
+
+        repo.get_tags_for_questions(ids)
+
+        assert mock_db.fetch_all.call_count == 2
+
+
+class TestQuestionRepositoryCursorPagination:
+    """测试游标分页与总数缓存"""
+
+    @staticmethod
+    def _question_rows(count, created_at='2024-01-01T00:00:00'):
+        return [
+            {
+                'id': f'q{i:03d}',
+                'content': f'题目{i}',
+                'options': '[]',
+                'answer': 'A',
+                'explanation': '解析',
+                'category_id': 'cat1',
+                'created_at': created_at,
+                'updated_at': created_at
+            }
+            for i in range(count)
+        ]
+
+    def test_cursor_roundtrip(self):
+        """测试游标编码解码"""
+        cursor = QuestionRepository.encode_cursor('2024-01-01T00:00:00', 'q1')
+
+        assert '=' not in cursor
+        assert QuestionRepository.decode_cursor(cursor) == ('2024-01-01T00:00:00', 'q1')
+
+    @pytest.mark.parametrize("cursor", ["not-base64!", "e30", "WyJhIl0"])
+    def test_decode_invalid_cursor(self, cursor):
+        """测试无效游标抛出 ValueError"""
+        with pytest.raises(ValueError):
+            QuestionRepository.decode_cursor(cursor)
+
+    @patch('core.database.repositories.db')
+    def test_first_page_skips_count(self, mock_db):
+        """测试游标首页默认不统计总数，多取一条判断下一页"""
+        repo = QuestionRepository()
+        mock_db.fetch_all.side_effect = [self._question_rows(3), []]
+
+        result = repo.get_all(limit=2, cursor="")
+
+        mock_db.fetch_one.assert_not_called()
+        query, params = mock_db.fetch_all.call_args_list[0][0]
+        assert 'ORDER BY q.created_at DESC, q.id DESC LIMIT ?' in query
+        assert 'q.created_at <' not in query
+        assert params == (3,)
+        assert len(result['data']) == 2
+        assert result['has_more'] is True
+        assert result['total'] is None
+        assert result['page'] is None
+        assert QuestionRepository.decode_cursor(result['next_cursor']) == ('2024-01-01T00:00:00', 'q001')
+
+    @patch('core.database.repositories.db')
+    def test_next_page_uses_keyset(self, mock_db):
+        """测试后续页按 (created_at, id) 键集定位"""
+        repo = QuestionRepository()
+        mock_db.fetch_all.side_effect = [self._question_rows(1), []]
+        cursor = QuestionRepository.encode_cursor('2024-01-02T00:00:00', 'q9')
+
+        result = repo.get_all(category_id='cat1', limit=5, cursor=cursor)
+
+        query, params = mock_db.fetch_all.call_args_list[0][0]
+        assert 'q.category_id = ? AND (q.created_at < ? OR (q.created_at = ? AND q.id < ?))' in query
+        assert params == ('cat1', '2024-01-02T00:00:00', '2024-01-02T00:00:00', 'q9', 6)
+        assert result['has_more'] is False
+        assert result['next_cursor'] is None
+
+    @patch('core.database.repositories.db')
+    def test_count_cached_until_write(self, mock_db):
+        """测试总数缓存命中及写操作后失效"""
+        repo = QuestionRepository()
+        mock_db.fetch_one.return_value = {'total': 5}
+        mock_db.fetch_all.return_value = []
+
+        repo.get_all(cursor="", include_total=True)
+        result = repo.get_all(cursor="", include_total=True)
+
+        assert result['total'] == 5
+        assert mock_db.fetch_one.call_count == 1
+
+        QuestionRepository.invalidate_count_cache()
+        repo.get_all(cursor="", include_total=True)
+
+        assert mock_db.fetch_one.call_count == 2
+
+    @patch('core.database.repositories.db')
+    def test_count_cache_keyed_by_filters(self, mock_db):
+        """测试不同筛选条件分别缓存总数"""
+        repo = QuestionRepository()
+        mock_db.fetch_one.return_value = {'total': 1}
+        mock_db.fetch_all.return_value = []
+
+        repo.get_all(category_id='cat1')
+        repo.get_all(category_id='cat2')
+
+        assert mock_db.fetch_one.call_count == 2
+
+    @patch('core.database.repositories.db')
+    def test_count_cache_bounded_lru(self, mock_db):
+        """测试总数缓存条目数有上限，淘汰最久未使用的筛选条件"""
+        repo = QuestionRepository()
+        mock_db.fetch_one.return_value = {'total': 1}
+        mock_db.fetch_all.return_value = []
+
+        with patch.object(QuestionRepository, 'COUNT_CACHE_MAX_ENTRIES', 2):
+            repo.get_all(category_id='cat1')
+            repo.get_all(category_id='cat2')
+            repo.get_all(category_id='cat1')
+            repo.get_all(category_id='cat3')
+            assert len(repo._count_cache) == 2
+            assert mock_db.fetch_one.call_count == 3
+
+            repo.get_all(category_id='cat1')
+            assert mock_db.fetch_one.call_count == 3
+            repo.get_all(category_id='cat2')
+            assert mock_db.fetch_one.call_count == 4
+
+
 class TestQuestionRepositoryUpdate:
     """测试更新题目"""
     
@@ -333,8 +662,10 @@ class TestQuestionRepositoryDelete:
         result = repo.delete('q1')
         
         assert result is True
-        # 验证删除了题目标签关联和题目
-        assert mock_db.execute.call_count == 2
+        # 验证删除了题目标签关联、题目向量和题目
+        assert mock_db.execute.call_count == 3
+        sqls = [c[0][0] for c in mock_db.execute.call_args_list]
+        assert any('question_embeddings' in sql for sql in sqls)
     
     @patch('core.database.repositories.transaction')
     @patch('core.database.repositories.db')
@@ -449,6 +780,55 @@ class TestQuestionRepositorySearch:
         result = repo.search('测试')
         
         assert isinstance(result, list)
+    
+    @patch('core.database.repositories.db')
+    def test_lexical_search_bm25(self, mock_db):
+        """测试词法检索按 bm25 排序并返回取负后的相关度"""
+        repo = QuestionRepository()
+        
+        mock_db.table_exists.return_value = True
+        mock_db.fetch_all.return_value = [{'id': 'q1', 'rank': -3.5}, {'id': 'q2', 'rank': -1.0}]
+        
+        result = repo.lexical_search('求导数', limit=10, category_id='cat1')
+        
+        assert result == [('q1', 3.5), ('q2', 1.0)]
+        query, params = mock_db.fetch_all.call_args[0]
+        assert 'questions_fts MATCH ?' in query
+        assert 'bm25(questions_fts' in query
+        assert '"求导数"' in params
+        assert 'cat1' in params
+        assert params[-1] == 10
+    
+    @patch('core.database.repositories.db')
+    def test_lexical_search_falls_back_to_like(self, mock_db):
+        """测试全文检索出错时回退到 LIKE，相关度为 0"""
+        import sqlite3
+        repo = QuestionRepository()
+        
+        mock_db.table_exists.return_value = True
+        mock_db.fetch_all.side_effect = [sqlite3.OperationalError("no such table"), [{'id': 'q1'}]]
+        
+        result = repo.lexical_search('求导数')
+        
+        assert result == [('q1', 0.0)]
+        assert 'LIKE' in mock_db.fetch_all.call_args[0][0]
+    
+    @patch('core.database.repositories.db')
+    def test_get_by_ids_keeps_order(self, mock_db):
+        """测试批量获取按传入顺序返回并跳过不存在的题目"""
+        repo = QuestionRepository()
+        
+        row = {
+            'content': '题目', 'options': None, 'answer': 'A', 'explanation': '解析',
+            'category_id': 'cat1', 'created_at': '2024-01-01T00:00:00', 'updated_at': '2024-01-01T00:00:00'
+        }
+        mock_db.fetch_all.side_effect = [[dict(row, id='q1'), dict(row, id='q2')], []]
+        
+        result = repo.get_by_ids(['q2', 'missing', 'q1'])
+        
+        assert [q.id for q in result] == ['q2', 'q1']
+        assert mock_db.fetch_all.call_count == 2
+        assert repo.get_by_ids([]) == []
 
 
 class TestStagingQuestionRepository:
@@ -484,6 +864,63 @@ class TestStagingQuestionRepository:
         assert 'INSERT INTO staging_questions' in call_args[0]
         assert result == 1
     
+    @patch('core.database.repositories.transaction')
+    @patch('core.database.repositories.db')
+    def test_create_batch_returning_ids(self, mock_db, mock_transaction):
+        """测试批量创建在一个事务内逐条插入，按 RETURNING 返回的 ID 保持输入顺序"""
+        mock_db.fetch_all.side_effect = [[{'id': 7}], [{'id': 3}], [{'id': 12}]]
+        questions = [{'source_type': 'image', 'content': f'题目{i}', 'answer': 'A'} for i in range(3)]
+        
+        ids = StagingQuestionRepository.create_batch(questions)
+        
+        assert ids == [7, 3, 12]
+        calls = mock_db.fetch_all.call_args_list
+        assert all('INSERT INTO staging_questions' in c[0][0] and 'RETURNING id' in c[0][0] for c in calls)
+        assert [c[0][1][2] for c in calls] == ['题目0', '题目1', '题目2']
+        mock_transaction.assert_called_once()
+    
+    @patch('core.database.repositories.db')
+    def test_create_batch_empty(self, mock_db):
+        """测试空列表不访问数据库"""
+        assert StagingQuestionRepository.create_batch([]) == []
+        mock_db.fetch_all.assert_not_called()
+    
+    @patch('core.database.repositories.db')
+    def test_get_pending_filters(self, mock_db):
+        """测试按来源文件和 ID 获取待审核题目"""
+        mock_db.fetch_all.return_value = []
+        
+        StagingQuestionRepository.get_pending(source_file='a.pdf', ids=[3, 4])
+        
+        sql, params = mock_db.fetch_all.call_args[0]
+        assert "status = 'pending'" in sql
+        assert 'source_file = ?' in sql
+        assert 'id IN (?, ?)' in sql
+        assert params == ('a.pdf', 3, 4)
+    
+    @patch('core.database.repositories.db')
+    def test_get_pending_chunked_ids_and_limit(self, mock_db):
+        """测试 ID 较多时分批查询，合并后按 ID 升序截取 limit 条"""
+        from core.database.repositories import IN_QUERY_BATCH_SIZE
+        mock_db.fetch_all.side_effect = [[{'id': 9}, {'id': 1}], [{'id': 5}]]
+        
+        with patch.object(StagingQuestionRepository, '_row_to_dict', side_effect=lambda row: row):
+            rows = StagingQuestionRepository.get_pending(ids=list(range(IN_QUERY_BATCH_SIZE + 1)), limit=2)
+        
+        assert rows == [{'id': 1}, {'id': 5}]
+        assert mock_db.fetch_all.call_count == 2
+    
+    @patch('core.database.repositories.db')
+    def test_get_pending_limit(self, mock_db):
+        """测试不按 ID 筛选时 limit 直接写入 SQL"""
+        mock_db.fetch_all.return_value = []
+        
+        StagingQuestionRepository.get_pending(limit=10)
+        
+        sql, params = mock_db.fetch_all.call_args[0]
+        assert sql.endswith('LIMIT ?')
+        assert params == (10,)
+    
     @patch('core.database.repositories.db')
     def test_get_staging_by_id(self, mock_db):
         """测试获取预备题目"""
@@ -0,0 +1,236 @@
+"""
+向量检索后端测试
+测试 IVF / HNSW 近似索引的检索、增量更新和持久化
+"""
+import pytest
+import sys
+import os
+import numpy as np
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services.vector_backends import (
+    EmbeddingMatrix, IVFFlatIndex, build_backend, load_backend, index_path, recall_at_k
+)
+
+
+def clustered_vectors(size=2000, dim=16, clusters=20, seed=0):
+    """带簇结构的测试向量"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    vectors = centers[labels] + 0.3 * rng.standard_normal((size, dim)).astype(np.float32)
+    return [f"q{i}" for i in range(size)], vectors
+
+
+def exact_ids(ids, vectors, queries, k):
+    """精确检索结果"""
+    exact = build_backend("exact", ids, vectors)
+    return [[qid for qid, _ in exact.search(query, k, -1.0)] for query in queries]
+
+
+class TestIVFFlatIndex:
+    """IVF-Flat 索引测试"""
+    
+    def test_train_and_search(self):
+        """测试训练后能检索到自身"""
+        ids, vectors = clustered_vectors()
+        index = build_backend("ivf", ids, vectors, {"nlist": 16, "nprobe": 4})
+        
+        assert isinstance(index, IVFFlatIndex)
+        assert len(index) == len(ids)
+        assert index.nlist == 16
+        hits = index.search(vectors[5], 1, 0.0)
+        assert hits[0][0] == "q5"
+        assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+    
+    def test_full_probe_matches_exact(self):
+        """测试扫描全部簇时结果与精确检索一致"""
+        ids, vectors = clustered_vectors()
+        queries = vectors[:20] + 0.05
+        index = build_backend("ivf", ids, vectors, {"nlist": 8, "nprobe": 8})
+        
+        approx = [[qid for qid, _ in index.search(query, 10, -1.0)] for query in queries]
+        
+        assert recall_at_k(approx, exact_ids(ids, vectors, queries, 10)) == 1.0
+    
+    def test_recall_with_partial_probe(self):
+        """测试只扫描部分簇时召回率仍然较高"""
+        ids, vectors = clustered_vectors()
+        queries = vectors[:50] + 0.05
+        index = build_backend("ivf", ids, vectors, {"nlist": 32, "nprobe": 8})
+        
+        approx = [[qid for qid, _ in index.search(query, 10, -1.0)] for query in queries]
+        
+        assert recall_at_k(approx, exact_ids(ids, vectors, queries, 10)) >= 0.9
+    
+    def test_upsert_moves_and_remove(self):
+        """测试覆盖写入会换簇，删除后不再返回"""
+        ids, vectors = clustered_vectors(size=500)
+        index = build_backend("ivf", ids, vectors, {"nlist": 8, "nprobe": 8})
+        
+        index.upsert(["q0"], vectors[100:101])
+        assert len(index) == 500
+        assert index.search(vectors[100], 2, 0.99)[0][0] in {"q0", "q100"}
+        
+        assert index.remove("q0") is True
+        assert index.remove("q0") is False
+        assert "q0" not in index
+        assert all(qid != "q0" for qid, _ in index.search(vectors[100], 10, 0.0))
+    
+    def test_exclude_ids_and_threshold(self):
+        """测试排除 ID 和相似度阈值"""
+        ids, vectors = clustered_vectors(size=500)
+        index = build_backend("ivf", ids, vectors, {"nlist": 4, "nprobe": 4})
+        
+        hits = index.search(vectors[3], 5, 0.0, exclude_ids=["q3"])
+        
+        assert "q3" not in [qid for qid, _ in hits]
+        assert index.search(-vectors[3], 5, 0.99) == []
+    
+    def test_dimension_mismatch(self):
+        """测试维度不一致时报错"""
+        ids, vectors = clustered_vectors(size=200)
+        index = build_backend("ivf", ids, vectors, {"nlist": 4})
+        
+        with pytest.raises(ValueError):
+            index.upsert(["x"], np.ones((1, 3), dtype=np.float32))
+        with pytest.raises(ValueError, match="维度"):
+            index.search(np.ones(3, dtype=np.float32), 5, 0.0)
+        with pytest.raises(ValueError, match="维度"):
+            index.search_batch(np.ones((2, 3), dtype=np.float32), 5, 0.0)
+    
+    def test_save_and_load(self, tmp_path):
+        """测试保存和加载（包括指纹）"""
+        ids, vectors = clustered_vectors(size=500)
+        index = build_backend("ivf", ids, vectors, {"nlist": 8, "nprobe": 3})
+        path = index_path(str(tmp_path / "vector_index"), "ivf")
+        
+        index.save(path, (500, "2024-01-01T00:00:00"))
+        loaded, fingerprint = load_backend("ivf", path)
+        
+        assert fingerprint == (500, "2024-01-01T00:00:00")
+        assert len(loaded) == 500
+        assert loaded.nprobe == 3
+        assert np.allclose(loaded.centroids, index.centroids)
+        assert loaded.search(vectors[7], 5, 0.0) == index.search(vectors[7], 5, 0.0)
+
+
+class TestBackendHelpers:
+    """后端工厂与召回率计算测试"""
+    
+    def test_build_exact(self):
+        """测试精确模式返回内存矩阵"""
+        ids, vectors = clustered_vectors(size=10)
+        
+        backend = build_backend("exact", ids, vectors)
+        
+        assert isinstance(backend, EmbeddingMatrix)
+        assert len(backend) == 10
+    
+    def test_unknown_mode(self):
+        """测试未知模式"""
+        with pytest.raises(ValueError):
+            build_backend("lsh", [], np.zeros((0, 4), dtype=np.float32))
+        with pytest.raises(ValueError):
+            load_backend("exact", "/tmp/none.npz")
+    
+    def test_recall_at_k(self):
+        """测试 recall@k 计算"""
+        assert recall_at_k([["a", "b"], ["c"]], [["a", "x"], ["c"]]) == pytest.approx(2 / 3)
+        assert recall_at_k([[]], [[]]) == 1.0
+
+
+class TestSearchBatch:
+    """批量检索测试"""
+    
+    @pytest.mark.parametrize("mode,options", [
+        ("exact", {}),
+        ("exact", {"dtype": "int8"}),
+        ("ivf", {"nlist": 8, "nprobe": 8}),
+    ])
+    def test_matches_single_search(self, mode, options):
+        """测试分块批量检索与逐个检索结果一致"""
+        ids, vectors = clustered_vectors(size=1000)
+        backend = build_backend(mode, ids, vectors, options)
+        queries = vectors[:30] + 0.05
+        
+        with patch('core.services.vector_backends.BATCH_BLOCK_ELEMENTS', 3000):
+            batch = backend.search_batch(queries, 5, 0.5, exclude_ids=["q1"])
+        single = [backend.search(query, 5, 0.5, ["q1"]) for query in queries]
+        
+        assert [[qid for qid, _ in hits] for hits in batch] == [[qid for qid, _ in hits] for hits in single]
+        for batch_hits, single_hits in zip(batch, single):
+            assert np.allclose([s for _, s in batch_hits], [s for _, s in single_hits], atol=1e-5)
+    
+    def test_zero_query_and_empty(self):
+        """测试零向量查询和空矩阵"""
+        ids, vectors = clustered_vectors(size=50)
+        backend = build_backend("exact", ids, vectors)
+        
+        results = backend.search_batch(np.vstack([np.zeros(16), vectors[0]]), 3, 0.0)
+        
+        assert results[0] == []
+        assert results[1][0][0] == "q0"
+        assert EmbeddingMatrix(16).search_batch(vectors[:2], 3, 0.0) == [[], []]
+
+
+class TestCandidateFilter:
+    """候选集合（预过滤）检索测试"""
+    
+    @pytest.mark.parametrize("mode,options", [
+        ("exact", {}),
+        ("exact", {"dtype": "float16"}),
+        ("exact", {"dtype": "int8"}),
+        ("ivf", {"nlist": 8, "nprobe": 1}),
+    ])
+    def test_matches_exact_subset(self, mode, options):
+        """测试只在候选集合内检索，结果与候选子集的精确检索一致"""
+        ids, vectors = clustered_vectors(size=1000)
+        backend = build_backend(mode, ids, vectors, options)
+        candidates = ids[::7]
+        subset = build_backend("exact", candidates, vectors[::7], options)
+        queries = vectors[:20] + 0.05
+        
+        with patch('core.services.vector_backends.BATCH_BLOCK_ELEMENTS', 3000):
+            batch = backend.search_batch(queries, 5, 0.0, ["q7"], candidate_ids=candidates)
+        single = [backend.search(query, 5, 0.0, ["q7"], candidates) for query in queries]
+        expected = subset.search_batch(queries, 5, 0.0, ["q7"])
+        
+        assert [[qid for qid, _ in hits] for hits in batch] == [[qid for qid, _ in hits] for hits in expected]
+        assert [[qid for qid, _ in hits] for hits in single] == [[qid for qid, _ in hits] for hits in batch]
+        assert all(qid in set(candidates) - {"q7"} for hits in batch for qid, _ in hits)
+    
+    def test_unknown_and_empty_candidates(self):
+        """测试候选中不在索引内的 ID 被忽略，空候选返回空结果"""
+        ids, vectors = clustered_vectors(size=50)
+        backend = build_backend("exact", ids, vectors)
+        
+        assert backend.search(vectors[3], 3, 0.0, candidate_ids=["q3", "missing"]) == \
+            [("q3", pytest.approx(1.0, abs=1e-5))]
+        assert backend.search_batch(vectors[:2], 3, 0.0, candidate_ids=[]) == [[], []]
+
+
+class TestHnswIndex:
+    """HNSW 索引测试（需要 hnswlib）"""
+    
+    def test_search_update_and_persist(self, tmp_path):
+        """测试检索、删除和保存加载"""
+        pytest.importorskip("hnswlib")
+        ids, vectors = clustered_vectors(size=500)
+        index = build_backend("hnsw", ids, vectors, {"ef_search": 64})
+        
+        assert index.search(vectors[5], 1, 0.0)[0][0] == "q5"
+        assert index.remove("q5") is True
+        assert all(qid != "q5" for qid, _ in index.search(vectors[5], 10, 0.0))
+        
+        path = index_path(str(tmp_path), "hnsw")
+        index.save(path, (499, None))
+        loaded, fingerprint = load_backend("hnsw", path)
+        
+        assert fingerprint == (499, None)
+        assert len(loaded) == 499
+        assert loaded.search(vectors[6], 1, 0.0)[0][0] == "q6"
@@ -13,7 +13,7 @@ from datetime import datetime
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
-from core.services.vector_index import VectorIndex, get_vector_index
+from core.services.vector_index import VectorIndex, EmbeddingMatrix, EmbeddingVersionMismatch, get_vector_index
 
 
 class MockDBConnection:
@@ -28,6 +28,10 @@ class MockDBConnection:
         self.executed_queries.append((query, params))
         return Mock()
     
+    def executemany(self, query, params_list):
+        self.executed_queries.append((query, list(params_list)))
+        return Mock()
+    
     def fetch_one(self, query, params=None):
         self.executed_queries.append((query, params))
         return self.fetch_one_result
@@ -466,8 +470,12 @@ class TestVectorIndexSearchSimilar:
         query_embedding = np.array([1.0, 0.0, 0.0], dtype=np.float32)
         similar_embedding = np.array([0.99, 0.01, 0.0], dtype=np.float32)
         
-        # 设置 mock 返回 q2（q1 应该被 SQL 排除）
         mock_db.fetch_all_result = [
+            {
+                'id': 'q1',
+                'content': '题目 1',
+                'embedding': similar_embedding.tobytes()
+            },
             {
                 'id': 'q2',
                 'content': '题目 2',
@@ -478,14 +486,8 @@ class TestVectorIndexSearchSimilar:
         index = VectorIndex(mock_db)
         results = index.search_similar(query_embedding, exclude_ids=['q1'])
         
-        # 验证 SQL 查询包含 NOT IN
-        queries = [q[0] for q in mock_db.executed_queries]
-        assert any('NOT IN' in q for q in queries)
-        
-        # 验证参数包含排除的 ID
-        for query, params in mock_db.executed_queries:
-            if 'NOT IN' in query:
-                assert 'q1' in params
+        # 排除在内存矩阵中完成，q1 不出现在结果中
+        assert [r['question_id'] for r in results] == ['q2']
     
     def test_search_similar_respects_top_k(self):
         """测试限制返回数量"""
@@ -697,6 +699,61 @@ class TestVectorIndexRebuildAll:
         # 验证调用了 embedding service
         assert mock_embedding_service.embed.call_count == 2
     
+    def test_rebuild_all_uses_embed_batch(self):
+        """测试按批次调用 embed_batch（经过 Embedding 缓存），不再逐题请求"""
+        mock_db = MockDBConnection()
+        mock_db.fetch_all_result = [
+            {'id': f'q{i}', 'content': f'题目 {i}', 'options': None} for i in range(3)
+        ]
+        
+        mock_embedding_service = Mock()
+        mock_embedding_service.embed_batch.side_effect = lambda texts: [np.array([0.1, 0.2, 0.3])] * len(texts)
+        
+        index = VectorIndex(mock_db)
+        result = index.rebuild_all(mock_embedding_service, 'v1', batch_size=2)
+        
+        assert result == {'total': 3, 'processed': 3, 'errors': 0}
+        assert [call.args[0] for call in mock_embedding_service.embed_batch.call_args_list] == \
+            [['题目 0', '题目 1'], ['题目 2']]
+        mock_embedding_service.embed.assert_not_called()
+    
+    def test_rebuild_all_writes_each_batch_once(self):
+        """测试每批用一次 update_embeddings 写入，而不是逐题 update_embedding"""
+        mock_db = MockDBConnection()
+        mock_db.fetch_all_result = [
+            {'id': f'q{i}', 'content': f'题目 {i}', 'options': None} for i in range(3)
+        ]
+        
+        mock_embedding_service = Mock()
+        mock_embedding_service.embed_batch.side_effect = lambda texts: [np.array([0.1, 0.2, 0.3])] * len(texts)
+        
+        index = VectorIndex(mock_db)
+        with patch.object(index, 'update_embedding') as update_one, \
+                patch.object(index, 'update_embeddings') as update_many:
+            index.rebuild_all(mock_embedding_service, 'v1', batch_size=2)
+        
+        update_one.assert_not_called()
+        assert [[item[0] for item in call.args[0]] for call in update_many.call_args_list] == \
+            [['q0', 'q1'], ['q2']]
+    
+    def test_rebuild_all_falls_back_per_row_when_batch_write_fails(self):
+        """测试批量写入失败时逐题重试，只有失败的题目计入错误"""
+        mock_db = MockDBConnection()
+        mock_db.fetch_all_result = [
+            {'id': 'q1', 'content': '题目 1', 'options': None},
+            {'id': 'q2', 'content': '题目 2', 'options': None}
+        ]
+        
+        mock_embedding_service = Mock()
+        mock_embedding_service.embed_batch.side_effect = lambda texts: [np.array([0.1, 0.2, 0.3])] * len(texts)
+        mock_embedding_service.embed.side_effect = [np.array([0.1, 0.2, 0.3]), Exception("Embedding failed")]
+        
+        index = VectorIndex(mock_db)
+        with patch.object(index, 'update_embeddings', side_effect=Exception("database is locked")):
+            result = index.rebuild_all(mock_embedding_service, 'v1')
+        
+        assert result == {'total': 2, 'processed': 1, 'errors': 1}
+    
     def test_rebuild_all_with_errors(self):
         """测试重建过程中有错误"""
         mock_db = MockDBConnection()
@@ -765,5 +822,506 @@ class TestGetVectorIndex:
         assert index1 is index2
 
 
+class TestEmbeddingMatrix:
+    """内存向量矩阵测试"""
+    
+    def test_search_top_k_sorted(self):
+        """测试 top-k 按相似度降序返回"""
+        matrix = EmbeddingMatrix(2)
+        matrix.upsert(['a', 'b', 'c', 'd'], np.array([[1, 0], [1, 1], [0, 1], [-1, 0]]))
+        
+        hits = matrix.search(np.array([2.0, 0.0]), top_k=2, threshold=-1.0)
+        
+        assert [h[0] for h in hits] == ['a', 'b']
+        assert hits[0][1] == pytest.approx(1.0)
+        assert hits[1][1] == pytest.approx(np.sqrt(0.5))
+    
+    def test_threshold_and_exclude(self):
+        """测试阈值过滤与排除"""
+        matrix = EmbeddingMatrix(2)
+        matrix.upsert(['a', 'b', 'c'], np.array([[1, 0], [1, 0.01], [0, 1]]))
+        
+        hits = matrix.search(np.array([1.0, 0.0]), top_k=10, threshold=0.9, exclude_ids=['a'])
+        
+        assert [h[0] for h in hits] == ['b']
+    
+    def test_upsert_overwrites_and_remove_compacts(self):
+        """测试覆盖写入与删除后行号紧凑"""
+        matrix = EmbeddingMatrix(2)
+        matrix.upsert(['a', 'b', 'c'], np.array([[1, 0], [0, 1], [1, 1]]))
+        matrix.upsert(['a'], np.array([[0, 1]]))
+        
+        assert matrix.remove('a') is True
+        assert matrix.remove('a') is False
+        assert len(matrix) == 2
+        assert sorted(h[0] for h in matrix.search(np.array([0.0, 1.0]), 10, 0.5)) == ['b', 'c']
+    
+    def test_zero_vectors_ignored(self):
+        """测试零向量不入矩阵，零查询无结果"""
+        matrix = EmbeddingMatrix(2)
+        matrix.upsert(['a', 'b'], np.array([[0, 0], [1, 0]]))
+        
+        assert 'a' not in matrix
+        assert matrix.search(np.zeros(2), 10, -1.0) == []
+    
+    def test_dimension_mismatch(self):
+        """测试维度不一致时写入和检索都报错（不静默返回空结果）"""
+        matrix = EmbeddingMatrix(2)
+        
+        with pytest.raises(ValueError):
+            matrix.upsert(['a'], np.array([[1, 0, 0]]))
+        assert matrix.search(np.array([1.0, 0.0, 0.0]), 10, 0.0) == []
+        
+        matrix.upsert(['a'], np.array([[1, 0]]))
+        with pytest.raises(ValueError, match="维度"):
+            matrix.search(np.array([1.0, 0.0, 0.0]), 10, 0.0)
+        with pytest.raises(ValueError, match="维度"):
+            matrix.search_batch(np.array([[1.0, 0.0, 0.0]]), 10, 0.0)
+
+
+@pytest.fixture
+def sqlite_db(temp_db_factory):
+    """临时 SQLite 数据库：三道题目"""
+    return temp_db_factory(
+        """
+        CREATE TABLE questions (
+            id TEXT PRIMARY KEY, content TEXT, options TEXT, answer TEXT,
+            explanation TEXT, category_id TEXT, created_at TEXT, updated_at TEXT
+        )
+        """,
+        ("INSERT INTO questions VALUES (?, ?, '[]', 'A', '', 'c1', ?, ?)",
+         [(f"q{i}", f"题目{i}", f"2024-01-0{i + 1}", f"2024-01-0{i + 1}") for i in range(3)]),
+    )
+
+
+class TestVectorIndexEmbeddingsTable:
+    """向量独立存储测试（真实 SQLite）"""
+    
+    def test_upsert_and_read(self, sqlite_db):
+        """测试写入、覆盖和读取向量"""
+        index = VectorIndex(sqlite_db)
+        
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        index.update_embedding("q0", np.array([0.0, 1.0]), "v2", "题目0")
+        
+        assert np.allclose(index.get_embedding("q0"), [0.0, 1.0])
+        row = sqlite_db.fetch_one("SELECT COUNT(*) as c FROM question_embeddings")
+        assert row['c'] == 1
+        assert index.needs_reembedding("q0", "题目0", None, "v2") == (False, "无需重新向量化")
+    
+    def test_batch_update_and_stats(self, sqlite_db):
+        """测试批量写入后的统计和缺失列表"""
+        index = VectorIndex(sqlite_db)
+        
+        index.update_embeddings([
+            ("q0", np.array([1.0, 0.0]), "题目0", None),
+            ("q1", np.array([0.9, 0.1]), "题目1", None),
+        ], "v1")
+        
+        stats = index.get_stats()
+        assert stats['total_questions'] == 3
+        assert stats['with_embedding'] == 2
+        assert stats['versions'][0]['count'] == 2
+        assert [q['id'] for q in index.get_missing_embeddings()] == ["q2"]
+        assert index.get_mismatched_embeddings("v2")[0]['embedding_version'] == "v1"
+    
+    def test_snapshot_backend(self, sqlite_db):
+        """测试批处理快照不受之后删除向量的影响"""
+        index = VectorIndex(sqlite_db)
+        index.update_embeddings([
+            (f"q{i}", np.array([1.0, float(i)]), f"题目{i}", None) for i in range(3)
+        ], "v1")
+        
+        snapshot = index.snapshot_backend()
+        index.delete_embedding("q0")
+        
+        assert snapshot.exact
+        assert [qid for ids, _ in snapshot.iter_blocks(2) for qid in ids] == ["q0", "q1", "q2"]
+        assert len(index.get_backend()) == 2
+    
+    def test_search_skips_orphan_embeddings(self, sqlite_db):
+        """测试题目删除后残留的向量不参与检索"""
+        index = VectorIndex(sqlite_db)
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        index.update_embedding("q1", np.array([1.0, 0.0]), "v1", "题目1")
+        sqlite_db.execute("DELETE FROM questions WHERE id = 'q1'")
+        
+        results = index.search_similar(np.array([1.0, 0.0]), threshold=0.9)
+        
+        assert [r['question_id'] for r in results] == ["q0"]
+    
+    
+    def test_search_similar_batch(self, sqlite_db):
+        """测试批量检索结果与逐个检索一致，题干只查询一次"""
+        index = VectorIndex(sqlite_db)
+        index.update_embeddings([
+            ("q0", np.array([1.0, 0.0]), "题目0", None),
+            ("q1", np.array([0.0, 1.0]), "题目1", None),
+            ("q2", np.array([0.7, 0.7]), "题目2", None),
+        ], "v1")
+        queries = np.array([[1.0, 0.0], [0.0, 1.0], [-1.0, 0.0]])
+        
+        with patch.object(sqlite_db, 'fetch_all', wraps=sqlite_db.fetch_all) as fetch_all:
+            results = index.search_similar_batch(queries, threshold=0.6, top_k=2, exclude_ids=["q2"])
+        
+        assert [[r['question_id'] for r in hits] for hits in results] == [["q0"], ["q1"], []]
+        assert results[0][0]['content'] == "题目0"
+        assert sum('FROM questions WHERE id IN' in call.args[0] for call in fetch_all.call_args_list) == 1
+        assert index.search_similar_batch(np.zeros((0, 2))) == []
+    
+    def test_matrix_updated_incrementally(self, sqlite_db):
+        """测试写入和删除直接同步到内存矩阵，不重新加载"""
+        index = VectorIndex(sqlite_db)
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        assert len(index.search_similar(np.array([1.0, 0.0]), threshold=0.9)) == 1
+        
+        with patch.object(index, '_load_matrix', side_effect=AssertionError("不应重新加载")):
+            index.update_embedding("q1", np.array([1.0, 0.01]), "v1", "题目1")
+            assert len(index.search_similar(np.array([1.0, 0.0]), threshold=0.9)) == 2
+            
+            index.delete_embedding("q0")
+            results = index.search_similar(np.array([1.0, 0.0]), threshold=0.9)
+        
+        assert [r['question_id'] for r in results] == ["q1"]
+        assert index.get_memory_stats()['vectors'] == 1
+    
+    def test_reloads_after_external_write(self, sqlite_db):
+        """测试其他实例（进程）写入的向量在一致性检查后可见"""
+        index = VectorIndex(sqlite_db)
+        index.RELOAD_CHECK_SECONDS = 0
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        index.search_similar(np.array([1.0, 0.0]))
+        
+        VectorIndex(sqlite_db).update_embedding("q1", np.array([1.0, 0.0]), "v1", "题目1")
+        index.search_similar(np.array([1.0, 0.0]))
+        results = index.search_similar(np.array([1.0, 0.0]))
+        
+        assert {r['question_id'] for r in results} == {"q0", "q1"}
+    
+    def test_dimension_change_reloads(self, sqlite_db):
+        """测试模型切换导致维度变化后按多数维度重新加载"""
+        index = VectorIndex(sqlite_db)
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        index.search_similar(np.array([1.0, 0.0]))
+        
+        index.update_embeddings([
+            ("q0", np.array([1.0, 0.0, 0.0]), "题目0", None),
+            ("q1", np.array([0.0, 1.0, 0.0]), "题目1", None),
+        ], "v2")
+        results = index.search_similar(np.array([1.0, 0.0, 0.0]), threshold=0.9)
+        
+        assert [r['question_id'] for r in results] == ["q0"]
+        assert index.get_memory_stats()['dimension'] == 3
+    
+    def test_model_version_checked(self, sqlite_db):
+        """测试查询向量的模型版本与检索后端不一致时报错"""
+        index = VectorIndex(sqlite_db)
+        index.update_embeddings([
+            ("q0", np.array([1.0, 0.0]), "题目0", None),
+            ("q1", np.array([0.0, 1.0]), "题目1", None),
+        ], "v1")
+        index.update_embedding("q2", np.array([1.0, 1.0]), "v0", "题目2")
+        
+        assert index.get_model_version() == "v1"
+        assert len(index.search_similar(np.array([1.0, 0.0]), threshold=0.9, model_version="v1")) == 1
+        with pytest.raises(EmbeddingVersionMismatch, match="v2"):
+            index.search_similar(np.array([1.0, 0.0]), model_version="v2")
+        with pytest.raises(EmbeddingVersionMismatch):
+            index.search_similar_batch(np.array([[1.0, 0.0]]), model_version="v2")
+
+
+class TestVectorIndexApproximateMode:
+    """近似检索模式测试（真实 SQLite）"""
+    
+    @pytest.fixture
+    def ivf_config(self):
+        """降低近似索引的启用阈值"""
+        with patch('core.services.vector_index.config') as mock_config:
+            mock_config.VECTOR_INDEX_MODE = "ivf"
+            mock_config.VECTOR_ANN_MIN_SIZE = 2
+            mock_config.VECTOR_IVF_NLIST = 2
+            mock_config.VECTOR_IVF_NPROBE = 2
+            mock_config.VECTOR_HNSW_EF_SEARCH = 64
+            mock_config.VECTOR_INDEX_DIR = ""
+            mock_config.VECTOR_STORE = "off"
+            mock_config.VECTOR_STORAGE_DTYPE = "float32"
+            mock_config.VECTOR_SEARCH_DTYPE = "float32"
+            mock_config.VECTOR_RERANK_CANDIDATES = 0
+            yield mock_config
+    
+    def _write(self, index):
+        index.update_embeddings([
+            ("q0", np.array([1.0, 0.0, 0.0]), "题目0", None),
+            ("q1", np.array([0.9, 0.1, 0.0]), "题目1", None),
+            ("q2", np.array([0.0, 0.0, 1.0]), "题目2", None),
+        ], "v1")
+    
+    def test_unknown_mode_falls_back(self, sqlite_db):
+        """测试未知模式回退到精确检索"""
+        assert VectorIndex(sqlite_db, mode="lsh").mode == "exact"
+    
+    def test_small_bank_uses_exact(self, sqlite_db, ivf_config):
+        """测试向量数低于阈值时使用精确检索"""
+        ivf_config.VECTOR_ANN_MIN_SIZE = 100
+        index = VectorIndex(sqlite_db)
+        self._write(index)
+        
+        index.search_similar(np.array([1.0, 0.0, 0.0]))
+        
+        stats = index.get_memory_stats()
+        assert stats['mode'] == "ivf"
+        assert stats['backend'] == "exact"
+    
+    def test_builds_and_persists_ivf(self, sqlite_db, ivf_config, tmp_path):
+        """测试构建 IVF 索引并保存，新实例指纹一致时直接加载"""
+        index = VectorIndex(sqlite_db)
+        self._write(index)
+        
+        results = index.search_similar(np.array([1.0, 0.0, 0.0]), threshold=0.9)
+        
+        assert [r['question_id'] for r in results] == ["q0", "q1"]
+        assert index.get_memory_stats()['backend'] == "ivf"
+        assert os.path.exists(tmp_path / "vector_index" / "ivf.npz")
+        
+        other = VectorIndex(sqlite_db)
+        with patch('core.services.vector_index.build_backend', side_effect=AssertionError("不应重新构建")):
+            results = other.search_similar(np.array([0.0, 0.0, 1.0]), threshold=0.9)
+        assert [r['question_id'] for r in results] == ["q2"]
+    
+    def test_stale_file_rebuilt(self, sqlite_db, ivf_config):
+        """测试向量表变化后磁盘索引失效并重新构建"""
+        index = VectorIndex(sqlite_db)
+        self._write(index)
+        index.search_similar(np.array([1.0, 0.0, 0.0]))
+        
+        index.delete_embedding("q2")
+        results = VectorIndex(sqlite_db).search_similar(np.array([0.0, 0.0, 1.0]), threshold=0.9)
+        
+        assert results == []
+    
+    def test_persist_saves_incremental_updates(self, sqlite_db, ivf_config):
+        """测试 persist 保存增量更新后的索引"""
+        index = VectorIndex(sqlite_db)
+        self._write(index)
+        index.search_similar(np.array([1.0, 0.0, 0.0]))
+        index.delete_embedding("q2")
+        
+        index.persist()
+        other = VectorIndex(sqlite_db)
+        with patch('core.services.vector_index.build_backend', side_effect=AssertionError("不应重新构建")):
+            other.search_similar(np.array([0.0, 0.0, 1.0]))
+        
+        assert other.get_memory_stats()['vectors'] == 2
+
+
+class TestVectorIndexMemmapStore:
+    """内存映射向量存储模式测试（真实 SQLite）"""
+    
+    @pytest.fixture
+    def store_config(self):
+        with patch('core.services.vector_index.config') as mock_config:
+            mock_config.VECTOR_INDEX_MODE = "exact"
+            mock_config.VECTOR_ANN_MIN_SIZE = 20000
+            mock_config.VECTOR_INDEX_DIR = ""
+            mock_config.VECTOR_STORE = "float16"
+            mock_config.VECTOR_STORAGE_DTYPE = "float32"
+            mock_config.VECTOR_SEARCH_DTYPE = "float32"
+            mock_config.VECTOR_RERANK_CANDIDATES = 0
+            yield mock_config
+    
+    def test_second_worker_opens_store_without_blobs(self, sqlite_db, store_config, tmp_path):
+        """测试第二个实例直接打开磁盘存储，不读取 BLOB"""
+        index = VectorIndex(sqlite_db)
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        index.search_similar(np.array([1.0, 0.0]))
+        assert index.get_memory_stats()['backend'] == "memmap"
+        assert os.path.exists(tmp_path / "vector_index" / "store" / "vectors.bin")
+        
+        # 已加载后写入：追加到存储并记录指纹
+        index.update_embedding("q1", np.array([0.0, 1.0]), "v1", "题目1")
+        
+        other = VectorIndex(sqlite_db)
+        with patch.object(sqlite_db, 'fetch_all', wraps=sqlite_db.fetch_all) as fetch_all:
+            results = other.search_similar(np.array([0.0, 1.0]), threshold=0.9)
+        assert [r['question_id'] for r in results] == ["q1"]
+        assert not any('e.embedding' in call.args[0] for call in fetch_all.call_args_list)
+    
+    def test_writes_visible_without_reload(self, sqlite_db, store_config):
+        """测试其他实例的写入经一致性检查后直接可见，不重新加载"""
+        index = VectorIndex(sqlite_db)
+        index.RELOAD_CHECK_SECONDS = 0
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        index.search_similar(np.array([1.0, 0.0]))
+        other = VectorIndex(sqlite_db)
+        other.search_similar(np.array([1.0, 0.0]))
+        
+        other.update_embedding("q1", np.array([1.0, 0.01]), "v1", "题目1")
+        other.delete_embedding("q0")
+        with patch.object(index, '_load_matrix', side_effect=AssertionError("不应重新加载")):
+            results = index.search_similar(np.array([1.0, 0.0]), threshold=0.9)
+        
+        assert [r['question_id'] for r in results] == ["q1"]
+    
+    def test_stale_store_rebuilt(self, sqlite_db, store_config):
+        """测试存储未同步的写入（如其他工具直接写库）触发重建"""
+        index = VectorIndex(sqlite_db)
+        index.update_embedding("q0", np.array([1.0, 0.0]), "v1", "题目0")
+        index.search_similar(np.array([1.0, 0.0]))
+        
+        sqlite_db.execute("DELETE FROM question_embeddings WHERE question_id = 'q0'")
+        
+        assert VectorIndex(sqlite_db).search_similar(np.array([1.0, 0.0])) == []
+
+
+class TestVectorIndexQuantization:
+    """向量量化存储与检索测试（真实 SQLite）"""
+    
+    @pytest.fixture
+    def quant_config(self):
+        with patch('core.services.vector_index.config') as mock_config:
+            mock_config.VECTOR_INDEX_MODE = "exact"
+            mock_config.VECTOR_ANN_MIN_SIZE = 20000
+            mock_config.VECTOR_INDEX_DIR = ""
+            mock_config.VECTOR_STORE = "off"
+            mock_config.VECTOR_STORAGE_DTYPE = "int8"
+            mock_config.VECTOR_SEARCH_DTYPE = "int8"
+            mock_config.VECTOR_RERANK_CANDIDATES = 0
+            yield mock_config
+    
+    def test_int8_storage(self, sqlite_db, quant_config):
+        """测试 int8 存储的字节数和读取"""
+        index = VectorIndex(sqlite_db)
+        vector = np.linspace(-1.0, 1.0, 64)
+        
+        index.update_embedding("q0", vector, "v1", "题目0")
+        
+        row = sqlite_db.fetch_one("SELECT embedding, embedding_dtype FROM question_embeddings")
+        assert row['embedding_dtype'] == "int8"
+        assert len(row['embedding']) == 64 + 4
+        assert np.allclose(index.get_embedding("q0"), vector, atol=1e-2)
+    
+    def test_loads_mixed_storage_dtypes(self, sqlite_db, quant_config):
+        """测试切换存储精度后新旧格式的向量都能加载"""
+        quant_config.VECTOR_STORAGE_DTYPE = "float32"
+        VectorIndex(sqlite_db).update_embedding("q0", np.array([1.0, 0.0, 0.0]), "v1", "题目0")
+        quant_config.VECTOR_STORAGE_DTYPE = "float16"
+        VectorIndex(sqlite_db).update_embedding("q1", np.array([0.0, 1.0, 0.0]), "v1", "题目1")
+        quant_config.VECTOR_STORAGE_DTYPE = "int8"
+        index = VectorIndex(sqlite_db)
+        index.update_embedding("q2", np.array([0.0, 0.0, 1.0]), "v1", "题目2")
+        
+        for i, query in enumerate(np.eye(3)):
+            results = index.search_similar(query, threshold=0.99)
+            assert [r['question_id'] for r in results] == [f"q{i}"]
+        stats = index.get_memory_stats()
+        assert stats['dtype'] == "int8"
+        assert stats['vectors'] == 3
+    
+    def test_rerank_uses_stored_vectors(self, sqlite_db, quant_config):
+        """测试重排后的相似度按数据库中的原始向量计算"""
+        quant_config.VECTOR_STORAGE_DTYPE = "float32"
+        quant_config.VECTOR_RERANK_CANDIDATES = 5
+        index = VectorIndex(sqlite_db)
+        index.update_embeddings([
+            ("q0", np.array([1.0, 0.02, 0.0]), "题目0", None),
+            ("q1", np.array([1.0, 0.0, 0.03]), "题目1", None),
+            ("q2", np.array([0.0, 1.0, 0.0]), "题目2", None),
+        ], "v1")
+        query = np.array([1.0, 0.0, 0.0])
+        
+        results = index.search_similar(query, threshold=0.9, top_k=1)
+        
+        assert [r['question_id'] for r in results] == ["q0"]
+        expected = 1.0 / np.linalg.norm([1.0, 0.02, 0.0])
+        assert results[0]['similarity'] == pytest.approx(expected, abs=1e-6)
+    
+    def test_adds_dtype_column_to_old_table(self, sqlite_db):
+        """测试旧版本向量表补充 embedding_dtype 列"""
+        sqlite_db.execute("""
+            CREATE TABLE question_embeddings (
+                question_id TEXT PRIMARY KEY, embedding BLOB NOT NULL,
+                embedding_version TEXT, content_hash TEXT, embedding_updated_at TEXT
+            )
+        """)
+        sqlite_db.execute(
+            "INSERT INTO question_embeddings VALUES ('q0', ?, 'v1', 'h', '2024')",
+            (np.array([1.0, 0.0], dtype=np.float32).tobytes(),)
+        )
+        
+        index = VectorIndex(sqlite_db)
+        
+        row = sqlite_db.fetch_one("SELECT embedding_dtype FROM question_embeddings")
+        assert row['embedding_dtype'] == "float32"
+        assert np.allclose(index.get_embedding("q0"), [1.0, 0.0])
+
+
+class TestVectorIndexFilteredSearch:
+    """按分类/标签预过滤的相似检索测试（真实 SQLite）"""
+    
+    @pytest.fixture
+    def filtered_index(self, sqlite_db):
+        sqlite_db.execute("CREATE TABLE question_tags (question_id TEXT, tag_id TEXT)")
+        sqlite_db.execute("CREATE TABLE category_closure (ancestor_id TEXT, descendant_id TEXT, depth INTEGER)")
+        sqlite_db.executemany("INSERT INTO category_closure VALUES (?, ?, ?)",
+                              [("c1", "c1", 0), ("c2", "c2", 0), ("c1", "c2", 1)])
+        sqlite_db.execute("UPDATE questions SET category_id = 'c2' WHERE id = 'q1'")
+        sqlite_db.execute("INSERT INTO question_tags VALUES ('q2', 't1')")
+        index = VectorIndex(sqlite_db)
+        for i in range(3):
+            index.update_embedding(f"q{i}", np.array([1.0, 0.1 * i]), "v1", f"题目{i}")
+        return index
+    
+    def test_category_filter(self, filtered_index):
+        """测试分类筛选（可包含子分类）"""
+        query = np.array([1.0, 0.0])
+        
+        direct = filtered_index.search_similar(query, threshold=0.0, category_id="c1")
+        subtree = filtered_index.search_similar(query, threshold=0.0, category_id="c1", include_descendants=True)
+        
+        assert [r['question_id'] for r in direct] == ["q0", "q2"]
+        assert [r['question_id'] for r in subtree] == ["q0", "q1", "q2"]
+    
+    def test_tag_filter_and_batch(self, filtered_index):
+        """测试标签筛选与批量检索"""
+        results = filtered_index.search_similar_batch(np.array([[1.0, 0.0], [0.0, 1.0]]), threshold=0.0,
+                                                      tag_id="t1")
+        
+        assert [[r['question_id'] for r in hits] for hits in results] == [["q2"], ["q2"]]
+    
+    def test_no_candidates(self, filtered_index):
+        """测试没有满足筛选条件的题目时不扫描矩阵"""
+        with patch.object(filtered_index, '_get_matrix') as get_matrix:
+            assert filtered_index.search_similar(np.array([1.0, 0.0]), threshold=0.0, tag_id="none") == []
+            assert filtered_index.search_similar_batch(np.eye(2), threshold=0.0, category_id="none") == [[], []]
+        get_matrix.assert_not_called()
+
+
+class TestLegacyEmbeddingMigration:
+    """旧版本向量列迁移测试"""
+    
+    def test_moves_vectors_out_of_questions(self, sqlite_db):
+        """测试 questions 表中的向量迁移到向量表"""
+        from core.database import migrations
+        
+        for column, column_type in [('embedding', 'BLOB'), ('embedding_version', 'TEXT'),
+                                    ('content_hash', 'TEXT'), ('embedding_updated_at', 'TEXT')]:
+            sqlite_db.execute(f"ALTER TABLE questions ADD COLUMN {column} {column_type}")
+        vector = np.array([0.5, 0.5], dtype=np.float32)
+        sqlite_db.execute(
+            "UPDATE questions SET embedding = ?, embedding_version = 'v1', content_hash = 'h' WHERE id = 'q0'",
+            (vector.tobytes(),)
+        )
+        
+        with patch.object(migrations, 'db', sqlite_db), \
+             patch.object(migrations, 'transaction', sqlite_db.pool.transaction):
+            migrations.ensure_embeddings_table()
+        
+        columns = {row['name'] for row in sqlite_db.fetch_all("PRAGMA table_info(questions)")}
+        assert 'embedding' not in columns
+        index = VectorIndex(sqlite_db)
+        assert np.allclose(index.get_embedding("q0"), vector)
+        assert index.get_stats()['with_embedding'] == 1
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
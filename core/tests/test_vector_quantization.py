@@ -0,0 +1,101 @@
+"""
+向量量化测试
+测试 float16 / int8 编解码和量化内存矩阵的检索
+"""
+import pytest
+import sys
+import os
+import numpy as np
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services.vector_quantization import (
+    bytes_per_vector, decode, decode_many, dimension_of, encode, quantize_int8
+)
+from core.services.vector_backends import EmbeddingMatrix, recall_at_k
+
+
+def random_vectors(size, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((size, dim)).astype(np.float32)
+
+
+class TestCodec:
+    """编解码测试"""
+    
+    @pytest.mark.parametrize("dtype,tolerance", [("float32", 0), ("float16", 1e-2), ("int8", 2e-2)])
+    def test_roundtrip(self, dtype, tolerance):
+        """测试编码后解码的误差和字节数"""
+        vector = random_vectors(1)[0]
+        
+        blob = encode(vector, dtype)
+        decoded = decode(blob, dtype)
+        
+        assert len(blob) == bytes_per_vector(32, dtype)
+        assert dimension_of(blob, dtype) == 32
+        assert decoded.dtype == np.float32
+        assert np.abs(decoded - vector).max() <= tolerance * np.abs(vector).max() + 1e-7
+    
+    def test_int8_zero_vector(self):
+        """测试零向量量化"""
+        codes, scales = quantize_int8(np.zeros((1, 4)))
+        
+        assert scales[0] == 0
+        assert np.all(decode(encode(np.zeros(4), "int8"), "int8") == 0)
+    
+    def test_decode_many_matches_decode(self):
+        """测试批量解码与逐条解码一致"""
+        vectors = random_vectors(5)
+        for dtype in ("float32", "float16", "int8"):
+            blobs = [encode(v, dtype) for v in vectors]
+            
+            matrix = decode_many(blobs, dtype, 32)
+            
+            assert matrix.shape == (5, 32)
+            assert np.allclose(matrix, np.vstack([decode(b, dtype) for b in blobs]))
+    
+    def test_unknown_dtype(self):
+        """测试不支持的精度"""
+        with pytest.raises(ValueError):
+            encode(np.ones(4), "int4")
+
+
+class TestQuantizedMatrix:
+    """量化内存矩阵测试"""
+    
+    @pytest.mark.parametrize("dtype,ratio", [("float16", 2), ("int8", 4)])
+    def test_memory_and_recall(self, dtype, ratio):
+        """测试内存节省且 top-10 与 float32 基本一致"""
+        vectors = random_vectors(2000)
+        ids = [f"q{i}" for i in range(2000)]
+        exact = EmbeddingMatrix(32)
+        exact.upsert(ids, vectors)
+        quantized = EmbeddingMatrix(32, dtype)
+        quantized.upsert(ids, vectors)
+        queries = vectors[:20] + 0.1
+        
+        approx = [[qid for qid, _ in quantized.search(q, 10, -1.0)] for q in queries]
+        expected = [[qid for qid, _ in exact.search(q, 10, -1.0)] for q in queries]
+        
+        assert exact.nbytes / quantized.nbytes >= ratio * 0.85
+        assert recall_at_k(approx, expected) >= 0.9
+        assert quantized.search(vectors[3], 1, 0.0)[0][0] == "q3"
+    
+    def test_int8_remove_keeps_scales(self):
+        """测试删除时缩放系数随行移动"""
+        vectors = random_vectors(3) * np.array([[1.0], [100.0], [0.01]], dtype=np.float32)
+        matrix = EmbeddingMatrix(32, "int8")
+        matrix.upsert(["a", "b", "c"], vectors)
+        
+        matrix.remove("a")
+        
+        assert matrix.search(vectors[2], 1, 0.0)[0][0] == "c"
+        assert matrix.search(vectors[2], 1, 0.0)[0][1] == pytest.approx(1.0, abs=1e-2)
+        assert np.allclose(matrix.vectors([matrix._rows["c"]])[0], vectors[2] / np.linalg.norm(vectors[2]), atol=1e-2)
+    
+    def test_invalid_dtype(self):
+        """测试不支持的精度"""
+        with pytest.raises(ValueError):
+            EmbeddingMatrix(4, "int4")
@@ -0,0 +1,166 @@
+"""
+MemmapVectorStore 测试
+测试内存映射向量存储的追加、删除、跨实例可见性和压缩
+"""
+import pytest
+import sys
+import os
+import numpy as np
+
+# 添加项目根目录到路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from core.services.vector_store import MemmapVectorStore
+
+
+def random_vectors(size, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((size, dim)).astype(np.float32)
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / "store")
+
+
+class TestMemmapVectorStore:
+    """内存映射向量存储测试"""
+    
+    def test_create_and_open(self, store_dir):
+        """测试创建后由新实例打开并检索"""
+        vectors = random_vectors(100)
+        MemmapVectorStore.create(store_dir, 8, "float32", [f"q{i}" for i in range(100)], vectors, (100, "t1"))
+        
+        store = MemmapVectorStore.open(store_dir)
+        
+        assert len(store) == 100
+        assert store.fingerprint == (100, "t1")
+        assert "q3" in store
+        hits = store.search(vectors[3], 2, 0.0)
+        assert hits[0][0] == "q3"
+        assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+    
+    def test_open_missing(self, store_dir):
+        """测试目录不存在时返回 None"""
+        assert MemmapVectorStore.open(store_dir) is None
+    
+    def test_float16(self, store_dir):
+        """测试 float16 存储占用减半且结果一致"""
+        vectors = random_vectors(50)
+        store = MemmapVectorStore.create(store_dir, 8, "float16", [f"q{i}" for i in range(50)], vectors)
+        
+        assert store.nbytes == 50 * 8 * 2
+        assert store.search(vectors[7], 1, 0.0)[0][0] == "q7"
+    
+    def test_upsert_appends_and_tombstones(self, store_dir):
+        """测试覆盖写入追加新行并标记旧行删除"""
+        vectors = random_vectors(10)
+        store = MemmapVectorStore.create(store_dir, 8, "float32", [f"q{i}" for i in range(10)], vectors)
+        
+        store.upsert(["q0", "new"], vectors[[5, 6]])
+        
+        assert len(store) == 11
+        assert store._meta["count"] == 12
+        assert store._meta["deleted"] == 1
+        assert store._meta["fingerprint"] is None
+        assert {qid for qid, _ in store.search(vectors[5], 2, 0.99)} == {"q0", "q5"}
+        assert store.search(vectors[0], 1, 0.99) == []
+    
+    def test_remove_and_zero_vector(self, store_dir):
+        """测试删除和零向量"""
+        vectors = random_vectors(10)
+        store = MemmapVectorStore.create(store_dir, 8, "float32", [f"q{i}" for i in range(10)], vectors)
+        
+        assert store.remove("q1") is True
+        assert store.remove("q1") is False
+        store.upsert(["q2"], np.zeros((1, 8), dtype=np.float32))
+        
+        assert len(store) == 8
+        assert "q1" not in store and "q2" not in store
+        assert all(qid not in ("q1", "q2") for qid, _ in store.search(vectors[1], 10, -1.0))
+    
+    def test_exclude_ids_and_threshold(self, store_dir):
+        """测试排除 ID 和相似度阈值"""
+        vectors = random_vectors(10)
+        store = MemmapVectorStore.create(store_dir, 8, "float32", [f"q{i}" for i in range(10)], vectors)
+        
+        assert "q4" not in [qid for qid, _ in store.search(vectors[4], 3, -1.0, exclude_ids=["q4"])]
+        assert store.search(-vectors[4], 3, 0.99) == []
+    
+    def test_other_instance_sees_writes(self, store_dir):
+        """测试其他实例（worker）检索时读到追加、删除和扩容"""
+        vectors = random_vectors(2000)
+        writer = MemmapVectorStore.create(store_dir, 8, "float32", [f"q{i}" for i in range(10)], vectors[:10])
+        reader = MemmapVectorStore.open(store_dir)
+        
+        writer.upsert([f"q{i}" for i in range(10, 2000)], vectors[10:])
+        writer.remove("q3")
+        writer.mark_synced((1999, "t2"))
+        
+        assert reader.refresh() == (1999, "t2")
+        assert len(reader) == 1999
+        assert reader.search(vectors[1500], 1, 0.0)[0][0] == "q1500"
+        assert "q3" not in reader
+        
+        # 读取方也可以写入，写入前会同步对方的追加
+        reader.upsert(["x"], vectors[:1])
+        assert len(writer) == 2000
+        assert {qid for qid, _ in writer.search(vectors[0], 2, 0.99)} == {"q0", "x"}
+    
+    def test_compact(self, store_dir):
+        """测试压缩后只保留未删除的行，其他实例重新打开新一代文件"""
+        vectors = random_vectors(20)
+        store = MemmapVectorStore.create(store_dir, 8, "float32", [f"q{i}" for i in range(20)], vectors, (20, "t"))
+        reader = MemmapVectorStore.open(store_dir)
+        for i in range(10):
+            store.remove(f"q{i}")
+        
+        store.compact()
+        
+        assert store._meta["count"] == 10
+        assert store._meta["deleted"] == 0
+        assert reader.search(vectors[15], 1, 0.0)[0][0] == "q15"
+        assert reader._meta["generation"] == 1
+        assert len(reader) == 10
+    
+    def test_search_batch_skips_deleted(self, store_dir):
+        """测试批量检索与逐个检索一致且跳过已删除的行"""
+        vectors = random_vectors(300)
+        store = MemmapVectorStore.create(store_dir, 8, "float16", [f"q{i}" for i in range(300)], vectors)
+        store.remove("q5")
+        queries = vectors[:10]
+        
+        batch = store.search_batch(queries, 3, 0.0)
+        
+        assert [[qid for qid, _ in hits] for hits in batch] == \
+            [[qid for qid, _ in store.search(query, 3, 0.0)] for query in queries]
+        assert "q5" not in [qid for qid, _ in batch[5]]
+    
+    def test_candidate_ids(self, store_dir):
+        """测试候选集合检索跳过已删除和已排除的行"""
+        vectors = random_vectors(100)
+        store = MemmapVectorStore.create(store_dir, 8, "float32", [f"q{i}" for i in range(100)], vectors)
+        store.remove("q4")
+        candidates = [f"q{i}" for i in range(0, 100, 2)]
+        
+        hits = store.search(vectors[4], 100, -1.0, exclude_ids=["q2"], candidate_ids=candidates)
+        
+        assert {qid for qid, _ in hits} == set(candidates) - {"q2", "q4"}
+        assert [hits[0][0] for hits in store.search_batch(vectors[:3], 1, -1.0, candidate_ids=["q1"])] == ["q1"] * 3
+    
+    def test_dimension_mismatch(self, store_dir):
+        """测试维度不一致时报错"""
+        store = MemmapVectorStore.create(store_dir, 8, "float32", ["q0"], random_vectors(1))
+        
+        with pytest.raises(ValueError):
+            store.upsert(["q1"], np.ones((1, 3), dtype=np.float32))
+        with pytest.raises(ValueError, match="维度"):
+            store.search(np.ones(3, dtype=np.float32), 5, 0.0)
+        with pytest.raises(ValueError, match="维度"):
+            store.search_batch(np.ones((2, 3), dtype=np.float32), 5, 0.0)
+    
+    def test_invalid_dtype(self, store_dir):
+        """测试不支持的精度"""
+        with pytest.raises(ValueError):
+            MemmapVectorStore.create(store_dir, 8, "int4", [], np.zeros((0, 8), dtype=np.float32))
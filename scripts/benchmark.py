@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+性能基准脚本
+
+在临时数据库上运行，不会修改正式数据
+支持：
+- 列表分页的 SQL 查询次数统计（验证无 N+1 查询）
+- 向量相似度检索延迟（内存矩阵 vs 逐行计算）
+- 近似向量检索（IVF / HNSW）的 recall@k 与延迟
+- 向量量化（float16 / int8）的召回损失与内存节省
+
+使用方法:
+    python scripts/benchmark.py queries                     # 默认 2000 题
+    python scripts/benchmark.py queries --questions 10000   # 指定题目数量
+    python scripts/benchmark.py vectors                     # 10k/100k/1M 向量，256 维
+    python scripts/benchmark.py vectors --sizes 10000 --dim 1024
+    python scripts/benchmark.py recall --mode ivf --sizes 100000 --nprobe 8 16 32
+    python scripts/benchmark.py recall --from-db            # 使用题库中的真实向量
+    python scripts/benchmark.py quantization --from-db      # float32 / float16 / int8 召回损失与内存
+"""
+
+import sys
+import os
+import argparse
+import tempfile
+import time
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def print_header(text: str):
+    """打印标题"""
+    print("\n" + "=" * 60)
+    print(text)
+    print("=" * 60)
+
+
+def use_temp_database() -> str:
+    """
+    将数据库指向临时文件（必须在导入 core 模块之前调用）
+
+    Returns:
+        临时数据库路径
+    """
+    temp_dir = tempfile.mkdtemp(prefix="qb_bench_")
+    db_path = os.path.join(temp_dir, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    return db_path
+
+
+class QueryCounter:
+    """通过 SQLite trace 回调统计执行的 SQL 语句数（覆盖连接池中的所有连接）"""
+
+    def __init__(self, db):
+        self.db = db
+        self.count = 0
+
+    def _trace(self, statement: str):
+        # 以 "--" 开头的是触发器/FTS5 内部执行的子语句，不计入
+        if not statement.startswith("--"):
+            self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        self.db.set_trace_callback(self._trace)
+        return self
+
+    def __exit__(self, *exc):
+        self.db.set_trace_callback(None)
+
+
+def seed_questions(db, total: int, tags_per_question: int = 3):
+    """批量写入测试题目和标签"""
+    import uuid
+    import json
+    from datetime import datetime, timedelta
+
+    category_id = db.fetch_one("SELECT id FROM categories LIMIT 1")['id']
+    tag_ids = [row['id'] for row in db.fetch_all("SELECT id FROM tags")]
+
+    from core.database.connection import transaction
+
+    base = datetime.now()
+    questions = []
+    links = []
+    for i in range(total):
+        question_id = str(uuid.uuid4())
+        created = (base - timedelta(seconds=i)).isoformat()
+        questions.append((
+            question_id, f"基准测试题目 {i}", json.dumps(["A", "B", "C", "D"]),
+            "A", f"解析 {i}", category_id, created, created
+        ))
+        for j in range(tags_per_question):
+            links.append((question_id, tag_ids[(i + j) % len(tag_ids)]))
+
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT INTO questions (id, content, options, answer, explanation, category_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, questions)
+        conn.executemany("INSERT INTO question_tags (question_id, tag_id) VALUES (?, ?)", links)
+
+
+def bench_queries(args):
+    """统计题目列表每页执行的 SQL 次数"""
+    print_header(f"列表查询次数基准（{args.questions} 题）")
+
+    db_path = use_temp_database()
+
+    from core.database.connection import db
+    from core.database.migrations import migrate_database
+    from core.database.repositories import QuestionRepository
+
+    migrate_database(auto=True)
+    seed_questions(db, args.questions)
+    repo = QuestionRepository()
+
+    tag_id = db.fetch_one("SELECT id FROM tags LIMIT 1")['id']
+    category_id = db.fetch_one("SELECT id FROM categories LIMIT 1")['id']
+
+    cases = [
+        ("列表 limit=20", lambda: repo.get_all(page=1, limit=20)),
+        ("列表 limit=100", lambda: repo.get_all(page=1, limit=100)),
+        ("列表 深分页 limit=100", lambda: repo.get_all(page=max(1, args.questions // 100), limit=100)),
+        ("搜索 keyword", lambda: repo.search("基准")),
+        ("按分类 (limit=1000)", lambda: repo.get_by_category(category_id)),
+        ("按标签 (limit=1000)", lambda: repo.get_by_tag(tag_id)),
+    ]
+
+    print(f"\n{'场景':<24}{'返回题数':>10}{'SQL 次数':>10}{'耗时(ms)':>12}")
+    for name, func in cases:
+        with QueryCounter(db) as counter:
+            start = time.perf_counter()
+            result = func()
+            elapsed = (time.perf_counter() - start) * 1000
+        rows = len(result['data']) if isinstance(result, dict) else len(result)
+        print(f"{name:<24}{rows:>10}{counter.count:>10}{elapsed:>12.1f}")
+
+    print(f"\n临时数据库：{db_path}")
+
+
+def _legacy_search(rows, query, threshold, top_k):
+    """旧实现：逐行反序列化、计算范数和点积"""
+    import numpy as np
+
+    query_norm = np.linalg.norm(query)
+    results = []
+    for question_id, emb_bytes in rows:
+        emb = np.frombuffer(emb_bytes, dtype=np.float32)
+        emb_norm = np.linalg.norm(emb)
+        if emb_norm == 0 or query_norm == 0:
+            continue
+        similarity = np.dot(query, emb) / (query_norm * emb_norm)
+        if similarity >= threshold:
+            results.append((question_id, float(similarity)))
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results[:top_k]
+
+
+def _percentiles(samples):
+    """返回 (p50, p95) 毫秒"""
+    import numpy as np
+
+    return float(np.percentile(samples, 50)), float(np.percentile(samples, 95))
+
+
+def bench_vectors(args):
+    """向量检索延迟：内存矩阵（矩阵向量乘 + argpartition）与逐行计算对比"""
+    import numpy as np
+    from core.services.vector_index import EmbeddingMatrix
+
+    print_header(f"向量检索基准（{args.dim} 维，top_k={args.top_k}，每档 {args.queries} 次查询）")
+    rng = np.random.default_rng(42)
+    chunk = 100_000
+
+    print(f"\n{'向量数':>10}{'加载(s)':>10}{'内存(MB)':>10}{'矩阵 p50(ms)':>14}{'矩阵 p95(ms)':>14}{'逐行 p50(ms)':>14}")
+    for size in args.sizes:
+        matrix = EmbeddingMatrix(args.dim)
+        start = time.perf_counter()
+        for offset in range(0, size, chunk):
+            count = min(chunk, size - offset)
+            vectors = rng.standard_normal((count, args.dim), dtype=np.float32)
+            matrix.upsert([f"q{offset + i}" for i in range(count)], vectors)
+        load_seconds = time.perf_counter() - start
+
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            matrix.search(query, args.top_k, args.threshold)
+            samples.append((time.perf_counter() - start) * 1000)
+        p50, p95 = _percentiles(samples)
+
+        legacy = "-"
+        if size <= args.legacy_max:
+            rows = [(question_id, matrix._data[row].tobytes()) for row, question_id in enumerate(matrix.ids)]
+            legacy_samples = []
+            for query in queries[:min(5, len(queries))]:
+                start = time.perf_counter()
+                _legacy_search(rows, query, args.threshold, args.top_k)
+                legacy_samples.append((time.perf_counter() - start) * 1000)
+            legacy = f"{_percentiles(legacy_samples)[0]:.1f}"
+
+        print(f"{size:>10}{load_seconds:>10.2f}{matrix.nbytes / 1024 / 1024:>10.1f}{p50:>14.2f}{p95:>14.2f}{legacy:>14}")
+        del matrix
+
+
+def _synthetic_vectors(rng, size, dim, clusters=256):
+    """带簇结构的合成向量（纯随机向量没有近邻结构，无法反映真实召回率）"""
+    import numpy as np
+
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, size)
+    return centers[labels] + 0.5 * rng.standard_normal((size, dim), dtype=np.float32)
+
+
+def _load_db_vectors():
+    """读取题库中的全部向量（解码为 float32，只保留占多数的维度）"""
+    import numpy as np
+    from collections import Counter
+    from core.database.connection import db
+    from core.database.migrations import EMBEDDINGS_TABLE
+    from core.database.migrations import ensure_embeddings_table
+    from core.services.vector_quantization import decode
+
+    ensure_embeddings_table()
+    rows = db.fetch_all(f"""
+        SELECT question_id, embedding, embedding_dtype FROM {EMBEDDINGS_TABLE} WHERE embedding IS NOT NULL
+    """)
+    vectors = [decode(row['embedding'], row['embedding_dtype'] or 'float32') for row in rows]
+    if not vectors:
+        return [], None
+    size = Counter(len(v) for v in vectors).most_common(1)[0][0]
+    kept = [(row['question_id'], v) for row, v in zip(rows, vectors) if len(v) == size]
+    return [question_id for question_id, _ in kept], np.vstack([v for _, v in kept])
+
+
+def bench_recall(args):
+    """近似检索 recall@k：与精确矩阵检索的结果对比"""
+    import numpy as np
+    from core.services.vector_backends import build_backend, hnswlib, recall_at_k
+
+    if args.mode == 'hnsw' and hnswlib is None:
+        print("❌ 未安装 hnswlib：pip install hnswlib")
+        return
+
+    rng = np.random.default_rng(42)
+    datasets = []
+    if args.from_db:
+        ids, vectors = _load_db_vectors()
+        if not ids:
+            print("❌ 题库中没有向量，请先运行 scripts/rebuild_embeddings.py")
+            return
+        datasets.append((ids, vectors))
+    else:
+        for size in args.sizes:
+            datasets.append(([f"q{i}" for i in range(size)], _synthetic_vectors(rng, size, args.dim)))
+
+    params = args.nprobe if args.mode == 'ivf' else args.ef_search
+    print_header(f"近似检索召回率（mode={args.mode}，k={args.k}，每档 {args.queries} 次查询）")
+    print(f"\n{'向量数':>10}{'参数':>8}{'构建(s)':>10}{'recall@k':>10}{'近似 p50(ms)':>14}{'近似 p95(ms)':>14}{'精确 p50(ms)':>14}")
+    for ids, vectors in datasets:
+        exact = build_backend('exact', ids, vectors)
+        # 查询取自库内向量加扰动，模拟"相似题"查询
+        picks = rng.choice(len(ids), min(args.queries, len(ids)), replace=False)
+        queries = vectors[picks] + 0.1 * rng.standard_normal((len(picks), vectors.shape[1]), dtype=np.float32)
+
+        exact_samples, exact_results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            hits = exact.search(query, args.k, -1.0)
+            exact_samples.append((time.perf_counter() - start) * 1000)
+            exact_results.append([question_id for question_id, _ in hits])
+        exact_p50 = _percentiles(exact_samples)[0]
+
+        start = time.perf_counter()
+        backend = build_backend(args.mode, ids, vectors, {'nprobe': params[0], 'ef_search': params[0]})
+        build_seconds = time.perf_counter() - start
+
+        for param in params:
+            if args.mode == 'ivf':
+                backend.nprobe = param
+            else:
+                backend.ef_search = param
+            samples, results = [], []
+            for query in queries:
+                start = time.perf_counter()
+                hits = backend.search(query, args.k, -1.0)
+                samples.append((time.perf_counter() - start) * 1000)
+                results.append([question_id for question_id, _ in hits])
+            p50, p95 = _percentiles(samples)
+            recall = recall_at_k(results, exact_results)
+            print(f"{len(ids):>10}{param:>8}{build_seconds:>10.2f}{recall:>10.3f}{p50:>14.2f}{p95:>14.2f}{exact_p50:>14.2f}")
+        del exact, backend
+
+
+def bench_quantization(args):
+    """量化精度对比：内存占用、recall@k（可选原始精度重排）与检索延迟"""
+    import numpy as np
+    from core.services.vector_backends import EmbeddingMatrix, recall_at_k
+    from core.services.vector_quantization import QUANT_DTYPES, bytes_per_vector
+
+    rng = np.random.default_rng(42)
+    if args.from_db:
+        ids, vectors = _load_db_vectors()
+        if not ids:
+            print("❌ 题库中没有向量，请先运行 scripts/rebuild_embeddings.py")
+            return
+    else:
+        ids = [f"q{i}" for i in range(args.size)]
+        vectors = _synthetic_vectors(rng, args.size, args.dim)
+    dim = vectors.shape[1]
+    picks = rng.choice(len(ids), min(args.queries, len(ids)), replace=False)
+    queries = vectors[picks] + 0.1 * rng.standard_normal((len(picks), dim), dtype=np.float32)
+    originals, _ = EmbeddingMatrix.normalize(vectors)
+    rows = {question_id: row for row, question_id in enumerate(ids)}
+
+    print_header(f"向量量化对比（{len(ids)} 条，{dim} 维，k={args.k}，重排候选 {args.rerank}）")
+    print(f"\n{'精度':>8}{'存储(B/条)':>12}{'内存(MB)':>10}{'recall@k':>10}{'重排 recall':>12}{'p50(ms)':>10}{'重排 p50(ms)':>14}")
+    exact_results = None
+    for dtype in QUANT_DTYPES:
+        matrix = EmbeddingMatrix(dim, dtype)
+        matrix.upsert(ids, vectors)
+
+        results, reranked, samples, rerank_samples = [], [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            hits = matrix.search(query, args.k, -1.0)
+            samples.append((time.perf_counter() - start) * 1000)
+            results.append([question_id for question_id, _ in hits])
+
+            # 重排：取更多候选，用 float32 原始向量重新计算相似度
+            start = time.perf_counter()
+            candidates = [question_id for question_id, _ in matrix.search(query, max(args.k, args.rerank), -1.0)]
+            scores = originals[[rows[question_id] for question_id in candidates]] @ (query / np.linalg.norm(query))
+            order = np.argsort(-scores)[:args.k]
+            rerank_samples.append((time.perf_counter() - start) * 1000)
+            reranked.append([candidates[i] for i in order])
+
+        if exact_results is None:
+            exact_results = results
+        print(f"{dtype:>8}{bytes_per_vector(dim, dtype):>12}{matrix.nbytes / 1024 / 1024:>10.1f}"
+              f"{recall_at_k(results, exact_results):>10.3f}{recall_at_k(reranked, exact_results):>12.3f}"
+              f"{_percentiles(samples)[0]:>10.2f}{_percentiles(rerank_samples)[0]:>14.2f}")
+        del matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='性能基准工具')
+    subparsers = parser.add_subparsers(dest='command')
+
+    queries_parser = subparsers.add_parser('queries', help='列表分页 SQL 查询次数')
+    queries_parser.add_argument('--questions', type=int, default=2000, help='题目数量')
+    queries_parser.set_defaults(func=bench_queries)
+
+    vectors_parser = subparsers.add_parser('vectors', help='向量相似度检索延迟')
+    vectors_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help='向量数量')
+    vectors_parser.add_argument('--dim', type=int, default=256, help='向量维度')
+    vectors_parser.add_argument('--queries', type=int, default=50, help='每档查询次数')
+    vectors_parser.add_argument('--top-k', type=int, default=10, help='返回结果数')
+    vectors_parser.add_argument('--threshold', type=float, default=0.0, help='相似度阈值')
+    vectors_parser.add_argument('--legacy-max', type=int, default=100_000, help='逐行计算对比的最大向量数')
+    vectors_parser.set_defaults(func=bench_vectors)
+
+    recall_parser = subparsers.add_parser('recall', help='近似向量检索召回率')
+    recall_parser.add_argument('--mode', choices=['ivf', 'hnsw'], default='ivf', help='近似检索后端')
+    recall_parser.add_argument('--sizes', type=int, nargs='+', default=[100_000], help='合成向量数量')
+    recall_parser.add_argument('--dim', type=int, default=256, help='合成向量维度')
+    recall_parser.add_argument('--k', type=int, default=10, help='recall@k 的 k')
+    recall_parser.add_argument('--queries', type=int, default=200, help='查询次数')
+    recall_parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32], help='IVF 扫描的簇数量')
+    recall_parser.add_argument('--ef-search', type=int, nargs='+', default=[32, 64, 128], help='HNSW 查询参数 ef')
+    recall_parser.add_argument('--from-db', action='store_true', help='使用题库中的真实向量')
+    recall_parser.set_defaults(func=bench_recall)
+
+    quant_parser = subparsers.add_parser('quantization', help='向量量化精度的召回损失与内存占用')
+    quant_parser.add_argument('--size', type=int, default=100_000, help='合成向量数量')
+    quant_parser.add_argument('--dim', type=int, default=1024, help='合成向量维度')
+    quant_parser.add_argument('--k', type=int, default=10, help='recall@k 的 k')
+    quant_parser.add_argument('--queries', type=int, default=100, help='查询次数')
+    quant_parser.add_argument('--rerank', type=int, default=50, help='重排候选数')
+    quant_parser.add_argument('--from-db', action='store_true', help='使用题库中的真实向量')
+    quant_parser.set_defaults(func=bench_quantization)
+
+    args = parser.parse_args()
+
+    if not args.command:
+        parser.print_help()
+        return
+
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+全库近似重复扫描脚本
+
+找出题库中所有相似度超过阈值的题目对，合并为重复簇后写入报告表
+（duplicate_scan_runs / duplicate_pairs / duplicate_clusters），供人工审核。
+检索后端由 VECTOR_INDEX_MODE 决定：精确模式分块自连接，IVF / HNSW 模式批量检索近邻。
+
+使用方法:
+    python scripts/find_duplicates.py                     # 阈值 0.95 扫描全库
+    python scripts/find_duplicates.py --threshold 0.9     # 指定阈值
+    python scripts/find_duplicates.py --top-k 50          # 近似模式每题检索的近邻数
+    python scripts/find_duplicates.py --show <run_id>     # 查看已有扫描结果
+    python scripts/find_duplicates.py --list              # 最近的扫描记录
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database.connection import db
+from core.services.duplicate_scanner import DuplicateScanner
+
+
+def print_header(text: str):
+    """打印标题"""
+    print("\n" + "=" * 60)
+    print(text)
+    print("=" * 60)
+
+
+def print_clusters(scanner: DuplicateScanner, run_id: str, limit: int):
+    """打印最大的若干个重复簇"""
+    clusters = scanner.get_clusters(run_id, limit=limit)
+    if not clusters:
+        print("\n未发现重复题目")
+        return
+    
+    print(f"\n📋 最大的 {len(clusters)} 个重复簇:")
+    for cluster in clusters:
+        print(f"\n  簇 #{cluster['cluster_id']}（{cluster['size']} 题，最高相似度 {cluster['max_similarity']:.4f}）")
+        for question in cluster['questions']:
+            content = (question['content'] or '（题目已删除）').replace('\n', ' ')
+            print(f"    - {question['id']}: {content[:60]}")
+
+
+def print_run(run: dict):
+    """打印运行记录"""
+    print(f"   运行 ID：{run['id']}")
+    print(f"   状态：{run['status']}（{run['method'] or '-'}）")
+    print(f"   阈值：{run['threshold']}")
+    print(f"   已扫描：{run['scanned']} / {run['total_vectors']}")
+    print(f"   重复题目对：{run['pair_count']}")
+    print(f"   重复簇：{run['cluster_count']}")
+    if run.get('error'):
+        print(f"   错误：{run['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全库近似重复扫描')
+    parser.add_argument('--threshold', type=float, default=0.95, help='相似度阈值（默认 0.95）')
+    parser.add_argument('--top-k', type=int, default=None, help='近似模式每道题检索的近邻数')
+    parser.add_argument('--clusters', type=int, default=20, help='打印的重复簇数')
+    parser.add_argument('--show', metavar='RUN_ID', help='查看已有扫描结果')
+    parser.add_argument('--list', action='store_true', help='列出最近的扫描记录')
+    
+    args = parser.parse_args()
+    scanner = DuplicateScanner(db)
+    
+    if args.list:
+        print_header("最近的扫描记录")
+        for run in scanner.list_runs():
+            print(f"   {run['started_at']}  {run['id']}  {run['status']}  "
+                  f"threshold={run['threshold']}  pairs={run['pair_count']}  clusters={run['cluster_count']}")
+        return
+    
+    if args.show:
+        run = scanner.get_run(args.show)
+        if not run:
+            print(f"❌ 扫描记录不存在：{args.show}")
+            return
+        print_header("扫描结果")
+        print_run(run)
+        print_clusters(scanner, args.show, args.clusters)
+        return
+    
+    print_header(f"全库近似重复扫描（阈值 {args.threshold}）")
+    start = time.time()
+    run = scanner.run(threshold=args.threshold, top_k=args.top_k)
+    print(f"\n⏱️  耗时：{time.time() - start:.1f} 秒")
+    print_run(run)
+    if run['status'] == 'completed':
+        print_clusters(scanner, run['id'], args.clusters)
+        print(f"\n查看完整结果：python scripts/find_duplicates.py --show {run['id']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,15 @@
 - 仅重建未向量化的题目
 - 仅重建模型版本不匹配的题目
 - 智能检测（跳过无需重建的题目）
+- 影子构建：切换模型时在后台构建新版本向量，检索继续使用旧版本，完成后整体切换
+- 重建文本指纹（本地计算，用于不依赖 Embedding 服务的查重）
+- 向量经过持久化缓存：内容和模型未变的题目不再调用 API（--no-cache 跳过缓存）
+- 离线部署使用本地模型（agent.json 中 embedding.provider 为 local）：tfidf 需先在题库上训练（--fit-local）
+
+切换模型的推荐流程（服务不停机）:
+    python scripts/rebuild_embeddings.py --shadow bge-m3      # 用新模型构建影子向量（可中断续建）
+    python scripts/rebuild_embeddings.py --activate bge-m3    # 补齐后原子切换，服务随即改用新模型检索和写入
+    python scripts/rebuild_embeddings.py --gc                 # 确认无需回滚后清理旧版本向量
 
 使用方法:
     python scripts/rebuild_embeddings.py           # 交互式
@@ -15,6 +24,10 @@
     python scripts/rebuild_embeddings.py --missing # 仅缺失的
     python scripts/rebuild_embeddings.py --mismatch # 仅版本不匹配的
     python scripts/rebuild_embeddings.py --check   # 检查状态
+    python scripts/rebuild_embeddings.py --versions # 查看向量版本
+    python scripts/rebuild_embeddings.py --fingerprints # 重建文本指纹
+    python scripts/rebuild_embeddings.py --cache-stats  # 查看 Embedding 缓存
+    python scripts/rebuild_embeddings.py --fit-local --mismatch  # 训练本地 TF-IDF 模型后重建版本不匹配的向量
 """
 
 import sys
@@ -27,9 +40,15 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.database.connection import db
 from core.services.vector_index import VectorIndex
+from core.services.embedding_versions import EmbeddingVersionManager, resolve_embedding_config
+from core.services.fingerprint_index import FingerprintIndex
 from agent.services.embedding_service import get_embedding_service
+from agent.services.embedding_cache import DEFAULT_MAX_ENTRIES, get_embedding_cache
 from agent.config import AgentConfig
 
+# 每批向量化并写入的题目数（一次 embed_batch + 一次 update_embeddings）
+REBUILD_BATCH_SIZE = 256
+
 
 def print_header(text: str):
     """打印标题"""
@@ -49,6 +68,7 @@ def check_status():
     print(f"   总题目数：{stats['total_questions']}")
     print(f"   已向量：{stats['with_embedding']}")
     print(f"   未向量：{stats['without_embedding']}")
+    print(f"   生效版本：{stats['active_version'] or '未记录'}")
     
     if stats['versions']:
         print(f"\n📦 向量版本分布:")
@@ -59,7 +79,7 @@ def check_status():
     try:
         config = AgentConfig._load_config()
         embedding_config = config.get('embedding', {})
-        current_model = embedding_config.get('model_name', 'unknown')
+        current_model = get_embedding_service(embedding_config).get_model_version()
         print(f"\n🎯 当前模型：{current_model}")
         
         # 检查版本不匹配
@@ -74,6 +94,117 @@ def check_status():
     print()
 
 
+def print_cache_stats(stats: dict):
+    """打印 Embedding 缓存统计"""
+    print(f"\n💾 Embedding 缓存：{stats['entries']}/{stats['max_entries']} 条（{stats['path']}）")
+    for model, count in stats['models'].items():
+        print(f"   - {model}: {count} 条")
+    if stats['hits'] or stats['misses']:
+        print(f"   本次命中：{stats['hits']}，未命中：{stats['misses']}，命中率：{stats['hit_rate']:.1%}")
+
+
+def open_cache():
+    """按 agent.json 的 Embedding 配置打开缓存"""
+    embedding_config = AgentConfig._load_config().get('embedding', {})
+    return get_embedding_cache(
+        embedding_config.get('cache_path') or None,
+        embedding_config.get('cache_max_entries', DEFAULT_MAX_ENTRIES)
+    )
+
+
+def fit_local(embedding_service):
+    """在当前题库上训练本地 TF-IDF 模型（模型版本随之变化）"""
+    print_header("训练本地 Embedding 模型")
+    
+    if not hasattr(embedding_service, 'fit'):
+        print("\n❌ 当前 Embedding 服务不是本地模型（embedding.provider 需为 local）")
+        return
+    questions = db.fetch_all("SELECT content FROM questions")
+    start_time = datetime.now()
+    version = embedding_service.fit([q['content'] for q in questions])
+    duration = (datetime.now() - start_time).total_seconds()
+    print(f"\n✅ 训练完成：{len(questions)} 题，耗时 {duration:.1f} 秒")
+    print(f"   模型版本：{version}")
+
+
+def print_versions():
+    """打印向量版本"""
+    print_header("向量版本")
+    
+    versions = EmbeddingVersionManager(db, VectorIndex(db)).list_versions()
+    if not versions:
+        print("\n尚未记录向量版本（首次影子构建时自动登记当前版本）")
+        return
+    for version in versions:
+        progress = f"{version['built']}/{version['total']}" if version['total'] else "-"
+        print(f"   - {version['version']}: {version['status']}，维度 {version['dimension'] or '-'}，"
+              f"进度 {progress}，影子向量 {version['shadow_count']}")
+        if version.get('error'):
+            print(f"     错误：{version['error']}")
+
+
+def build_shadow(embedding_service, model_version: str):
+    """后台构建新模型版本的影子向量（检索继续使用当前版本）"""
+    print_header(f"构建影子向量：{model_version}")
+    
+    manager = EmbeddingVersionManager(db, VectorIndex(db))
+    start_time = datetime.now()
+    try:
+        version = manager.build(embedding_service, model_version)
+    except ValueError as e:
+        print(f"\n❌ {e}")
+        return
+    duration = (datetime.now() - start_time).total_seconds()
+    
+    print(f"\n   状态：{version['status']}")
+    print(f"   进度：{version['built']}/{version['total']}")
+    print(f"   耗时：{duration:.1f} 秒")
+    if version['status'] == 'ready':
+        print(f"\n下一步：python scripts/rebuild_embeddings.py --activate {model_version}")
+    elif version.get('error'):
+        print(f"   错误：{version['error']}（重新运行可继续构建）")
+
+
+def activate_version(model_version: str, force: bool):
+    """切换生效版本"""
+    print_header(f"切换向量版本：{model_version}")
+    
+    manager = EmbeddingVersionManager(db, VectorIndex(db))
+    try:
+        version = manager.activate(model_version, force=force)
+    except ValueError as e:
+        print(f"\n❌ {e}")
+        return
+    print(f"\n✅ 已切换到 {version['version']}")
+    print("   检索和写入随即改用该版本的模型（无需修改 config/agent.json）；旧版本向量保留在影子表中，可再次切换回滚")
+
+
+def gc_versions(keep_latest: bool):
+    """清理已退役版本的影子向量"""
+    print_header("清理旧版本向量")
+    
+    removed = EmbeddingVersionManager(db, VectorIndex(db)).gc(keep_latest_retired=keep_latest)
+    if not removed:
+        print("\n没有需要清理的向量")
+    for version, count in removed.items():
+        print(f"   - {version}: 删除 {count} 条")
+
+
+def rebuild_fingerprints():
+    """重建全部题目的文本指纹（不调用 Embedding 服务）"""
+    print_header("重建文本指纹")
+    
+    index = FingerprintIndex(db)
+    start_time = datetime.now()
+    result = index.rebuild_all()
+    duration = (datetime.now() - start_time).total_seconds()
+    stats = index.get_stats()
+    
+    print(f"\n✅ 已写入 {result['indexed']}/{result['total']} 道题目的指纹（耗时 {duration:.1f} 秒）")
+    if stats['missing']:
+        print(f"   {stats['missing']} 道题目题干为空，未生成指纹")
+
+
 def rebuild_all(embedding_service, model_version: str):
     """重建所有题目向量"""
     print_header("重建所有题目向量")
@@ -118,27 +249,9 @@ def rebuild_missing(embedding_service, model_version: str):
         return
     
     start_time = datetime.now()
-    processed = 0
-    errors = 0
-    
-    for i, question in enumerate(missing):
-        try:
-            embedding = embedding_service.embed(question['content'])
-            vi.update_embedding(
-                question['id'],
-                embedding,
-                model_version,
-                question['content'],
-                None  # options 可能不存在
-            )
-            processed += 1
-            
-            if (i + 1) % 50 == 0:
-                print(f"   进度：{i + 1}/{len(missing)} ({(i + 1) / len(missing) * 100:.1f}%)")
-                
-        except Exception as e:
-            print(f"   ❌ 题目 {question['id']} 失败：{e}")
-            errors += 1
+    result = vi.embed_questions(missing, embedding_service, model_version, REBUILD_BATCH_SIZE)
+    processed = result['processed']
+    errors = result['errors']
     
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
@@ -179,27 +292,9 @@ def rebuild_mismatched(embedding_service, model_version: str):
         return
     
     start_time = datetime.now()
-    processed = 0
-    errors = 0
-    
-    for i, question in enumerate(mismatched):
-        try:
-            embedding = embedding_service.embed(question['content'])
-            vi.update_embedding(
-                question['id'],
-                embedding,
-                model_version,
-                question['content'],
-                None  # options 可能不存在
-            )
-            processed += 1
-            
-            if (i + 1) % 50 == 0:
-                print(f"   进度：{i + 1}/{len(mismatched)} ({(i + 1) / len(mismatched) * 100:.1f}%)")
-                
-        except Exception as e:
-            print(f"   ❌ 题目 {question['id']} 失败：{e}")
-            errors += 1
+    result = vi.embed_questions(mismatched, embedding_service, model_version, REBUILD_BATCH_SIZE)
+    processed = result['processed']
+    errors = result['errors']
     
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
@@ -233,7 +328,7 @@ def smart_rebuild(embedding_service, model_version: str):
     if not needs_update:
         print("\n✅ 所有题目无需重建！")
         print(f"   当前模型：{model_version}")
-        print(f"   已矢量化：{db.fetch_one('SELECT COUNT(*) as c FROM questions WHERE embedding IS NOT NULL')['c']} 题")
+        print(f"   已矢量化：{vi.get_stats()['with_embedding']} 题")
         return
     
     # 按原因分类
@@ -251,26 +346,9 @@ def smart_rebuild(embedding_service, model_version: str):
         return
     
     start_time = datetime.now()
-    processed = 0
-    errors = 0
-    
-    for i, (question, reason) in enumerate(needs_update):
-        try:
-            embedding = embedding_service.embed(question['content'])
-            vi.update_embedding(
-                question['id'],
-                embedding,
-                model_version,
-                question['content'],
-                question.get('options')
-            )
-            processed += 1
-            
-            if (i + 1) % 50 == 0:
-                print(f"   进度：{i + 1}/{len(needs_update)} ({(i + 1) / len(needs_update) * 100:.1f}%)")
-        except Exception as e:
-            print(f"   ❌ 题目 {question['id']} 失败：{e}")
-            errors += 1
+    result = vi.embed_questions([question for question, _ in needs_update], embedding_service, model_version, REBUILD_BATCH_SIZE)
+    processed = result['processed']
+    errors = result['errors']
     
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
@@ -290,6 +368,20 @@ def main():
     parser.add_argument('--mismatch', action='store_true', help='仅重建版本不匹配的')
     parser.add_argument('--check', action='store_true', help='仅检查状态')
     parser.add_argument('--no-confirm', action='store_true', help='跳过确认提示')
+    parser.add_argument('--shadow', nargs='?', const='', metavar='MODEL',
+                        help='用指定模型（默认为配置中的模型）构建影子向量，不影响当前检索')
+    parser.add_argument('--activate', metavar='VERSION', help='切换生效的向量版本')
+    parser.add_argument('--force', action='store_true', help='切换时允许部分题目缺少新版本向量')
+    parser.add_argument('--versions', action='store_true', help='查看向量版本')
+    parser.add_argument('--gc', action='store_true', help='清理已退役版本的影子向量')
+    parser.add_argument('--keep-latest', action='store_true', help='清理时保留最近退役的版本（可回滚）')
+    parser.add_argument('--fingerprints', action='store_true', help='重建文本指纹（不需要 Embedding 服务）')
+    parser.add_argument('--no-cache', action='store_true', help='不读写 Embedding 缓存，全部重新调用 API')
+    parser.add_argument('--cache-stats', action='store_true', help='查看 Embedding 缓存')
+    parser.add_argument('--clear-cache', nargs='?', const='', metavar='MODEL',
+                        help='清空 Embedding 缓存（可只清空指定模型）')
+    parser.add_argument('--fit-local', action='store_true',
+                        help='在题库上训练本地 TF-IDF 模型（provider 为 local 时），随后按其他参数重建')
     
     args = parser.parse_args()
     
@@ -303,6 +395,31 @@ def main():
         check_status()
         return
     
+    if args.versions:
+        print_versions()
+        return
+    
+    if args.activate:
+        activate_version(args.activate, args.force)
+        return
+    
+    if args.gc:
+        gc_versions(args.keep_latest)
+        return
+    
+    if args.fingerprints:
+        rebuild_fingerprints()
+        return
+    
+    if args.cache_stats:
+        print_cache_stats(open_cache().get_stats())
+        return
+    
+    if args.clear_cache is not None:
+        removed = open_cache().clear(args.clear_cache or None)
+        print(f"✅ 已删除 {removed} 条缓存")
+        return
+    
     # 初始化服务
     print("🔄 初始化服务...")
     try:
@@ -312,13 +429,26 @@ def main():
         if not embedding_config:
             print("❌ 未配置 Embedding 服务，请先在设置中配置")
             return
+        if args.shadow:
+            # 影子构建使用新模型，其余连接配置不变
+            embedding_config = dict(embedding_config, model_name=args.shadow)
+        elif args.shadow is None:
+            # 重建使用生效版本的模型（与服务一致）
+            embedding_config = resolve_embedding_config(embedding_config, VectorIndex(db).get_active_version())
+        if args.no_cache:
+            embedding_config = dict(embedding_config, cache_enabled=False)
         
         embedding_service = get_embedding_service(embedding_config)
+        if args.fit_local:
+            fit_local(embedding_service)
         model_version = embedding_service.get_model_version()
         
         print(f"✅ 服务初始化成功")
         print(f"   模型：{model_version}")
-        print(f"   API: {embedding_config.get('base_url', 'unknown')}")
+        if embedding_config.get('provider') == 'local':
+            print(f"   本地模型：{embedding_config.get('local_method', 'hashing')}")
+        else:
+            print(f"   API: {embedding_config.get('base_url', 'unknown')}")
         
     except Exception as e:
         print(f"❌ 初始化失败：{e}")
@@ -329,7 +459,9 @@ def main():
         return
     
     # 执行重建
-    if args.all:
+    if args.shadow is not None:
+        build_shadow(embedding_service, model_version)
+    elif args.all:
         rebuild_all(embedding_service, model_version)
     elif args.missing:
         rebuild_missing(embedding_service, model_version)
@@ -339,6 +471,10 @@ def main():
         # 默认智能重建
         smart_rebuild(embedding_service, model_version)
     
+    cache_stats = embedding_service.get_cache_stats()
+    if cache_stats:
+        print_cache_stats(cache_stats)
+    
     print("\n✅ 完成！")
 
 
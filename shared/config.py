@@ -12,6 +12,43 @@ class SharedConfig:
     # 数据库配置（所有入口共享）
     DATABASE_URL: str = "sqlite:///./data/question_bank.db"
     
+    # SQLite 连接池配置
+    DB_POOL_SIZE: int = 5              # 读连接上限（另有一个共享写连接）
+    DB_POOL_TIMEOUT: float = 30.0      # 等待空闲读连接的秒数
+    DB_BUSY_TIMEOUT_MS: int = 5000     # 数据库被其他进程锁定时的等待毫秒数
+    DB_JOURNAL_MODE: str = "WAL"       # WAL 模式下读不阻塞写
+    DB_CACHE_SIZE_KB: int = 8192       # 每个连接的页缓存大小
+    DB_MMAP_SIZE_MB: int = 256         # 内存映射读取大小，0 表示关闭
+    
+    # 向量检索配置
+    VECTOR_INDEX_MODE: str = "exact"   # exact（精确）/ ivf / hnsw（近似，hnsw 需安装 hnswlib）
+    VECTOR_ANN_MIN_SIZE: int = 20000   # 向量数低于该值时近似模式也使用精确检索
+    VECTOR_IVF_NLIST: int = 0          # IVF 簇数量，0 表示按数据量自动选择
+    VECTOR_IVF_NPROBE: int = 16        # IVF 每次查询扫描的簇数量
+    VECTOR_HNSW_EF_SEARCH: int = 64    # HNSW 查询时的候选队列长度
+    VECTOR_INDEX_DIR: str = ""         # 近似索引持久化目录，默认在数据库同目录的 vector_index/
+    VECTOR_STORE: str = "off"          # 精确模式的内存映射向量存储：off / float32 / float16
+    VECTOR_STORAGE_DTYPE: str = "float32"  # 数据库中向量的存储精度：float32 / float16 / int8
+    VECTOR_SEARCH_DTYPE: str = "float32"   # 内存矩阵的检索精度：float32 / float16 / int8
+    VECTOR_RERANK_CANDIDATES: int = 0      # 量化检索后用原始精度重排的候选数，0 表示不重排
+    
+    # 混合检索配置（关键词 bm25 + 向量相似度，倒数排名融合）
+    HYBRID_SEARCH_CANDIDATES: int = 50     # 每个来源最多取的候选数
+    HYBRID_SEARCH_TIMEOUT_MS: int = 1500   # 检索时间预算，超时的来源不参与融合
+    HYBRID_RRF_K: int = 60                 # 倒数排名融合常数：得分 = Σ 1 / (k + 排名)
+    HYBRID_MIN_SIMILARITY: float = 0.3     # 向量来源的最低相似度
+    
+    # 文本指纹查重（MinHash + LSH，不依赖 Embedding 服务）
+    FINGERPRINT_THRESHOLD: float = 0.8     # 判定为近似重复的最低相似度（字符 3-gram 的 Jaccard 估计值）
+    
+    # 后台向量化队列（题目写入后立即返回，由后台 worker 批量向量化）
+    EMBEDDING_QUEUE_ENABLED: bool = True       # 关闭时在写入请求中直接向量化
+    EMBEDDING_QUEUE_WORKERS: int = 1           # worker 线程数
+    EMBEDDING_QUEUE_BATCH_SIZE: int = 64       # 每次领取并向量化的任务数
+    EMBEDDING_QUEUE_MAX_ATTEMPTS: int = 5      # 失败重试次数上限，超过后标记为 failed
+    EMBEDDING_QUEUE_BACKOFF_SECONDS: float = 5.0   # 第 n 次失败后等待 backoff × 2^(n-1) 秒再重试
+    EMBEDDING_QUEUE_POLL_SECONDS: float = 2.0      # 队列为空时的轮询间隔
+    
     # 应用通用配置
     APP_NAME: str = "题库管理系统"
     DEBUG: bool = True
@@ -31,6 +68,48 @@ class SharedConfig:
         if db_url:
             self.DATABASE_URL = db_url
         
+        self.DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", self.DB_POOL_SIZE))
+        self.DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", self.DB_POOL_TIMEOUT))
+        self.DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", self.DB_BUSY_TIMEOUT_MS))
+        self.DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", self.DB_JOURNAL_MODE).upper()
+        self.DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", self.DB_CACHE_SIZE_KB))
+        self.DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", self.DB_MMAP_SIZE_MB))
+        
+        # 向量检索配置
+        self.VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", self.VECTOR_INDEX_MODE).lower()
+        self.VECTOR_ANN_MIN_SIZE = int(os.getenv("VECTOR_ANN_MIN_SIZE", self.VECTOR_ANN_MIN_SIZE))
+        self.VECTOR_IVF_NLIST = int(os.getenv("VECTOR_IVF_NLIST", self.VECTOR_IVF_NLIST))
+        self.VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", self.VECTOR_IVF_NPROBE))
+        self.VECTOR_HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", self.VECTOR_HNSW_EF_SEARCH))
+        self.VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", self.VECTOR_INDEX_DIR)
+        self.VECTOR_STORE = os.getenv("VECTOR_STORE", self.VECTOR_STORE).lower()
+        self.VECTOR_STORAGE_DTYPE = os.getenv("VECTOR_STORAGE_DTYPE", self.VECTOR_STORAGE_DTYPE).lower()
+        self.VECTOR_SEARCH_DTYPE = os.getenv("VECTOR_SEARCH_DTYPE", self.VECTOR_SEARCH_DTYPE).lower()
+        self.VECTOR_RERANK_CANDIDATES = int(os.getenv("VECTOR_RERANK_CANDIDATES", self.VECTOR_RERANK_CANDIDATES))
+        
+        # 混合检索配置
+        self.HYBRID_SEARCH_CANDIDATES = int(os.getenv("HYBRID_SEARCH_CANDIDATES", self.HYBRID_SEARCH_CANDIDATES))
+        self.HYBRID_SEARCH_TIMEOUT_MS = int(os.getenv("HYBRID_SEARCH_TIMEOUT_MS", self.HYBRID_SEARCH_TIMEOUT_MS))
+        self.HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", self.HYBRID_RRF_K))
+        self.HYBRID_MIN_SIMILARITY = float(os.getenv("HYBRID_MIN_SIMILARITY", self.HYBRID_MIN_SIMILARITY))
+        
+        # 文本指纹查重配置
+        self.FINGERPRINT_THRESHOLD = float(os.getenv("FINGERPRINT_THRESHOLD", self.FINGERPRINT_THRESHOLD))
+        
+        # 后台向量化队列配置
+        self.EMBEDDING_QUEUE_ENABLED = os.getenv("EMBEDDING_QUEUE_ENABLED", "true").lower() == "true"
+        self.EMBEDDING_QUEUE_WORKERS = int(os.getenv("EMBEDDING_QUEUE_WORKERS", self.EMBEDDING_QUEUE_WORKERS))
+        self.EMBEDDING_QUEUE_BATCH_SIZE = int(os.getenv("EMBEDDING_QUEUE_BATCH_SIZE", self.EMBEDDING_QUEUE_BATCH_SIZE))
+        self.EMBEDDING_QUEUE_MAX_ATTEMPTS = int(
+            os.getenv("EMBEDDING_QUEUE_MAX_ATTEMPTS", self.EMBEDDING_QUEUE_MAX_ATTEMPTS)
+        )
+        self.EMBEDDING_QUEUE_BACKOFF_SECONDS = float(
+            os.getenv("EMBEDDING_QUEUE_BACKOFF_SECONDS", self.EMBEDDING_QUEUE_BACKOFF_SECONDS)
+        )
+        self.EMBEDDING_QUEUE_POLL_SECONDS = float(
+            os.getenv("EMBEDDING_QUEUE_POLL_SECONDS", self.EMBEDDING_QUEUE_POLL_SECONDS)
+        )
+        
         # 端口配置
         web_port = os.getenv("WEB_PORT")
         if web_port:
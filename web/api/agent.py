@@ -2,6 +2,7 @@
 AI Agent API 接口
 提供题目提取、解析生成、智能问答、配置管理等功能
 """
+import asyncio
 import os
 import tempfile
 import shutil
@@ -9,7 +10,7 @@ from datetime import datetime
 from typing import List, Optional, Dict, Any
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Body
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, Field, ValidationError
 
 from core.models import (
     StagingQuestion, StagingQuestionCreate, StagingQuestionUpdate,
@@ -21,6 +22,7 @@ from agent.config import AgentConfig
 from agent.extractors.image_extractor import ImageExtractor
 from agent.extractors.document_extractor import DocumentExtractor
 from agent.generators.explanation_generator import ExplanationGenerator
+from shared.config import config
 
 router = APIRouter(prefix="/agent", tags=["AI Agent"])
 
@@ -36,6 +38,32 @@ class AgentConfigUpdate(BaseModel):
     allowed_extensions: Optional[Dict[str, List[str]]] = None
 
 
+# 批量查重每次请求最多检查的预备题目数
+STAGING_DEDUP_MAX_ROWS = 2000
+
+# 批内向量查重分块自连接的每块行数
+STAGING_DEDUP_BLOCK_ROWS = 512
+
+
+class StagingDedupRequest(BaseModel):
+    """预备题目批量查重请求模型"""
+    source_file: Optional[str] = None
+    ids: Optional[List[int]] = None
+    threshold: float = Field(0.95, ge=0, le=1)
+    top_k: int = Field(5, ge=1, le=50)
+    limit: int = Field(500, ge=1, le=STAGING_DEDUP_MAX_ROWS)
+    category_id: Optional[str] = None
+    include_descendants: bool = False
+    tag_id: Optional[str] = None
+
+
+def _active_embedding_config(vector_index) -> Dict:
+    """agent.json 中的 Embedding 配置，模型按生效向量版本确定（见 resolve_embedding_config）"""
+    from core.services.embedding_versions import resolve_embedding_config
+    return resolve_embedding_config(AgentConfig.get_full_config().get('embedding', {}),
+                                    vector_index.get_active_version())
+
+
 # ========== 题目提取功能 ==========
 
 @router.post("/extract/image")
@@ -82,18 +110,17 @@ async def extract_from_image(files: List[UploadFile] = File(...)):
             
             extractor.close()
             
-            # 保存到预备题目
-            saved_questions = []
-            if result.get("questions"):
-                for q_data in result["questions"]:
-                    q_data['source_type'] = result.get('source_type', 'image')
-                    q_data['source_file'] = result.get('source_file', file.filename if len(files) == 1 else 'batch')
-                    
-                    q_id = StagingQuestionRepository.create(q_data)
-                    saved_questions.append(StagingQuestion(
-                        id=q_id,
-                        **q_data
-                    ))
+            # 保存到预备题目（单个事务批量写入）
+            extracted = result.get("questions") or []
+            for q_data in extracted:
+                q_data['source_type'] = result.get('source_type', 'image')
+                q_data['source_file'] = result.get('source_file', file.filename if len(files) == 1 else 'batch')
+            
+            q_ids = StagingQuestionRepository.create_batch(extracted)
+            saved_questions = [
+                StagingQuestion(id=q_id, **q_data)
+                for q_id, q_data in zip(q_ids, extracted)
+            ]
             
             # 构建返回数据
             response_data = {
@@ -172,22 +199,19 @@ async def extract_from_document(files: List[UploadFile] = File(...)):
             all_questions = []
             for doc_path in document_paths:
                 result = extractor.extract(doc_path)
-                if result.get("questions"):
-                    all_questions.extend(result["questions"])
+                for q_data in result.get("questions") or []:
+                    q_data['source_type'] = 'document'
+                    q_data['source_file'] = os.path.basename(doc_path)
+                    all_questions.append(q_data)
             
             extractor.close()
             
-            # 保存到预备题目
-            saved_questions = []
-            for q_data in all_questions:
-                q_data['source_type'] = 'document'
-                q_data['source_file'] = os.path.basename(doc_path)
-                
-                q_id = StagingQuestionRepository.create(q_data)
-                saved_questions.append(StagingQuestion(
-                    id=q_id,
-                    **q_data
-                ))
+            # 保存到预备题目（所有文档的题目在单个事务中批量写入）
+            q_ids = StagingQuestionRepository.create_batch(all_questions)
+            saved_questions = [
+                StagingQuestion(id=q_id, **q_data)
+                for q_id, q_data in zip(q_ids, all_questions)
+            ]
             
             return SuccessResponse(
                 success=True,
@@ -248,6 +272,137 @@ async def get_staging_questions(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _staging_batch_pairs(contents: List[str], embeddings, threshold: float) -> Dict:
+    """同一批预备题目之间的重复：{(前一题下标, 后一题下标): (相似度, 方法)}"""
+    from core.services.vector_backends import EmbeddingMatrix
+    from core.services.duplicate_scanner import self_join_pairs
+    from core.services.fingerprint_index import FingerprintIndex
+    
+    batch_pairs = {
+        (i, j): (similarity, "fingerprint")
+        for i, j, similarity in FingerprintIndex.find_batch_duplicates(contents)
+    }
+    if embeddings is not None:
+        # 分块自连接，只计算上三角（不构造 Q×Q 得分矩阵）；零向量不参与比较
+        batch_matrix = EmbeddingMatrix(embeddings.shape[1])
+        batch_matrix.upsert([str(i) for i in range(len(embeddings))], embeddings)
+        for _, pairs in self_join_pairs(batch_matrix, threshold, STAGING_DEDUP_BLOCK_ROWS):
+            for a, b, similarity in pairs:
+                i, j = sorted((int(a), int(b)))
+                batch_pairs.setdefault((i, j), (similarity, "vector"))
+    return batch_pairs
+
+
+@router.post("/staging/dedup")
+async def dedup_staging_questions(request: Optional[StagingDedupRequest] = None):
+    """批量查重：一次检查全部待审核预备题目（或某次提取结果）与题库及彼此之间的重复
+    
+    先用本地文本指纹（MinHash）找完全 / 近似重复的题目（不受分类/标签筛选限制）；
+    再将所有题目一次批量向量化，与题库的相似度按块矩阵乘法计算，不再逐题扫描整个题库。
+    数据库查询和矩阵计算都在线程中执行，不阻塞事件循环。
+    Embedding 服务未配置或不可用时只返回指纹查重结果（vector_available 为 false）。
+    
+    Args:
+        request: source_file 只检查某个来源文件的题目；ids 只检查指定题目；
+                 threshold 相似度阈值；top_k 每道题最多返回的相似题目数；
+                 limit 本次最多检查的题目数（按 ID 升序，超出时 has_more 为 true）；
+                 category_id / include_descendants / tag_id 只与题库中该分类（子树）/标签下的题目比较
+    """
+    import logging
+    import numpy as np
+    from core.database.connection import db
+    from core.services.vector_index import get_vector_index
+    from core.services.fingerprint_index import get_fingerprint_index
+    from agent.services.async_embedding_service import get_async_embedding_service
+    
+    request = request or StagingDedupRequest()
+    questions = await asyncio.to_thread(StagingQuestionRepository.get_pending, source_file=request.source_file,
+                                        ids=request.ids, limit=request.limit + 1)
+    has_more = len(questions) > request.limit
+    questions = questions[:request.limit]
+    if not questions:
+        return SuccessResponse(
+            success=True,
+            data={"checked": 0, "duplicates": [], "batch_duplicates": [], "has_more": False},
+            message="没有待查重的题目"
+        )
+    
+    contents = [q['content'] for q in questions]
+    try:
+        fingerprint_lists = await asyncio.to_thread(
+            lambda: get_fingerprint_index(db).find_similar_batch(contents, top_k=request.top_k)
+        )
+    except Exception as e:
+        logging.error(f"指纹查重失败：{e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"批量查重失败：{e}")
+    
+    embeddings = None
+    similar_lists = [[] for _ in questions]
+    try:
+        vector_index = await asyncio.to_thread(get_vector_index, db)
+        embedding_config = await asyncio.to_thread(_active_embedding_config, vector_index)
+        embedding_service = get_async_embedding_service(embedding_config)
+        embeddings = np.vstack(await embedding_service.embed_batch(contents))
+        
+        similar_lists = await asyncio.to_thread(
+            vector_index.search_similar_batch,
+            embeddings, threshold=request.threshold, top_k=request.top_k,
+            category_id=request.category_id, include_descendants=request.include_descendants,
+            tag_id=request.tag_id, model_version=embedding_service.get_model_version()
+        )
+    except Exception as e:
+        # 向量查重不可用时仍返回指纹查重结果
+        logging.warning(f"向量查重不可用，仅使用文本指纹查重：{e}")
+        embeddings = None
+    
+    def preview(content: str) -> str:
+        return content[:100] + '...' if len(content) > 100 else content
+    
+    duplicates = []
+    for question, fingerprint_hits, vector_hits in zip(questions, fingerprint_lists, similar_lists):
+        similar_questions = {}
+        for method, hits in (("fingerprint", fingerprint_hits), ("vector", vector_hits)):
+            for sim in hits:
+                similar_questions.setdefault(sim['question_id'], {
+                    'id': sim['question_id'],
+                    'content': preview(sim['content']),
+                    'similarity': sim['similarity'],
+                    'method': method
+                })
+        if similar_questions:
+            duplicates.append({
+                "staging_id": question['id'],
+                "content": preview(question['content']),
+                "similar_questions": list(similar_questions.values())
+            })
+    
+    # 同一批预备题目之间的重复（例如同一份文档重复上传）
+    batch_pairs = await asyncio.to_thread(_staging_batch_pairs, contents, embeddings, request.threshold)
+    batch_duplicates = [
+        {
+            "staging_id": questions[j]['id'],
+            "duplicate_of": questions[i]['id'],
+            "similarity": similarity,
+            "method": method
+        }
+        for (i, j), (similarity, method) in sorted(batch_pairs.items())
+    ]
+    
+    logging.info(f"批量查重：checked={len(questions)}, duplicates={len(duplicates)}, "
+                 f"batch_duplicates={len(batch_duplicates)}, vector={embeddings is not None}")
+    return SuccessResponse(
+        success=True,
+        data={
+            "checked": len(questions),
+            "duplicates": duplicates,
+            "batch_duplicates": batch_duplicates,
+            "vector_available": embeddings is not None,
+            "has_more": has_more
+        },
+        message=f"检查 {len(questions)} 道题目，发现 {len(duplicates) + len(batch_duplicates)} 处可能重复"
+    )
+
+
 @router.get("/staging/{question_id}")
 async def get_staging_question(question_id: int):
     """获取单个预备题目"""
@@ -304,50 +459,64 @@ async def approve_staging_question(question_id: int, reviewed_by: str = Form("sy
         
         logging.info(f"预备题目数据：content={question['content'][:50]}..., category_id={question.get('category_id')}")
         
-        # 1. 重复检测（使用向量相似度）- 如果 force=true 则跳过
+        # 1. 重复检测（文本指纹 + 向量相似度）- 如果 force=true 则跳过
+        embedding_service = None
+        question_embedding = None
         if not force:
-            from core.database import get_db_connection
-            from core.services.vector_index import VectorIndex
-            from agent.services.embedding_service import get_embedding_service
-            
-            db = get_db_connection()
-            vector_index = VectorIndex(db)
-            
-            # 获取 Embedding 配置
-            from agent.config import AgentConfig
-            config = AgentConfig.get_full_config()
-            embedding_config = config.get('embedding', {})
+            from core.database.connection import db
+            from core.database.repositories import QuestionRepository
+            from core.services.vector_index import get_vector_index
+            from core.services.fingerprint_index import get_fingerprint_index
+            from agent.services.async_embedding_service import get_async_embedding_service
             
-            # 计算题目向量
-            embedding_service = get_embedding_service(embedding_config)
-            question_embedding = embedding_service.embed(question['content'])
+            # 先查文本指纹：完全 / 近似重复的题目本地即可发现，不调用 Embedding 服务
+            similar_questions = [
+                dict(hit, method='fingerprint')
+                for hit in get_fingerprint_index(db).find_similar(question['content'], top_k=5)
+            ]
             
-            # 检索相似题目（相似度 > 0.95 认为高度相似）
-            similar_questions = vector_index.search_similar(
-                embedding=question_embedding,
-                threshold=0.95,
-                top_k=5
-            )
+            # 指纹未命中时再用向量相似度检测改写过的重复；Embedding 服务不可用时只依赖指纹结果
+            if not similar_questions:
+                try:
+                    # 进程级单例：向量矩阵常驻内存，检索只做一次矩阵向量乘法
+                    vector_index = get_vector_index(db)
+                    
+                    # 计算题目向量（生效版本的模型，异步客户端不阻塞事件循环）
+                    embedding_service = get_async_embedding_service(_active_embedding_config(vector_index))
+                    question_embedding = await embedding_service.embed(question['content'])
+                    
+                    # 检索相似题目（相似度 > 0.95 认为高度相似）
+                    similar_questions = [
+                        dict(hit, method='vector')
+                        for hit in vector_index.search_similar(
+                            embedding=question_embedding,
+                            threshold=0.95,
+                            top_k=5,
+                            model_version=embedding_service.get_model_version()
+                        )
+                    ]
+                except Exception as e:
+                    logging.warning(f"向量查重不可用，仅使用文本指纹查重：{e}")
+                    embedding_service = None
+                    question_embedding = None
             
             # 如果有高度相似题目，返回警告（不直接入库）
             if similar_questions:
                 # 获取相似题目的详细信息
-                from core.services import QuestionService
-                question_service = QuestionService()
+                question_repo = QuestionRepository()
                 
                 similar_details = []
                 for sim_q in similar_questions:
-                    q_detail = question_service.get_question(sim_q['question_id'])
+                    q_detail = question_repo.get_by_id(sim_q['question_id'])
                     if q_detail:
                         similar_details.append({
                             'id': q_detail.id,
                             'content': q_detail.content[:100] + '...' if len(q_detail.content) > 100 else q_detail.content,
                             'similarity': sim_q['similarity'],
+                            'method': sim_q['method'],
                             'answer': q_detail.answer
                         })
                 
-                db.close()
-                
                 logging.warning(f"发现 {len(similar_details)} 道相似题目")
                 
                 return SuccessResponse(
@@ -359,11 +528,8 @@ async def approve_staging_question(question_id: int, reviewed_by: str = Form("sy
                     },
                     message="检测到相似题目"
                 )
-            
-            db.close()
         else:
             logging.info(f"强制入库模式，跳过重复检测")
-            question_embedding = None
         
         # 2. 无重复，创建正式题目
         from core.database.repositories import QuestionRepository, CategoryRepository
@@ -399,31 +565,42 @@ async def approve_staging_question(question_id: int, reviewed_by: str = Form("sy
         
         logging.info(f"正式题目创建成功，ID: {created_question.id}")
         
-        # 3. 保存向量到索引（如果之前没计算过，重新计算）
-        if question_embedding is None:
-            from core.database import get_db_connection
-            from core.services.vector_index import VectorIndex
-            from agent.services.embedding_service import get_embedding_service
-            
-            db = get_db_connection()
-            vector_index = VectorIndex(db)
-            
-            from agent.config import AgentConfig
-            config = AgentConfig.get_full_config()
-            embedding_config = config.get('embedding', {})
-            
-            embedding_service = get_embedding_service(embedding_config)
-            question_embedding = embedding_service.embed(question['content'])
+        # 写入文本指纹（本地计算）；失败不影响入库
+        try:
+            from core.database.connection import db
+            from core.services.fingerprint_index import get_fingerprint_index
+            get_fingerprint_index(db).update(created_question.id, question_data.content)
+        except Exception as e:
+            logging.warning(f"题目指纹保存失败：{created_question.id}, {e}")
+        
+        # 3. 保存向量到索引：查重时已计算的向量直接保存；否则启用后台队列时登记任务，
+        #    未启用时在请求中计算。向量化失败不影响入库
+        try:
+            from core.database.connection import db
+            from core.services.vector_index import get_vector_index
+            from core.services.embedding_queue import get_embedding_job_queue
+            from agent.services.async_embedding_service import get_async_embedding_service
             
-            vector_index.add(created_question.id, question_embedding)
-            db.close()
-        else:
-            db = get_db_connection()
-            vector_index = VectorIndex(db)
-            vector_index.add(created_question.id, question_embedding)
-            db.close()
-        
-        logging.info(f"题目向量已保存：{created_question.id}")
+            if embedding_service is None and config.EMBEDDING_QUEUE_ENABLED:
+                get_embedding_job_queue(db).enqueue([created_question.id])
+                logging.info(f"题目向量化任务已登记：{created_question.id}")
+            else:
+                vector_index = get_vector_index(db)
+                if embedding_service is None:
+                    embedding_service = get_async_embedding_service(_active_embedding_config(vector_index))
+                    question_embedding = await embedding_service.embed(question['content'])
+                
+                options_json = str(question_data.options) if question_data.options else None
+                vector_index.update_embedding(
+                    created_question.id,
+                    question_embedding,
+                    embedding_service.get_model_version(),
+                    question_data.content,
+                    options_json
+                )
+                logging.info(f"题目向量已保存：{created_question.id}")
+        except Exception as e:
+            logging.warning(f"题目向量保存失败：{created_question.id}, {e}")
         
         # 4. 删除预备题目记录
         StagingQuestionRepository.delete(question_id)
@@ -596,6 +773,27 @@ async def get_qa_logs(page: int = 1, limit: int = 20):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/embedding/cache")
+async def get_embedding_cache_stats():
+    """
+    获取 Embedding 缓存统计
+    
+    - 条目数、按模型分布、进程内命中 / 未命中 / 淘汰计数
+    """
+    embedding_config = AgentConfig.get_full_config().get('embedding', {})
+    if not embedding_config.get('cache_enabled', True):
+        return SuccessResponse(success=True, data={"enabled": False}, message="Embedding 缓存未启用")
+    try:
+        from agent.services.embedding_cache import DEFAULT_MAX_ENTRIES, get_embedding_cache
+        cache = get_embedding_cache(
+            embedding_config.get('cache_path') or None,
+            embedding_config.get('cache_max_entries', DEFAULT_MAX_ENTRIES)
+        )
+        return SuccessResponse(success=True, data=dict(cache.get_stats(), enabled=True))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ========== 配置管理 ==========
 
 @router.get("/config")
@@ -44,50 +44,19 @@ router = APIRouter(prefix="/categories", tags=["分类管理"])
 category_service = CategoryService(category_repo)
 
 
-def build_category_tree(categories: List[Category], parent_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    """构建分类树形结构"""
-    tree = []
-    for cat in categories:
-        if cat.parent_id == parent_id:
-            node = {
-                "id": cat.id,
-                "name": cat.name,
-                "description": cat.description,
-                "parent_id": cat.parent_id,
-                "created_at": cat.created_at.isoformat() if cat.created_at else None,
-                "updated_at": cat.updated_at.isoformat() if cat.updated_at else None,
-                "children": build_category_tree(categories, cat.id)
-            }
-            tree.append(node)
-    return tree
+def build_category_tree(parent_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """构建分类树形结构（完整树基于进程级分类缓存，子树基于分类闭包表）"""
+    return category_service.get_category_tree(parent_id)
 
 
-def get_category_breadcrumb(categories: List[Category], category_id: str) -> List[Dict[str, str]]:
-    """获取分类的面包屑路径"""
-    breadcrumb = []
-    current_id = category_id
-    max_depth = 10  # 防止循环引用
-    
-    while current_id and max_depth > 0:
-        cat = next((c for c in categories if c.id == current_id), None)
-        if not cat:
-            break
-        breadcrumb.insert(0, {"id": cat.id, "name": cat.name})
-        current_id = cat.parent_id
-        max_depth -= 1
-    
-    return breadcrumb
+def get_category_breadcrumb(category_id: str) -> List[Dict[str, str]]:
+    """获取分类的面包屑路径（基于分类闭包表）"""
+    return category_service.get_breadcrumb(category_id)
 
 
-def get_all_children_ids(categories: List[Category], parent_id: str) -> List[str]:
-    """获取某个分类下的所有子分类ID（包括间接子分类）"""
-    children_ids = [parent_id]
-    direct_children = [c.id for c in categories if c.parent_id == parent_id]
-    
-    for child_id in direct_children:
-        children_ids.extend(get_all_children_ids(categories, child_id))
-    
-    return children_ids
+def get_all_children_ids(parent_id: str) -> List[str]:
+    """获取某个分类下的所有子分类ID（包括间接子分类，基于分类闭包表）"""
+    return category_service.get_descendant_ids(parent_id)
 
 
 @router.post("/", response_model=Category, status_code=status.HTTP_201_CREATED)
@@ -138,8 +107,7 @@ async def get_category_tree():
     返回嵌套的树形结构，包含所有层级关系
     """
     try:
-        categories = category_service.get_all_categories()
-        return build_category_tree(categories)
+        return build_category_tree()
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -161,8 +129,7 @@ async def get_breadcrumb(category_id: str):
     返回从根分类到当前分类的路径
     """
     try:
-        categories = category_service.get_all_categories()
-        category = next((c for c in categories if c.id == category_id), None)
+        category = category_service.get_category_map().get(category_id)
         if not category:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -172,7 +139,7 @@ async def get_breadcrumb(category_id: str):
                     message="分类不存在"
                 ).dict()
             )
-        return get_category_breadcrumb(categories, category_id)
+        return get_category_breadcrumb(category_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -196,8 +163,7 @@ async def get_children_ids(category_id: str):
     用于查询某个分类及其所有子分类下的题目
     """
     try:
-        categories = category_service.get_all_categories()
-        category = next((c for c in categories if c.id == category_id), None)
+        category = category_service.get_category_map().get(category_id)
         if not category:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -207,7 +173,7 @@ async def get_children_ids(category_id: str):
                     message="分类不存在"
                 ).dict()
             )
-        return get_all_children_ids(categories, category_id)
+        return get_all_children_ids(category_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -298,7 +264,7 @@ async def delete_category(category_id: str):
     """
     try:
         # 检查是否有子分类
-        categories = category_service.get_all_categories()
+        categories = category_service.get_category_map().values()
         has_children = any(c.parent_id == category_id for c in categories)
         if has_children:
             raise HTTPException(
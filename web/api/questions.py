@@ -3,17 +3,20 @@
 
 提供题目的 CRUD 操作：
 - 创建题目
+- 批量创建题目
 - 获取题目列表
 - 获取单个题目
 - 更新题目
 - 删除题目
-- 搜索题目
+- 搜索题目（关键词 / 向量 / 混合检索）
+- 相似题目检索
+- 全库近似重复扫描
 - 管理题目标签
 """
 
 from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, HTTPException, Query, status
-from pydantic import BaseModel
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, status
+from pydantic import BaseModel, Field
 import logging
 
 import sys
@@ -22,10 +25,13 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspa
 
 from core.models import (
     Question, QuestionCreate, QuestionUpdate, 
+    QuestionBulkCreate, QuestionBulkCreateResponse,
     SuccessResponse, ErrorResponse, ErrorCodes
 )
 from core.services import QuestionService
+from core.services.hybrid_search import HybridSearchService, SEARCH_MODES
 from core.database.repositories import question_repo, category_repo, tag_repo
+from shared.config import config
 from core.exceptions import (
     ResourceNotFoundException,
     ValidationException,
@@ -40,10 +46,38 @@ logger = logging.getLogger(__name__)
 # 题目列表响应模型
 class QuestionListResponse(BaseModel):
     data: List[Question]
-    total: int
-    page: int
+    total: Optional[int] = None
+    page: Optional[int] = None
     limit: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+    has_more: Optional[bool] = None
+
+
+# 混合检索响应模型
+class SearchSourceScore(BaseModel):
+    rank: int
+    score: float
+
+
+class SearchHit(BaseModel):
+    question: Question
+    score: float
+    lexical: Optional[SearchSourceScore] = None
+    vector: Optional[SearchSourceScore] = None
+
+
+class QuestionSearchResponse(BaseModel):
+    mode: str
+    results: List[SearchHit]
+    sources: Dict[str, Dict[str, Any]]
+    elapsed_ms: float
+
+
+# 全库查重请求模型
+class DuplicateScanRequest(BaseModel):
+    threshold: float = Field(0.95, ge=0, le=1, description="相似度阈值")
+    top_k: Optional[int] = Field(None, ge=1, le=1000, description="近似索引每道题检索的近邻数")
 
 
 # 创建路由
@@ -51,6 +85,18 @@ router = APIRouter(prefix="/questions", tags=["题目管理"])
 
 # 创建服务实例
 question_service = QuestionService(question_repo, category_repo, tag_repo)
+hybrid_search_service = HybridSearchService(question_repo, question_service.get_embedding_config)
+_duplicate_scanner = None
+
+
+def get_duplicate_scanner():
+    """全库查重任务（首次使用时创建，确保报告表存在）"""
+    global _duplicate_scanner
+    if _duplicate_scanner is None:
+        from core.database.connection import db
+        from core.services.duplicate_scanner import DuplicateScanner
+        _duplicate_scanner = DuplicateScanner(db)
+    return _duplicate_scanner
 
 
 @router.post("/", response_model=Question, status_code=status.HTTP_201_CREATED)
@@ -67,7 +113,8 @@ async def create_question(question: QuestionCreate):
     """
     try:
         logger.info(f"创建题目：category_id={question.category_id}, content={question.content[:50]}...")
-        result = question_service.create_question(question)
+        result = question_service.create_question(question, embed=False)
+        await question_service.schedule_embedding_async(result.id, question.content, question.options)
         logger.info(f"题目创建成功：id={result.id}")
         return result
     except ResourceNotFoundException as e:
@@ -122,31 +169,192 @@ async def create_question(question: QuestionCreate):
         )
 
 
+@router.post("/bulk", response_model=QuestionBulkCreateResponse, status_code=status.HTTP_201_CREATED)
+async def create_questions_bulk(request: QuestionBulkCreate, background_tasks: BackgroundTasks):
+    """
+    批量创建题目（用于导入 AI 生成的题目，单次最多 5000 道）
+    
+    所有题目在同一个事务中写入，任一分类或标签不存在时整体失败；
+    向量在响应返回后分批生成（启用后台向量化队列时由 worker 处理）
+    
+    - **questions**: 题目列表，字段同创建题目
+    """
+    try:
+        logger.info(f"批量创建题目：count={len(request.questions)}")
+        question_ids = question_service.create_questions(request.questions)
+        if not config.EMBEDDING_QUEUE_ENABLED:
+            background_tasks.add_task(question_service.embed_questions, question_ids, request.questions)
+        logger.info(f"批量创建题目成功：count={len(question_ids)}")
+        return QuestionBulkCreateResponse(created=len(question_ids), ids=question_ids, embedding_queued=True)
+    except ValueError as e:
+        logger.warning(f"验证失败：{e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.VALIDATION_ERROR,
+                message=str(e)
+            ).dict()
+        )
+    except Exception as e:
+        logger.error(f"批量创建题目失败：{e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.INTERNAL_ERROR,
+                message=f"批量创建题目失败：{str(e)}"
+            ).dict()
+        )
+
+
+@router.post("/duplicates/scan", status_code=status.HTTP_202_ACCEPTED)
+async def scan_duplicates(background_tasks: BackgroundTasks, request: Optional[DuplicateScanRequest] = None):
+    """
+    全库近似重复扫描（后台执行）
+    
+    找出所有相似度超过阈值的题目对并合并为重复簇，结果写入报告表；
+    返回运行 ID，通过 GET /questions/duplicates/runs/{run_id} 查看进度和结果
+    
+    - **threshold**: 相似度阈值，默认 0.95
+    - **top_k**: 近似索引（IVF / HNSW）每道题检索的近邻数
+    """
+    request = request or DuplicateScanRequest()
+    try:
+        scanner = get_duplicate_scanner()
+        run_id = scanner.start_run(request.threshold)
+        background_tasks.add_task(scanner.run, request.threshold, run_id, request.top_k)
+        logger.info(f"全库查重已提交：run_id={run_id}, threshold={request.threshold}")
+        return SuccessResponse(success=True, data={"run_id": run_id}, message="全库查重已开始")
+    except Exception as e:
+        logger.error(f"提交全库查重失败：{e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.INTERNAL_ERROR,
+                message=f"提交全库查重失败：{str(e)}"
+            ).dict()
+        )
+
+
+@router.get("/duplicates/runs")
+async def list_duplicate_runs(limit: int = Query(20, ge=1, le=100, description="返回数量")):
+    """
+    最近的全库查重记录
+    
+    - **limit**: 返回数量，1-100
+    """
+    return SuccessResponse(success=True, data=get_duplicate_scanner().list_runs(limit))
+
+
+@router.get("/duplicates/runs/{run_id}")
+async def get_duplicate_run(
+    run_id: str,
+    limit: int = Query(50, ge=1, le=500, description="返回的重复簇数"),
+    offset: int = Query(0, ge=0, description="跳过的重复簇数")
+):
+    """
+    全库查重进度和结果（重复簇按大小降序）
+    
+    - **run_id**: 运行 ID
+    - **limit** / **offset**: 重复簇分页
+    """
+    scanner = get_duplicate_scanner()
+    run = scanner.get_run(run_id)
+    if not run:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.NOT_FOUND,
+                message="查重记录不存在"
+            ).dict()
+        )
+    clusters = scanner.get_clusters(run_id, limit=limit, offset=offset) if run['status'] == 'completed' else []
+    return SuccessResponse(success=True, data={"run": run, "clusters": clusters})
+
+
+@router.get("/embedding/queue")
+async def get_embedding_queue_status():
+    """
+    后台向量化队列状态
+    
+    返回队列深度、执行中 / 失败任务数、最早任务的等待时间（lag_seconds）和 worker 运行状态
+    """
+    from core.database.connection import db
+    from core.services.embedding_queue import get_embedding_job_queue, get_embedding_worker
+    data = get_embedding_job_queue(db).get_status()
+    data['enabled'] = config.EMBEDDING_QUEUE_ENABLED
+    data['worker'] = get_embedding_worker(db).get_stats()
+    return SuccessResponse(success=True, data=data)
+
+
+@router.post("/embedding/queue/retry")
+async def retry_failed_embedding_jobs():
+    """失败（超过重试次数）的向量化任务重新排队"""
+    from core.database.connection import db
+    from core.services.embedding_queue import get_embedding_job_queue
+    retried = get_embedding_job_queue(db).retry_failed()
+    logger.info(f"向量化任务重新排队：count={retried}")
+    return SuccessResponse(success=True, data={"retried": retried}, message=f"已重新排队 {retried} 个任务")
+
+
 @router.get("/", response_model=QuestionListResponse)
 async def get_questions(
     category_id: Optional[str] = Query(None, description="按分类筛选"),
+    include_descendants: bool = Query(False, description="按分类筛选时包含所有子孙分类"),
     tag_id: Optional[str] = Query(None, description="按标签筛选"),
     page: int = Query(1, ge=1, description="页码"),
-    limit: int = Query(20, ge=1, le=100, description="每页数量")
+    limit: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="游标分页：首页传空字符串，之后传上一页的 next_cursor"),
+    include_total: bool = Query(False, description="游标分页时是否返回总数")
 ):
     """
     获取题目列表
     
     - **category_id**: 按分类筛选（可选）
+    - **include_descendants**: 按分类筛选时包含所有子孙分类（默认只匹配该分类）
     - **tag_id**: 按标签筛选（可选）
-    - **page**: 页码，从 1 开始
+    - **page**: 页码，从 1 开始（偏移分页）
     - **limit**: 每页数量，1-100
+    - **cursor**: 传入后使用游标分页，忽略 page；翻页代价与首页相同
+    - **include_total**: 游标分页时是否返回总数（默认不统计）
     """
     try:
+        if cursor is not None:
+            logger.info(f"游标获取题目列表：category_id={category_id}, tag_id={tag_id}, cursor={cursor}, limit={limit}")
+            result = question_service.get_questions_by_cursor(
+                cursor=cursor,
+                category_id=category_id,
+                tag_id=tag_id,
+                limit=limit,
+                include_total=include_total,
+                include_descendants=include_descendants
+            )
+            logger.info(f"获取题目列表成功：count={len(result['data'])}, has_more={result['has_more']}")
+            return QuestionListResponse(**result)
+        
         logger.info(f"获取题目列表：category_id={category_id}, tag_id={tag_id}, page={page}, limit={limit}")
         result = question_service.get_all_questions(
             category_id=category_id,
             tag_id=tag_id,
             page=page,
-            limit=limit
+            limit=limit,
+            include_descendants=include_descendants
         )
         logger.info(f"获取题目列表成功：total={result['total']}")
         return QuestionListResponse(**result)
+    except ValueError as e:
+        logger.warning(f"分页参数无效：{e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.VALIDATION_ERROR,
+                message=str(e)
+            ).dict()
+        )
     except Exception as e:
         logger.error(f"获取题目列表失败：{e}", exc_info=True)
         raise HTTPException(
@@ -159,6 +367,54 @@ async def get_questions(
         )
 
 
+@router.get("/search", response_model=QuestionSearchResponse)
+async def search_questions_ranked(
+    q: str = Query(..., min_length=1, description="查询文本"),
+    mode: str = Query("hybrid", description=f"检索模式：{' / '.join(SEARCH_MODES)}"),
+    limit: int = Query(20, ge=1, le=100, description="返回数量（不超过每个来源的候选上限）"),
+    category_id: Optional[str] = Query(None, description="按分类筛选"),
+    include_descendants: bool = Query(False, description="分类筛选是否包含子分类"),
+    tag_id: Optional[str] = Query(None, description="按标签筛选")
+):
+    """
+    检索题目并按相关度排序
+    
+    - **mode=keyword**: 全文检索（bm25：题干 > 答案 > 解析）
+    - **mode=vector**: 向量相似度检索（需要配置 Embedding 服务）
+    - **mode=hybrid**: 两路并行检索，按倒数排名融合；每条结果附带各来源的排名和得分，
+      超时或不可用的来源在 sources 中标注，不参与融合
+    """
+    try:
+        logger.info(f"检索题目：q={q}, mode={mode}, limit={limit}")
+        return await hybrid_search_service.search(
+            q,
+            mode=mode,
+            limit=limit,
+            category_id=category_id,
+            include_descendants=include_descendants,
+            tag_id=tag_id
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.VALIDATION_ERROR,
+                message=str(e)
+            ).dict()
+        )
+    except Exception as e:
+        logger.error(f"检索题目失败：{e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.INTERNAL_ERROR,
+                message=f"检索题目失败：{str(e)}"
+            ).dict()
+        )
+
+
 @router.get("/{question_id}", response_model=Question)
 async def get_question(question_id: str):
     """
@@ -205,7 +461,9 @@ async def update_question(question_id: str, update_data: QuestionUpdate):
     """
     try:
         logger.info(f"更新题目：id={question_id}")
-        question = question_service.update_question(question_id, update_data)
+        question = question_service.update_question(question_id, update_data, embed=False)
+        if question and (update_data.content or update_data.options):
+            await question_service.schedule_embedding_async(question_id, question.content, question.options)
         if not question:
             logger.warning(f"题目未找到：id={question_id}")
             raise HTTPException(
@@ -275,7 +533,7 @@ async def search_questions(
     limit: int = Query(20, ge=1, le=100, description="每页数量")
 ):
     """
-    搜索题目
+    搜索题目（全文检索，按相关度排序；单字或索引不可用时回退到模糊匹配）
     
     - **keyword**: 搜索关键词（至少 1 个字符）
     - **page**: 页码，从 1 开始
@@ -302,6 +560,62 @@ async def search_questions(
         )
 
 
+@router.get("/{question_id}/similar")
+async def get_similar_questions(
+    question_id: str,
+    threshold: float = Query(0.8, ge=0, le=1, description="相似度阈值"),
+    top_k: int = Query(10, ge=1, le=100, description="最多返回数量"),
+    category_id: Optional[str] = Query(None, description="只在该分类下检索"),
+    include_descendants: bool = Query(False, description="分类筛选是否包含子分类"),
+    tag_id: Optional[str] = Query(None, description="只在带该标签的题目中检索")
+):
+    """
+    检索相似题目（向量相似度，可按分类/标签限定范围）
+    
+    - **question_id**: 题目 ID
+    - **threshold**: 相似度阈值，0-1
+    - **top_k**: 最多返回数量，1-100
+    - **category_id** / **include_descendants**: 只在该分类（子树）下检索
+    - **tag_id**: 只在带该标签的题目中检索
+    """
+    try:
+        logger.info(f"检索相似题目：id={question_id}, category_id={category_id}, tag_id={tag_id}")
+        similar = await question_service.find_similar_questions_async(
+            question_id,
+            threshold=threshold,
+            top_k=top_k,
+            category_id=category_id,
+            include_descendants=include_descendants,
+            tag_id=tag_id
+        )
+        if similar is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=ErrorResponse(
+                    error=True,
+                    code=ErrorCodes.NOT_FOUND,
+                    message="题目不存在"
+                ).dict()
+            )
+        return SuccessResponse(
+            success=True,
+            data={"question_id": question_id, "similar_questions": similar},
+            message=f"找到 {len(similar)} 道相似题目"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"检索相似题目失败：{e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=ErrorResponse(
+                error=True,
+                code=ErrorCodes.INTERNAL_ERROR,
+                message=f"检索相似题目失败：{str(e)}"
+            ).dict()
+        )
+
+
 @router.post("/{question_id}/tags/{tag_id}")
 async def add_tag_to_question(question_id: str, tag_id: str):
     """
@@ -30,6 +30,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from web.api import categories, tags, questions, qa, agent
 from web.config import settings
 from core.database.migrations import migrate_database
+from core.database.connection import db
 
 # 获取 web 目录路径
 WEB_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -86,7 +87,25 @@ def create_web_app() -> FastAPI:
     # 健康检查端点
     @app.get("/health")
     async def health_check():
-        return {"status": "healthy", "service": "web"}
+        return {"status": "healthy", "service": "web", "db_pool": db.pool.stats()}
+    
+    # 启动后台向量化 worker（题目创建/更新时只登记任务）
+    @app.on_event("startup")
+    async def start_embedding_worker():
+        if settings.shared.EMBEDDING_QUEUE_ENABLED:
+            from core.services.embedding_queue import get_embedding_worker
+            get_embedding_worker(db).start()
+    
+    # 关闭时停止向量化 worker、保存近似向量索引并释放数据库连接
+    @app.on_event("shutdown")
+    async def close_database():
+        from core.services import embedding_queue
+        if embedding_queue._worker is not None:
+            embedding_queue._worker.stop()
+        from core.services import vector_index
+        if vector_index._vector_index is not None:
+            vector_index._vector_index.persist()
+        db.close_connection()
     
     return app
 
@@ -159,7 +159,7 @@ def test_extract_from_image_success(mock_qa_repo, mock_staging_repo, mock_extrac
     mock_extractor_class.return_value = mock_extractor
     
     # Mock 保存预备题目
-    mock_staging_repo.create.return_value = 'staging_123'
+    mock_staging_repo.create_batch.return_value = [123]
     
     client = TestClient(app)
     
@@ -175,6 +175,9 @@ def test_extract_from_image_success(mock_qa_repo, mock_staging_repo, mock_extrac
     data = response.json()
     assert data['success'] is True
     assert data['data']['total_count'] >= 0
+    assert data['data']['questions'][0]['id'] == 123
+    mock_staging_repo.create_batch.assert_called_once()
+    mock_staging_repo.create.assert_not_called()
 
 
 @patch('web.api.agent.AgentConfig')
@@ -225,7 +228,7 @@ def test_extract_from_document_success(mock_qa_repo, mock_staging_repo, mock_ext
     }
     mock_extractor_class.return_value = mock_extractor
     
-    mock_staging_repo.create.return_value = 'staging_456'
+    mock_staging_repo.create_batch.return_value = [456]
     
     client = TestClient(app)
     
@@ -239,6 +242,9 @@ def test_extract_from_document_success(mock_qa_repo, mock_staging_repo, mock_ext
     assert response.status_code == 200
     data = response.json()
     assert data['success'] is True
+    saved = mock_staging_repo.create_batch.call_args[0][0]
+    assert saved[0]['source_type'] == 'document'
+    assert saved[0]['source_file'] == 'test.txt'
 
 
 @patch('web.api.agent.AgentConfig')
@@ -471,5 +477,239 @@ def test_delete_staging_question_not_found(mock_qa_repo, mock_staging_repo):
     assert response.status_code == 404
 
 
+@patch('core.services.fingerprint_index.get_fingerprint_index')
+@patch('core.services.vector_index.get_vector_index')
+@patch('agent.services.async_embedding_service.get_async_embedding_service')
+@patch('web.api.agent.AgentConfig')
+@patch('web.api.agent.StagingQuestionRepository')
+def test_dedup_staging_questions(mock_staging_repo, mock_config, mock_get_embedding, mock_get_index,
+                                 mock_get_fingerprint):
+    """测试批量查重：一次向量化、一次批量检索，并找出批内重复"""
+    from web.main import app
+    
+    mock_get_fingerprint.return_value.find_similar_batch.return_value = [[], [], []]
+    mock_staging_repo.get_pending.return_value = [
+        {'id': 1, 'content': '题目一'},
+        {'id': 2, 'content': '题目二'},
+        {'id': 3, 'content': '题目一（重复）'},
+    ]
+    mock_config.get_full_config.return_value = {'embedding': {'model_name': 'm1'}}
+    mock_get_embedding.return_value.embed_batch = AsyncMock(return_value=[
+        [1.0, 0.0], [0.0, 1.0], [1.0, 0.001]
+    ])
+    mock_get_embedding.return_value.get_model_version.return_value = 'm2'
+    mock_get_index.return_value.get_active_version.return_value = 'm2'
+    mock_get_index.return_value.search_similar_batch.return_value = [
+        [{'question_id': 'q9', 'content': '题库题目', 'similarity': 0.97}], [], []
+    ]
+    
+    client = TestClient(app)
+    response = client.post("/api/agent/staging/dedup", json={
+        'source_file': 'a.pdf', 'threshold': 0.96, 'category_id': 'c1', 'include_descendants': True
+    })
+    
+    assert response.status_code == 200
+    data = response.json()['data']
+    assert data['checked'] == 3
+    assert [d['staging_id'] for d in data['duplicates']] == [1]
+    assert data['duplicates'][0]['similar_questions'][0]['id'] == 'q9'
+    assert [(d['staging_id'], d['duplicate_of']) for d in data['batch_duplicates']] == [(3, 1)]
+    assert data['has_more'] is False
+    mock_staging_repo.get_pending.assert_called_once_with(source_file='a.pdf', ids=None, limit=501)
+    mock_get_embedding.return_value.embed_batch.assert_awaited_once()
+    args, kwargs = mock_get_index.return_value.search_similar_batch.call_args
+    assert args[0].shape == (3, 2)
+    assert kwargs == {'threshold': 0.96, 'top_k': 5, 'category_id': 'c1',
+                      'include_descendants': True, 'tag_id': None, 'model_version': 'm2'}
+    # 查询向量使用生效版本的模型，而不是 agent.json 中的旧模型
+    mock_get_embedding.assert_called_once_with({'model_name': 'm2'})
+
+
+@patch('core.services.fingerprint_index.get_fingerprint_index')
+@patch('core.services.vector_index.get_vector_index')
+@patch('agent.services.async_embedding_service.get_async_embedding_service')
+@patch('web.api.agent.AgentConfig')
+@patch('web.api.agent.StagingQuestionRepository')
+def test_dedup_staging_runs_lookups_off_event_loop(mock_staging_repo, mock_config, mock_get_embedding,
+                                                   mock_get_index, mock_get_fingerprint):
+    """测试数据库查询和检索在线程中执行，只有 Embedding 调用在事件循环中等待"""
+    import threading
+    from web.main import app
+    
+    threads = {}
+    
+    def record(name, result):
+        def call(*args, **kwargs):
+            threads[name] = threading.get_ident()
+            return result
+        return call
+    
+    async def embed_batch(texts):
+        threads['embed_batch'] = threading.get_ident()
+        return [[1.0, 0.0], [0.0, 1.0]]
+    
+    mock_staging_repo.get_pending.side_effect = record('get_pending', [
+        {'id': 1, 'content': '题目一'}, {'id': 2, 'content': '题目二'}
+    ])
+    mock_get_fingerprint.return_value.find_similar_batch.side_effect = record('fingerprint', [[], []])
+    mock_config.get_full_config.return_value = {'embedding': {'model_name': 'm1'}}
+    mock_get_embedding.return_value.embed_batch = embed_batch
+    mock_get_embedding.return_value.get_model_version.return_value = 'm1'
+    mock_get_index.return_value.get_active_version.return_value = 'm1'
+    mock_get_index.return_value.search_similar_batch.side_effect = record('search', [[], []])
+    
+    client = TestClient(app)
+    response = client.post("/api/agent/staging/dedup")
+    
+    assert response.status_code == 200
+    assert response.json()['data']['vector_available'] is True
+    for name in ('get_pending', 'fingerprint', 'search'):
+        assert threads[name] != threads['embed_batch'], name
+
+
+@patch('core.services.fingerprint_index.get_fingerprint_index')
+@patch('agent.services.async_embedding_service.get_async_embedding_service')
+@patch('web.api.agent.AgentConfig')
+@patch('web.api.agent.StagingQuestionRepository')
+def test_dedup_staging_fingerprint_fallback(mock_staging_repo, mock_config, mock_get_embedding, mock_get_fingerprint):
+    """测试 Embedding 服务不可用时仅返回文本指纹查重结果"""
+    from web.main import app
+    
+    mock_staging_repo.get_pending.return_value = [
+        {'id': 1, 'content': '已知函数 f(x) = x^2 + 2x + 1，求 f(x) 的最小值。'},
+        {'id': 2, 'content': '已知函数f(x)=x^2+2x+1，求f(x)的最小值'},
+    ]
+    mock_config.get_full_config.return_value = {'embedding': {}}
+    mock_get_embedding.side_effect = ValueError("未配置 Embedding 服务")
+    mock_get_fingerprint.return_value.find_similar_batch.return_value = [
+        [{'question_id': 'q9', 'content': '题库题目', 'similarity': 1.0, 'exact': True}], []
+    ]
+    
+    client = TestClient(app)
+    response = client.post("/api/agent/staging/dedup")
+    
+    assert response.status_code == 200
+    data = response.json()['data']
+    assert data['vector_available'] is False
+    assert data['duplicates'][0]['similar_questions'][0]['method'] == 'fingerprint'
+    assert [(d['staging_id'], d['duplicate_of'], d['method']) for d in data['batch_duplicates']] == \
+        [(2, 1, 'fingerprint')]
+
+
+@patch('core.services.fingerprint_index.get_fingerprint_index')
+@patch('agent.services.async_embedding_service.get_async_embedding_service')
+@patch('web.api.agent.AgentConfig')
+@patch('web.api.agent.StagingQuestionRepository')
+def test_dedup_staging_limit_and_zero_threshold(mock_staging_repo, mock_config, mock_get_embedding,
+                                                mock_get_fingerprint):
+    """测试超出 limit 时只检查前 limit 道题；阈值为 0 时批内每对只出现一次，不含自身"""
+    from web.main import app
+    
+    mock_staging_repo.get_pending.return_value = [{'id': i, 'content': f'题目{i}'} for i in range(1, 5)]
+    mock_config.get_full_config.return_value = {'embedding': {}}
+    mock_get_embedding.return_value.embed_batch = AsyncMock(return_value=[
+        [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]
+    ])
+    mock_get_fingerprint.return_value.find_similar_batch.return_value = [[], [], []]
+    
+    with patch('core.services.vector_index.get_vector_index') as mock_get_index:
+        mock_get_index.return_value.search_similar_batch.return_value = [[], [], []]
+        response = TestClient(app).post("/api/agent/staging/dedup", json={'threshold': 0, 'limit': 3})
+    
+    data = response.json()['data']
+    assert (data['checked'], data['has_more']) == (3, True)
+    assert sorted((d['duplicate_of'], d['staging_id']) for d in data['batch_duplicates']) == \
+        [(1, 2), (1, 3), (2, 3)]
+
+
+@pytest.mark.parametrize("body", [{'threshold': -0.5}, {'threshold': 1.5}, {'limit': 0}, {'limit': 100000}])
+def test_dedup_staging_invalid_request(body):
+    """测试阈值超出 [0, 1] 或检查数量超出上限返回 422"""
+    from web.main import app
+    
+    response = TestClient(app).post("/api/agent/staging/dedup", json=body)
+    
+    assert response.status_code == 422
+
+
+@patch('web.api.agent.StagingQuestionRepository')
+def test_dedup_staging_questions_empty(mock_staging_repo):
+    """测试没有待审核题目时不调用向量化"""
+    from web.main import app
+    
+    mock_staging_repo.get_pending.return_value = []
+    
+    client = TestClient(app)
+    response = client.post("/api/agent/staging/dedup")
+    
+    assert response.status_code == 200
+    assert response.json()['data']['checked'] == 0
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
+
+
+STAGING_QUESTION = {'id': 7, 'content': '预备题目', 'options': ['A', 'B'], 'answer': 'A',
+                    'explanation': '', 'category_id': 'c1'}
+
+
+@patch('core.services.embedding_queue.get_embedding_job_queue')
+@patch('core.services.vector_index.get_vector_index')
+@patch('agent.services.async_embedding_service.get_async_embedding_service')
+@patch('core.services.fingerprint_index.get_fingerprint_index')
+@patch('core.database.repositories.QuestionRepository')
+@patch('web.api.agent.config')
+@patch('web.api.agent.StagingQuestionRepository')
+def test_approve_staging_enqueues_embedding(mock_staging_repo, mock_config, mock_question_repo,
+                                            mock_get_fingerprint, mock_get_embedding, mock_get_index,
+                                            mock_get_queue):
+    """测试强制入库（未计算向量）且启用后台队列时登记向量化任务，不在请求中调用 Embedding 服务"""
+    from web.main import app
+    
+    mock_config.EMBEDDING_QUEUE_ENABLED = True
+    mock_staging_repo.get_by_id.return_value = dict(STAGING_QUESTION)
+    mock_question_repo.return_value.create.return_value = Mock(id='q-new')
+    
+    client = TestClient(app)
+    response = client.post("/api/agent/staging/7/approve", data={'force': 'true'})
+    
+    assert response.json()['success'] is True
+    mock_get_queue.return_value.enqueue.assert_called_once_with(['q-new'])
+    mock_get_embedding.assert_not_called()
+    mock_get_index.return_value.update_embedding.assert_not_called()
+    mock_staging_repo.delete.assert_called_once_with(7)
+
+
+@patch('core.services.embedding_queue.get_embedding_job_queue')
+@patch('core.services.vector_index.get_vector_index')
+@patch('agent.services.async_embedding_service.get_async_embedding_service')
+@patch('core.services.fingerprint_index.get_fingerprint_index')
+@patch('core.database.repositories.QuestionRepository')
+@patch('web.api.agent.AgentConfig')
+@patch('web.api.agent.config')
+@patch('web.api.agent.StagingQuestionRepository')
+def test_approve_staging_reuses_dedup_vector(mock_staging_repo, mock_config, mock_agent_config, mock_question_repo,
+                                             mock_get_fingerprint, mock_get_embedding, mock_get_index,
+                                             mock_get_queue):
+    """测试查重时已计算的向量直接保存，不再登记任务或重复计算"""
+    from web.main import app
+    
+    mock_config.EMBEDDING_QUEUE_ENABLED = True
+    mock_agent_config.get_full_config.return_value = {'embedding': {}}
+    mock_staging_repo.get_by_id.return_value = dict(STAGING_QUESTION)
+    mock_question_repo.return_value.create.return_value = Mock(id='q-new')
+    mock_get_fingerprint.return_value.find_similar.return_value = []
+    mock_get_index.return_value.get_active_version.return_value = None
+    mock_get_index.return_value.search_similar.return_value = []
+    mock_get_embedding.return_value.embed = AsyncMock(return_value=[1.0, 0.0])
+    mock_get_embedding.return_value.get_model_version.return_value = 'm1'
+    
+    client = TestClient(app)
+    response = client.post("/api/agent/staging/7/approve")
+    
+    assert response.json()['success'] is True
+    mock_get_embedding.return_value.embed.assert_awaited_once_with('预备题目')
+    args = mock_get_index.return_value.update_embedding.call_args[0]
+    assert (args[0], args[1], args[2]) == ('q-new', [1.0, 0.0], 'm1')
+    mock_get_queue.return_value.enqueue.assert_not_called()
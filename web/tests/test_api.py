@@ -67,6 +67,109 @@ class TestQuestionsAPI:
         assert "total" in data
         assert "page" in data
     
+    def test_get_questions_cursor_pagination(self):
+        """测试游标分页"""
+        response = client.get("/api/questions/?cursor=&limit=1")
+        assert response.status_code == 200
+        data = response.json()
+        assert "next_cursor" in data
+        assert "has_more" in data
+        if data["next_cursor"]:
+            response = client.get(f"/api/questions/?cursor={data['next_cursor']}&limit=1")
+            assert response.status_code == 200
+    
+    def test_get_questions_invalid_cursor(self):
+        """测试无效游标返回400"""
+        response = client.get("/api/questions/?cursor=invalid!")
+        assert response.status_code == 400
+    
+    def test_bulk_create_unknown_tag(self):
+        """测试批量创建时标签不存在返回400且不写入"""
+        categories = client.get("/api/categories/").json()
+        if not categories:
+            pytest.skip("没有分类数据")
+        question = {
+            "content": "批量创建测试题目",
+            "answer": "答案",
+            "explanation": "解析",
+            "category_id": categories[0]["id"],
+            "tag_ids": ["不存在的标签"]
+        }
+        response = client.post("/api/questions/bulk", json={"questions": [question]})
+        assert response.status_code == 400
+    
+    def test_bulk_create_empty(self):
+        """测试批量创建空列表返回422"""
+        response = client.post("/api/questions/bulk", json={"questions": []})
+        assert response.status_code == 422
+    
+    def test_similar_questions_not_found(self):
+        """测试检索不存在题目的相似题目返回404"""
+        response = client.get("/api/questions/不存在的题目/similar?category_id=c1")
+        assert response.status_code == 404
+    
+    def test_similar_questions_filters(self):
+        """测试相似题目检索透传分类/标签筛选"""
+        from unittest.mock import AsyncMock, patch
+        with patch('web.api.questions.question_service.find_similar_questions_async',
+                   new_callable=AsyncMock, return_value=[{'question_id': 'q2', 'similarity': 0.9, 'content': '题目'}]) as find:
+            response = client.get("/api/questions/q1/similar?threshold=0.85&category_id=c1"
+                                  "&include_descendants=true&tag_id=t1")
+        assert response.status_code == 200
+        assert response.json()['data']['similar_questions'][0]['question_id'] == 'q2'
+        find.assert_called_once_with('q1', threshold=0.85, top_k=10, category_id='c1',
+                                     include_descendants=True, tag_id='t1')
+    
+    def test_search_hybrid(self):
+        """测试混合检索透传模式和筛选条件"""
+        from unittest.mock import AsyncMock, patch
+        result = {'mode': 'hybrid', 'results': [], 'sources': {'lexical': {'status': 'ok', 'count': 0}},
+                  'elapsed_ms': 1.0}
+        with patch('web.api.questions.hybrid_search_service.search', new=AsyncMock(return_value=result)) as search:
+            response = client.get("/api/questions/search?q=求导&mode=hybrid&limit=5&category_id=c1")
+        assert response.status_code == 200
+        assert response.json()['sources']['lexical']['status'] == 'ok'
+        search.assert_awaited_once_with('求导', mode='hybrid', limit=5, category_id='c1',
+                                        include_descendants=False, tag_id=None)
+    
+    def test_search_invalid_mode(self):
+        """测试无效检索模式返回400"""
+        response = client.get("/api/questions/search?q=求导&mode=fuzzy")
+        assert response.status_code == 400
+    
+    def test_duplicate_scan(self):
+        """测试提交全库查重并查询结果"""
+        from unittest.mock import Mock, patch
+        scanner = Mock()
+        scanner.start_run.return_value = "run-1"
+        scanner.get_run.return_value = {'id': "run-1", 'status': "completed"}
+        scanner.get_clusters.return_value = [{'cluster_id': 1, 'size': 2, 'questions': []}]
+        with patch('web.api.questions.get_duplicate_scanner', return_value=scanner):
+            response = client.post("/api/questions/duplicates/scan", json={"threshold": 0.9})
+            result = client.get("/api/questions/duplicates/runs/run-1?limit=10")
+        assert response.status_code == 202
+        assert response.json()['data']['run_id'] == "run-1"
+        scanner.run.assert_called_once_with(0.9, "run-1", None)
+        assert result.json()['data']['clusters'][0]['size'] == 2
+        scanner.get_clusters.assert_called_once_with("run-1", limit=10, offset=0)
+    
+    def test_duplicate_run_not_found(self):
+        """测试查询不存在的查重记录返回404"""
+        from unittest.mock import Mock, patch
+        scanner = Mock()
+        scanner.get_run.return_value = None
+        with patch('web.api.questions.get_duplicate_scanner', return_value=scanner):
+            response = client.get("/api/questions/duplicates/runs/missing")
+        assert response.status_code == 404
+    
+    def test_embedding_queue_status(self):
+        """测试后台向量化队列状态"""
+        response = client.get("/api/questions/embedding/queue")
+        assert response.status_code == 200
+        data = response.json()['data']
+        for key in ("depth", "pending", "failed", "lag_seconds", "enabled", "worker"):
+            assert key in data
+    
     def test_create_question_validation(self):
         """测试题目创建验证"""
         # 缺少必填字段
@@ -39,18 +39,23 @@ export interface QuestionUpdate {
 
 export interface QuestionFilter {
   category_id?: string
+  include_descendants?: boolean
   tag_id?: string
   keyword?: string
   page?: number
   limit?: number
+  cursor?: string
+  include_total?: boolean
 }
 
 export interface PaginatedResponse {
   data: Question[]
-  total: number
-  page: number
+  total: number | null
+  page: number | null
   limit: number
-  pages: number
+  pages: number | null
+  next_cursor?: string | null
+  has_more?: boolean
 }
 
 export interface PendingQuestion {
@@ -76,10 +81,13 @@ export const questionApi = {
   async getQuestions(filter: QuestionFilter = {}): Promise<PaginatedResponse> {
     const params = new URLSearchParams()
     if (filter.category_id) params.append('category_id', filter.category_id)
+    if (filter.include_descendants) params.append('include_descendants', 'true')
     if (filter.tag_id) params.append('tag_id', filter.tag_id)
     if (filter.keyword) params.append('keyword', filter.keyword)
     if (filter.page) params.append('page', filter.page.toString())
     if (filter.limit) params.append('limit', filter.limit.toString())
+    if (filter.cursor !== undefined) params.append('cursor', filter.cursor)
+    if (filter.include_total) params.append('include_total', 'true')
     
     return api.get(`/questions?${params.toString()}`)
   },